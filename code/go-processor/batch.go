@@ -0,0 +1,43 @@
+package main
+
+import (
+	"encoding/binary"
+	"errors"
+)
+
+// Batched frames travel on batchPrefix + subject, e.g. batch.inpktsec
+const batchPrefix = "batch."
+
+// Every frame of a batch is preceded by its receive timestamp in nanoseconds (8 bytes)
+// and its length (4 bytes), both in network byte order
+const batchRecordHeaderLen = 12
+
+var errTruncatedBatch = errors.New("truncated batch")
+
+// forEachFrame calls fn with the timestamp and frame of every record of a batch.
+// Frames are slices of data, nothing is copied; fn must not keep a frame after
+// the message is released unless it copies it.
+func forEachFrame(data []byte, fn func(timestamp uint64, frame []byte)) error {
+	for offset := 0; offset < len(data); {
+		if len(data)-offset < batchRecordHeaderLen {
+			return errTruncatedBatch
+		}
+		timestamp := binary.BigEndian.Uint64(data[offset:])
+		length := int(binary.BigEndian.Uint32(data[offset+8:]))
+		offset += batchRecordHeaderLen
+		if length > len(data)-offset {
+			return errTruncatedBatch
+		}
+		fn(timestamp, data[offset:offset+length:offset+length])
+		offset += length
+	}
+	return nil
+}
+
+// appendRecord appends a record holding frame and its timestamp to a batch.
+// The batch's capacity is reused, so a batch reset with batch[:0] grows only until its largest size.
+func appendRecord(batch []byte, timestamp uint64, frame []byte) []byte {
+	batch = binary.BigEndian.AppendUint64(batch, timestamp)
+	batch = binary.BigEndian.AppendUint32(batch, uint32(len(frame)))
+	return append(batch, frame...)
+}
@@ -0,0 +1,65 @@
+package main
+
+import (
+	"fmt"
+	"strings"
+
+	"github.com/google/gopacket"
+	"github.com/google/gopacket/layers"
+)
+
+// frameDecoder decodes frames into a fixed set of preallocated layers with a DecodingLayerParser,
+// so decoding a frame allocates nothing, unlike gopacket.NewPacket. Layers are overwritten by the
+// next frame; a frameDecoder belongs to one worker and is not safe for concurrent use.
+type frameDecoder struct {
+	eth     layers.Ethernet
+	dot1q   layers.Dot1Q
+	ip4     layers.IPv4
+	ip6     layers.IPv6
+	tcp     layers.TCP
+	udp     layers.UDP
+	icmp4   layers.ICMPv4
+	payload gopacket.Payload
+	parser  *gopacket.DecodingLayerParser
+	decoded []gopacket.LayerType
+}
+
+func newFrameDecoder() *frameDecoder {
+	d := &frameDecoder{decoded: make([]gopacket.LayerType, 0, 8)}
+	d.parser = gopacket.NewDecodingLayerParser(layers.LayerTypeEthernet,
+		&d.eth, &d.dot1q, &d.ip4, &d.ip6, &d.tcp, &d.udp, &d.icmp4, &d.payload)
+	// Layers without a decoder here (ARP, IPv6 extensions...) end decoding without an error
+	d.parser.IgnoreUnsupported = true
+	return d
+}
+
+// decode decodes a frame, the layers found are listed in d.decoded.
+func (d *frameDecoder) decode(data []byte) error {
+	return d.parser.DecodeLayers(data, &d.decoded)
+}
+
+// summary describes the last decoded frame on one line, for sampled logging only.
+func (d *frameDecoder) summary() string {
+	var b strings.Builder
+	for _, layerType := range d.decoded {
+		switch layerType {
+		case layers.LayerTypeEthernet:
+			fmt.Fprintf(&b, "eth %s>%s", d.eth.SrcMAC, d.eth.DstMAC)
+		case layers.LayerTypeDot1Q:
+			fmt.Fprintf(&b, " vlan %d", d.dot1q.VLANIdentifier)
+		case layers.LayerTypeIPv4:
+			fmt.Fprintf(&b, " ipv4 %s>%s", d.ip4.SrcIP, d.ip4.DstIP)
+		case layers.LayerTypeIPv6:
+			fmt.Fprintf(&b, " ipv6 %s>%s", d.ip6.SrcIP, d.ip6.DstIP)
+		case layers.LayerTypeTCP:
+			fmt.Fprintf(&b, " tcp %d>%d", d.tcp.SrcPort, d.tcp.DstPort)
+		case layers.LayerTypeUDP:
+			fmt.Fprintf(&b, " udp %d>%d", d.udp.SrcPort, d.udp.DstPort)
+		case layers.LayerTypeICMPv4:
+			fmt.Fprintf(&b, " icmp %s", d.icmp4.TypeCode)
+		case gopacket.LayerTypePayload:
+			fmt.Fprintf(&b, " payload %dB", len(d.payload))
+		}
+	}
+	return b.String()
+}
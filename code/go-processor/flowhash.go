@@ -0,0 +1,86 @@
+package main
+
+import "encoding/binary"
+
+const (
+	ethHeaderLen  = 14
+	etherTypeIPv4 = 0x0800
+	etherTypeIPv6 = 0x86DD
+	etherTypeVLAN = 0x8100
+	etherTypeQinQ = 0x88A8
+	maxVLANTags   = 2
+
+	ipProtoTCP = 6
+	ipProtoUDP = 17
+
+	// 32-bit FNV-1a, the hash of flow_hash() in the switch and the Python processor
+	fnvOffset = 2166136261
+	fnvPrime  = 16777619
+)
+
+// noPorts stands in for the ports of frames without a TCP/UDP header.
+var noPorts [4]byte
+
+// fnvBytes adds b to an FNV-1a hash.
+func fnvBytes(hash uint32, b []byte) uint32 {
+	for _, c := range b {
+		hash ^= uint32(c)
+		hash *= fnvPrime
+	}
+	return hash
+}
+
+// flowHash returns the FNV-1a hash of a frame's protocol, addresses and TCP/UDP ports, read in
+// place at their offsets. Every frame of a flow gets the same hash, so it picks the worker keeping
+// the flow's order. Ports are zero for other protocols and for IPv4 fragments but the first. Frames
+// that are not IP, or are truncated, hash their Ethernet header instead. Untagged frames get the
+// hash of flow_hash() in the switch and of flow_hash(flow_key()) in the Python processor, which
+// key VLAN tagged and IPv6 frames by their Ethernet header where this hashes their flow.
+func flowHash(data []byte) uint32 {
+	hash := uint32(fnvOffset)
+	if len(data) < ethHeaderLen {
+		return fnvBytes(hash, data)
+	}
+	etherType := binary.BigEndian.Uint16(data[12:])
+	offset := ethHeaderLen
+	for tags := 0; (etherType == etherTypeVLAN || etherType == etherTypeQinQ) && tags < maxVLANTags; tags++ {
+		if len(data) < offset+4 {
+			return fnvBytes(hash, data[:ethHeaderLen])
+		}
+		etherType = binary.BigEndian.Uint16(data[offset+2:])
+		offset += 4
+	}
+
+	var proto byte
+	var ports bool
+	switch etherType {
+	case etherTypeIPv4:
+		if len(data) < offset+20 {
+			return fnvBytes(hash, data[:ethHeaderLen])
+		}
+		ip := data[offset:]
+		proto = ip[9]
+		hash = fnvBytes(hash, ip[12:20])
+		// Only the first fragment carries the transport header
+		ports = binary.BigEndian.Uint16(ip[6:])&0x1FFF == 0
+		offset += int(ip[0]&0x0F) * 4
+	case etherTypeIPv6:
+		if len(data) < offset+40 {
+			return fnvBytes(hash, data[:ethHeaderLen])
+		}
+		ip := data[offset:]
+		proto = ip[6]
+		hash = fnvBytes(hash, ip[8:40])
+		// Extension headers are not followed, such frames of a flow still share the same hash
+		ports = true
+		offset += 40
+	default:
+		return fnvBytes(hash, data[:ethHeaderLen])
+	}
+	hash ^= uint32(proto)
+	hash *= fnvPrime
+	if ports && (proto == ipProtoTCP || proto == ipProtoUDP) && len(data) >= offset+4 {
+		return fnvBytes(hash, data[offset:offset+4])
+	}
+	return fnvBytes(hash, noPorts[:])
+}
@@ -1,8 +1,15 @@
 package main
 
 import (
+	"context"
+	"flag"
 	"fmt"
 	"os"
+	"os/signal"
+	"runtime"
+	"strconv"
+	"syscall"
+	"time"
 
 	"github.com/google/gopacket"
 	"github.com/google/gopacket/layers"
@@ -13,7 +20,7 @@ import (
 func processEthernetPacket(nc *nats.Conn, iface string, data []byte) {
 	// Add your ethernet packet processing logic here
 	fmt.Printf("Processing ethernet packet: %s\n", iface)
-	
+
 	// Use gopacket to dissect the packet
 	packet := gopacket.NewPacket(data, layers.LayerTypeEthernet, gopacket.Default)
 	if packet.ErrorLayer() != nil {
@@ -59,21 +66,43 @@ func processEthernetPacket(nc *nats.Conn, iface string, data []byte) {
 	}
 }
 
-func main() {
-	fmt.Println("Hello, World!")
-	url := os.Getenv("NATS_SURVEYOR_SERVERS")
-	if url == "" {
-		url = nats.DefaultURL
+// Header set by the MITM switch with the kernel receive timestamp in nanoseconds since the epoch
+const captureTsHeader = "Capture-Ts-Ns"
+
+// outSubjects maps the subject a frame is received on to the subject it is forwarded to
+var outSubjects = map[string]string{
+	"inpktsec":   "outpktinsec",
+	"inpktinsec": "outpktsec",
+}
+
+func envInt(name string, fallback int) int {
+	if value, err := strconv.Atoi(os.Getenv(name)); err == nil {
+		return value
 	}
-	fmt.Println("NATS_SURVEYOR_SERVERS: ", url)
+	return fallback
+}
 
+func envString(name, fallback string) string {
+	if value := os.Getenv(name); value != "" {
+		return value
+	}
+	return fallback
+}
 
-		// Connect to a server
-	nc, _ := nats.Connect(url)
-	defer nc.Drain()
-	// Simple Publisher
-	//nc.Publish("foo", []byte("Hello World"))
+// receiveTimestamp returns the switch's capture timestamp of a message, or the current time.
+func receiveTimestamp(m *nats.Msg) uint64 {
+	if m.Header != nil {
+		if values := m.Header[captureTsHeader]; len(values) > 0 {
+			if timestamp, err := strconv.ParseUint(values[0], 10, 64); err == nil {
+				return timestamp
+			}
+		}
+	}
+	return uint64(time.Now().UnixNano())
+}
 
+// runDebug decodes every frame with gopacket.NewPacket and dumps its layers, in the NATS callback.
+func runDebug(nc *nats.Conn) {
 	// Simple Subscriber
 	nc.Subscribe("inpktsec", func(m *nats.Msg) {
 		//fmt.Printf("Received a message: %s\n", string(m.Data))
@@ -82,20 +111,120 @@ func main() {
 	})
 
 	// Simple Subscriber
-	nc.Subscribe("inpktinsec", func( m *nats.Msg) {
+	nc.Subscribe("inpktinsec", func(m *nats.Msg) {
 		//fmt.Printf("Received a message: %s\n", string(m.Data))
 		// Process the incoming ethernet packet here
 		processEthernetPacket(nc, m.Subject, m.Data)
 	})
 
-	// Keep the connection alive
-	select {}
+	// Batches from the switch when PROCESSOR_BATCH_SIZE is set, frames are handled one by one
+	for _, subject := range []string{"inpktsec", "inpktinsec"} {
+		iface := subject
+		nc.Subscribe(batchPrefix+iface, func(m *nats.Msg) {
+			err := forEachFrame(m.Data, func(timestamp uint64, frame []byte) {
+				processEthernetPacket(nc, iface, frame)
+			})
+			if err != nil {
+				fmt.Println("Error decoding batch:", err)
+			}
+		})
+	}
+}
+
+// runProduction hands frames from the NATS callbacks to a worker pool by flow hash until ctx is
+// done, then drains the subscriptions and lets the workers publish every frame they received.
+func runProduction(ctx context.Context, nc *nats.Conn, workers, queueLen, batchSize int, flushInterval time.Duration, logSample int) {
+	stats := &processorStats{}
+	pool := newWorkerPool(workers, queueLen, flushInterval, func(int) frameHandler {
+		return newFrameProcessor(nc.Publish, batchSize, uint64(logSample), stats)
+	})
+
+	var subs []*nats.Subscription
+	for in, out := range outSubjects {
+		out := out
+		// The callback only hashes the frame and queues it, decoding and publishing run on the workers
+		sub, err := nc.Subscribe(in, func(m *nats.Msg) {
+			pool.dispatch(out, receiveTimestamp(m), m.Data)
+		})
+		if err != nil {
+			fmt.Println("Error subscribing:", err)
+			continue
+		}
+		subs = append(subs, sub)
+		sub, err = nc.Subscribe(batchPrefix+in, func(m *nats.Msg) {
+			// Frames are slices of the message, which nats.go does not reuse
+			err := forEachFrame(m.Data, func(timestamp uint64, frame []byte) {
+				pool.dispatch(out, timestamp, frame)
+			})
+			if err != nil && logSample > 0 {
+				fmt.Println("Error decoding batch:", err)
+			}
+		})
+		if err != nil {
+			fmt.Println("Error subscribing:", err)
+			continue
+		}
+		subs = append(subs, sub)
+	}
+	fmt.Printf("Production mode: %d workers, batch size %d, flush every %s, logging 1 in %d frames\n",
+		workers, batchSize, flushInterval, logSample)
 
-	// Drain connection (Preferred for responders)
-	// Close() not needed if this is called.
+	<-ctx.Done()
+	// Stop receiving, let the callbacks finish queueing what was received, then empty the queues
+	for _, sub := range subs {
+		sub.Drain()
+	}
+	deadline := time.Now().Add(5 * time.Second)
+	for _, sub := range subs {
+		for sub.IsValid() && time.Now().Before(deadline) {
+			time.Sleep(10 * time.Millisecond)
+		}
+	}
+	pool.close()
+	nc.Flush()
+	fmt.Println("Processor stats:", stats)
+}
 
+func main() {
+	mode := flag.String("mode", envString("PROCESSOR_MODE", "debug"),
+		"debug dumps every frame's layers, production decodes without allocating on a worker pool (PROCESSOR_MODE)")
+	workers := flag.Int("workers", envInt("PROCESSOR_WORKERS", runtime.NumCPU()),
+		"Workers decoding and publishing frames in production mode, flows are spread by hash (PROCESSOR_WORKERS)")
+	queueLen := flag.Int("queue", 4096, "Frames queued per worker before the NATS callback waits")
+	batchSize := flag.Int("batch_size", envInt("PROCESSOR_BATCH_SIZE", 0),
+		"Frames per outgoing batch message, 0 to publish every frame on its own (PROCESSOR_BATCH_SIZE)")
+	flushUs := flag.Int("batch_flush_us", envInt("PROCESSOR_BATCH_FLUSH_US", 1000),
+		"Longest time a frame waits in a worker's buffer in microseconds (PROCESSOR_BATCH_FLUSH_US)")
+	logSample := flag.Int("log_sample", envInt("PROCESSOR_LOG_SAMPLE", 0),
+		"Log one in this many frames in production mode, 0 to disable (PROCESSOR_LOG_SAMPLE)")
+	flag.Parse()
 
-	// Close connection
-	nc.Close()
-}	
+	fmt.Println("Hello, World!")
+	url := os.Getenv("NATS_SURVEYOR_SERVERS")
+	if url == "" {
+		url = nats.DefaultURL
+	}
+	fmt.Println("NATS_SURVEYOR_SERVERS: ", url)
 
+	// Connect to a server
+	nc, err := nats.Connect(url)
+	if err != nil {
+		fmt.Println("Error connecting to NATS:", err)
+		os.Exit(1)
+	}
+	defer nc.Drain()
+
+	ctx, stop := signal.NotifyContext(context.Background(), os.Interrupt, syscall.SIGTERM)
+	defer stop()
+	switch *mode {
+	case "production":
+		runProduction(ctx, nc, max(*workers, 1), *queueLen, *batchSize, time.Duration(max(*flushUs, 1))*time.Microsecond, *logSample)
+	case "debug":
+		runDebug(nc)
+		// Keep the connection alive
+		<-ctx.Done()
+	default:
+		fmt.Println("Unknown mode:", *mode)
+		os.Exit(2)
+	}
+}
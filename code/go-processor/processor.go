@@ -0,0 +1,58 @@
+package main
+
+import (
+	"fmt"
+	"sync/atomic"
+)
+
+// processorStats are shared by the workers and updated atomically.
+type processorStats struct {
+	frames        atomic.Uint64
+	decodeErrors  atomic.Uint64
+	publishErrors atomic.Uint64
+}
+
+func (s *processorStats) String() string {
+	return fmt.Sprintf("frames=%d decode_errors=%d publish_errors=%d",
+		s.frames.Load(), s.decodeErrors.Load(), s.publishErrors.Load())
+}
+
+// frameProcessor is the production mode handler of one worker: frames are decoded into reused
+// layers and published through the worker's batch publisher, and only one in logSample frames
+// is logged, 0 to log none.
+type frameProcessor struct {
+	decoder   *frameDecoder
+	publisher *batchPublisher
+	stats     *processorStats
+	logSample uint64
+}
+
+func newFrameProcessor(publish publishFunc, batchSize int, logSample uint64, stats *processorStats) *frameProcessor {
+	return &frameProcessor{
+		decoder:   newFrameDecoder(),
+		publisher: newBatchPublisher(publish, batchSize, &stats.publishErrors),
+		stats:     stats,
+		logSample: logSample,
+	}
+}
+
+func (p *frameProcessor) handle(job *frameJob) {
+	count := p.stats.frames.Add(1)
+	sampled := p.logSample > 0 && count%p.logSample == 0
+	if err := p.decoder.decode(job.data); err != nil {
+		// Like the debug mode, frames that fail to decode are not forwarded
+		p.stats.decodeErrors.Add(1)
+		if sampled {
+			fmt.Println("Error decoding packet:", err)
+		}
+		return
+	}
+	if sampled {
+		fmt.Printf("Packet %d to %s: %s\n", count, job.subject, p.decoder.summary())
+	}
+	p.publisher.add(job.subject, job.timestamp, job.data)
+}
+
+func (p *frameProcessor) flush() {
+	p.publisher.flush()
+}
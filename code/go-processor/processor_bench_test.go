@@ -0,0 +1,133 @@
+package main
+
+// Cost per frame of the debug and production paths, run from code/go-processor:
+//
+//	go test -run '^$' -bench . -benchmem
+//
+// Every op is one frame, so ns/op and allocs/op are per frame.
+
+import (
+	"encoding/binary"
+	"fmt"
+	"sync"
+	"testing"
+	"time"
+
+	"github.com/google/gopacket"
+	"github.com/google/gopacket/layers"
+)
+
+// udpFrame builds an Ethernet/IPv4/UDP frame like the ones the switch forwards.
+func udpFrame(src, dst [4]byte, srcPort, dstPort uint16, payload []byte) []byte {
+	frame := make([]byte, 0, 42+len(payload))
+	frame = append(frame, 0x02, 0, 0, 0, 0, 0x02, 0x02, 0, 0, 0, 0, 0x01)
+	frame = binary.BigEndian.AppendUint16(frame, etherTypeIPv4)
+	frame = append(frame, 0x45, 0)
+	frame = binary.BigEndian.AppendUint16(frame, uint16(28+len(payload)))
+	frame = append(frame, 0, 0, 0x40, 0, 64, ipProtoUDP, 0, 0)
+	frame = append(frame, src[:]...)
+	frame = append(frame, dst[:]...)
+	frame = binary.BigEndian.AppendUint16(frame, srcPort)
+	frame = binary.BigEndian.AppendUint16(frame, dstPort)
+	frame = binary.BigEndian.AppendUint16(frame, uint16(8+len(payload)))
+	frame = append(frame, 0, 0)
+	return append(frame, payload...)
+}
+
+// benchFrames are frames of many flows, from 10.1.x.y to 10.0.0.21:8002.
+func benchFrames(count int) [][]byte {
+	frames := make([][]byte, count)
+	for i := range frames {
+		src := [4]byte{10, 1, byte(i >> 8), byte(i)}
+		frames[i] = udpFrame(src, [4]byte{10, 0, 0, 21}, uint16(1024+i), 8002, []byte("dummy data payload"))
+	}
+	return frames
+}
+
+func discard(subject string, data []byte) error { return nil }
+
+// BenchmarkNewPacket is the debug mode's decoding, without printing the layers.
+func BenchmarkNewPacket(b *testing.B) {
+	frames := benchFrames(1024)
+	b.ReportAllocs()
+	b.ResetTimer()
+	for i := 0; i < b.N; i++ {
+		packet := gopacket.NewPacket(frames[i%len(frames)], layers.LayerTypeEthernet, gopacket.Default)
+		if packet.Layer(layers.LayerTypeUDP) == nil {
+			b.Fatal("no UDP layer")
+		}
+	}
+}
+
+func BenchmarkDecodingLayerParser(b *testing.B) {
+	frames := benchFrames(1024)
+	decoder := newFrameDecoder()
+	b.ReportAllocs()
+	b.ResetTimer()
+	for i := 0; i < b.N; i++ {
+		if err := decoder.decode(frames[i%len(frames)]); err != nil {
+			b.Fatal(err)
+		}
+	}
+}
+
+func BenchmarkFlowHash(b *testing.B) {
+	frames := benchFrames(1024)
+	var hash uint32
+	b.ReportAllocs()
+	b.ResetTimer()
+	for i := 0; i < b.N; i++ {
+		hash ^= flowHash(frames[i%len(frames)])
+	}
+	_ = hash
+}
+
+func BenchmarkFrameProcessor(b *testing.B) {
+	for _, batchSize := range []int{0, 64} {
+		b.Run(fmt.Sprintf("batch_%d", batchSize), func(b *testing.B) {
+			frames := benchFrames(1024)
+			processor := newFrameProcessor(discard, batchSize, 0, &processorStats{})
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				processor.handle(&frameJob{subject: "outpktinsec", data: frames[i%len(frames)]})
+			}
+			processor.flush()
+		})
+	}
+}
+
+// countingHandler counts the frames of a worker and marks the last one done.
+type countingHandler struct {
+	processor *frameProcessor
+	done      *sync.WaitGroup
+}
+
+func (h countingHandler) handle(job *frameJob) {
+	h.processor.handle(job)
+	h.done.Done()
+}
+
+func (h countingHandler) flush() { h.processor.flush() }
+
+// BenchmarkWorkerPool measures a frame from dispatch by the NATS callback to its publication.
+func BenchmarkWorkerPool(b *testing.B) {
+	for _, workers := range []int{1, 4} {
+		b.Run(fmt.Sprintf("workers_%d", workers), func(b *testing.B) {
+			frames := benchFrames(1024)
+			var done sync.WaitGroup
+			stats := &processorStats{}
+			pool := newWorkerPool(workers, 4096, time.Millisecond, func(int) frameHandler {
+				return countingHandler{newFrameProcessor(discard, 64, 0, stats), &done}
+			})
+			defer pool.close()
+			done.Add(b.N)
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				pool.dispatch("outpktinsec", uint64(i), frames[i%len(frames)])
+			}
+			done.Wait()
+		})
+	}
+}
@@ -0,0 +1,214 @@
+package main
+
+// Correctness of the flow hash, batch framing and worker pool, run from code/go-processor:
+//
+//	go test -run . -bench '^$'
+
+import (
+	"bytes"
+	"encoding/binary"
+	"math"
+	"sync"
+	"testing"
+	"time"
+)
+
+// ipv4Variant returns a copy of an Ethernet/IPv4 frame with another protocol and flags/fragment offset.
+func ipv4Variant(frame []byte, proto byte, fragment uint16) []byte {
+	variant := append([]byte(nil), frame...)
+	variant[ethHeaderLen+9] = proto
+	binary.BigEndian.PutUint16(variant[ethHeaderLen+6:], fragment)
+	return variant
+}
+
+// vlanTagged returns a copy of a frame with an 802.1Q tag after the Ethernet addresses.
+func vlanTagged(frame []byte, vlan uint16) []byte {
+	tagged := append([]byte(nil), frame[:12]...)
+	tagged = binary.BigEndian.AppendUint16(tagged, etherTypeVLAN)
+	tagged = binary.BigEndian.AppendUint16(tagged, vlan)
+	return append(tagged, frame[12:]...)
+}
+
+// arpFrame builds an ARP request from 10.1.0.21 for 10.0.0.21.
+func arpFrame() []byte {
+	frame := []byte{0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0x02, 0x02, 0, 0, 0, 0, 0x08, 0x06}
+	frame = append(frame, 0, 1, 0x08, 0, 6, 4, 0, 1)
+	frame = append(frame, 0x02, 0x02, 0, 0, 0, 0, 10, 1, 0, 21)
+	return append(frame, 0, 0, 0, 0, 0, 0, 10, 0, 0, 21)
+}
+
+func TestFlowHashMatchesSwitchAndPythonProcessor(t *testing.T) {
+	udp := udpFrame([4]byte{10, 1, 0, 21}, [4]byte{10, 0, 0, 21}, 40000, 8002, []byte("payload"))
+	// Hashes from flow_hash(flow_key(frame)) of code/python-processor/flow/flow_table.py, which
+	// tests/test_flow_table.py checks against flow_hash() of the switch
+	tests := []struct {
+		name  string
+		frame []byte
+		want  uint32
+	}{
+		{"udp", udp, 2415546388},
+		{"tcp", ipv4Variant(udp, ipProtoTCP, 0x4000), 2895885429},
+		{"icmp", ipv4Variant(udp, 1, 0x4000), 1332680625},
+		{"first fragment", ipv4Variant(udp, ipProtoUDP, 0x2000), 2415546388},
+		{"later fragment", ipv4Variant(udp, ipProtoUDP, 0x2000|185), 3841629057},
+		{"arp", arpFrame(), 326269097},
+		{"truncated ipv4", udp[:30], 1954100228},
+		{"runt", udp[:10], 520236839},
+	}
+	for _, test := range tests {
+		t.Run(test.name, func(t *testing.T) {
+			if got := flowHash(test.frame); got != test.want {
+				t.Errorf("flowHash() = %d, want %d", got, test.want)
+			}
+		})
+	}
+}
+
+func TestFlowHashKeepsFlowsTogether(t *testing.T) {
+	udp := udpFrame([4]byte{10, 1, 0, 21}, [4]byte{10, 0, 0, 21}, 40000, 8002, []byte("payload"))
+	tests := []struct {
+		name  string
+		frame []byte
+		same  bool
+	}{
+		{"other payload", udpFrame([4]byte{10, 1, 0, 21}, [4]byte{10, 0, 0, 21}, 40000, 8002, []byte("x")), true},
+		{"vlan tagged", vlanTagged(udp, 7), true},
+		{"other source port", udpFrame([4]byte{10, 1, 0, 21}, [4]byte{10, 0, 0, 21}, 40001, 8002, []byte("payload")), false},
+		{"other source", udpFrame([4]byte{10, 1, 0, 22}, [4]byte{10, 0, 0, 21}, 40000, 8002, []byte("payload")), false},
+		{"reply", udpFrame([4]byte{10, 0, 0, 21}, [4]byte{10, 1, 0, 21}, 8002, 40000, []byte("payload")), false},
+	}
+	for _, test := range tests {
+		t.Run(test.name, func(t *testing.T) {
+			if same := flowHash(test.frame) == flowHash(udp); same != test.same {
+				t.Errorf("same hash as the udp frame = %v, want %v", same, test.same)
+			}
+		})
+	}
+}
+
+type record struct {
+	timestamp uint64
+	frame     string
+}
+
+func TestForEachFrame(t *testing.T) {
+	// Records as the switch and processor/batch_framing.py write them, struct "!QI" then the frame
+	framed := []byte{
+		0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 3, 'a', 'b', 'c',
+		0, 0, 0, 0, 0, 0, 0, 2, 0, 0, 0, 0,
+	}
+	large := bytes.Repeat([]byte{0x5a}, 1500)
+	tests := []struct {
+		name string
+		data []byte
+		want []record
+		err  error
+	}{
+		{"empty", nil, nil, nil},
+		{"framed", framed, []record{{1, "abc"}, {2, ""}}, nil},
+		{"appended", appendRecord(appendRecord(nil, math.MaxUint64, large), 7, []byte("x")),
+			[]record{{math.MaxUint64, string(large)}, {7, "x"}}, nil},
+		{"truncated header", append(append([]byte(nil), framed...), 0, 0, 0, 0, 0),
+			[]record{{1, "abc"}, {2, ""}}, errTruncatedBatch},
+		{"truncated frame", framed[:14], nil, errTruncatedBatch},
+	}
+	for _, test := range tests {
+		t.Run(test.name, func(t *testing.T) {
+			var got []record
+			err := forEachFrame(test.data, func(timestamp uint64, frame []byte) {
+				got = append(got, record{timestamp, string(frame)})
+				if cap(frame) != len(frame) {
+					t.Errorf("frame of capacity %d, appending to it would overwrite the next record", cap(frame))
+				}
+			})
+			if err != test.err {
+				t.Errorf("forEachFrame() error = %v, want %v", err, test.err)
+			}
+			if len(got) != len(test.want) {
+				t.Fatalf("forEachFrame() gave %d frames, want %d", len(got), len(test.want))
+			}
+			for i := range got {
+				if got[i] != test.want[i] {
+					t.Errorf("frame %d = %v, want %v", i, got[i], test.want[i])
+				}
+			}
+		})
+	}
+}
+
+// orderRecorder records the sequence numbers of every flow, keyed by source port, and its worker.
+type orderRecorder struct {
+	worker int
+	mu     *sync.Mutex
+	seen   map[uint16][]uint32
+	owner  map[uint16]int
+	errors *[]string
+}
+
+func (h orderRecorder) handle(job *frameJob) {
+	port := binary.BigEndian.Uint16(job.data[34:])
+	sequence := binary.BigEndian.Uint32(job.data[42:])
+	h.mu.Lock()
+	defer h.mu.Unlock()
+	if owner, ok := h.owner[port]; ok && owner != h.worker {
+		*h.errors = append(*h.errors, "flow handled by two workers")
+	}
+	h.owner[port] = h.worker
+	h.seen[port] = append(h.seen[port], sequence)
+}
+
+func (h orderRecorder) flush() {}
+
+func TestWorkerPoolKeepsFlowOrder(t *testing.T) {
+	tests := []struct {
+		workers, flows, frames int
+	}{
+		{1, 4, 100},
+		{4, 64, 200},
+		{8, 3, 500},
+	}
+	for _, test := range tests {
+		var mu sync.Mutex
+		seen := map[uint16][]uint32{}
+		owner := map[uint16]int{}
+		var errors []string
+		// A short queue makes dispatch block on busy workers
+		pool := newWorkerPool(test.workers, 4, time.Millisecond, func(worker int) frameHandler {
+			return orderRecorder{worker, &mu, seen, owner, &errors}
+		})
+		for sequence := 0; sequence < test.frames; sequence++ {
+			for flow := 0; flow < test.flows; flow++ {
+				payload := binary.BigEndian.AppendUint32(nil, uint32(sequence))
+				frame := udpFrame([4]byte{10, 1, 0, 21}, [4]byte{10, 0, 0, 21}, uint16(1024+flow), 8002, payload)
+				pool.dispatch("outpktinsec", uint64(sequence), frame)
+			}
+		}
+		pool.close()
+
+		if len(errors) > 0 {
+			t.Errorf("%d workers: %s", test.workers, errors[0])
+		}
+		if len(seen) != test.flows {
+			t.Fatalf("%d workers: %d flows handled, want %d", test.workers, len(seen), test.flows)
+		}
+		for port, sequences := range seen {
+			if len(sequences) != test.frames {
+				t.Errorf("%d workers: flow %d got %d frames, want %d", test.workers, port, len(sequences), test.frames)
+				continue
+			}
+			for i, sequence := range sequences {
+				if sequence != uint32(i) {
+					t.Errorf("%d workers: flow %d frame %d is frame %d", test.workers, port, i, sequence)
+					break
+				}
+			}
+		}
+		workers := map[int]bool{}
+		for _, worker := range owner {
+			workers[worker] = true
+		}
+		if test.flows >= 4*test.workers && len(workers) != test.workers {
+			t.Errorf("%d workers: flows spread over %d of them", test.workers, len(workers))
+		}
+	}
+}
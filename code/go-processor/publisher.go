@@ -0,0 +1,72 @@
+package main
+
+import "sync/atomic"
+
+// publishFunc publishes data on a subject, e.g. (*nats.Conn).Publish. It must not keep data
+// after returning; nats.go copies it into the connection's write buffer.
+type publishFunc func(subject string, data []byte) error
+
+// pendingBatch collects the frames waiting to be published on one subject.
+type pendingBatch struct {
+	subject string // batchPrefix + subject, built once
+	data    []byte
+	frames  int
+}
+
+// batchPublisher collects the frames a worker publishes into one batch message per subject,
+// sent when batchSize frames are waiting or on flush(), which the worker calls periodically.
+// Batch buffers are reused, so publishing a frame does not allocate. With a batchSize of 0 or 1
+// every frame is published on its own and left to the connection's write buffer.
+// A batchPublisher belongs to one worker and is not safe for concurrent use.
+type batchPublisher struct {
+	publish   publishFunc
+	batchSize int
+	pending   map[string]*pendingBatch
+	failed    *atomic.Uint64
+}
+
+func newBatchPublisher(publish publishFunc, batchSize int, failed *atomic.Uint64) *batchPublisher {
+	return &batchPublisher{
+		publish:   publish,
+		batchSize: batchSize,
+		pending:   make(map[string]*pendingBatch),
+		failed:    failed,
+	}
+}
+
+// add publishes a frame on subject, or adds it to the subject's batch.
+func (p *batchPublisher) add(subject string, timestamp uint64, frame []byte) {
+	if p.batchSize <= 1 {
+		if err := p.publish(subject, frame); err != nil {
+			p.failed.Add(1)
+		}
+		return
+	}
+	batch := p.pending[subject]
+	if batch == nil {
+		batch = &pendingBatch{subject: batchPrefix + subject}
+		p.pending[subject] = batch
+	}
+	batch.data = appendRecord(batch.data, timestamp, frame)
+	batch.frames++
+	if batch.frames >= p.batchSize {
+		p.send(batch)
+	}
+}
+
+// flush publishes every batch that has frames waiting.
+func (p *batchPublisher) flush() {
+	for _, batch := range p.pending {
+		if batch.frames > 0 {
+			p.send(batch)
+		}
+	}
+}
+
+func (p *batchPublisher) send(batch *pendingBatch) {
+	if err := p.publish(batch.subject, batch.data); err != nil {
+		p.failed.Add(1)
+	}
+	batch.data = batch.data[:0]
+	batch.frames = 0
+}
@@ -0,0 +1,77 @@
+package main
+
+import (
+	"sync"
+	"time"
+)
+
+// frameJob is a frame handed to a worker, passed by value so queueing it does not allocate.
+type frameJob struct {
+	subject   string // Subject the frame is published on
+	timestamp uint64 // Receive time in nanoseconds since the epoch
+	data      []byte
+}
+
+// frameHandler handles the frames of one worker; flush is called periodically and when the
+// worker stops, to publish what it buffered.
+type frameHandler interface {
+	handle(job *frameJob)
+	flush()
+}
+
+// workerPool hands frames to a fixed set of workers by flow hash. Every frame of a flow goes to
+// the same worker through a FIFO queue, so frames of a flow are published in the order received
+// while different flows are handled in parallel.
+type workerPool struct {
+	queues []chan frameJob
+	wg     sync.WaitGroup
+}
+
+// newWorkerPool starts workers goroutines, each with its own handler from newHandler and a queue
+// of queueLen frames. flushInterval is the longest time a handler keeps frames buffered.
+func newWorkerPool(workers, queueLen int, flushInterval time.Duration, newHandler func(worker int) frameHandler) *workerPool {
+	pool := &workerPool{queues: make([]chan frameJob, workers)}
+	for i := range pool.queues {
+		queue := make(chan frameJob, queueLen)
+		pool.queues[i] = queue
+		pool.wg.Add(1)
+		go pool.run(queue, newHandler(i), flushInterval)
+	}
+	return pool
+}
+
+func (pool *workerPool) run(queue chan frameJob, handler frameHandler, flushInterval time.Duration) {
+	defer pool.wg.Done()
+	ticker := time.NewTicker(flushInterval)
+	defer ticker.Stop()
+	// Declared once, a job taken by address through the interface would otherwise escape per frame
+	var job frameJob
+	var ok bool
+	for {
+		select {
+		case job, ok = <-queue:
+			if !ok {
+				handler.flush()
+				return
+			}
+			handler.handle(&job)
+		case <-ticker.C:
+			handler.flush()
+		}
+	}
+}
+
+// dispatch queues a frame on the worker of its flow. It blocks while that worker's queue is
+// full, which leaves the backlog to the subscription's pending limits instead of reordering.
+func (pool *workerPool) dispatch(subject string, timestamp uint64, data []byte) {
+	pool.queues[flowHash(data)%uint32(len(pool.queues))] <- frameJob{subject: subject, timestamp: timestamp, data: data}
+}
+
+// close stops the workers once they handled and flushed every queued frame.
+// dispatch must not be called anymore.
+func (pool *workerPool) close() {
+	for _, queue := range pool.queues {
+		close(queue)
+	}
+	pool.wg.Wait()
+}
@@ -28,10 +28,11 @@
  * 2. Creates raw sockets for ethsec and ethinsec.
  * 3. Binds the raw sockets to the respective network interfaces.
  * 4. Creates two threads to capture packets from ethsec and ethinsec.
- * 5. Captures packets in each thread.
+ * 5. Captures packets in each thread, with recvmsg or from a TPACKET_V3 ring when SWITCH_RING_BLOCK_SIZE is set.
  * 6. Prints packet details for IP, TCP, UDP, and ICMP headers.
- * 7. Publishes packets to NATS subjects for further processing.
+ * 7. Publishes packets to NATS subjects for further processing, sharded by flow hash when PROCESSOR_SHARDS > 1.
  * 8. Subscribes to NATS subjects to receive packets and forwards them to the appropriate interface.
+ *    With PROCESSOR_BATCH_SIZE > 1, frames are sent in batches on batch.<subject> subjects (see BATCH_PREFIX).
  * 9. Handles NATS messages and prints Ethernet packet details.
  * 10. Cleans up NATS connections and subscriptions on program exit.
  * 
@@ -44,11 +45,54 @@
  *   - @param arg Pointer to the interface name (ethsec or ethinsec).
  *   - @return NULL
  * 
- * - void handle_packet_from_interface(unsigned char *buffer, int size, char *in_iface)
+ * - bool configure_rx_ring(int sock, struct rx_ring *ring, char *iface)
+ *   - Sets up a TPACKET_V3 receive ring on a raw socket and maps it.
+ *   - @param sock Raw socket of the interface.
+ *   - @param ring Ring to set up.
+ *   - @param iface Name of the interface, for error messages.
+ *   - @return true if the ring is ready, false otherwise.
+ * 
+ * - void capture_ring(char *interface, int sock_raw, struct rx_ring *ring, struct frame_batch *batches)
+ *   - Captures packets block by block from a receive ring, with the ring's per-packet timestamps.
+ *   - @param interface Name of the interface (ethsec or ethinsec).
+ *   - @param sock_raw Raw socket of the interface.
+ *   - @param ring Receive ring of the socket.
+ *   - @param batches Per-shard batches of the capturing thread, NULL when batching is disabled.
+ * 
+ * - void handle_packet_from_interface(unsigned char *buffer, int size, char *in_iface, struct timespec *ts, struct frame_batch *batches)
  *   - Switches the packet to the other interface and prints packet details.
  *   - @param buffer Pointer to the packet buffer.
  *   - @param size Size of the packet.
  *   - @param in_iface Name of the input interface (ethsec or ethinsec).
+ *   - @param ts Kernel receive timestamp of the packet, sent in the CAPTURE_TS_HEADER NATS header.
+ *   - @param batches Per-shard batches of the capturing thread, NULL to publish the packet on its own.
+ * 
+ * - void batch_append(struct frame_batch *batch, unsigned char *buffer, int size, struct timespec *ts)
+ *   - Appends a frame and its receive timestamp to a batch, publishing the batch when it is full.
+ *   - @param batch Batch of the frame's subject.
+ *   - @param buffer Pointer to the packet buffer.
+ *   - @param size Size of the packet.
+ *   - @param ts Kernel receive timestamp of the packet.
+ * 
+ * - void batch_flush(struct frame_batch *batch)
+ *   - Publishes the frames of a batch as one NATS message and empties it.
+ *   - @param batch Batch to publish.
+ * 
+ * - void handle_batch_from_nats(natsConnection *nc, natsSubscription *sub, natsMsg *msg, void *closure)
+ *   - Callback for batches from the processors; forwards every frame of the batch with a single sendmmsg.
+ * 
+ * - void send_frames(int sock, struct mmsghdr *msgs, int count, char *outiface)
+ *   - Sends frames on a raw socket with sendmmsg, retrying the ones a call did not send.
+ *   - @param sock Raw socket of the output interface.
+ *   - @param msgs Frames to send.
+ *   - @param count Number of frames.
+ *   - @param outiface Name of the output interface, for error messages.
+ * 
+ * - uint32_t flow_hash(unsigned char *buffer, int size)
+ *   - Hashes the flow key of a frame, the same key the Python processor uses for its flow table.
+ *   - @param buffer Pointer to the packet buffer.
+ *   - @param size Size of the packet.
+ *   - @return 32-bit FNV-1a hash of the flow key.
  * 
  * - bool configure_switch()
  *   - Configures the switch by reading environment variables and querying MAC addresses.
@@ -73,6 +117,8 @@
  *   - @param host_ip IP address of the host.
  *   - @param mac_address Pointer to the MAC address buffer.
  */
+// sendmmsg and struct mmsghdr
+#define _GNU_SOURCE
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
@@ -87,11 +133,46 @@
 #include <netinet/tcp.h>
 #include <sys/ioctl.h>
 #include <pthread.h>
-#include <netpacket/packet.h>
+// linux/if_packet.h replaces netpacket/packet.h, it also defines the TPACKET_V3 ring structures
+#include <linux/if_packet.h>
+#include <poll.h>
+#include <sys/mman.h>
 #include <stdbool.h>
+#include <stdint.h>
+#include <errno.h>
+#include <sys/time.h>
+#include <time.h>
 #include <nats/nats.h>
 
 #define BUF_SIZE 65536
+// NATS header carrying the kernel receive timestamp (SO_TIMESTAMPNS) in nanoseconds since the epoch
+#define CAPTURE_TS_HEADER "Capture-Ts-Ns"
+// Batched frames travel on BATCH_PREFIX + subject; every frame is preceded by a record header of
+// its receive timestamp in nanoseconds (8 bytes) and its length (4 bytes), both in network byte order
+#define BATCH_PREFIX "batch."
+#define BATCH_RECORD_HEADER_LEN 12
+// Stay below the default 1 MB NATS max payload
+#define BATCH_BUF_SIZE (512 * 1024)
+
+// Frames of the receive ring; large enough for a full size Ethernet frame and the tpacket headers
+#define RING_FRAME_SIZE 2048
+// Most frames handed to a single sendmmsg call
+#define SEND_BATCH_MAX 256
+
+struct rx_ring {
+    unsigned char *map;
+    size_t map_len;
+    unsigned int block_size;
+    unsigned int block_count;
+};
+
+struct frame_batch {
+    char subject[40];
+    unsigned char *data;
+    int len;
+    int frames;
+    struct timespec started;  // CLOCK_MONOTONIC time the first frame was added
+};
 
 int sock_raw_ethsec;
 int sock_raw_ethinsec;
@@ -101,8 +182,17 @@ unsigned char mac_secure_net_host[6];
 unsigned char mac_insecure_net_host[6];
 
 void *capture_packets(void *arg);
+bool configure_rx_ring(int sock, struct rx_ring *ring, char *iface);
+void capture_ring(char *interface, int sock_raw, struct rx_ring *ring, struct frame_batch *batches);
 void handle_packet_from_nats(natsConnection *nc, natsSubscription *sub, natsMsg *msg, void *closure);
-void handle_packet_from_interface(unsigned char *buffer, int size, char *in_iface);
+void handle_packet_from_interface(unsigned char *buffer, int size, char *in_iface, struct timespec *ts, struct frame_batch *batches);
+void forward_packet(const char *subject, unsigned char *buffer, int size);
+void handle_batch_from_nats(natsConnection *nc, natsSubscription *sub, natsMsg *msg, void *closure);
+void batch_append(struct frame_batch *batch, unsigned char *buffer, int size, struct timespec *ts);
+void send_frames(int sock, struct mmsghdr *msgs, int count, char *outiface);
+void batch_flush(struct frame_batch *batch);
+void batch_flush_expired(struct frame_batch *batches, int count);
+uint32_t flow_hash(unsigned char *buffer, int size);
 bool configure_switch();
 bool configureRawSockets();
 bool configure_nats();
@@ -121,6 +211,18 @@ char *insecure_net_host_ip;
 char *secure_net_subnet;
 char *insecure_net_subnet;
 char *nats_url;
+// Number of processor workers; frames go to inpktsec.<shard>/inpktinsec.<shard> when above 1
+int processor_shards = 1;
+// Frames per batch message, 0 or 1 publishes every frame as its own message
+int batch_size = 0;
+// Longest time a frame waits in a batch before it is published
+long batch_flush_us = 1000;
+// TPACKET_V3 receive ring, used instead of recvmsg when ring_block_size is set
+unsigned int ring_block_size = 0;
+unsigned int ring_block_count = 64;
+unsigned int ring_timeout_ms = 10;
+struct rx_ring ring_ethsec;
+struct rx_ring ring_ethinsec;
 
 natsConnection *conn = NULL;
 natsOptions *opts = NULL;
@@ -187,9 +289,15 @@ int main() {
 void *capture_packets(void *arg) {
     int sock_raw;
     struct sockaddr saddr;
-    int saddr_len = sizeof(saddr);
     unsigned char *buffer = (unsigned char *)malloc(BUF_SIZE);
     char *interface = (char *)arg;
+    char control[CMSG_SPACE(sizeof(struct timespec))];
+    struct iovec iov;
+    struct msghdr msg;
+    struct cmsghdr *cmsg;
+    struct timespec ts;
+    // One batch per shard, only used when batching is enabled
+    struct frame_batch *batches = NULL;
 
     if (strcmp(interface, ethsec) == 0) {
         sock_raw = sock_raw_ethsec;
@@ -199,44 +307,338 @@ void *capture_packets(void *arg) {
         printf("Capturing packets from ethinsec\n");
     } 
 
+    if (batch_size > 1) {
+        batches = (struct frame_batch *)calloc(processor_shards, sizeof(struct frame_batch));
+        for (int i = 0; i < processor_shards; i++) {
+            const char *base_subject = strcmp(interface, ethsec) == 0 ? "inpktsec" : "inpktinsec";
+            if (processor_shards > 1) {
+                snprintf(batches[i].subject, sizeof(batches[i].subject), BATCH_PREFIX "%s.%d", base_subject, i);
+            } else {
+                snprintf(batches[i].subject, sizeof(batches[i].subject), BATCH_PREFIX "%s", base_subject);
+            }
+            batches[i].data = (unsigned char *)malloc(BATCH_BUF_SIZE);
+        }
+        // Wake up at least every flush deadline so a partial batch is not held back when traffic stops
+        struct timeval timeout = { batch_flush_us / 1000000, batch_flush_us % 1000000 };
+        if (setsockopt(sock_raw, SOL_SOCKET, SO_RCVTIMEO, &timeout, sizeof(timeout)) < 0) {
+            perror("setsockopt SO_RCVTIMEO error");
+        }
+    }
+
+    struct rx_ring *ring = strcmp(interface, ethsec) == 0 ? &ring_ethsec : &ring_ethinsec;
+    if (ring->map != NULL) {
+        capture_ring(interface, sock_raw, ring, batches);
+        return NULL;
+    }
+
     while (1) {
-        int data_size = recvfrom(sock_raw, buffer, BUF_SIZE, 0, &saddr, (socklen_t *)&saddr_len);
+        iov.iov_base = buffer;
+        iov.iov_len = BUF_SIZE;
+        memset(&msg, 0, sizeof(msg));
+        msg.msg_name = &saddr;
+        msg.msg_namelen = sizeof(saddr);
+        msg.msg_iov = &iov;
+        msg.msg_iovlen = 1;
+        msg.msg_control = control;
+        msg.msg_controllen = sizeof(control);
+
+        int data_size = recvmsg(sock_raw, &msg, 0);
         if (data_size < 0) {
-            perror("Recvfrom error");
+            if (batches != NULL && (errno == EAGAIN || errno == EWOULDBLOCK || errno == EINTR)) {
+                batch_flush_expired(batches, processor_shards);
+                continue;
+            }
+            perror("Recvmsg error");
             return NULL;
         }
-        handle_packet_from_interface(buffer, data_size, interface);
+
+        // Kernel receive timestamp, taken before any queuing in the switch or NATS
+        ts.tv_sec = 0;
+        ts.tv_nsec = 0;
+        for (cmsg = CMSG_FIRSTHDR(&msg); cmsg != NULL; cmsg = CMSG_NXTHDR(&msg, cmsg)) {
+            if (cmsg->cmsg_level == SOL_SOCKET && cmsg->cmsg_type == SCM_TIMESTAMPNS) {
+                memcpy(&ts, CMSG_DATA(cmsg), sizeof(ts));
+            }
+        }
+        if (ts.tv_sec == 0 && ts.tv_nsec == 0) {
+            clock_gettime(CLOCK_REALTIME, &ts);
+        }
+        handle_packet_from_interface(buffer, data_size, interface, &ts, batches);
+        if (batches != NULL) {
+            batch_flush_expired(batches, processor_shards);
+        }
     }
 
     return NULL;
 }
 
 
-void handle_packet_from_interface(unsigned char *buffer, int size, char *in_iface) {
+void capture_ring(char *interface, int sock_raw, struct rx_ring *ring, struct frame_batch *batches) {
+    struct pollfd pfd;
+    struct timespec ts;
+    unsigned int block_index = 0;
+    // Poll no longer than the batch flush deadline so partial batches still go out on time
+    int poll_timeout_ms = batches != NULL ? (int)((batch_flush_us + 999) / 1000) : -1;
+
+    memset(&pfd, 0, sizeof(pfd));
+    pfd.fd = sock_raw;
+    pfd.events = POLLIN | POLLERR;
+
+    while (1) {
+        struct tpacket_block_desc *block = (struct tpacket_block_desc *)(ring->map + (size_t)block_index * ring->block_size);
+        if ((block->hdr.bh1.block_status & TP_STATUS_USER) == 0) {
+            if (poll(&pfd, 1, poll_timeout_ms) < 0 && errno != EINTR) {
+                perror("Poll error");
+                return;
+            }
+            if (batches != NULL) {
+                batch_flush_expired(batches, processor_shards);
+            }
+            continue;
+        }
+
+        // Frames of a block are handled in place, straight from the shared ring
+        struct tpacket3_hdr *packet = (struct tpacket3_hdr *)((unsigned char *)block + block->hdr.bh1.offset_to_first_pkt);
+        for (unsigned int i = 0; i < block->hdr.bh1.num_pkts; i++) {
+            ts.tv_sec = packet->tp_sec;
+            ts.tv_nsec = packet->tp_nsec;
+            handle_packet_from_interface((unsigned char *)packet + packet->tp_mac, packet->tp_snaplen, interface, &ts, batches);
+            packet = (struct tpacket3_hdr *)((unsigned char *)packet + packet->tp_next_offset);
+        }
+
+        // Give the block back to the kernel
+        __sync_synchronize();
+        block->hdr.bh1.block_status = TP_STATUS_KERNEL;
+        block_index = (block_index + 1) % ring->block_count;
+        if (batches != NULL) {
+            batch_flush_expired(batches, processor_shards);
+        }
+    }
+}
+
+
+void handle_packet_from_interface(unsigned char *buffer, int size, char *in_iface, struct timespec *ts, struct frame_batch *batches) {
     
     natsStatus s;
+    natsMsg *msg = NULL;
+    const char *base_subject;
+    char subject[32];
+    char ts_value[32];
+    unsigned int shard = 0;
+
     print_packet(buffer, size, in_iface, false);
     if (strcmp(in_iface, ethsec) == 0) {
-        // Publish the packet to NATS
-        s = natsConnection_Publish(conn, "inpktsec", buffer, size);
-        if (s != NATS_OK) {
-            fprintf(stderr, "Error publishing packet to NATS: %s\n", natsStatus_GetText(s));
-        }
+        base_subject = "inpktsec";
     } else {                
-        s = natsConnection_Publish(conn, "inpktinsec", buffer, size);
-        if (s != NATS_OK) {
-            fprintf(stderr, "Error publishing packet to NATS: %s\n", natsStatus_GetText(s));
+        base_subject = "inpktinsec";
+    }
+    // Every frame of a flow goes to the same shard, which keeps the flow's order and detector state together
+    if (processor_shards > 1) {
+        shard = flow_hash(buffer, size) % processor_shards;
+    }
+    if (batches != NULL) {
+        batch_append(&batches[shard], buffer, size, ts);
+        return;
+    }
+    if (processor_shards > 1) {
+        snprintf(subject, sizeof(subject), "%s.%u", base_subject, shard);
+    } else {
+        snprintf(subject, sizeof(subject), "%s", base_subject);
+    }
+
+    // Publish the packet to NATS with its receive timestamp as a header
+    snprintf(ts_value, sizeof(ts_value), "%lld", (long long)ts->tv_sec * 1000000000LL + ts->tv_nsec);
+    s = natsMsg_Create(&msg, subject, NULL, (const char *)buffer, size);
+    if (s == NATS_OK) {
+        s = natsMsgHeader_Set(msg, CAPTURE_TS_HEADER, ts_value);
+    }
+    if (s == NATS_OK) {
+        s = natsConnection_PublishMsg(conn, msg);
+    }
+    if (s != NATS_OK) {
+        fprintf(stderr, "Error publishing packet to NATS: %s\n", natsStatus_GetText(s));
+    }
+    natsMsg_Destroy(msg);
+}
+
+
+void batch_append(struct frame_batch *batch, unsigned char *buffer, int size, struct timespec *ts) {
+    if (batch->len + BATCH_RECORD_HEADER_LEN + size > BATCH_BUF_SIZE) {
+        batch_flush(batch);
+    }
+    if (batch->frames == 0) {
+        clock_gettime(CLOCK_MONOTONIC, &batch->started);
+    }
+    uint64_t ts_ns = (uint64_t)ts->tv_sec * 1000000000ULL + ts->tv_nsec;
+    uint32_t ts_high = htonl((uint32_t)(ts_ns >> 32));
+    uint32_t ts_low = htonl((uint32_t)ts_ns);
+    uint32_t length = htonl((uint32_t)size);
+    unsigned char *record = batch->data + batch->len;
+    memcpy(record, &ts_high, 4);
+    memcpy(record + 4, &ts_low, 4);
+    memcpy(record + 8, &length, 4);
+    memcpy(record + BATCH_RECORD_HEADER_LEN, buffer, size);
+    batch->len += BATCH_RECORD_HEADER_LEN + size;
+    batch->frames++;
+    if (batch->frames >= batch_size) {
+        batch_flush(batch);
+    }
+}
+
+
+void batch_flush(struct frame_batch *batch) {
+    if (batch->frames == 0) {
+        return;
+    }
+    natsStatus s = natsConnection_Publish(conn, batch->subject, batch->data, batch->len);
+    if (s != NATS_OK) {
+        fprintf(stderr, "Error publishing batch to NATS: %s\n", natsStatus_GetText(s));
+    }
+    batch->len = 0;
+    batch->frames = 0;
+}
+
+
+void batch_flush_expired(struct frame_batch *batches, int count) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    for (int i = 0; i < count; i++) {
+        if (batches[i].frames == 0) {
+            continue;
+        }
+        long waited_us = (now.tv_sec - batches[i].started.tv_sec) * 1000000L
+                         + (now.tv_nsec - batches[i].started.tv_nsec) / 1000;
+        if (waited_us >= batch_flush_us) {
+            batch_flush(&batches[i]);
         }
-    }    
+    }
+}
+
+
+uint32_t flow_hash(unsigned char *buffer, int size) {
+    // Must match flow_key() and flow_hash() in code/python-processor/flow/flow_table.py
+    unsigned char key[14];
+    int key_len;
+    struct ethhdr *eth = (struct ethhdr *)buffer;
+
+    if (size < (int)sizeof(struct ethhdr) + 20 || ntohs(eth->h_proto) != ETH_P_IP) {
+        // Non IPv4 frames are keyed by their Ethernet header
+        key_len = size < (int)sizeof(struct ethhdr) ? size : (int)sizeof(struct ethhdr);
+        memcpy(key, buffer, key_len);
+    } else {
+        // IPv4 frames are keyed by src ip, dst ip, protocol, src port, dst port
+        struct iphdr *iph = (struct iphdr *)(buffer + sizeof(struct ethhdr));
+        int l4 = sizeof(struct ethhdr) + iph->ihl * 4;
+        memcpy(key, &iph->saddr, 4);
+        memcpy(key + 4, &iph->daddr, 4);
+        key[8] = iph->protocol;
+        // Only the first fragment carries the transport header, the others have zero ports
+        if ((iph->protocol == IPPROTO_TCP || iph->protocol == IPPROTO_UDP) && size >= l4 + 4
+            && (ntohs(iph->frag_off) & IP_OFFMASK) == 0) {
+            memcpy(key + 9, buffer + l4, 4);
+        } else {
+            memset(key + 9, 0, 4);
+        }
+        key_len = 13;
+    }
+
+    uint32_t hash = 2166136261u;
+    for (int i = 0; i < key_len; i++) {
+        hash ^= key[i];
+        hash *= 16777619u;
+    }
+    return hash;
 }
 
 
 void handle_packet_from_nats(natsConnection *nc, natsSubscription *sub, natsMsg *msg, void *closure) {
-    unsigned char *buffer = (unsigned char *)natsMsg_GetData(msg);
-    int size = natsMsg_GetDataLength(msg);
+    forward_packet(natsMsg_GetSubject(msg), (unsigned char *)natsMsg_GetData(msg), natsMsg_GetDataLength(msg));
+    natsMsg_Destroy(msg);
+}
+
+
+void handle_batch_from_nats(natsConnection *nc, natsSubscription *sub, natsMsg *msg, void *closure) {
+    unsigned char *data = (unsigned char *)natsMsg_GetData(msg);
+    int len = natsMsg_GetDataLength(msg);
+    // Frames are forwarded in place; the record timestamps are not needed on the way out
+    const char *subject = natsMsg_GetSubject(msg) + strlen(BATCH_PREFIX);
+    struct mmsghdr msgs[SEND_BATCH_MAX];
+    struct iovec iovs[SEND_BATCH_MAX];
+    unsigned char *mac;
+    char *outiface;
+    int sock;
+    int count = 0;
+    int offset = 0;
+
+    if (strcmp(subject, "outpktsec") == 0) {
+        sock = sock_raw_ethsec;
+        mac = mac_secure_net_host;
+        outiface = ethsec;
+    } else if (strcmp(subject, "outpktinsec") == 0) {
+        sock = sock_raw_ethinsec;
+        mac = mac_insecure_net_host;
+        outiface = ethinsec;
+    } else {
+        natsMsg_Destroy(msg);
+        return;
+    }
+
+    memset(msgs, 0, sizeof(msgs));
+    while (offset + BATCH_RECORD_HEADER_LEN <= len) {
+        uint32_t length;
+        memcpy(&length, data + offset + 8, 4);
+        length = ntohl(length);
+        offset += BATCH_RECORD_HEADER_LEN;
+        if (length > (uint32_t)(len - offset)) {
+            fprintf(stderr, "Truncated batch on %s\n", natsMsg_GetSubject(msg));
+            break;
+        }
+        unsigned char *buffer = data + offset;
+        offset += length;
+        if (length < sizeof(struct ethhdr)) {
+            continue;
+        }
+        memcpy(((struct ethhdr *)buffer)->h_dest, mac, 6);
+        print_packet(buffer, length, outiface, true);
+
+        // Send up to SEND_BATCH_MAX frames with one syscall
+        iovs[count].iov_base = buffer;
+        iovs[count].iov_len = length;
+        msgs[count].msg_hdr.msg_iov = &iovs[count];
+        msgs[count].msg_hdr.msg_iovlen = 1;
+        count++;
+        if (count == SEND_BATCH_MAX) {
+            send_frames(sock, msgs, count, outiface);
+            count = 0;
+        }
+    }
+    send_frames(sock, msgs, count, outiface);
+    natsMsg_Destroy(msg);
+}
+
+
+void send_frames(int sock, struct mmsghdr *msgs, int count, char *outiface) {
+    int sent = 0;
+    while (sent < count) {
+        int result = sendmmsg(sock, msgs + sent, count - sent, MSG_DONTROUTE);
+        if (result < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            fprintf(stderr, "Sendmmsg error for %s: %s\n", outiface, strerror(errno));
+            // Skip the frame that failed and keep sending the rest
+            sent++;
+            continue;
+        }
+        sent += result;
+    }
+}
+
+
+void forward_packet(const char *subject, unsigned char *buffer, int size) {
     struct ethhdr *eth = (struct ethhdr *)buffer;
-    char * outiface;
-    if (strcmp(natsMsg_GetSubject(msg), "outpktsec") == 0) {
+    char * outiface = NULL;
+    if (strcmp(subject, "outpktsec") == 0) {
         memcpy(eth->h_dest, mac_secure_net_host, 6);
         //memcpy(eth->h_source, mac_ethsec, 6);
 
@@ -244,7 +646,7 @@ void handle_packet_from_nats(natsConnection *nc, natsSubscription *sub, natsMsg
         if (sendto(sock_raw_ethsec, buffer, size, MSG_DONTROUTE, NULL, 0) < 0) {
             perror("Sendto error for ethsec");
         }
-    } else if (strcmp(natsMsg_GetSubject(msg), "outpktinsec") == 0) {
+    } else if (strcmp(subject, "outpktinsec") == 0) {
         memcpy(eth->h_dest, mac_insecure_net_host, 6);
         //memcpy(eth->h_source, mac_ethinsec, 6);
         outiface = ethinsec;
@@ -253,9 +655,9 @@ void handle_packet_from_nats(natsConnection *nc, natsSubscription *sub, natsMsg
         }
     }
 
-    print_packet(buffer, size, outiface, true);
-
-    natsMsg_Destroy(msg);
+    if (outiface != NULL) {
+        print_packet(buffer, size, outiface, true);
+    }
 }
 
 
@@ -270,6 +672,37 @@ bool configure_switch(){
         configured = false;
     }
     printf("NATS_SURVEYOR_SERVERS: %s\n", nats_url);
+
+    char *shards = getenv("PROCESSOR_SHARDS");
+    if (shards != NULL && atoi(shards) > 1) {
+        processor_shards = atoi(shards);
+    }
+    printf("PROCESSOR_SHARDS: %d\n", processor_shards);
+
+    char *batch = getenv("PROCESSOR_BATCH_SIZE");
+    if (batch != NULL && atoi(batch) > 1) {
+        batch_size = atoi(batch);
+    }
+    char *flush_us = getenv("PROCESSOR_BATCH_FLUSH_US");
+    if (flush_us != NULL && atol(flush_us) > 0) {
+        batch_flush_us = atol(flush_us);
+    }
+    printf("PROCESSOR_BATCH_SIZE: %d, PROCESSOR_BATCH_FLUSH_US: %ld\n", batch_size, batch_flush_us);
+
+    char *block_size = getenv("SWITCH_RING_BLOCK_SIZE");
+    if (block_size != NULL && atoi(block_size) > 0) {
+        ring_block_size = atoi(block_size);
+    }
+    char *block_count = getenv("SWITCH_RING_BLOCK_COUNT");
+    if (block_count != NULL && atoi(block_count) > 0) {
+        ring_block_count = atoi(block_count);
+    }
+    char *ring_timeout = getenv("SWITCH_RING_TIMEOUT_MS");
+    if (ring_timeout != NULL && atoi(ring_timeout) > 0) {
+        ring_timeout_ms = atoi(ring_timeout);
+    }
+    printf("SWITCH_RING_BLOCK_SIZE: %u, SWITCH_RING_BLOCK_COUNT: %u, SWITCH_RING_TIMEOUT_MS: %u\n",
+           ring_block_size, ring_block_count, ring_timeout_ms);
     
 
     secure_net_host_ip = getenv("SECURENET_HOST_IP");
@@ -342,6 +775,15 @@ bool configureRawSockets() {
         configured = false;
     }
 
+    // Ask the kernel for nanosecond receive timestamps on captured packets
+    int enable_timestamps = 1;
+    if (setsockopt(sock_raw_ethsec, SOL_SOCKET, SO_TIMESTAMPNS, &enable_timestamps, sizeof(enable_timestamps)) < 0) {
+        perror("setsockopt SO_TIMESTAMPNS error for ethsec");
+    }
+    if (setsockopt(sock_raw_ethinsec, SOL_SOCKET, SO_TIMESTAMPNS, &enable_timestamps, sizeof(enable_timestamps)) < 0) {
+        perror("setsockopt SO_TIMESTAMPNS error for ethinsec");
+    }
+
     // Bind raw socket sock_raw_ethsec to interfaces ethsec
     memset(&ifr_ethsec, 0, sizeof(ifr_ethsec));
     strncpy(ifr_ethsec.ifr_name, ethsec, IFNAMSIZ - 1);
@@ -394,11 +836,57 @@ bool configureRawSockets() {
     printf("MAC address of ethinsec: %02x:%02x:%02x:%02x:%02x:%02x\n",
            mac_ethinsec[0], mac_ethinsec[1], mac_ethinsec[2], mac_ethinsec[3], mac_ethinsec[4], mac_ethinsec[5]);
 
+    // Capture from memory mapped rings instead of one recvmsg per packet
+    if (ring_block_size > 0 && configured) {
+        configured = configure_rx_ring(sock_raw_ethsec, &ring_ethsec, ethsec)
+                     && configure_rx_ring(sock_raw_ethinsec, &ring_ethinsec, ethinsec);
+    }
 
     return configured;
 }
 
 
+bool configure_rx_ring(int sock, struct rx_ring *ring, char *iface) {
+    int version = TPACKET_V3;
+    struct tpacket_req3 req;
+
+    if (setsockopt(sock, SOL_PACKET, PACKET_VERSION, &version, sizeof(version)) < 0) {
+        fprintf(stderr, "setsockopt PACKET_VERSION error for %s: %s\n", iface, strerror(errno));
+        return false;
+    }
+
+    // The kernel fills whole blocks and hands a block over when it is full or after tp_retire_blk_tov ms
+    memset(&req, 0, sizeof(req));
+    req.tp_block_size = ring_block_size;
+    req.tp_block_nr = ring_block_count;
+    req.tp_frame_size = RING_FRAME_SIZE;
+    req.tp_frame_nr = (ring_block_size / RING_FRAME_SIZE) * ring_block_count;
+    req.tp_retire_blk_tov = ring_timeout_ms;
+    req.tp_feature_req_word = TP_FT_REQ_FILL_RXHASH;
+    if (setsockopt(sock, SOL_PACKET, PACKET_RX_RING, &req, sizeof(req)) < 0) {
+        fprintf(stderr, "setsockopt PACKET_RX_RING error for %s (block size must be a multiple of the page size): %s\n",
+                iface, strerror(errno));
+        return false;
+    }
+
+    ring->block_size = ring_block_size;
+    ring->block_count = ring_block_count;
+    ring->map_len = (size_t)ring_block_size * ring_block_count;
+    ring->map = mmap(NULL, ring->map_len, PROT_READ | PROT_WRITE, MAP_SHARED | MAP_LOCKED, sock, 0);
+    if (ring->map == MAP_FAILED) {
+        // Locking the ring needs CAP_IPC_LOCK, fall back to a plain mapping
+        ring->map = mmap(NULL, ring->map_len, PROT_READ | PROT_WRITE, MAP_SHARED, sock, 0);
+    }
+    if (ring->map == MAP_FAILED) {
+        fprintf(stderr, "mmap error for the %s ring: %s\n", iface, strerror(errno));
+        ring->map = NULL;
+        return false;
+    }
+    printf("Capturing from a TPACKET_V3 ring on %s: %u blocks of %u bytes\n", iface, ring_block_count, ring_block_size);
+    return true;
+}
+
+
 bool configure_nats() {
     // Initialize NATS connection
     bool configured = true;
@@ -426,6 +914,19 @@ bool configure_nats() {
         fprintf(stderr, "Error subscribing to outpktinsec: %s\n", natsStatus_GetText(s));
         configured =false;
     }
+    // Processors may send frames back in batches whether or not the switch batches its own
+    natsSubscription *sub_batch_outpktsec = NULL;
+    natsSubscription *sub_batch_outpktinsec = NULL;
+    s = natsConnection_Subscribe(&sub_batch_outpktsec, conn, BATCH_PREFIX "outpktsec", handle_batch_from_nats, NULL);
+    if (s != NATS_OK) {
+        fprintf(stderr, "Error subscribing to " BATCH_PREFIX "outpktsec: %s\n", natsStatus_GetText(s));
+        configured =false;
+    }
+    s = natsConnection_Subscribe(&sub_batch_outpktinsec, conn, BATCH_PREFIX "outpktinsec", handle_batch_from_nats, NULL);
+    if (s != NATS_OK) {
+        fprintf(stderr, "Error subscribing to " BATCH_PREFIX "outpktinsec: %s\n", natsStatus_GetText(s));
+        configured =false;
+    }
     return configured;
 }
 
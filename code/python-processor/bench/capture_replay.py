@@ -0,0 +1,200 @@
+"""
+Replay captured frames (see journal.capture_stream) through the processor's detection and
+mitigation in virtual time: the capture timestamps drive the detectors and the release clock, the
+random delays are seeded, and nothing waits for the scheduler, so the decisions on a capture are
+the same on every run whatever the replay speed. Hours of traffic are checked in minutes, e.g.
+before and after a CovertChannelDetector change. Run from code/python-processor:
+
+    python -m bench.capture_replay --start 2025-06-15T10:00 --end 2025-06-15T12:00 --output before.json
+    python -m bench.capture_replay --start 2025-06-15T10:00 --end 2025-06-15T12:00 --compare before.json
+    python -m bench.capture_replay --start 2025-06-15T10:00 --duration 60 --speed 1
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+from typing import AsyncIterable, Dict
+
+import nats
+import numpy as np
+
+from journal.capture_stream import DEFAULT_STREAM, read_capture
+from journal.packet_journal import DECISION_COVERT, DECISION_MITIGATED, PacketJournal, concatenate, read_journal
+from processor.packet_processor import PacketProcessor, score_names
+
+
+class DiscardNATS:
+    async def publish(self, subject: str, payload: bytes = b'', headers: Dict = None) -> None:
+        pass
+
+
+def parse_time(value: str) -> float:
+    """Seconds since the epoch, or an ISO 8601 time (UTC unless it has an offset)."""
+    try:
+        return float(value)
+    except ValueError:
+        moment = datetime.datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        return moment.timestamp()
+
+
+async def replay_capture(frames: AsyncIterable, processor: PacketProcessor, speed: float = 0.0) -> Dict:
+    """
+    Inspect every frame at its capture time, on the processor's virtual clock.
+    With a speed above 0 frames are paced to speed times their captured rate; this only changes
+    how long the replay takes, decisions never depend on the wall clock.
+    """
+    count = 0
+    first = None
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    inspect = processor.inspect
+    async for frame in frames:
+        timestamp = frame.timestamp
+        if first is None:
+            first = timestamp
+        if speed > 0:
+            delay = (timestamp - first) / speed - (time.perf_counter() - wall_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # Capture time is both the ipd clock and the release clock, instead of the event loop's
+        inspect(frame.subject, frame.data, timestamp, timestamp)
+        count += 1
+    wall = time.perf_counter() - wall_start
+    return {
+        'frames': count,
+        'captured_seconds': timestamp - first if count else 0.0,
+        'replay_seconds': wall,
+        'speedup': (timestamp - first) / wall if count and wall > 0 else 0.0,
+        'cpu_us_per_frame': (time.process_time() - cpu_start) / max(count, 1) * 1e6
+    }
+
+
+def summarize_decisions(journal_dir: str) -> Dict:
+    """Per-flow detections and a digest of every frame's decision and score, read back from the journal."""
+    segments = read_journal(journal_dir)
+    if not segments:
+        return {'digest': None, 'flows': 0, 'detections': 0, 'mitigated': 0, 'flagged_flows': {}}
+    columns = concatenate(segments)
+    digest = hashlib.sha256()
+    for name in ("flow_id", "decision", "total_score"):
+        digest.update(np.ascontiguousarray(columns[name]).tobytes())
+    flagged = (columns["decision"] & DECISION_COVERT) != 0
+    flow_ids, counts = np.unique(columns["flow_id"][flagged], return_counts=True)
+    return {
+        'digest': digest.hexdigest(),
+        'flows': int(len(np.unique(columns["flow_id"]))),
+        'detections': int(flagged.sum()),
+        'mitigated': int(((columns["decision"] & DECISION_MITIGATED) != 0).sum()),
+        'flagged_flows': {str(flow_id): int(count) for flow_id, count in zip(flow_ids, counts)}
+    }
+
+
+def compare(results: Dict, previous: Dict) -> None:
+    """Print how the decisions of two replays of a capture differ."""
+    decisions, old = results['decisions'], previous['decisions']
+    if decisions['digest'] == old['digest']:
+        print("Decisions identical to the previous replay")
+        return
+    flagged, old_flagged = decisions['flagged_flows'], old['flagged_flows']
+    print(f"Decisions differ: {old['detections']} -> {decisions['detections']} detections, "
+          f"{len(old_flagged)} -> {len(flagged)} flagged flows")
+    for flow_id in sorted(set(flagged) - set(old_flagged)):
+        print(f"  newly flagged: flow {flow_id} ({flagged[flow_id]} detections)")
+    for flow_id in sorted(set(old_flagged) - set(flagged)):
+        print(f"  no longer flagged: flow {flow_id} ({old_flagged[flow_id]} detections before)")
+
+
+async def run(args, journal_dir: str) -> Dict:
+    random.seed(args.seed)
+    journal = PacketJournal(journal_dir, score_names=score_names(args.detectors, args.scales))
+    processor = PacketProcessor(
+        DiscardNATS(), args.mean_value, args.min_delay, args.max_delay,
+        window_size=args.window_size, detection_threshold=args.detection_threshold,
+        max_flows=args.max_flows, flow_idle_timeout=args.flow_idle_timeout,
+        baseline_scope=args.baseline_scope, baseline_decay=args.baseline_decay,
+        mitigation_mode=args.mitigation_mode, pace_quantum=args.pace_quantum, pace_hold=args.pace_hold,
+        full_score_interval=args.full_score_interval, journal=journal, detectors=args.detectors,
+        monitor_rules=args.monitor, scales=args.scales, scale_fusion=args.scale_fusion)
+    nc = await nats.connect(args.nats)
+    try:
+        end = args.end if args.end is not None else (args.start + args.duration if args.duration else None)
+        replay = await replay_capture(read_capture(nc.jetstream(), args.stream, args.start, end),
+                                      processor, args.speed)
+    finally:
+        await nc.close()
+        journal.close()
+    return {'replay': replay, 'decisions': summarize_decisions(journal_dir)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured frames through the processor in virtual time")
+    parser.add_argument("--nats", type=str, default=os.getenv("NATS_SURVEYOR_SERVERS", "nats://localhost:4222"),
+                        help="NATS server of the capture stream (NATS_SURVEYOR_SERVERS)")
+    parser.add_argument("--stream", type=str, default=DEFAULT_STREAM, help="Capture stream")
+    parser.add_argument("--start", type=parse_time, default=None,
+                        help="First capture time replayed, epoch seconds or ISO 8601, the oldest frame when not given")
+    parser.add_argument("--end", type=parse_time, default=None, help="Capture time the replay stops at")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds of capture replayed after --start")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="1 for the captured rate, N for N times faster, 0 for as fast as possible")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random delays")
+    parser.add_argument("--journal_dir", type=str, default=None,
+                        help="Keep the journal of the replay's decisions in this directory, a temporary one otherwise")
+    parser.add_argument("--mean_value", type=float, default=5e-6, help="Mean value for random delay")
+    parser.add_argument("--min_delay", type=float, default=0.6, help="Minimum mitigation delay")
+    parser.add_argument("--max_delay", type=float, default=1.6, help="Maximum mitigation delay")
+    parser.add_argument("--window_size", type=int, default=30, help="Window size for detector")
+    parser.add_argument("--detection_threshold", type=float, default=0.65, help="Detection threshold (0-1)")
+    parser.add_argument("--max_flows", type=int, default=100000, help="Maximum number of flows")
+    parser.add_argument("--flow_idle_timeout", type=float, default=60.0,
+                        help="Capture seconds without a packet after which a flow is dropped")
+    parser.add_argument("--baseline_scope", choices=["flow", "subnet"], default="flow",
+                        help="Learn ipd baselines per flow or per source /24 subnet")
+    parser.add_argument("--baseline_decay", type=float, default=0.0,
+                        help="Weight of a new ipd in a warmed up baseline, e.g. 0.01; 0 freezes baselines")
+    parser.add_argument("--mitigation_mode", choices=["delay", "grid", "jitter", "predictive"], default="delay",
+                        help="Random delays on the packets after a detection, or pace the suspect flow")
+    parser.add_argument("--pace_quantum", type=float, default=0.05, help="Granularity of the release grid (seconds)")
+    parser.add_argument("--pace_hold", type=float, default=30.0, help="Seconds a flow stays paced after a detection")
+    parser.add_argument("--full_score_interval", type=int, default=0,
+                        help="Fully score flows failing the prefilter every this many packets, 0 for always")
+    parser.add_argument("--detectors", type=str, nargs="+", default=None,
+                        help="Detectors of the scoring pipeline as name[:weight]")
+    parser.add_argument("--monitor", type=str, nargs="+", default=None, help="Only inspect frames matching these rules")
+    parser.add_argument("--scales", type=int, nargs="+", default=None, help="Window lengths scored at once")
+    parser.add_argument("--scale_fusion", choices=["max", "mean"], default="max", help="How per-scale scores are fused")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    parser.add_argument("--compare", type=str, default=None, help="Compare decisions with an earlier replay's results")
+    args = parser.parse_args()
+    if args.duration is not None and args.start is None:
+        parser.error("--duration needs --start")
+
+    if args.journal_dir:
+        results = asyncio.run(run(args, args.journal_dir))
+    else:
+        with tempfile.TemporaryDirectory() as journal_dir:
+            results = asyncio.run(run(args, journal_dir))
+    results['config'] = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+
+    replay, decisions = results['replay'], results['decisions']
+    print(f"{replay['frames']} frames, {replay['captured_seconds']:.1f}s of capture replayed in "
+          f"{replay['replay_seconds']:.1f}s ({replay['speedup']:.1f}x), {replay['cpu_us_per_frame']:.1f} us per frame")
+    print(f"{decisions['flows']} flows, {decisions['detections']} detections on {len(decisions['flagged_flows'])} flows, "
+          f"{decisions['mitigated']} frames mitigated, decision digest {decisions['digest']}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
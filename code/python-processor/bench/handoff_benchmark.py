@@ -0,0 +1,168 @@
+"""
+Cost and fidelity of the flow state handoff of a hot restart (see processor.handoff).
+The state of many flows is dumped, written to the handoff directory, read back and loaded by a
+second processor, then every flow is restored and compared with the original. A synthetic trace
+is also cut in two: the second half goes through the processor that saw the first half, through
+one that took its state over, and through a cold one, with the same random delays; the first two
+must release every frame at the same time. Run from code/python-processor:
+
+    python -m bench.handoff_benchmark --flows 100000
+    python -m bench.handoff_benchmark --flows 100000 --window_size 50 --scales 30 120
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import time
+from typing import Dict, List
+
+from bench.capture_replay import DiscardNATS
+from bench.traces import TraceFrame, synthetic_trace
+from flow.flow_snapshot import save
+from processor.handoff import DEFAULT_HANDOFF_DIR
+from processor.packet_processor import PacketProcessor
+
+
+def new_processor(args) -> PacketProcessor:
+    return PacketProcessor(DiscardNATS(), args.mean_value, args.min_delay, args.max_delay,
+                           window_size=args.window_size, detection_threshold=args.detection_threshold,
+                           max_flows=args.flows, mitigation_mode=args.mitigation_mode, scales=args.scales)
+
+
+def flow_keys(count: int) -> List[bytes]:
+    """Keys of UDP flows from distinct source addresses and ports to the insecure host."""
+    return [struct.pack("!IIBHH", 0x0A010000 + flow // 60000, 0x0A000015, 17, 1024 + flow % 60000, 8002)
+            for flow in range(count)]
+
+
+def handoff_cost(args) -> Dict:
+    """Time to dump, write, read and load the state of args.flows flows, and check the restored flows."""
+    rng = random.Random(args.seed)
+    old = new_processor(args)
+    keys = flow_keys(args.flows)
+    table = old.flow_table
+    for key in keys:
+        timestamp = rng.uniform(0, 1)
+        flow = table.get(key, timestamp)
+        detector = flow.detector
+        for _ in range(args.packets_per_flow):
+            timestamp += rng.expovariate(1 / args.mean_ipd)
+            detector.add_packet(timestamp)
+        flow.last_seen = timestamp
+        if rng.random() < args.mitigated_share:
+            old.start_mitigation(flow, timestamp)
+
+    start = time.perf_counter()
+    data = old.dump_state()
+    dumped = time.perf_counter()
+    path = os.path.join(args.handoff_dir, f"handoff-benchmark-{os.getpid()}.bin")
+    save(path, data)
+    written = time.perf_counter()
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)
+    read = time.perf_counter()
+    new = new_processor(args)
+    new.load_state(data)
+    loaded = time.perf_counter()
+
+    now = max(flow.last_seen for flow in table.flows.values())
+    mismatched = 0
+    restore_start = time.perf_counter()
+    restored = [new.flow_table.get(key, now) for key in keys]
+    restore_time = time.perf_counter() - restore_start
+    for key, flow in zip(keys, restored):
+        original = table.lookup(key)
+        a, b = original.detector, flow.detector
+        pacers = (original.pacer is None) == (flow.pacer is None) and (
+            original.pacer is None or original.pacer.paced_until == flow.pacer.paced_until)
+        if (a.ipd_window.window()[-b.ipd_window.size:] != b.ipd_window.window() or a.total_packets != b.total_packets
+                or a.last_packet_time != b.last_packet_time or original.release_at != flow.release_at
+                or original.mitigation_count != flow.mitigation_count or not pacers):
+            mismatched += 1
+    return {
+        'flows': args.flows,
+        'snapshot_bytes': len(data),
+        'dump_ms': (dumped - start) * 1000,
+        'write_ms': (written - dumped) * 1000,
+        'read_ms': (read - written) * 1000,
+        'load_ms': (loaded - read) * 1000,
+        'handoff_ms': (loaded - start) * 1000,
+        'restore_us_per_flow': restore_time / max(len(keys), 1) * 1e6,
+        'restored': new.flow_table.restored,
+        'mismatched': mismatched
+    }
+
+
+def replay(processor: PacketProcessor, frames: List[TraceFrame], seed: int) -> List[float]:
+    """Release deadlines of the frames, inspected in virtual time with seeded random delays."""
+    random.seed(seed)
+    return [processor.inspect(frame.subject, frame.data, frame.timestamp, frame.timestamp) for frame in frames]
+
+
+def continuity(args) -> Dict:
+    """Compare the second half of a trace handled without restart, after a handoff and after a cold restart."""
+    trace = synthetic_trace(args.benign_flows, args.covert_flows, args.trace_packets_per_flow, seed=args.seed)
+    middle = trace[len(trace) // 2].timestamp
+    first = [frame for frame in trace if frame.timestamp < middle]
+    second = [frame for frame in trace if frame.timestamp >= middle]
+    results = {}
+    old = new_processor(args)
+    replay(old, first, args.seed)
+    taken_over = new_processor(args)
+    taken_over.load_state(old.dump_state())
+    cold = new_processor(args)
+    before = old.detected_covert_channel_count
+    continued = replay(old, second, args.seed + 1)
+    for name, processor in (("continued", old), ("handed_over", taken_over), ("cold", cold)):
+        deadlines = continued if processor is old else replay(processor, second, args.seed + 1)
+        detections = processor.detected_covert_channel_count - (before if processor is old else 0)
+        results[name] = {
+            'detections': detections,
+            'same_deadlines': sum(a == b for a, b in zip(deadlines, continued)) / max(len(second), 1)
+        }
+    results['frames'] = len(second)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flow state handoff benchmark")
+    parser.add_argument("--flows", type=int, default=100000, help="Flows handed over")
+    parser.add_argument("--packets_per_flow", type=int, default=64, help="Packets seen on every flow before the handoff")
+    parser.add_argument("--mean_ipd", type=float, default=0.05, help="Mean ipd of the flows")
+    parser.add_argument("--mitigated_share", type=float, default=0.01, help="Share of flows mitigated at the handoff")
+    parser.add_argument("--handoff_dir", type=str, default=DEFAULT_HANDOFF_DIR, help="Directory the snapshot is written to")
+    parser.add_argument("--benign_flows", type=int, default=200, help="Benign flows of the continuity trace")
+    parser.add_argument("--covert_flows", type=int, default=4, help="Covert channel flows of the continuity trace")
+    parser.add_argument("--trace_packets_per_flow", type=int, default=200, help="Packets per benign flow of the trace")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the flows and random delays")
+    parser.add_argument("--mean_value", type=float, default=5e-6, help="Mean value for random delay")
+    parser.add_argument("--min_delay", type=float, default=0.6, help="Minimum mitigation delay")
+    parser.add_argument("--max_delay", type=float, default=1.6, help="Maximum mitigation delay")
+    parser.add_argument("--window_size", type=int, default=30, help="Window size for detector")
+    parser.add_argument("--detection_threshold", type=float, default=0.65, help="Detection threshold (0-1)")
+    parser.add_argument("--mitigation_mode", choices=["delay", "grid", "jitter", "predictive"], default="grid",
+                        help="Mitigation of the detected flows, pacing modes also hand over pacers")
+    parser.add_argument("--scales", type=int, nargs="+", default=None, help="Window lengths scored at once")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {'handoff': handoff_cost(args), 'continuity': continuity(args)}
+    print(json.dumps(results, indent=2))
+    cost = results['handoff']
+    print(f"{cost['flows']} flows, {cost['snapshot_bytes'] / 1e6:.1f} MB: handoff {cost['handoff_ms']:.0f}ms "
+          f"(dump {cost['dump_ms']:.0f}, write {cost['write_ms']:.0f}, read {cost['read_ms']:.0f}, "
+          f"load {cost['load_ms']:.0f}), {cost['restore_us_per_flow']:.1f} us per flow restored on its next packet, "
+          f"{cost['mismatched']} mismatched")
+    for name in ("continued", "handed_over", "cold"):
+        run = results['continuity'][name]
+        print(f"{name:>12}: {run['detections']} detections, {run['same_deadlines']:.1%} of "
+              f"{results['continuity']['frames']} release deadlines as without restart")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
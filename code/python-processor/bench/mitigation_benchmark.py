@@ -0,0 +1,165 @@
+"""
+Measure how much of the covert timing channel is left after mitigation and what it costs in
+latency. The covert flow is timed like code/sec/phase2_experiment_sender.py, sent through the
+processor's detection and mitigation in virtual time, and decoded from the release times the
+way code/insec/covert_channel_receiver.py does; BER and capacity are computed like the sender's
+experiment. Run from code/python-processor:
+
+    python -m bench.mitigation_benchmark --modes off delay grid jitter predictive
+"""
+import argparse
+import json
+import math
+import random
+from typing import Dict, List
+
+import numpy as np
+
+from bench.traces import covert_ipds, create_bitstream_from_message, synthetic_trace, udp_frame, \
+    INSECURE_HOST_IP, SECURE_HOST_IP
+from processor.packet_processor import PacketProcessor
+
+
+class DiscardNATS:
+    async def publish(self, subject: str, payload: bytes = b'', headers: Dict = None) -> None:
+        pass
+
+
+def decode_bits(times: List[float], bit_repeat_len: int, sender_bit_delay: float, given_delay_threshold: float) -> str:
+    """Decode received packet times like covert_channel_receiver.py."""
+    ipd_threshold = sender_bit_delay + given_delay_threshold
+    bits = ""
+    recv_times = []
+    is_first_data_received = False
+    for previous, current in zip(times, times[1:]):
+        recv_times.append(current - previous)
+        if len(recv_times) >= bit_repeat_len or (len(recv_times) >= bit_repeat_len - 1 and not is_first_data_received):
+            is_first_data_received = True
+            bits += "0" if sum(recv_times) / len(recv_times) < ipd_threshold else "1"
+            recv_times.clear()
+    return bits
+
+
+def binary_entropy(p: float) -> float:
+    if p <= 0.0 or p >= 1.0:
+        return 0.0
+    return -p * math.log2(p) - (1 - p) * math.log2(1 - p)
+
+
+def make_processor(mode: str, args) -> PacketProcessor:
+    # Mode "off" never detects, it measures the channel without any mitigation
+    threshold = 1.0 if mode == "off" else args.detection_threshold
+    return PacketProcessor(DiscardNATS(), args.mean_value, args.min_delay, args.max_delay,
+                           window_size=args.window_size, detection_threshold=threshold,
+                           mitigation_mode="delay" if mode == "off" else mode,
+                           pace_quantum=args.pace_quantum, pace_hold=args.pace_hold)
+
+
+def run_covert(mode: str, args) -> Dict:
+    """Send the message repeatedly on one flow, each repetition once the previous one was decoded."""
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    processor = make_processor(mode, args)
+    bitstream = create_bitstream_from_message(args.message)
+    gaps = covert_ipds(args.message, args.zero_bit_delay, args.one_bit_delay, args.bit_repeat_len)
+    frame = udp_frame(SECURE_HOST_IP, INSECURE_HOST_IP, 40000, 8002, b"bit")
+
+    bers, capacities, bit_rates, latencies = [], [], [], []
+    start = 0.0
+    for _ in range(args.repetitions):
+        sent = start
+        released = []
+        for gap in gaps:
+            arrival = sent + abs(rng.gauss(0, args.jitter))
+            release_at = processor.inspect("inpktsec", frame, arrival, arrival)
+            released.append(release_at)
+            latencies.append(release_at - arrival)
+            sent += gap
+        received_bits = decode_bits(released, args.bit_repeat_len, args.zero_bit_delay, args.given_delay_threshold)
+        received_bits = received_bits[:len(bitstream)]
+        errors = sum(a != b for a, b in zip(bitstream, received_bits)) + len(bitstream) - len(received_bits)
+        # The sender's experiment times a repetition from its first packet to the receiver's answer
+        total_time = released[-1] - start + args.rtt
+        bers.append(errors / len(bitstream))
+        capacities.append((len(received_bits) - errors) / total_time)
+        bit_rates.append(len(bitstream) / total_time)
+        start = max(sent, released[-1] + args.rtt)
+
+    ber = float(np.mean(bers))
+    return {
+        'ber': ber,
+        'ber_after_first': float(np.mean(bers[1:])) if len(bers) > 1 else None,
+        'capacity_bps': float(np.mean(capacities)),
+        'capacity_bps_after_first': float(np.mean(capacities[1:])) if len(capacities) > 1 else None,
+        # The sender's capacity still counts the bits a receiver guessing at random gets right,
+        # the binary symmetric channel capacity does not
+        'bsc_capacity_bps': float(np.mean(bit_rates)) * (1 - binary_entropy(min(ber, 0.5))),
+        'covert_latency_ms': _percentiles(np.array(latencies) * 1000),
+        'detections': processor.detected_covert_channel_count,
+        'paced_flows': processor.paced_flows_count
+    }
+
+
+def run_benign(mode: str, args) -> Dict:
+    """Added latency of benign flows and how many of them get mitigated by mistake."""
+    random.seed(args.seed)
+    processor = make_processor(mode, args)
+    trace = synthetic_trace(args.benign_flows, 0, args.packets_per_flow, args.benign_mean_ipd, seed=args.seed)
+    latencies = np.empty(len(trace))
+    for index, frame in enumerate(trace):
+        latencies[index] = processor.inspect(frame.subject, frame.data, frame.timestamp, frame.timestamp) - frame.timestamp
+    return {
+        'benign_latency_ms': _percentiles(latencies * 1000),
+        'benign_detections': processor.detected_covert_channel_count,
+        'benign_paced_flows': processor.paced_flows_count
+    }
+
+
+def _percentiles(values: np.ndarray) -> Dict:
+    if len(values) == 0:
+        return {'p50': None, 'p99': None, 'mean': None, 'max': None}
+    p50, p99 = np.percentile(values, [50, 99])
+    return {'p50': float(p50), 'p99': float(p99), 'mean': float(values.mean()), 'max': float(values.max())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mitigation benchmark")
+    parser.add_argument("--modes", nargs="+", default=["off", "delay", "grid", "jitter", "predictive"],
+                        help="Mitigation modes to compare, off for no mitigation")
+    parser.add_argument("--message", type=str, default="Hello", help="Covert message")
+    parser.add_argument("--zero_bit_delay", type=float, default=0.3, help="Zero's bit delay time")
+    parser.add_argument("--one_bit_delay", type=float, default=0.9, help="One's bit delay time")
+    parser.add_argument("--bit_repeat_len", type=int, default=5, help="How many packets sends the same bit")
+    parser.add_argument("--given_delay_threshold", type=float, default=0.3, help="Receiver's delay threshold")
+    parser.add_argument("--repetitions", type=int, default=10, help="Times the message is sent")
+    parser.add_argument("--jitter", type=float, default=0.002, help="Network jitter on the covert packets (seconds)")
+    parser.add_argument("--rtt", type=float, default=0.01, help="Time for the receiver's answer to reach the sender")
+    parser.add_argument("--benign_flows", type=int, default=200, help="Number of benign flows")
+    parser.add_argument("--packets_per_flow", type=int, default=200, help="Packets per benign flow")
+    parser.add_argument("--benign_mean_ipd", type=float, default=0.05, help="Mean ipd of benign flows")
+    parser.add_argument("--mean_value", type=float, default=5e-6, help="Mean value for random delay")
+    parser.add_argument("--min_delay", type=float, default=0.6, help="Minimum mitigation delay")
+    parser.add_argument("--max_delay", type=float, default=1.6, help="Maximum mitigation delay")
+    parser.add_argument("--window_size", type=int, default=30, help="Window size for detector")
+    parser.add_argument("--detection_threshold", type=float, default=0.65, help="Detection threshold (0-1)")
+    parser.add_argument("--pace_quantum", type=float, default=0.05, help="Granularity of the pacing grid")
+    parser.add_argument("--pace_hold", type=float, default=30.0, help="Seconds a flow stays paced after a detection")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {mode: dict(run_covert(mode, args), **run_benign(mode, args)) for mode in args.modes}
+    print(json.dumps(results, indent=2))
+    print(f"{'mode':<12}{'BER':>8}{'bits/s':>10}{'BSC bits/s':>12}{'covert p50 ms':>15}{'covert p99 ms':>15}"
+          f"{'benign p99 ms':>15}")
+    for mode, result in results.items():
+        print(f"{mode:<12}{result['ber']:>8.3f}{result['capacity_bps']:>10.3f}{result['bsc_capacity_bps']:>12.4f}"
+              f"{result['covert_latency_ms']['p50']:>15.1f}{result['covert_latency_ms']['p99']:>15.1f}"
+              f"{result['benign_latency_ms']['p99']:>15.3f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Compare a single detection window, one detector per window length, and the multi-scale detector
+merging block summaries: cost per packet, recall on fast and slow covert channels and benign flows
+flagged. Fast channels repeat every bit a few times with short delays, slow ones repeat it many times.
+Run from code/python-processor:
+
+    python -m bench.multiscale_benchmark --scales 16 64 256 1024 --benign_flows 100
+"""
+import argparse
+import json
+import random
+import struct
+import time
+from typing import Callable, Dict, List
+
+from bench.traces import INSECURE_HOST_IP, TraceFrame, covert_ipds, synthetic_trace, udp_frame
+from detector.covert_channel_detector import CovertChannelDetector
+from detector.multiscale import FUSION_MODES, MultiScaleDetector
+from flow.flow_table import flow_key
+
+
+def covert_flows(count: int, message: str, zero_bit_delay: float, one_bit_delay: float, bit_repeat_len: int,
+                 src_ip: str, seed: int, jitter: float = 0.002) -> List[TraceFrame]:
+    """Covert flows from src_ip, one source port each, timed like covert_channel_sender.py."""
+    rng = random.Random(seed)
+    frames = []
+    for flow in range(count):
+        timestamp = rng.uniform(0, 1)
+        for sequence, gap in enumerate(covert_ipds(message, zero_bit_delay, one_bit_delay, bit_repeat_len)):
+            payload = struct.pack('!Q', sequence) + b"covert"
+            frames.append(TraceFrame(timestamp, "inpktsec", udp_frame(src_ip, INSECURE_HOST_IP, 2000 + flow, 8002, payload),
+                                     True))
+            timestamp += max(gap + rng.gauss(0, jitter), 0.0)
+    return frames
+
+
+class IndependentWindows:
+    """One CovertChannelDetector per window length, the highest score wins."""
+
+    def __init__(self, scales, threshold: float, baseline_decay: float):
+        self.detectors = [CovertChannelDetector(scale, threshold, baseline_decay=baseline_decay) for scale in scales]
+        self.threshold = threshold
+
+    def add_packet(self, timestamp: float) -> None:
+        for detector in self.detectors:
+            detector.add_packet(timestamp)
+
+    def detect(self):
+        score = max(detector.detect()[1] for detector in self.detectors)
+        return score > self.threshold, score, {}
+
+
+def run(trace: List[TraceFrame], keys: List[bytes], factory: Callable, labels: Dict[bytes, str]) -> Dict:
+    """Feed the trace through per-flow detectors made by factory, timing add_packet() and detect()."""
+    detectors = {}
+    flagged = set()
+    clock = time.process_time
+    cpu_time = 0.0
+    for frame, key in zip(trace, keys):
+        detector = detectors.get(key)
+        if detector is None:
+            detector = detectors[key] = factory()
+        start = clock()
+        detector.add_packet(frame.timestamp)
+        is_covert = detector.detect()[0]
+        cpu_time += clock() - start
+        if is_covert:
+            flagged.add(key)
+    result = {'us_per_packet': cpu_time / max(len(trace), 1) * 1e6}
+    for label in sorted(set(labels.values())):
+        flows = {key for key, flow_label in labels.items() if flow_label == label}
+        name = 'flagged' if label == 'benign' else 'recall'
+        result[f"{label}_{name}"] = len(flows & flagged) / max(len(flows), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-scale detection benchmark")
+    parser.add_argument("--scales", type=int, nargs="+", default=[16, 64, 256, 1024], help="Window lengths")
+    parser.add_argument("--fusion", choices=FUSION_MODES, default="max", help="How per-scale scores are fused")
+    parser.add_argument("--window_size", type=int, default=30, help="Window of the single window detector")
+    parser.add_argument("--benign_flows", type=int, default=100, help="Number of benign flows")
+    parser.add_argument("--packets_per_flow", type=int, default=1500, help="Packets per benign flow")
+    parser.add_argument("--benign_mean_ipd", type=float, default=0.05, help="Mean ipd of benign flows")
+    parser.add_argument("--covert_flows", type=int, default=5, help="Covert flows of each kind")
+    parser.add_argument("--message", type=str, default="Hello", help="Covert message")
+    parser.add_argument("--fast", type=float, nargs=3, default=[0.1, 0.25, 2],
+                        help="Zero delay, one delay and bit repetition of fast channels")
+    parser.add_argument("--slow", type=float, nargs=3, default=[0.3, 0.9, 40],
+                        help="Zero delay, one delay and bit repetition of slow channels")
+    parser.add_argument("--detection_threshold", type=float, default=0.65, help="Detection threshold (0-1)")
+    parser.add_argument("--baseline_decay", type=float, default=0.0,
+                        help="Weight of a new ipd in a warmed up baseline, e.g. 0.01; 0 freezes baselines")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic trace")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    benign = synthetic_trace(args.benign_flows, 0, args.packets_per_flow, args.benign_mean_ipd, seed=args.seed)
+    fast = covert_flows(args.covert_flows, args.message * 4, args.fast[0], args.fast[1], int(args.fast[2]),
+                        "10.1.1.21", args.seed + 1)
+    slow = covert_flows(args.covert_flows, args.message, args.slow[0], args.slow[1], int(args.slow[2]),
+                        "10.1.2.21", args.seed + 2)
+    trace = sorted(benign + fast + slow, key=lambda frame: frame.timestamp)
+    keys = [flow_key(frame.data) for frame in trace]
+    labels = {}
+    for kind, frames in (("benign", benign), ("fast", fast), ("slow", slow)):
+        for frame in frames:
+            labels[flow_key(frame.data)] = kind
+
+    threshold, decay = args.detection_threshold, args.baseline_decay
+    results = {
+        f"single_{args.window_size}": run(trace, keys, lambda: CovertChannelDetector(
+            args.window_size, threshold, baseline_decay=decay), labels),
+        "independent": run(trace, keys, lambda: IndependentWindows(args.scales, threshold, decay), labels),
+        "multiscale": run(trace, keys, lambda: MultiScaleDetector(args.scales, threshold, baseline_decay=decay,
+                                                                  fusion=args.fusion), labels),
+    }
+
+    print(json.dumps(results, indent=2))
+    print(f"{len(trace)} packets, scales {args.scales}")
+    print(f"{'mode':>14}{'us/pkt':>10}{'fast recall':>13}{'slow recall':>13}{'benign FP':>11}")
+    for mode, result in results.items():
+        print(f"{mode:>14}{result['us_per_packet']:>10.2f}{result['fast_recall']:>13.2f}{result['slow_recall']:>13.2f}"
+              f"{result['benign_flagged']:>11.3f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
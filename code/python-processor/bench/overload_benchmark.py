@@ -0,0 +1,193 @@
+"""
+Offer frames to the processor faster than it can handle them and compare it with and without
+overload control. The processor's capacity is measured first by handling the trace back to back;
+frames are then offered at multiples of it into a bounded pending buffer standing in for the
+NATS subscription, which drops frames once full like the server does with a slow consumer.
+Run from code/python-processor:
+
+    python -m bench.overload_benchmark --factors 2 5
+    python -m bench.overload_benchmark --factors 2 5 --overload_depth 500 2000 8000 --pending_limit 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from bench.replay_benchmark import InProcessNATS, LatencyRecorder, _percentiles
+from bench.traces import TraceFrame, synthetic_trace
+from flow.flow_table import flow_key
+from processor.overload import LEVELS
+from processor.packet_processor import CAPTURE_TS_HEADER, PacketProcessor
+
+
+class PendingBuffer:
+    """Bounded buffer of offered frames, the pending messages of a subscription."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.frames = deque()
+        self.dropped_count = 0
+
+    @property
+    def pending_msgs(self) -> int:
+        return len(self.frames)
+
+    def offer(self, frame: TraceFrame) -> None:
+        if len(self.frames) >= self.limit:
+            # The slow consumer case, the frame is lost without the processor seeing it
+            self.dropped_count += 1
+        else:
+            self.frames.append(frame)
+
+
+async def offered_replay(trace: List[TraceFrame], args, rate: Optional[float], overload: bool) -> Dict:
+    """
+    Handle the trace offered at rate frames per second, or back to back when rate is None.
+    Frames carry their capture timestamp, so the offered rate does not change the ipds.
+    """
+    loop = asyncio.get_running_loop()
+    recorder = LatencyRecorder(loop)
+    processor = PacketProcessor(
+        InProcessNATS(recorder.published), args.mean_value, args.min_delay, args.max_delay,
+        window_size=args.window_size, detection_threshold=args.detection_threshold,
+        max_pending_frames=len(trace),
+        overload_depth=args.overload_depth if overload else None,
+        overload_lag=args.overload_lag if overload else None,
+        overload_hold=args.overload_hold, overload_sample=args.overload_sample)
+    await processor.start()
+    buffer = PendingBuffer(args.pending_limit)
+    processor.watch(buffer)
+    headers = CAPTURE_TS_HEADER
+
+    async def handle(frame: TraceFrame) -> None:
+        await processor.message_handler(SimpleNamespace(
+            subject=frame.subject, data=frame.data, headers={headers: str(int(frame.timestamp * 1e9))}))
+
+    start = loop.time()
+    if rate is None:
+        for frame in trace:
+            recorder.inject(frame.data)
+            await handle(frame)
+    else:
+        offered = 0
+
+        async def offer():
+            nonlocal offered
+            while offered < len(trace):
+                due = min(int((loop.time() - start) * rate), len(trace))
+                while offered < due:
+                    frame = trace[offered]
+                    recorder.inject(frame.data)
+                    buffer.offer(frame)
+                    offered += 1
+                await asyncio.sleep(0.001)
+
+        offer_task = asyncio.create_task(offer())
+        handled = 0
+        frames = buffer.frames
+        while offered < len(trace) or frames:
+            if not frames:
+                await asyncio.sleep(0.0005)
+                continue
+            await handle(frames.popleft())
+            handled += 1
+            # The NATS client reads the socket on the same loop, give the offering task its turn
+            if handled % args.yield_every == 0:
+                await asyncio.sleep(0)
+        await offer_task
+    handle_time = loop.time() - start
+
+    drain_deadline = loop.time() + args.drain_timeout
+    while len(processor.scheduler) and loop.time() < drain_deadline:
+        await asyncio.sleep(0.05)
+
+    covert_keys = {flow_key(frame.data) for frame in trace if frame.covert}
+    detected = 0
+    for key in covert_keys:
+        flow = processor.flow_table.lookup(key)
+        if flow is not None and flow.detector.detection_count > 0:
+            detected += 1
+    stats = processor.get_stats()
+    overload_stats = stats['overload']
+    results = {
+        'offered_fps': rate,
+        'handle_seconds': handle_time,
+        'handled_fps': (len(trace) - buffer.dropped_count) / handle_time if handle_time > 0 else 0.0,
+        'dropped': buffer.dropped_count,
+        'dropped_share': buffer.dropped_count / max(len(trace), 1),
+        'latency_ms': _percentiles(np.array(recorder.latencies) * 1000),
+        'detections': processor.detected_covert_channel_count,
+        'covert_flows_detected': detected,
+        'covert_flows': len(covert_keys),
+        'level_seconds': overload_stats['seconds'] if overload_stats else None,
+        'transitions': overload_stats['transitions'] if overload_stats else 0,
+        'peak_pending': overload_stats['peak_pending'] if overload_stats else None,
+        'sampled': processor.sampled_count,
+        'undelayed': processor.undelayed_count,
+        'passed_through': processor.passed_through_count
+    }
+    processor.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overload control benchmark")
+    parser.add_argument("--factors", type=float, nargs="+", default=[2.0, 5.0],
+                        help="Offered rates as multiples of the measured capacity")
+    parser.add_argument("--benign_flows", type=int, default=500, help="Number of benign flows")
+    parser.add_argument("--covert_flows", type=int, default=4, help="Number of covert channel flows")
+    parser.add_argument("--packets_per_flow", type=int, default=400, help="Packets per benign flow")
+    parser.add_argument("--benign_mean_ipd", type=float, default=0.3,
+                        help="Mean ipd of benign flows, the default spreads them over the covert flows")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic trace")
+    parser.add_argument("--pending_limit", type=int, default=20000,
+                        help="Pending frames of the stand-in subscription beyond which frames are dropped")
+    parser.add_argument("--yield_every", type=int, default=16, help="Frames handled between yields to the loop")
+    parser.add_argument("--overload_depth", type=int, nargs=3, default=[1000, 4000, 10000],
+                        help="Pending frames entering the sample, skip_delay and pass_through levels")
+    parser.add_argument("--overload_lag", type=float, nargs=3, default=[0.1, 0.5, 2.0],
+                        help="Event loop lag (seconds) entering the same levels")
+    parser.add_argument("--overload_hold", type=float, default=1.0,
+                        help="Seconds under a level's watermarks before stepping down")
+    parser.add_argument("--overload_sample", type=int, default=8, help="Score windows every this many packets while sampling")
+    parser.add_argument("--drain_timeout", type=float, default=5.0, help="Seconds to wait for delayed frames")
+    parser.add_argument("--mean_value", type=float, default=5e-6, help="Mean value for random delay")
+    parser.add_argument("--min_delay", type=float, default=0.6, help="Minimum mitigation delay")
+    parser.add_argument("--max_delay", type=float, default=1.6, help="Maximum mitigation delay")
+    parser.add_argument("--window_size", type=int, default=30, help="Window size for detector")
+    parser.add_argument("--detection_threshold", type=float, default=0.65, help="Detection threshold (0-1)")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    trace = synthetic_trace(args.benign_flows, args.covert_flows, args.packets_per_flow, args.benign_mean_ipd,
+                            seed=args.seed)
+    capacity = asyncio.run(offered_replay(trace, args, None, overload=False))
+    capacity_fps = capacity['handled_fps']
+    results = {'frames': len(trace), 'capacity': capacity, 'runs': {}}
+    for factor in args.factors:
+        for overload in (False, True):
+            name = f"{factor:g}x_{'control' if overload else 'no_control'}"
+            results['runs'][name] = asyncio.run(offered_replay(trace, args, capacity_fps * factor, overload))
+            time.sleep(0.5)
+
+    print(json.dumps(results, indent=2))
+    print(f"{len(trace)} frames, capacity {capacity_fps:.0f} frames/s, pending limit {args.pending_limit}")
+    print(f"{'run':>16}{'handled/s':>11}{'dropped':>9}{'p50 ms':>9}{'p99 ms':>9}{'covert':>8}  time per level")
+    for name, run in results['runs'].items():
+        latency = run['latency_ms']
+        levels = run['level_seconds']
+        shares = " ".join(f"{level}={levels[level]:.1f}s" for level in LEVELS if levels[level] >= 0.05) if levels else "-"
+        print(f"{name:>16}{run['handled_fps']:>11.0f}{run['dropped_share']:>9.1%}{latency['p50'] or 0:>9.1f}"
+              f"{latency['p99'] or 0:>9.1f}{run['covert_flows_detected']:>5}/{run['covert_flows']:<2}  {shares}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import struct
+from typing import Iterator, Tuple
+
+LINKTYPE_ETHERNET = 1
+
+PCAP_MAGIC_USEC = 0xA1B2C3D4
+PCAP_MAGIC_NSEC = 0xA1B23C4D
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_ENHANCED_PACKET = 0x00000006
+PCAPNG_OPTION_TSRESOL = 9
+
+
+def read_packets(path: str) -> Iterator[Tuple[float, bytes]]:
+    """
+    Read (timestamp, Ethernet frame) pairs from a pcap or pcapng file.
+    Only Ethernet link types are returned, frames of other interfaces are skipped.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 4:
+        return
+    magic = struct.unpack_from('<I', data)[0]
+    if magic == PCAPNG_SECTION_HEADER:
+        yield from _read_pcapng(data)
+    else:
+        yield from _read_pcap(data)
+
+
+def _read_pcap(data: bytes) -> Iterator[Tuple[float, bytes]]:
+    for endian in ('<', '>'):
+        magic = struct.unpack_from(endian + 'I', data)[0]
+        if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            break
+    else:
+        raise ValueError("Not a pcap or pcapng file")
+    resolution = 1e-9 if magic == PCAP_MAGIC_NSEC else 1e-6
+    linktype = struct.unpack_from(endian + 'I', data, 20)[0]
+    if linktype != LINKTYPE_ETHERNET:
+        raise ValueError(f"Unsupported pcap link type {linktype}, only Ethernet is supported")
+
+    record = struct.Struct(endian + 'IIII')
+    offset = 24
+    while offset + record.size <= len(data):
+        seconds, fraction, captured_len, _ = record.unpack_from(data, offset)
+        offset += record.size
+        yield seconds + fraction * resolution, data[offset:offset + captured_len]
+        offset += captured_len
+
+
+def _read_pcapng(data: bytes) -> Iterator[Tuple[float, bytes]]:
+    endian = '<'
+    interfaces = []  # (linktype, timestamp resolution) per interface of the current section
+    offset = 0
+    while offset + 12 <= len(data):
+        block_type = struct.unpack_from(endian + 'I', data, offset)[0]
+        if block_type == PCAPNG_SECTION_HEADER:
+            # Byte order of a section is given by its own header
+            endian = '<' if struct.unpack_from('<I', data, offset + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            interfaces = []
+        block_len = struct.unpack_from(endian + 'I', data, offset + 4)[0]
+        if block_len < 12:
+            raise ValueError(f"Corrupt pcapng block at offset {offset}")
+        body = offset + 8
+
+        if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+            linktype = struct.unpack_from(endian + 'H', data, body)[0]
+            interfaces.append((linktype, _tsresol(data, body + 8, offset + block_len - 4, endian)))
+        elif block_type == PCAPNG_ENHANCED_PACKET:
+            interface, ts_high, ts_low, captured_len, _ = struct.unpack_from(endian + 'IIIII', data, body)
+            linktype, resolution = interfaces[interface]
+            if linktype == LINKTYPE_ETHERNET:
+                yield ((ts_high << 32) | ts_low) * resolution, data[body + 20:body + 20 + captured_len]
+        offset += block_len
+
+
+def _tsresol(data: bytes, offset: int, end: int, endian: str) -> float:
+    """Timestamp resolution from the options of an interface description block."""
+    while offset + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', data, offset)
+        if code == 0:
+            break
+        if code == PCAPNG_OPTION_TSRESOL:
+            value = data[offset + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
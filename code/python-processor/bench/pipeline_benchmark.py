@@ -0,0 +1,114 @@
+"""
+Per-packet cost of every stage of the detector pipeline: the window update in add_packet(), the
+shared feature computation and each registered detector, with how often each detector fires on
+covert and benign frames. Covert flows are timed like code/sec/phase2_experiment_sender.py.
+Run from code/python-processor:
+
+    python -m bench.pipeline_benchmark --benign_flows 1000
+    python -m bench.pipeline_benchmark --detectors bimodal entropy ks --pcap capture.pcapng
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+from bench.traces import TraceFrame, pcap_trace, synthetic_trace
+from detector.covert_channel_detector import CovertChannelDetector
+from detector.pipeline import DETECTORS, DetectorPipeline
+from flow.flow_table import flow_key
+
+
+def run(trace: List[TraceFrame], keys: List[bytes], pipeline: DetectorPipeline, args) -> Dict:
+    """Feed the trace through per-flow detectors, timing every stage of the pipeline separately."""
+    detectors = {}
+    features = pipeline.features
+    stages = ["add_packet", "features"] + [detector.name for detector in pipeline.detectors]
+    stage_time = dict.fromkeys(stages, 0.0)
+    fired = {name: [0, 0] for name in stages[2:]}  # Detector -> hits on covert, benign frames
+    scored = [0, 0]
+    clock = time.perf_counter
+    for frame, key in zip(trace, keys):
+        detector = detectors.get(key)
+        if detector is None:
+            detector = detectors[key] = CovertChannelDetector(args.window_size, args.detection_threshold,
+                                                              baseline_decay=args.baseline_decay,
+                                                              pipeline=pipeline)
+        start = clock()
+        detector.add_packet(frame.timestamp)
+        stage_time["add_packet"] += clock() - start
+        if detector.total_packets < args.window_size:
+            continue
+        label = 0 if frame.covert else 1
+        scored[label] += 1
+        start = clock()
+        features.update(detector.ipd_window, detector.baseline)
+        end = clock()
+        stage_time["features"] += end - start
+        for stage in pipeline.detectors:
+            start = end
+            score = stage.score(features)
+            end = clock()
+            stage_time[stage.name] += end - start
+            if score > 0:
+                fired[stage.name][label] += 1
+    packets = max(len(trace), 1)
+    return {
+        'us_per_packet': {name: elapsed / packets * 1e6 for name, elapsed in stage_time.items()},
+        'covert_hit_rate': {name: hits[0] / max(scored[0], 1) for name, hits in fired.items()},
+        'benign_hit_rate': {name: hits[1] / max(scored[1], 1) for name, hits in fired.items()},
+        'scored_packets': sum(scored)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detector pipeline stage benchmark")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--pcap", type=str, help="pcap or pcapng capture, every frame counts as benign")
+    source.add_argument("--synthetic", action="store_true", help="Synthetic covert/benign trace (default)")
+    parser.add_argument("--secure_net", type=str, default=os.getenv("SECURE_NET", "10.1.0.0/16"),
+                        help="Frames from this subnet are replayed on inpktsec")
+    parser.add_argument("--detectors", type=str, nargs="+", default=sorted(DETECTORS),
+                        help="Detector specs of the pipeline, every registered detector by default")
+    parser.add_argument("--benign_flows", type=int, default=1000, help="Number of benign flows")
+    parser.add_argument("--covert_flows", type=int, default=10, help="Number of covert channel flows")
+    parser.add_argument("--packets_per_flow", type=int, default=200, help="Packets per benign flow")
+    parser.add_argument("--benign_mean_ipd", type=float, default=0.05, help="Mean ipd of benign flows")
+    parser.add_argument("--message", type=str, default="Hello", help="Covert message")
+    parser.add_argument("--zero_bit_delay", type=float, default=0.3, help="Zero's bit delay time")
+    parser.add_argument("--one_bit_delay", type=float, default=0.9, help="One's bit delay time")
+    parser.add_argument("--bit_repeat_len", type=int, default=5, help="How many packets sends the same bit")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic trace")
+    parser.add_argument("--window_size", type=int, default=30, help="Window size for detector")
+    parser.add_argument("--detection_threshold", type=float, default=0.65, help="Detection threshold (0-1)")
+    parser.add_argument("--baseline_decay", type=float, default=0.0,
+                        help="Weight of a new ipd in a warmed up baseline, e.g. 0.01; 0 freezes baselines")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.pcap:
+        trace = pcap_trace(args.pcap, args.secure_net)
+    else:
+        trace = synthetic_trace(args.benign_flows, args.covert_flows, args.packets_per_flow, args.benign_mean_ipd,
+                                args.message, args.zero_bit_delay, args.one_bit_delay, args.bit_repeat_len,
+                                seed=args.seed)
+    keys = [flow_key(frame.data) for frame in trace]
+    pipeline = DetectorPipeline.from_specs(args.detectors)
+    result = run(trace, keys, pipeline, args)
+
+    print(json.dumps(result, indent=2))
+    print(f"{len(trace)} packets, {result['scored_packets']} scored")
+    print(f"{'stage':>20}{'us/pkt':>10}{'covert hits':>13}{'benign hits':>13}")
+    for name, cost in result['us_per_packet'].items():
+        if name in result['covert_hit_rate']:
+            print(f"{name:>20}{cost:>10.2f}{result['covert_hit_rate'][name]:>13.3f}{result['benign_hit_rate'][name]:>13.4f}")
+        else:
+            print(f"{name:>20}{cost:>10.2f}{'':>13}{'':>13}")
+    print(f"{'total':>20}{sum(result['us_per_packet'].values()):>10.2f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+"""
+Replay a pcap/pcapng capture or a synthetic covert/benign timing trace through the
+processor's message handler and report throughput, added latency, detector cost and
+memory per flow. Run from code/python-processor:
+
+    python -m bench.replay_benchmark --synthetic --benign_flows 1000 --output results.json
+    python -m bench.replay_benchmark --pcap capture.pcapng --nats nats://localhost:4222
+    python -m bench.replay_benchmark --synthetic --compare results.json
+    python -m bench.replay_benchmark --synthetic --benign_flows 2000 --shards 4
+    python -m bench.replay_benchmark --synthetic --batch_size 64 --batch_flush_us 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, List
+
+import numpy as np
+
+from bench.traces import TraceFrame, background_traffic, pcap_trace, synthetic_trace
+from detector.covert_channel_detector import CovertChannelDetector
+from flow.flow_table import FlowTable, flow_key, shard_of
+from processor.batch_framing import BATCH_PREFIX, encode_batch, iter_batch
+from processor.packet_processor import CAPTURE_TS_HEADER, OUT_SUBJECTS, PacketProcessor
+
+
+class InProcessNATS:
+    """Stand-in for a NATS client, published frames are handed to on_publish."""
+
+    def __init__(self, on_publish):
+        self.on_publish = on_publish
+
+    async def publish(self, subject: str, payload: bytes = b'', headers: Dict = None) -> None:
+        self.on_publish(subject, payload)
+
+
+class LatencyRecorder:
+    """Matches published frames to their injection time; identical frames are matched in order."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.injected = defaultdict(deque)
+        self.latencies = []
+        self.messages = 0
+
+    def inject(self, data: bytes) -> None:
+        self.injected[data].append(self.loop.time())
+
+    def published(self, subject: str, data: bytes) -> None:
+        self.messages += 1
+        if subject.startswith(BATCH_PREFIX):
+            for _, frame in iter_batch(data):
+                self.match(frame)
+        else:
+            self.match(data)
+
+    def match(self, data: bytes) -> None:
+        sent = self.injected.get(bytes(data))
+        if sent:
+            self.latencies.append(self.loop.time() - sent.popleft())
+
+    def pending(self) -> int:
+        return sum(len(times) for times in self.injected.values())
+
+
+async def replay(trace: List[TraceFrame], args, keep_latencies: bool = False) -> Dict:
+    """
+    Replay the trace through a PacketProcessor and measure handler throughput and added latency.
+    With keep_latencies the added latency of every frame is returned as well, under 'latencies_ms'.
+    """
+    loop = asyncio.get_running_loop()
+    recorder = LatencyRecorder(loop)
+    config = dict(window_size=args.window_size, detection_threshold=args.detection_threshold,
+                  max_flows=args.max_flows,
+                  max_pending_frames=args.max_pending_frames, baseline_scope=args.baseline_scope,
+                  baseline_decay=args.baseline_decay, batch_size=args.batch_size,
+                  batch_flush_us=args.batch_flush_us, analysis_workers=args.analysis_workers,
+                  analysis_max_in_flight=args.analysis_max_in_flight, analysis_lag=args.bit_repeat_len,
+                  monitor_rules=args.monitor)
+
+    if args.nats:
+        from nats.aio.client import Client as NATS
+
+        nc = NATS()
+        await nc.connect(args.nats)
+        processor = PacketProcessor(nc, args.mean_value, args.min_delay, args.max_delay, **config)
+        await processor.start()
+        for subject in OUT_SUBJECTS:
+            await nc.subscribe(subject, cb=processor.message_handler)
+            await nc.subscribe(BATCH_PREFIX + subject, cb=processor.batch_handler)
+
+        async def released(msg):
+            recorder.published(msg.subject, msg.data)
+
+        for subject in OUT_SUBJECTS.values():
+            await nc.subscribe(subject, cb=released)
+            await nc.subscribe(BATCH_PREFIX + subject, cb=released)
+        await nc.flush()
+        inject = nc.publish
+
+        async def inject_batch(subject, payload):
+            await nc.publish(BATCH_PREFIX + subject, payload)
+    else:
+        nc = InProcessNATS(recorder.published)
+        processor = PacketProcessor(nc, args.mean_value, args.min_delay, args.max_delay, **config)
+        await processor.start()
+
+        async def inject(subject, data, headers):
+            await processor.message_handler(SimpleNamespace(subject=subject, data=data, headers=headers))
+
+        async def inject_batch(subject, payload):
+            await processor.batch_handler(SimpleNamespace(subject=BATCH_PREFIX + subject, data=payload, headers=None))
+
+    # Frames waiting to be injected as a batch like the switch collects them, by subject
+    batches = {}
+    batch_started = {}
+    flush_delay = args.batch_flush_us / 1e6
+    messages_in = 0
+
+    cpu_start = time.process_time()
+    start = loop.time()
+    first_timestamp = trace[0].timestamp if trace else 0.0
+    for frame in trace:
+        if args.speed > 0:
+            delay = start + (frame.timestamp - first_timestamp) / args.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        recorder.inject(frame.data)
+        # Frames carry their capture timestamp like the switch's, so replay speed does not change the ipds
+        if args.batch_size > 1:
+            batch = batches.setdefault(frame.subject, [])
+            if not batch:
+                batch_started[frame.subject] = loop.time()
+            batch.append((int(frame.timestamp * 1e9), frame.data))
+            for subject, batch in batches.items():
+                if batch and (len(batch) >= args.batch_size or loop.time() - batch_started[subject] >= flush_delay):
+                    await inject_batch(subject, encode_batch(batch))
+                    messages_in += 1
+                    batch.clear()
+        else:
+            await inject(frame.subject, frame.data, headers={CAPTURE_TS_HEADER: str(int(frame.timestamp * 1e9))})
+            messages_in += 1
+    for subject, batch in batches.items():
+        if batch:
+            await inject_batch(subject, encode_batch(batch))
+            messages_in += 1
+    if args.nats:
+        await nc.flush()
+    inject_time = loop.time() - start
+    cpu_time = time.process_time() - cpu_start
+
+    # Wait for delayed frames to be released
+    drain_deadline = loop.time() + args.drain_timeout
+    while recorder.pending() and loop.time() < drain_deadline:
+        await asyncio.sleep(0.05)
+
+    if args.nats:
+        await nc.drain()
+
+    latencies = np.array(recorder.latencies) * 1000
+    results = {
+        'packets': len(trace),
+        'inject_seconds': inject_time,
+        'throughput_pps': len(trace) / inject_time if inject_time > 0 else 0.0,
+        'handler_cpu_us_per_packet': cpu_time / max(len(trace), 1) * 1e6,
+        'messages_in': messages_in,
+        'messages_in_per_sec': messages_in / inject_time if inject_time > 0 else 0.0,
+        'messages_out': recorder.messages,
+        'released': len(latencies),
+        'lost': recorder.pending(),
+        'latency_ms': _percentiles(latencies),
+        'detections': processor.detected_covert_channel_count,
+        'peak_pending': processor.scheduler.peak_pending,
+        'flows': len(processor.flow_table),
+        'analysis': processor.analysis.get_stats() if processor.analysis is not None else None,
+        'filter': processor.frame_filter.get_stats() if processor.frame_filter is not None else None
+    }
+    processor.close()
+    if keep_latencies:
+        results['latencies_ms'] = latencies
+    return results
+
+
+def _replay_shard(trace: List[TraceFrame], args) -> Dict:
+    return asyncio.run(replay(trace, args, keep_latencies=True))
+
+
+def replay_sharded(trace: List[TraceFrame], args) -> Dict:
+    """
+    Split the trace by flow hash like the switch does and replay every shard in its own process.
+    Shards run concurrently, so the aggregate throughput is all frames over the slowest shard's time.
+    """
+    shards = [[] for _ in range(args.shards)]
+    for frame in trace:
+        shards[shard_of(flow_key(frame.data), args.shards)].append(frame)
+    with ProcessPoolExecutor(args.shards) as pool:
+        shard_results = list(pool.map(_replay_shard, shards, [args] * args.shards))
+
+    latencies = np.concatenate([result.pop('latencies_ms') for result in shard_results])
+    inject_time = max(result['inject_seconds'] for result in shard_results)
+    return {
+        'packets': len(trace),
+        'shards': args.shards,
+        'inject_seconds': inject_time,
+        'throughput_pps': len(trace) / inject_time if inject_time > 0 else 0.0,
+        'released': len(latencies),
+        'lost': sum(result['lost'] for result in shard_results),
+        'latency_ms': _percentiles(latencies),
+        'detections': sum(result['detections'] for result in shard_results),
+        'peak_pending': max(result['peak_pending'] for result in shard_results),
+        'flows': sum(result['flows'] for result in shard_results),
+        'per_shard': [{key: result[key] for key in ('packets', 'flows', 'throughput_pps', 'handler_cpu_us_per_packet')}
+                      for result in shard_results]
+    }
+
+
+def _percentiles(values: np.ndarray) -> Dict:
+    if len(values) == 0:
+        return {'p50': None, 'p99': None, 'p999': None, 'mean': None, 'max': None}
+    p50, p99, p999 = np.percentile(values, [50, 99, 99.9])
+    return {'p50': float(p50), 'p99': float(p99), 'p999': float(p999),
+            'mean': float(values.mean()), 'max': float(values.max())}
+
+
+def measure_detector(trace: List[TraceFrame], args) -> Dict:
+    """Detector-only cost: CPU time of add_packet()+detect() and flow table memory per flow."""
+    flows = {}
+    flagged = set()
+    covert_flows = set()
+    start = time.process_time()
+    for frame in trace:
+        key = flow_key(frame.data)
+        detector = flows.get(key)
+        if detector is None:
+            detector = flows[key] = CovertChannelDetector(args.window_size, args.detection_threshold,
+                                                          baseline_decay=args.baseline_decay)
+        detector.add_packet(frame.timestamp)
+        if detector.detect()[0]:
+            flagged.add(key)
+        if frame.covert:
+            covert_flows.add(key)
+    cpu_time = time.process_time() - start
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    flow_table = FlowTable(lambda key: CovertChannelDetector(args.window_size, args.detection_threshold),
+                           max_flows=args.max_flows, idle_timeout=float('inf'))
+    for frame in trace:
+        flow_table.get(flow_key(frame.data), frame.timestamp).detector.add_packet(frame.timestamp)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    benign_flows = set(flows) - covert_flows
+    return {
+        'detector_cpu_us_per_packet': cpu_time / max(len(trace), 1) * 1e6,
+        'memory_bytes_per_flow': memory / max(len(flow_table), 1),
+        'flows': len(flows),
+        'covert_flows_detected': len(flagged & covert_flows),
+        'covert_flows': len(covert_flows),
+        'benign_flows_flagged': len(flagged & benign_flows),
+        'benign_flows': len(benign_flows)
+    }
+
+
+def compare(results: Dict, previous: Dict, prefix: str = '') -> None:
+    """Print numeric differences between two result sets."""
+    for key, value in results.items():
+        old = previous.get(key) if isinstance(previous, dict) else None
+        if isinstance(value, dict):
+            compare(value, old or {}, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)):
+            change = (value - old) / old * 100 if old else float('nan')
+            print(f"  {prefix}{key}: {old:.6g} -> {value:.6g} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Processor replay benchmark")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--pcap", type=str, help="pcap or pcapng capture to replay")
+    source.add_argument("--synthetic", action="store_true", help="Replay a synthetic covert/benign trace")
+    parser.add_argument("--secure_net", type=str, default=os.getenv("SECURE_NET", "10.1.0.0/16"),
+                        help="Frames from this subnet are replayed on inpktsec")
+    parser.add_argument("--benign_flows", type=int, default=200, help="Number of benign flows")
+    parser.add_argument("--covert_flows", type=int, default=2, help="Number of covert channel flows")
+    parser.add_argument("--packets_per_flow", type=int, default=200, help="Packets per benign flow")
+    parser.add_argument("--benign_mean_ipd", type=float, default=0.05, help="Mean ipd of benign flows")
+    parser.add_argument("--message", type=str, default="Hello", help="Covert message")
+    parser.add_argument("--zero_bit_delay", type=float, default=0.3, help="Zero's bit delay time")
+    parser.add_argument("--one_bit_delay", type=float, default=0.9, help="One's bit delay time")
+    parser.add_argument("--bit_repeat_len", type=int, default=5, help="How many packets sends the same bit")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic trace")
+    parser.add_argument("--nats", type=str, default=None,
+                        help="Replay through this NATS server instead of the in-process stand-in")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Replay with this many processor shards, one process each (in-process only)")
+    parser.add_argument("--batch_size", type=int, default=0,
+                        help="Frames per batch message in both directions, 0 to send every frame on its own")
+    parser.add_argument("--batch_flush_us", type=int, default=1000,
+                        help="Longest time a frame waits for its batch to fill (microseconds)")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Replay speed relative to capture time, 0 for as fast as possible")
+    parser.add_argument("--drain_timeout", type=float, default=5.0,
+                        help="Seconds to wait for delayed frames after the replay")
+    parser.add_argument("--mean_value", type=float, default=5e-6, help="Mean value for random delay")
+    parser.add_argument("--min_delay", type=float, default=0.6, help="Minimum mitigation delay")
+    parser.add_argument("--max_delay", type=float, default=1.6, help="Maximum mitigation delay")
+    parser.add_argument("--window_size", type=int, default=30, help="Window size for detector")
+    parser.add_argument("--detection_threshold", type=float, default=0.65, help="Detection threshold (0-1)")
+    parser.add_argument("--baseline_scope", choices=["flow", "subnet"], default="flow",
+                        help="Learn ipd baselines per flow or per source /24 subnet")
+    parser.add_argument("--baseline_decay", type=float, default=0.0,
+                        help="Weight of a new ipd in a warmed up baseline, e.g. 0.01; 0 freezes baselines")
+    parser.add_argument("--max_flows", type=int, default=100000, help="Maximum number of flows")
+    parser.add_argument("--max_pending_frames", type=int, default=10000,
+                        help="Maximum number of delayed frames waiting for release")
+    parser.add_argument("--background_share", type=float, default=0.0,
+                        help="Share of the synthetic trace made of ARP, ICMP, TCP, VLAN and IPv6 background frames")
+    parser.add_argument("--monitor", type=str, nargs="+", default=None,
+                        help="Only inspect frames matching these filter rules, e.g. udp:8002")
+    parser.add_argument("--analysis_workers", type=int, default=0,
+                        help="Processes analyzing suspect windows off the event loop, 0 to disable")
+    parser.add_argument("--analysis_max_in_flight", type=int, default=64,
+                        help="Suspect windows analyzed at the same time, more are dropped")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    parser.add_argument("--compare", type=str, default=None, help="Compare with results of an earlier run")
+    args = parser.parse_args()
+    if args.shards > 1 and args.nats:
+        parser.error("--shards replays in-process, shard a NATS deployment with PROCESSOR_SHARDS instead")
+
+    if args.pcap:
+        trace = pcap_trace(args.pcap, args.secure_net)
+    else:
+        trace = synthetic_trace(args.benign_flows, args.covert_flows, args.packets_per_flow, args.benign_mean_ipd,
+                                args.message, args.zero_bit_delay, args.one_bit_delay, args.bit_repeat_len,
+                                seed=args.seed)
+        if args.background_share > 0:
+            trace = background_traffic(trace, args.background_share, args.seed)
+
+    results = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'environment': {'python': sys.version.split()[0], 'numpy': np.__version__,
+                        'machine': platform.machine(), 'time': time.time()},
+        'replay': replay_sharded(trace, args) if args.shards > 1 else asyncio.run(replay(trace, args)),
+        'detector': measure_detector(trace, args)
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"Compared with {args.compare}:")
+        compare({'replay': results['replay'], 'detector': results['detector']}, previous)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
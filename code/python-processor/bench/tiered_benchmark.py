@@ -0,0 +1,130 @@
+"""
+Compare full scoring of every packet with tiered detection, where flows failing the detector's
+prefilter are only fully scored every k packets: detector CPU saved against detection recall.
+Covert flows are timed like code/sec/phase2_experiment_sender.py. Run from code/python-processor:
+
+    python -m bench.tiered_benchmark --intervals 0 4 16 64 --benign_flows 1000
+    python -m bench.tiered_benchmark --pcap capture.pcapng
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+from bench.traces import TraceFrame, pcap_trace, synthetic_trace
+from detector.covert_channel_detector import CovertChannelDetector
+from flow.flow_table import flow_key
+
+
+def run(trace: List[TraceFrame], keys: List[bytes], full_score_interval: int, args) -> Dict:
+    """Feed the trace through per-flow detectors, timing add_packet() and detect() separately."""
+    detectors = {}
+    flagged_packets = set()
+    first_detection = {}
+    packets_seen = {}
+    clock = time.process_time
+    cpu_time = detect_time = 0.0
+    for index, (frame, key) in enumerate(zip(trace, keys)):
+        detector = detectors.get(key)
+        if detector is None:
+            detector = detectors[key] = CovertChannelDetector(args.window_size, args.detection_threshold,
+                                                              baseline_decay=args.baseline_decay,
+                                                              full_score_interval=full_score_interval)
+        start = clock()
+        detector.add_packet(frame.timestamp)
+        added = clock()
+        is_covert = detector.detect()[0]
+        end = clock()
+        cpu_time += end - start
+        detect_time += end - added
+        packets_seen[key] = packets_seen.get(key, 0) + 1
+        if is_covert:
+            flagged_packets.add(index)
+            first_detection.setdefault(key, packets_seen[key])
+    skipped = sum(detector.skipped_count for detector in detectors.values())
+    return {
+        'cpu_us_per_packet': cpu_time / max(len(trace), 1) * 1e6,
+        'detect_us_per_packet': detect_time / max(len(trace), 1) * 1e6,
+        'skipped_fraction': skipped / max(len(trace), 1),
+        'flagged_packets': flagged_packets,
+        'first_detection': first_detection
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiered detection benchmark")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--pcap", type=str, help="pcap or pcapng capture, flows flagged by full scoring count as covert")
+    source.add_argument("--synthetic", action="store_true", help="Synthetic covert/benign trace (default)")
+    parser.add_argument("--secure_net", type=str, default=os.getenv("SECURE_NET", "10.1.0.0/16"),
+                        help="Frames from this subnet are replayed on inpktsec")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[0, 4, 16, 64, 256],
+                        help="Full score intervals to compare, 0 scores every packet")
+    parser.add_argument("--benign_flows", type=int, default=1000, help="Number of benign flows")
+    parser.add_argument("--covert_flows", type=int, default=10, help="Number of covert channel flows")
+    parser.add_argument("--packets_per_flow", type=int, default=200, help="Packets per benign flow")
+    parser.add_argument("--benign_mean_ipd", type=float, default=0.05, help="Mean ipd of benign flows")
+    parser.add_argument("--message", type=str, default="Hello", help="Covert message")
+    parser.add_argument("--zero_bit_delay", type=float, default=0.3, help="Zero's bit delay time")
+    parser.add_argument("--one_bit_delay", type=float, default=0.9, help="One's bit delay time")
+    parser.add_argument("--bit_repeat_len", type=int, default=5, help="How many packets sends the same bit")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic trace")
+    parser.add_argument("--window_size", type=int, default=30, help="Window size for detector")
+    parser.add_argument("--detection_threshold", type=float, default=0.65, help="Detection threshold (0-1)")
+    parser.add_argument("--baseline_decay", type=float, default=0.0,
+                        help="Weight of a new ipd in a warmed up baseline, e.g. 0.01; 0 freezes baselines")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.pcap:
+        trace = pcap_trace(args.pcap, args.secure_net)
+    else:
+        trace = synthetic_trace(args.benign_flows, args.covert_flows, args.packets_per_flow, args.benign_mean_ipd,
+                                args.message, args.zero_bit_delay, args.one_bit_delay, args.bit_repeat_len,
+                                seed=args.seed)
+    keys = [flow_key(frame.data) for frame in trace]
+
+    # Full scoring of every packet is the reference recall is measured against
+    reference = run(trace, keys, 0, args)
+    if args.pcap:
+        # Captures are not labeled
+        covert_flows = set(reference['first_detection'])
+        covert_packets = set(range(len(trace)))
+    else:
+        covert_flows = {key for frame, key in zip(trace, keys) if frame.covert}
+        covert_packets = {index for index, frame in enumerate(trace) if frame.covert}
+    results = {}
+    for interval in args.intervals:
+        result = reference if interval == 0 else run(trace, keys, interval, args)
+        flagged = result['flagged_packets']
+        first_detection = result['first_detection']
+        detected_covert = covert_flows & set(first_detection)
+        delays = [first_detection[key] - reference['first_detection'][key]
+                  for key in detected_covert if key in reference['first_detection']]
+        results[interval] = dict(
+            cpu_us_per_packet=result['cpu_us_per_packet'],
+            detect_us_per_packet=result['detect_us_per_packet'],
+            skipped_fraction=result['skipped_fraction'],
+            cpu_saved=1 - result['cpu_us_per_packet'] / reference['cpu_us_per_packet'],
+            detect_cpu_saved=1 - result['detect_us_per_packet'] / reference['detect_us_per_packet'],
+            covert_flow_recall=len(detected_covert) / max(len(covert_flows), 1),
+            covert_packet_recall=len(flagged & covert_packets) / max(len(reference['flagged_packets'] & covert_packets), 1),
+            benign_flows_flagged=len(set(first_detection) - covert_flows),
+            detection_delay_packets_max=max(delays, default=0)
+        )
+
+    print(json.dumps(results, indent=2))
+    print(f"{'k':>6}{'us/pkt':>10}{'detect us':>11}{'skipped':>10}{'cpu saved':>11}{'detect saved':>14}"
+          f"{'flow recall':>13}{'pkt recall':>12}{'benign FP':>11}")
+    for interval, result in results.items():
+        print(f"{interval:>6}{result['cpu_us_per_packet']:>10.2f}{result['detect_us_per_packet']:>11.2f}"
+              f"{result['skipped_fraction']:>10.3f}{result['cpu_saved']:>11.3f}{result['detect_cpu_saved']:>14.3f}{result['covert_flow_recall']:>13.3f}{result['covert_packet_recall']:>12.3f}"
+              f"{result['benign_flows_flagged']:>11}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
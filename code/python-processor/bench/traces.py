@@ -0,0 +1,167 @@
+import ipaddress
+import random
+import struct
+from typing import List, NamedTuple
+
+ETH_P_IP = 0x0800
+ETH_P_ARP = 0x0806
+ETH_P_IPV6 = 0x86DD
+ETH_P_8021Q = 0x8100
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+ETH_ADDRESSES = b'\x02\x42\x0a\x01\x00\x15' + b'\x02\x42\x0a\x00\x00\x15'
+
+SECURE_HOST_IP = "10.1.0.21"
+INSECURE_HOST_IP = "10.0.0.21"
+
+
+class TraceFrame(NamedTuple):
+    timestamp: float
+    subject: str
+    data: bytes
+    covert: bool  # Frame belongs to a covert channel flow
+
+
+def create_bitstream_from_message(message):
+    """Same encoding as code/sec/covert_channel_sender.py."""
+    bitstream = message
+    if not all(c in '01' for c in message):
+        bitstream = ''.join(format(ord(char), '08b') for char in message)
+    return bitstream
+
+
+def udp_frame(src_ip: str, dst_ip: str, src_port: int, dst_port: int, payload: bytes) -> bytes:
+    """Build an Ethernet/IPv4/UDP frame, checksums are left zero."""
+    udp = struct.pack('!HHHH', src_port, dst_port, 8 + len(payload), 0)
+    return ipv4_frame(src_ip, dst_ip, IPPROTO_UDP, udp + payload)
+
+
+def ipv4_frame(src_ip: str, dst_ip: str, protocol: int, payload: bytes) -> bytes:
+    """Build an Ethernet/IPv4 frame around a transport header and payload, checksums are left zero."""
+    eth = ETH_ADDRESSES + struct.pack('!H', ETH_P_IP)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 0, 0, 64, protocol, 0,
+                     ipaddress.IPv4Address(src_ip).packed, ipaddress.IPv4Address(dst_ip).packed)
+    return eth + ip + payload
+
+
+def tcp_frame(src_ip: str, dst_ip: str, src_port: int, dst_port: int, payload: bytes) -> bytes:
+    """Build an Ethernet/IPv4/TCP frame with a bare 20-byte TCP header."""
+    tcp = struct.pack('!HHIIBBHHH', src_port, dst_port, 0, 0, 0x50, 0x18, 65535, 0, 0)
+    return ipv4_frame(src_ip, dst_ip, IPPROTO_TCP, tcp + payload)
+
+
+def icmp_frame(src_ip: str, dst_ip: str, sequence: int) -> bytes:
+    """Build an Ethernet/IPv4 ICMP echo request."""
+    return ipv4_frame(src_ip, dst_ip, IPPROTO_ICMP, struct.pack('!BBHHH', 8, 0, 0, 1, sequence & 0xFFFF))
+
+
+def ipv6_udp_frame(src_ip: str, dst_ip: str, src_port: int, dst_port: int, payload: bytes) -> bytes:
+    """Build an Ethernet/IPv6/UDP frame."""
+    eth = ETH_ADDRESSES + struct.pack('!H', ETH_P_IPV6)
+    udp = struct.pack('!HHHH', src_port, dst_port, 8 + len(payload), 0)
+    ip = struct.pack('!IHBB16s16s', 6 << 28, len(udp) + len(payload), IPPROTO_UDP, 64,
+                     ipaddress.IPv6Address(src_ip).packed, ipaddress.IPv6Address(dst_ip).packed)
+    return eth + ip + udp + payload
+
+
+def arp_frame(src_ip: str, dst_ip: str) -> bytes:
+    """Build an Ethernet ARP request."""
+    arp = struct.pack('!HHBBH6s4s6s4s', 1, ETH_P_IP, 6, 4, 1, ETH_ADDRESSES[6:],
+                      ipaddress.IPv4Address(src_ip).packed, b'\x00' * 6, ipaddress.IPv4Address(dst_ip).packed)
+    return b'\xff' * 6 + ETH_ADDRESSES[6:] + struct.pack('!H', ETH_P_ARP) + arp
+
+
+def vlan_tagged(frame: bytes, vlan_id: int) -> bytes:
+    """Insert an 802.1Q tag into an Ethernet frame."""
+    return frame[:12] + struct.pack('!HH', ETH_P_8021Q, vlan_id & 0x0FFF) + frame[12:]
+
+
+def covert_ipds(message: str, zero_bit_delay: float, one_bit_delay: float, bit_repeat_len: int) -> List[float]:
+    """Gaps between the packets covert_channel_sender.py sends for message."""
+    bit_delay = {"0": zero_bit_delay, "1": one_bit_delay}
+    return [bit_delay[bit] for bit in create_bitstream_from_message(message) for _ in range(bit_repeat_len)]
+
+
+def synthetic_trace(benign_flows: int = 100,
+                    covert_flows: int = 2,
+                    packets_per_flow: int = 200,
+                    benign_mean_ipd: float = 0.05,
+                    message: str = "Hello",
+                    zero_bit_delay: float = 0.3,
+                    one_bit_delay: float = 0.9,
+                    bit_repeat_len: int = 5,
+                    jitter: float = 0.002,
+                    seed: int = 0) -> List[TraceFrame]:
+    """
+    Build a timing trace mixing benign flows with exponential gaps and covert flows
+    timed like covert_channel_sender.py, all sent from the secure host.
+    Every frame carries a unique sequence number in its payload.
+    """
+    rng = random.Random(seed)
+    frames = []
+    sequence = 0
+    for flow in range(benign_flows + covert_flows):
+        covert = flow >= benign_flows
+        if covert:
+            gaps = covert_ipds(message, zero_bit_delay, one_bit_delay, bit_repeat_len)
+            gaps = [gap + rng.gauss(0, jitter) for gap in gaps]
+        else:
+            gaps = [rng.expovariate(1 / benign_mean_ipd) for _ in range(packets_per_flow)]
+        src_ip = str(ipaddress.IPv4Address(SECURE_HOST_IP) + flow // 60000)
+        src_port = 1024 + flow % 60000
+        timestamp = rng.uniform(0, benign_mean_ipd)
+        for gap in gaps:
+            payload = struct.pack('!Q', sequence) + b"dummy data"
+            sequence += 1
+            frames.append(TraceFrame(timestamp, "inpktsec",
+                                     udp_frame(src_ip, INSECURE_HOST_IP, src_port, 8002, payload), covert))
+            timestamp += max(gap, 0.0)
+    frames.sort(key=lambda frame: frame.timestamp)
+    return frames
+
+
+def background_traffic(frames: List[TraceFrame], share: float = 0.5, seed: int = 0) -> List[TraceFrame]:
+    """
+    Mix traffic a covert channel monitor has no use for into a trace: ARP, ICMP, TCP to other
+    services, VLAN tagged and IPv6 UDP, so that share of the returned frames is background.
+    """
+    rng = random.Random(seed)
+    count = int(len(frames) * share / (1 - share)) if share < 1 else len(frames)
+    start = frames[0].timestamp if frames else 0.0
+    end = frames[-1].timestamp if frames else 1.0
+    background = []
+    for sequence in range(count):
+        kind = sequence % 5
+        src = str(ipaddress.IPv4Address(SECURE_HOST_IP) + rng.randrange(256))
+        payload = struct.pack('!Q', sequence) + b"background"
+        if kind == 0:
+            data = arp_frame(src, INSECURE_HOST_IP)
+        elif kind == 1:
+            data = icmp_frame(src, INSECURE_HOST_IP, sequence)
+        elif kind == 2:
+            data = tcp_frame(src, INSECURE_HOST_IP, 1024 + rng.randrange(60000), rng.choice((22, 80, 443)), payload)
+        elif kind == 3:
+            data = vlan_tagged(udp_frame(src, INSECURE_HOST_IP, 1024 + rng.randrange(60000), 53, payload), 100)
+        else:
+            data = ipv6_udp_frame("fd00::1:0:15", "fd00::21", 1024 + rng.randrange(60000), 5353, payload)
+        background.append(TraceFrame(rng.uniform(start, end), "inpktsec", data, False))
+    mixed = frames + background
+    mixed.sort(key=lambda frame: frame.timestamp)
+    return mixed
+
+
+def pcap_trace(path: str, secure_net: str = "10.1.0.0/16") -> List[TraceFrame]:
+    """Load a capture, frames sent from secure_net are replayed on inpktsec and the rest on inpktinsec."""
+    from bench.pcap_reader import read_packets
+
+    network = ipaddress.IPv4Network(secure_net)
+    frames = []
+    for timestamp, data in read_packets(path):
+        subject = "inpktinsec"
+        if len(data) >= 34 and struct.unpack_from('!H', data, 12)[0] == ETH_P_IP:
+            if ipaddress.IPv4Address(data[26:30]) in network:
+                subject = "inpktsec"
+        frames.append(TraceFrame(timestamp, subject, data, False))
+    return frames
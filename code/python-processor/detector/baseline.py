@@ -0,0 +1,153 @@
+import logging
+import os
+import struct
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Ipds a baseline learns from, larger ones are treated as idle gaps or covert bits
+BASELINE_MAX_IPD = 0.2
+# Samples needed before a baseline is used, and the memory of the estimate while warming up
+BASELINE_MIN_SAMPLES = 100
+# Weight of a new sample once warmed up, about 1 / number of samples remembered, e.g. 0.01 to follow
+# drifting traffic. Baselines are frozen by default, as detect_batch() scores them
+DEFAULT_DECAY = 0.0
+
+SNAPSHOT_MAGIC = b"CCBL"
+SNAPSHOT_VERSION = 1
+_header = struct.Struct("<4sHI")  # magic, version, entry count
+_entry = struct.Struct("<ddQB")  # mean, variance, sample count, key length
+
+
+class BaselineEstimator:
+    """
+    Exponentially weighted mean and variance of the normal ipds of a flow or subnet.
+    Uses the weighted form of Welford's update, so each sample costs O(1) time and memory.
+    While fewer than 1 / decay samples were seen every sample has the same weight, hence
+    the first BASELINE_MIN_SAMPLES samples give exactly their plain mean and std; after
+    that older samples fade out and the baseline follows the traffic as it drifts.
+    A decay of 0 freezes the baseline once established.
+    """
+    __slots__ = ("decay", "mean", "variance", "count")
+
+    def __init__(self, decay: float = DEFAULT_DECAY, mean: float = 0.0, variance: float = 0.0, count: int = 0):
+        self.decay = decay
+        self.mean = mean
+        self.variance = variance
+        self.count = count
+
+    def update(self, value: float) -> None:
+        """Add a sample to the estimate."""
+        count = self.count
+        if count >= BASELINE_MIN_SAMPLES and self.decay <= 0:
+            return
+        count += 1
+        self.count = count
+        alpha = 1.0 / count
+        if alpha < self.decay:
+            alpha = self.decay
+        diff = value - self.mean
+        increment = alpha * diff
+        self.mean += increment
+        self.variance = (1.0 - alpha) * (self.variance + diff * increment)
+
+    @property
+    def established(self) -> bool:
+        return self.count >= BASELINE_MIN_SAMPLES
+
+    def std(self) -> float:
+        return self.variance ** 0.5 if self.variance > 0 else 0.0
+
+
+class BaselineStore:
+    def __init__(self, decay: float = DEFAULT_DECAY, max_entries: int = 100000):
+        """
+        Initialize a store of baselines keyed by flow or subnet key.
+        Detectors sharing a key share its estimator, so a new flow from a known subnet starts
+        with a warm baseline. Entries are kept in least recently used order, and the store can
+        be saved to and loaded from disk so a restart does not go through a blind warm-up.
+        Args:
+            decay: Weight of a new sample once a baseline is warmed up, 0 to freeze it
+            max_entries: Maximum number of baselines kept at the same time
+        """
+        self.decay = decay
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[bytes, BaselineEstimator]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: bytes) -> BaselineEstimator:
+        """Return the baseline of key, creating it if needed."""
+        estimator = self.entries.get(key)
+        if estimator is not None:
+            self.entries.move_to_end(key)
+            return estimator
+        estimator = self.entries[key] = BaselineEstimator(self.decay)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+        return estimator
+
+    def dumps(self) -> bytes:
+        """Serialize every baseline to the snapshot format."""
+        parts = [_header.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.entries))]
+        pack = _entry.pack
+        for key, estimator in self.entries.items():
+            parts.append(pack(estimator.mean, estimator.variance, estimator.count, len(key)))
+            parts.append(key)
+        return b"".join(parts)
+
+    def loads(self, data: bytes) -> int:
+        """
+        Restore baselines from a snapshot, in the store's least recently used order.
+        Entries already in the store are replaced.
+        Returns:
+            Number of baselines loaded
+        """
+        magic, version, count = _header.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"Not a baseline snapshot (magic {magic!r}, version {version})")
+        offset = _header.size
+        unpack = _entry.unpack_from
+        for _ in range(count):
+            mean, variance, samples, key_len = unpack(data, offset)
+            offset += _entry.size
+            key = bytes(data[offset:offset + key_len])
+            offset += key_len
+            self.entries[key] = BaselineEstimator(self.decay, mean, variance, samples)
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+        return count
+
+    def save(self, path: str, data: Optional[bytes] = None) -> None:
+        """Atomically write a snapshot to path, data from dumps() may be given to write it elsewhere."""
+        if data is None:
+            data = self.dumps()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> int:
+        """Load a snapshot written by save(), a missing file loads nothing."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        count = self.loads(data)
+        logger.info(f"Loaded {count} baselines from {path}")
+        return count
+
+    def get_stats(self) -> dict:
+        """Get baseline store statistics."""
+        return {
+            'baselines': len(self.entries),
+            'max_entries': self.max_entries,
+            'evicted': self.evicted
+        }
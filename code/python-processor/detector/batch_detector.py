@@ -0,0 +1,174 @@
+import numpy as np
+from typing import Dict, Optional, Tuple
+from numpy.lib.stride_tricks import sliding_window_view
+
+from detector.baseline import BASELINE_MAX_IPD, BASELINE_MIN_SAMPLES
+
+# Baseline of the streaming detector with baseline_decay=0: first BASELINE_LENGTH ipds under BASELINE_MAX_IPD
+BASELINE_LENGTH = BASELINE_MIN_SAMPLES
+
+SCORE_NAMES = ('bimodal', 'regularity', 'baseline_deviation', 'pattern_match')
+
+# Mode selection packs (count, rounded delay) into one int64 so a single max finds the top mode
+_KEY_BITS = 40
+
+
+def detect_batch(timestamps: np.ndarray,
+                 flow_ids: Optional[np.ndarray] = None,
+                 window_size: int = 50,
+                 threshold: float = 0.7,
+                 chunk_size: int = 1 << 17) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Score every packet of a capture at once, as if each flow was replayed through its own
+    CovertChannelDetector with a frozen baseline (baseline_decay=0) with add_packet() followed by detect().
+    Windows are taken as strided views over the per-flow ipds and scored a chunk at a time
+    with row-wise sorting for the rounded histograms and vectorized band counts.
+    Args:
+        timestamps: Packet timestamps in arrival order
+        flow_ids: Integer flow id of each packet, all packets are one flow if None
+        window_size: Number of packets to analyze in detection window
+        threshold: Threshold for detection confidence (0-1)
+        chunk_size: Number of windows scored at a time, bounds the memory used
+    Returns:
+        is_covert, total score and a dict of per-component scores, each aligned with timestamps
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    n = len(timestamps)
+    if flow_ids is None:
+        flow_ids = np.zeros(n, dtype=np.int64)
+    flow_ids = np.asarray(flow_ids)
+
+    scores = {name: np.zeros(n) for name in SCORE_NAMES}
+    total_score = np.zeros(n)
+    is_covert = np.zeros(n, dtype=bool)
+    if n == 0 or window_size < 2:
+        scores['total_score'] = total_score
+        return is_covert, total_score, scores
+
+    # Group packets by flow keeping arrival order inside each flow
+    order = np.argsort(flow_ids, kind='stable')
+    ts = timestamps[order]
+    fid = flow_ids[order]
+    new_flow = np.empty(n, dtype=bool)
+    new_flow[0] = True
+    np.not_equal(fid[1:], fid[:-1], out=new_flow[1:])
+    flow_rank = np.cumsum(new_flow) - 1
+    flow_start = np.flatnonzero(new_flow)
+    position = np.arange(n) - flow_start[flow_rank]  # Index of the packet in its flow
+
+    # Ipds of all flows back to back, a packet's window ends right after its own ipd
+    ipds = (ts[1:] - ts[:-1])[~new_flow[1:]]
+    window_end = np.arange(n) - flow_rank
+
+    # Baseline: first BASELINE_LENGTH small ipds of each flow, frozen once complete
+    small = ipds < BASELINE_MAX_IPD
+    small_before = np.concatenate(([0], np.cumsum(small)))
+    flow_ipd_start = window_end[flow_start]
+    baseline_seen = small_before[window_end] - small_before[flow_ipd_start[flow_rank]]
+    baseline_ready = baseline_seen >= BASELINE_LENGTH
+    baseline_mean = np.zeros(len(flow_start))
+    baseline_std = np.zeros(len(flow_start))
+    small_index = np.flatnonzero(small)
+    small_rank = np.searchsorted(window_end[flow_start], small_index, side='right') - 1
+    small_start = np.searchsorted(small_rank, np.arange(len(flow_start)))
+    small_count = np.bincount(small_rank, minlength=len(flow_start))
+    ready_flows = np.flatnonzero(small_count >= BASELINE_LENGTH)
+    if len(ready_flows):
+        rows = ipds[small_index[small_start[ready_flows][:, None] + np.arange(BASELINE_LENGTH)]]
+        baseline_mean[ready_flows] = np.mean(rows, axis=1)
+        baseline_std[ready_flows] = np.std(rows, axis=1)
+
+    # First scored packet of a flow sees window_size - 1 ipds, the following ones window_size
+    for width, selected in ((window_size - 1, position == window_size - 1),
+                            (window_size, position >= window_size)):
+        packets = np.flatnonzero(selected)
+        if len(packets) == 0:
+            continue
+        views = sliding_window_view(ipds, width)
+        for begin in range(0, len(packets), chunk_size):
+            chunk = packets[begin:begin + chunk_size]
+            windows = views[window_end[chunk] - width]
+            flows = flow_rank[chunk]
+            ready = baseline_ready[chunk]
+            chunk_scores = _score_windows(windows,
+                                          np.where(ready, baseline_mean[flows], 0.0),
+                                          np.where(ready, baseline_std[flows], 0.0))
+            targets = order[chunk]
+            for name in SCORE_NAMES:
+                scores[name][targets] = chunk_scores[name]
+
+    for name in SCORE_NAMES:
+        total_score += scores[name]
+    np.minimum(total_score, 1.0, out=total_score)
+    is_covert[:] = total_score > threshold
+    scores['total_score'] = total_score
+    return is_covert, total_score, scores
+
+
+def _score_windows(windows: np.ndarray, baseline_mean: np.ndarray, baseline_std: np.ndarray) -> Dict[str, np.ndarray]:
+    """Score a (windows x width) matrix of ipds, baseline_std is 0 for flows without baseline."""
+    count, width = windows.shape
+    rows = np.arange(count)
+
+    # Rounded histogram of each window from its sorted rounded keys
+    keys = np.rint(windows * 1000).astype(np.int64)
+    keys.sort(axis=1)
+    run_start = np.empty(keys.shape, dtype=bool)
+    run_start[:, 0] = True
+    np.not_equal(keys[:, 1:], keys[:, :-1], out=run_start[:, 1:])
+    unique_count = run_start.sum(axis=1)
+    flat_start = np.flatnonzero(run_start)
+    run_length = np.diff(np.append(flat_start, keys.size))
+    run_key = keys.ravel()[flat_start]
+    run_row = flat_start // width
+    row_first_run = np.concatenate(([0], np.cumsum(unique_count)[:-1]))
+    max_count = np.maximum.reduceat(run_length, row_first_run)
+    min_count = np.minimum.reduceat(run_length, row_first_run)
+
+    # Top two modes by count, ties go to the larger delay
+    key_offset = keys[:, 0].min()
+    packed = (run_length << _KEY_BITS) | (run_key - key_offset)
+    top1 = np.maximum.reduceat(packed, row_first_run)
+    packed[packed == top1[run_row]] = -1
+    top2 = np.maximum.reduceat(packed, row_first_run)
+    key_mask = (1 << _KEY_BITS) - 1
+    mode1 = ((top1 & key_mask) + key_offset) / 1000
+    mode2 = ((top2 & key_mask) + key_offset) / 1000
+    min_delay = np.minimum(mode1, mode2)
+    max_delay = np.maximum(mode1, mode2)
+    has_modes = unique_count >= 2
+
+    # 1. Bimodal distribution
+    value_ratio = max_delay / np.maximum(min_delay, 0.001)
+    delay_range = keys[rows, -1] / 1000 - keys[rows, 0] / 1000
+    bimodal = has_modes & (min_count / max_count > 0.5) & (value_ratio > 2.0) & (delay_range > 0.2)
+
+    # 2. Artificial regularity, running-sum moments like SlidingWindowStats
+    mean = windows.sum(axis=1) / width
+    std = np.sqrt(np.maximum((windows * windows).sum(axis=1) / width - mean * mean, 0.0))
+    regularity = std / np.maximum(mean, 0.001) < 0.7
+
+    # 3. Baseline deviation
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_score = np.abs(mean - baseline_mean) / baseline_std
+    baseline = (baseline_std > 0) & (z_score > 2.0)
+
+    # 4. Two main delay bands
+    candidates = has_modes & (max_delay > 0.5) & (min_delay > 0.1)
+    pattern = np.zeros(count, dtype=bool)
+    for band, gap in ((0.2, 0.2), (0.1, 0.1)):
+        matched = _band_count(windows, min_delay - band, min_delay + band) + \
+            _band_count(windows, max_delay - band, max_delay + band)
+        pattern |= candidates & (max_delay - min_delay > gap) & (matched / width > 0.6)
+
+    return {
+        'bimodal': np.where(bimodal, 0.5, 0.0),
+        'regularity': np.where(regularity, 0.3, 0.0),
+        'baseline_deviation': np.where(baseline, 0.2, 0.0),
+        'pattern_match': np.where(pattern, 0.4, 0.0)
+    }
+
+
+def _band_count(windows: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """Number of ipds of each window within [low, high]."""
+    return ((windows >= low[:, None]) & (windows <= high[:, None])).sum(axis=1)
@@ -0,0 +1,79 @@
+"""
+Statistical tests too slow to run on every packet in the event loop, run by processor.analysis_offload
+in worker processes on the ipd windows of suspect flows.
+"""
+import math
+from typing import Dict
+
+import numpy as np
+
+# Kolmogorov-Smirnov critical value of sqrt(n) * D at alpha 0.01 against a fully specified distribution
+KS_CRITICAL = 1.628
+# Sample entropy below which the window repeats itself, benign exponential gaps stay around 2
+SAMPLE_ENTROPY_MAX = 0.8
+SAMPLE_ENTROPY_M = 2
+SAMPLE_ENTROPY_R = 0.2  # Tolerance, in standard deviations of the window
+# Largest absolute autocorrelation up to the lag above which the window is correlated
+AUTOCORRELATION_MIN = 0.5
+# Tests that must fail for a covert verdict
+VERDICT_MIN_TESTS = 2
+
+
+def ks_exponential(ipds: np.ndarray, mean: float) -> float:
+    """sqrt(n) times the Kolmogorov-Smirnov distance of ipds to an exponential distribution with mean."""
+    n = len(ipds)
+    cdf = 1.0 - np.exp(-np.sort(ipds) / max(mean, 1e-9))
+    steps = np.arange(1, n + 1) / n
+    return float(max(np.max(steps - cdf), np.max(cdf - (steps - 1.0 / n)))) * math.sqrt(n)
+
+
+def sample_entropy(ipds: np.ndarray, m: int = SAMPLE_ENTROPY_M, r: float = SAMPLE_ENTROPY_R) -> float:
+    """
+    Sample entropy SampEn(m, r * std) of ipds: -log of the probability that sequences matching for m
+    points still match for m + 1. Low values mean a repetitive sequence; inf when nothing matches.
+    """
+    n = len(ipds)
+    tolerance = r * float(np.std(ipds))
+    if n <= m + 1 or tolerance <= 0:
+        return 0.0
+
+    def matches(length: int) -> int:
+        templates = np.lib.stride_tricks.sliding_window_view(ipds[:n - m + length - 1], length)
+        distance = np.max(np.abs(templates[:, None, :] - templates[None, :, :]), axis=2)
+        # Pairs of distinct templates within tolerance
+        return (int(np.count_nonzero(distance <= tolerance)) - len(templates)) // 2
+
+    shorter, longer = matches(m), matches(m + 1)
+    if shorter == 0 or longer == 0:
+        return math.inf
+    return -math.log(longer / shorter)
+
+
+def max_autocorrelation(ipds: np.ndarray, lag: int) -> float:
+    """Largest absolute autocorrelation of ipds at lags 1 to lag."""
+    centered = ipds - ipds.mean()
+    variance = float(np.dot(centered, centered))
+    if variance <= 0:
+        return 1.0
+    lag = min(lag, len(ipds) - 1)
+    return max((abs(float(np.dot(centered[:-k], centered[k:]))) / variance for k in range(1, lag + 1)), default=0.0)
+
+
+def analyze(ipds: np.ndarray, baseline_mean: float, lag: int) -> Dict:
+    """
+    Run every test on a window of ipds.
+    KS compares the window to exponential gaps with the flow's baseline mean, or with the window's
+    own mean when there is no baseline yet; lag is the repetition period of suspected bits.
+    Returns:
+        Test statistics, and the covert verdict when VERDICT_MIN_TESTS tests fail
+    """
+    ks = ks_exponential(ipds, baseline_mean if baseline_mean > 0 else float(ipds.mean()))
+    entropy = sample_entropy(ipds)
+    autocorrelation = max_autocorrelation(ipds, lag)
+    failed = (ks > KS_CRITICAL) + (entropy < SAMPLE_ENTROPY_MAX) + (autocorrelation > AUTOCORRELATION_MIN)
+    return {
+        'ks': ks,
+        'sample_entropy': entropy,
+        'autocorrelation': autocorrelation,
+        'covert': failed >= VERDICT_MIN_TESTS
+    }
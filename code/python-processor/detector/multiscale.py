@@ -0,0 +1,274 @@
+"""
+Multi-scale detection: a flow's ipds are scored over several window lengths at once, e.g. 16, 64, 256
+and 1024, so that slow channels with long bit repetitions and fast ones are both seen without running
+one detector per window length. The shortest window is an exact SlidingWindowStats; the longer ones
+are merged from summaries of consecutive blocks of that length and rescored as new blocks replace
+a quarter of them.
+"""
+import math
+import time
+from array import array
+from collections import deque
+from itertools import islice
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from detector.baseline import BASELINE_MAX_IPD, DEFAULT_DECAY, BaselineEstimator
+from detector.pipeline import DetectorPipeline, default_pipeline
+from detector.sliding_window import SlidingWindowStats
+
+DEFAULT_SCALES = (16, 64, 256, 1024)
+# How per-scale scores become one: the most confident scale, or the mean of the scored scales
+FUSION_MODES = ("max", "mean")
+# A merged window is rescored every time this share of it was replaced by new blocks
+RESCORE_FRACTION = 4
+
+# Keys of the per-scale totals in detailed scores, shared by detectors with the same scales
+_scale_names: Dict[Tuple[int, ...], Tuple[str, ...]] = {}
+
+
+def scale_names(scales: Sequence[int]) -> Tuple[str, ...]:
+    """Keys of the per-scale totals in the detailed scores of a detector with these scales."""
+    key = tuple(sorted(scales))
+    names = _scale_names.get(key)
+    if names is None:
+        names = _scale_names[key] = tuple(f"scale_{scale}" for scale in key)
+    return names
+
+
+class BlockSummary:
+    """Moments, extremes and rounded delay keys of one block of consecutive ipds."""
+    __slots__ = ("count", "total", "total_sq", "minimum", "maximum", "keys")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.keys = array('i')  # Rounded delay keys (ms), in arrival order
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        self.keys.append(round(value * 1000))
+
+
+class MergedWindow:
+    """
+    Statistics of the last block_count complete blocks, with the interface of SlidingWindowStats the
+    pipeline's detectors use. The histogram is kept by adding the newest block's keys and removing the
+    oldest block's; moments and extremes are summed over the blocks before the window is scored.
+    The order of the ipds is not kept, so detectors that need it (e.g. compressibility) are skipped.
+    """
+    __slots__ = ("block_count", "count", "total", "total_sq", "minimum", "maximum", "histogram")
+    ordered = False
+
+    def __init__(self, block_count: int):
+        self.block_count = block_count
+        self.count = 0
+        self.total = self.total_sq = 0.0
+        self.minimum = self.maximum = 0.0
+        self.histogram: Dict[int, int] = {}  # Rounded delay key (ms) -> count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def refresh(self, new: BlockSummary, old: Optional[BlockSummary]) -> None:
+        """Account for the block new completing, and for old leaving the window if it did."""
+        histogram = self.histogram
+        for key in new.keys:
+            histogram[key] = histogram.get(key, 0) + 1
+        self.count += new.count
+        if old is not None:
+            for key in old.keys:
+                count = histogram[key] - 1
+                if count:
+                    histogram[key] = count
+                else:
+                    del histogram[key]
+            self.count -= old.count
+
+    def summarize(self, blocks: deque) -> None:
+        """Sum moments and extremes over the window's blocks, before it is scored."""
+        window = list(islice(reversed(blocks), self.block_count))
+        # Summed again from the blocks instead of running sums, so no floating point drift builds up
+        self.total = math.fsum(block.total for block in window)
+        self.total_sq = math.fsum(block.total_sq for block in window)
+        self.minimum = min(block.minimum for block in window)
+        self.maximum = max(block.maximum for block in window)
+
+    def mean(self) -> float:
+        return self.total / self.count
+
+    def std(self) -> float:
+        mean = self.total / self.count
+        return math.sqrt(max(self.total_sq / self.count - mean * mean, 0.0))
+
+    def unique_count(self) -> int:
+        return len(self.histogram)
+
+    def count_ratio(self) -> float:
+        counts = self.histogram.values()
+        return min(counts) / max(counts)
+
+    def concentration(self) -> float:
+        return max(self.histogram.values()) / self.count
+
+    def top_two(self) -> Tuple[Optional[int], Optional[int]]:
+        """Keys of the two most frequent rounded delays, ties go to the larger delay."""
+        mode1 = mode2 = None
+        count1 = count2 = 0
+        for key, count in self.histogram.items():
+            if count > count1 or (count == count1 and key > mode1):
+                mode2, count2 = mode1, count1
+                mode1, count1 = key, count
+            elif mode2 is None or count > count2 or (count == count2 and key > mode2):
+                mode2, count2 = key, count
+        return mode1, mode2
+
+    def min_value(self) -> float:
+        return self.minimum
+
+    def max_value(self) -> float:
+        return self.maximum
+
+    def band_count(self, low: float, high: float) -> int:
+        """Number of delays within [low, high], to the 1 ms resolution of the histogram."""
+        low_key, high_key = math.ceil(low * 1000 - 1e-9), math.floor(high * 1000 + 1e-9)
+        return sum(count for key, count in self.histogram.items() if low_key <= key <= high_key)
+
+    @property
+    def sorted_values(self) -> List[float]:
+        """Delays of the window rounded to 1 ms, in increasing order."""
+        return [key / 1000 for key in sorted(self.histogram) for _ in range(self.histogram[key])]
+
+
+class MultiScaleDetector:
+    # Slots keep per-flow instances small when the processor tracks many flows
+    __slots__ = ("scales", "scale_names", "threshold", "fusion", "pipeline", "window_size", "last_packet_time",
+                 "ipd_window", "block", "blocks", "completed_blocks", "merged", "scale_scores", "scale_details",
+                 "baseline", "suspect", "last_detection_time", "detection_count", "total_packets", "skipped_count")
+
+    def __init__(self,
+                 scales: Sequence[int] = DEFAULT_SCALES,
+                 threshold: float = 0.7,
+                 baseline: Optional[BaselineEstimator] = None,
+                 baseline_decay: float = DEFAULT_DECAY,
+                 pipeline: Optional[DetectorPipeline] = None,
+                 fusion: str = "max"):
+        """
+        Initialize a detector scoring a flow over several window lengths at once.
+        Every packet updates one exact window of scales[0] ipds and one block summary; every scales[0]
+        packets the block completes and is merged into the longer windows, each rescored once a quarter
+        of it is new. The cost per packet stays close to that of a single window detector.
+        Args:
+            scales: Window lengths in ipds, increasing multiples of the first one
+            threshold: Threshold of the fused score
+            baseline: Baseline shared with other detectors (e.g. of the same subnet), a private one when None
+            baseline_decay: Weight of a new ipd in a private baseline once warmed up, 0 to freeze it
+            pipeline: Detectors scoring every scale, shared by flows, the default ones when None
+            fusion: How per-scale scores are fused, one of FUSION_MODES
+        """
+        scales = sorted(scales)
+        if any(scale % scales[0] for scale in scales):
+            raise ValueError(f"Window scales {scales} must be multiples of the shortest one")
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"Unknown fusion mode {fusion!r}, expected one of {FUSION_MODES}")
+        self.scales = scales
+        self.scale_names = scale_names(scales)
+        self.threshold = threshold
+        self.fusion = fusion
+        self.pipeline = default_pipeline if pipeline is None else pipeline
+        self.window_size = scales[0]
+        self.last_packet_time = None
+        self.ipd_window = SlidingWindowStats(scales[0])
+        self.block = BlockSummary()
+        # One more block than the longest window, the one leaving it when a block completes
+        self.blocks = deque(maxlen=scales[-1] // scales[0] + 1)
+        self.completed_blocks = 0
+        self.merged = [MergedWindow(scale // scales[0]) for scale in scales[1:]]
+        self.scale_scores = [0.0] * len(scales)
+        self.scale_details: List[Optional[Dict]] = [None] * len(scales)
+        self.baseline = BaselineEstimator(baseline_decay) if baseline is None else baseline
+        self.suspect = False
+        self.last_detection_time = time.time()
+        self.detection_count = 0
+        self.total_packets = 0
+        self.skipped_count = 0
+
+    def add_packet(self, timestamp: float) -> None:
+        """Add a new packet timestamp for analysis."""
+        self.total_packets += 1
+        last_packet_time = self.last_packet_time
+        self.last_packet_time = timestamp
+        if last_packet_time is None:
+            return
+        ipd = timestamp - last_packet_time
+        self.ipd_window.push(ipd)
+        block = self.block
+        block.add(ipd)
+        if block.count == self.window_size:
+            self._complete_block()
+
+        # Keep learning the baseline of normal delays, a flagged flow must not drag an established one along
+        if ipd < BASELINE_MAX_IPD and not (self.suspect and self.baseline.established):
+            self.baseline.update(ipd)
+
+    def _complete_block(self) -> None:
+        blocks = self.blocks
+        new = self.block
+        blocks.append(new)
+        self.block = BlockSummary()
+        self.completed_blocks += 1
+        length = len(blocks)
+        for index, window in enumerate(self.merged, 1):
+            block_count = window.block_count
+            old = blocks[-block_count - 1] if length > block_count else None
+            window.refresh(new, old)
+            if length >= block_count and self.completed_blocks % max(1, block_count // RESCORE_FRACTION) == 0:
+                window.summarize(blocks)
+                self.scale_scores[index], self.scale_details[index] = self.pipeline.score(window, self.baseline)
+
+    def detect(self) -> Tuple[bool, float, Dict]:
+        """Score the shortest window, fuse it with the latest scores of the longer ones."""
+        if len(self.ipd_window) < self.window_size:
+            return False, 0.0, {"total_score": 0.0}
+        scale_scores = self.scale_scores
+        scale_scores[0], self.scale_details[0] = self.pipeline.score(self.ipd_window, self.baseline)
+
+        # Scales not scored yet keep a score of 0 and no details
+        best = 0
+        for index in range(1, len(scale_scores)):
+            if scale_scores[index] > scale_scores[best]:
+                best = index
+        if self.fusion == "max":
+            score = scale_scores[best]
+        else:
+            scored = [scale_scores[index] for index, details in enumerate(self.scale_details) if details is not None]
+            score = sum(scored) / len(scored)
+        # Components of the most confident scale, then every scale's total
+        detailed_scores = dict(self.scale_details[best])
+        detailed_scores.update(zip(self.scale_names, scale_scores))
+        detailed_scores['total_score'] = score
+
+        is_covert = score > self.threshold
+        self.suspect = is_covert
+        if is_covert:
+            self.detection_count += 1
+            self.last_detection_time = time.time()
+        return is_covert, score, detailed_scores
+
+    def get_detection_stats(self) -> Dict:
+        """Get detection statistics."""
+        return {
+            'detection_rate': self.detection_count / max(1, self.total_packets),
+            'total_packets': self.total_packets,
+            'detections': self.detection_count,
+            'scale_scores': dict(zip(self.scales, self.scale_scores)),
+            'last_detection_time': self.last_detection_time
+        }
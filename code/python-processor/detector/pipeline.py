@@ -0,0 +1,280 @@
+"""
+Detector pipeline: the features of a flow's ipd window are computed once per packet and shared by
+every registered detector, each returning a score in [0, 1] that the pipeline weights and sums.
+Detectors are named in DETECTORS and picked with specs like "bimodal:0.5", see parse_pipeline().
+"""
+import math
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from detector.baseline import BaselineEstimator
+from detector.sliding_window import SlidingWindowStats
+
+# Detector name -> class, filled by register_detector()
+DETECTORS: Dict[str, type] = {}
+
+# Detectors of CovertChannelDetector before pipelines, with their weights
+DEFAULT_PIPELINE = ("bimodal:0.5", "regularity:0.3", "baseline_deviation:0.2", "pattern_match:0.4")
+
+# Pattern bands around the two modes (seconds)
+PATTERN_BANDS = (0.2, 0.1)
+
+# Normalized entropy of the rounded delays below which a window is too predictable
+ENTROPY_MAX = 0.85
+# Compressed bytes per delay of the quantized window below which it is too repetitive
+COMPRESSIBILITY_MAX = 0.6
+# Quantization levels per mean delay of the compressibility symbols, and highest symbol
+COMPRESSIBILITY_LEVELS = 4
+COMPRESSIBILITY_MAX_SYMBOL = 31
+_EMPTY_COMPRESSED = len(zlib.compress(b"", 9))
+# Stephens' modified Kolmogorov-Smirnov statistic against an exponential with the window's mean,
+# critical value at alpha 0.01; benign gaps are close to exponential, covert gaps are not
+KS_CRITICAL = 1.308
+
+
+class WindowFeatures:
+    # Slots keep the per-packet update cheap, one instance is reused by a pipeline
+    __slots__ = ("window", "baseline", "count", "mean", "std", "cv", "unique_count",
+                 "mode1", "mode2", "min_delay", "max_delay", "_bands", "_entropy")
+
+    def __init__(self):
+        """
+        Initialize the shared features of an ipd window.
+        Moments, distinct rounded delays and the top two modes are computed by update(); band counts
+        around the modes and the entropy of the rounded histogram on first use, at most once per packet.
+        """
+        self.window: Optional[SlidingWindowStats] = None
+        self.baseline: Optional[BaselineEstimator] = None
+        self.count = 0
+        self.mean = self.std = self.cv = 0.0
+        self.unique_count = 0
+        self.mode1 = self.mode2 = None
+        self.min_delay = self.max_delay = 0.0
+        self._bands: Dict[float, int] = {}
+        self._entropy: Optional[float] = None
+
+    def update(self, window: SlidingWindowStats, baseline: BaselineEstimator) -> "WindowFeatures":
+        """Compute the features of window, a flow's ipds, whose delays are learned by baseline."""
+        self.window = window
+        self.baseline = baseline
+        self.count = len(window)
+        self.mean = window.mean()
+        self.std = window.std()
+        self.cv = self.std / max(self.mean, 0.001)  # Coefficient of variation
+        self.unique_count = window.unique_count()
+        if self.unique_count >= 2:
+            # Two most frequent delays rounded to 1 ms, ties go to the larger delay. This is the order a
+            # stable sort gives the original detector's np.argsort(counts)[::-1], whose default unstable
+            # sort picked tied modes in an order that depended on the window's length and contents
+            self.mode1, self.mode2 = window.top_two()
+            self.min_delay = min(self.mode1, self.mode2) / 1000
+            self.max_delay = max(self.mode1, self.mode2) / 1000
+        else:
+            self.mode1 = self.mode2 = None
+        if self._bands:
+            self._bands.clear()
+        self._entropy = None
+        return self
+
+    def mode_band_count(self, width: float) -> int:
+        """Delays within width of either of the two modes, when there are two modes."""
+        count = self._bands.get(width)
+        if count is None:
+            band_count = self.window.band_count
+            count = self._bands[width] = (band_count(self.min_delay - width, self.min_delay + width)
+                                          + band_count(self.max_delay - width, self.max_delay + width))
+        return count
+
+    def entropy(self) -> float:
+        """Shannon entropy of the rounded delays over its maximum for the window length, in [0, 1]."""
+        if self._entropy is None:
+            count = self.count
+            if count < 2:
+                self._entropy = 1.0
+            else:
+                log = math.log2
+                self._entropy = -sum(c * log(c / count) for c in self.window.histogram.values()) / (count * log(count))
+        return self._entropy
+
+
+class WindowDetector:
+    name = ""
+    default_weight = 0.0
+    # Needs the delays in arrival order, windows merged from summaries (multiscale) do not keep it
+    ordered = False
+
+    def __init__(self, weight: Optional[float] = None):
+        """
+        Initialize a detector of the pipeline.
+        Args:
+            weight: Share of the total score a full score of this detector is worth, default_weight when None
+        """
+        self.weight = self.default_weight if weight is None else weight
+
+    def score(self, features: WindowFeatures) -> float:
+        """Score in [0, 1] of how artificial the timing of the window looks."""
+        raise NotImplementedError
+
+
+def register_detector(cls: type) -> type:
+    """Class decorator making a WindowDetector available to pipelines by its name."""
+    DETECTORS[cls.name] = cls
+    return cls
+
+
+@register_detector
+class BimodalDetector(WindowDetector):
+    """Two balanced delays far apart, characteristic of binary encoding."""
+    name = "bimodal"
+    default_weight = 0.5
+
+    def score(self, features: WindowFeatures) -> float:
+        if features.unique_count < 2:
+            return 0.0
+        window = features.window
+        if window.count_ratio() <= 0.5:
+            return 0.0
+        value_ratio = features.max_delay / max(features.min_delay, 0.001)
+        delay_range = (SlidingWindowStats.round_key(window.max_value()) / 1000
+                       - SlidingWindowStats.round_key(window.min_value()) / 1000)
+        # One value is at least 2x the other
+        return 1.0 if value_ratio > 2.0 and delay_range > 0.2 else 0.0
+
+
+@register_detector
+class RegularityDetector(WindowDetector):
+    """Artificial regularity, too consistent timing."""
+    name = "regularity"
+    default_weight = 0.3
+
+    def score(self, features: WindowFeatures) -> float:
+        return 1.0 if features.cv < 0.7 else 0.0
+
+
+@register_detector
+class BaselineDeviationDetector(WindowDetector):
+    """Mean delay more than 2 standard deviations from the flow's established baseline."""
+    name = "baseline_deviation"
+    default_weight = 0.2
+
+    def score(self, features: WindowFeatures) -> float:
+        baseline = features.baseline
+        if not baseline.established:
+            return 0.0
+        baseline_std = baseline.std()
+        if baseline_std <= 0:
+            return 0.0
+        return 1.0 if abs(features.mean - baseline.mean) / baseline_std > 2.0 else 0.0
+
+
+@register_detector
+class PatternDetector(WindowDetector):
+    """Most delays close to one of two distinct modes, the specific pattern of the known senders."""
+    name = "pattern_match"
+    default_weight = 0.4
+
+    def score(self, features: WindowFeatures) -> float:
+        if features.unique_count < 2 or features.max_delay <= 0.5 or features.min_delay <= 0.1:
+            return 0.0
+        spread = features.max_delay - features.min_delay
+        for width in PATTERN_BANDS:
+            # More than 60% of delays match the two main patterns
+            if spread > width and features.mode_band_count(width) / features.count > 0.6:
+                return 1.0
+        return 0.0
+
+
+@register_detector
+class EntropyDetector(WindowDetector):
+    """Low entropy of the rounded delays, the window only uses a few symbols."""
+    name = "entropy"
+    default_weight = 0.3
+
+    def score(self, features: WindowFeatures) -> float:
+        return 1.0 if features.entropy() < ENTROPY_MAX else 0.0
+
+
+@register_detector
+class CompressibilityDetector(WindowDetector):
+    """The delays, quantized relative to their mean, compress too well: the sequence repeats."""
+    name = "compressibility"
+    default_weight = 0.3
+    ordered = True
+
+    def score(self, features: WindowFeatures) -> float:
+        scale = COMPRESSIBILITY_LEVELS / max(features.mean, 1e-6)
+        top = COMPRESSIBILITY_MAX_SYMBOL
+        symbols = bytes([min(int(delay * scale), top) for delay in features.window.window()])
+        compressed = len(zlib.compress(symbols, 9)) - _EMPTY_COMPRESSED
+        return 1.0 if compressed / features.count < COMPRESSIBILITY_MAX else 0.0
+
+
+@register_detector
+class KSDetector(WindowDetector):
+    """Kolmogorov-Smirnov test of the delays against an exponential distribution with their mean."""
+    name = "ks"
+    default_weight = 0.3
+
+    def score(self, features: WindowFeatures) -> float:
+        count = features.count
+        rate = 1.0 / max(features.mean, 1e-9)
+        exp = math.exp
+        distance = 0.0
+        # The window is kept sorted, so the statistic is a single pass
+        for index, delay in enumerate(features.window.sorted_values):
+            cdf = 1.0 - exp(-delay * rate)
+            distance = max(distance, (index + 1) / count - cdf, cdf - index / count)
+        root = math.sqrt(count)
+        return 1.0 if (distance - 0.2 / count) * (root + 0.26 + 0.5 / root) > KS_CRITICAL else 0.0
+
+
+def parse_pipeline(specs: Sequence[str]) -> List[WindowDetector]:
+    """Detectors for specs like "entropy" or "entropy:0.3", a name of DETECTORS with an optional weight."""
+    detectors = []
+    for spec in specs:
+        name, _, weight = spec.partition(":")
+        if name not in DETECTORS:
+            raise ValueError(f"Unknown detector {name!r}, expected one of {sorted(DETECTORS)}")
+        detectors.append(DETECTORS[name](float(weight) if weight else None))
+    return detectors
+
+
+class DetectorPipeline:
+    def __init__(self, detectors: Optional[List[WindowDetector]] = None):
+        """
+        Initialize a pipeline shared by the detectors of every flow.
+        Args:
+            detectors: Detectors run on every scored window, the DEFAULT_PIPELINE ones when None
+        """
+        self.detectors = parse_pipeline(DEFAULT_PIPELINE) if detectors is None else detectors
+        self.stages = [(detector.name, detector.weight, detector.score) for detector in self.detectors]
+        self.unordered_stages = [(detector.name, detector.weight, detector.score) for detector in self.detectors
+                                 if not detector.ordered]
+        self.features = WindowFeatures()
+
+    @classmethod
+    def from_specs(cls, specs: Optional[Sequence[str]]) -> "DetectorPipeline":
+        return cls(parse_pipeline(specs) if specs else None)
+
+    def score(self, window: SlidingWindowStats, baseline: BaselineEstimator) -> Tuple[float, Dict[str, float]]:
+        """
+        Total score in [0, 1] of a flow's window and the weighted score of every detector.
+        Detectors needing the delays in order are skipped on windows that do not keep it.
+        """
+        features = self.features.update(window, baseline)
+        total = 0.0
+        detailed_scores = {}
+        for name, weight, score in self.stages if window.ordered else self.unordered_stages:
+            weighted = weight * score(features)
+            detailed_scores[name] = weighted
+            total += weighted
+        total = min(1.0, total)
+        detailed_scores['total_score'] = total
+        return total, detailed_scores
+
+    def describe(self) -> str:
+        return " ".join(f"{name}:{weight:g}" for name, weight, _ in self.stages)
+
+
+# Pipeline of detectors created without one
+default_pipeline = DetectorPipeline()
@@ -0,0 +1,230 @@
+import math
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import Optional, Tuple
+
+
+class SlidingWindowStats:
+    # Slots keep per-flow windows small when the processor tracks many flows
+    __slots__ = ("size", "values", "head", "count", "total", "total_sq", "sorted_values",
+                 "histogram", "count_freq", "min_count", "max_count",
+                 "mode1", "mode2", "modes_dirty", "pushes_since_resync")
+
+    # Running sums are recomputed exactly after this many windows worth of pushes
+    RESYNC_WINDOWS = 64
+    # The delays are kept in arrival order, see window()
+    ordered = True
+
+    def __init__(self, size: int):
+        """
+        Initialize an incremental statistics engine over the last size inter-packet delays.
+        Every statistic the detector needs is updated when a delay is pushed or evicted
+        instead of being recomputed over the whole window:
+        - running sum and sum of squares for mean and variance,
+        - a histogram of delays rounded to 1 ms with counts of counts and top-2 mode tracking,
+        - a sorted copy of the window for band counts and min/max.
+        Args:
+            size: Number of delays kept in the window
+        """
+        self.size = size
+        self.values = array('d', bytes(8 * size))  # Ring buffer of raw delays
+        self.head = 0  # Index of the oldest delay
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.sorted_values = array('d')
+        self.histogram = {}  # Rounded delay key (ms) -> count
+        self.count_freq = [0] * (size + 1)  # Count -> number of keys with that count
+        self.min_count = 0
+        self.max_count = 0
+        self.mode1: Optional[int] = None
+        self.mode2: Optional[int] = None
+        self.modes_dirty = False
+        self.pushes_since_resync = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    @staticmethod
+    def round_key(value: float) -> int:
+        """Rounded delay key in ms; matches np.round(value, 3) == key / 1000 (round half to even)."""
+        return round(value * 1000)
+
+    def push(self, value: float) -> None:
+        """Add a new delay to the window, evicting the oldest one if the window is full."""
+        size = self.size
+        if self.count == size:
+            old = self.values[self.head]
+            self.values[self.head] = value
+            self.head = (self.head + 1) % size
+            self._remove(old)
+        else:
+            self.values[(self.head + self.count) % size] = value
+            self.count += 1
+        self._add(value)
+
+        self.pushes_since_resync += 1
+        if self.pushes_since_resync >= size * self.RESYNC_WINDOWS:
+            self.resync()
+
+    def load(self, values) -> None:
+        """
+        Replace the window by the last size of values, oldest first, building every statistic
+        at once instead of pushing them one by one, e.g. when a flow is restored from a snapshot.
+        """
+        size = self.size
+        values = values[-size:]
+        count = len(values)
+        ring = array('d', bytes(8 * size))
+        ring[:count] = array('d', values)
+        self.values = ring
+        self.head = 0
+        self.count = count
+        self.total = math.fsum(values)
+        self.total_sq = math.fsum(v * v for v in values)
+        self.sorted_values = array('d', sorted(values))
+        histogram = {}
+        for value in values:
+            key = round(value * 1000)
+            histogram[key] = histogram.get(key, 0) + 1
+        self.histogram = histogram
+        count_freq = [0] * (size + 1)
+        for key_count in histogram.values():
+            count_freq[key_count] += 1
+        self.count_freq = count_freq
+        self.min_count = min(histogram.values()) if histogram else 0
+        self.max_count = max(histogram.values()) if histogram else 0
+        # Modes are found on the next top_two()
+        self.mode1 = self.mode2 = None
+        self.modes_dirty = bool(histogram)
+        self.pushes_since_resync = 0
+
+    def _add(self, value: float) -> None:
+        self.total += value
+        self.total_sq += value * value
+        insort(self.sorted_values, value)
+
+        key = round(value * 1000)
+        histogram = self.histogram
+        count_freq = self.count_freq
+        count = histogram.get(key, 0) + 1
+        histogram[key] = count
+        if count > 1:
+            count_freq[count - 1] -= 1
+        count_freq[count] += 1
+
+        if count == 1:
+            self.min_count = 1
+        elif count - 1 == self.min_count and count_freq[count - 1] == 0:
+            self.min_count = count
+        if count > self.max_count:
+            self.max_count = count
+
+        # Only the incremented key changed, so it can at most move into the top-2
+        if self.modes_dirty or key == self.mode1:
+            return
+        if self.mode1 is None:
+            self.mode1 = key
+        elif key == self.mode2:
+            if self._better(key, self.mode1):
+                self.mode1, self.mode2 = key, self.mode1
+        elif self._better(key, self.mode1):
+            self.mode1, self.mode2 = key, self.mode1
+        elif self.mode2 is None or self._better(key, self.mode2):
+            self.mode2 = key
+
+    def _remove(self, value: float) -> None:
+        self.total -= value
+        self.total_sq -= value * value
+        sorted_values = self.sorted_values
+        del sorted_values[bisect_left(sorted_values, value)]
+
+        key = round(value * 1000)
+        histogram = self.histogram
+        count_freq = self.count_freq
+        count = histogram[key]
+        count_freq[count] -= 1
+        if count == 1:
+            del histogram[key]
+        else:
+            histogram[key] = count - 1
+            count_freq[count - 1] += 1
+
+        if count == self.max_count and count_freq[count] == 0:
+            self.max_count = count - 1
+        if count - 1 > 0 and count - 1 < self.min_count:
+            self.min_count = count - 1
+        elif count == self.min_count and count_freq[count] == 0:
+            # The last key with the minimum count left the window, scan up to the next one
+            min_count = count
+            max_count = self.max_count
+            while min_count <= max_count and count_freq[min_count] == 0:
+                min_count += 1
+            self.min_count = min_count if min_count <= max_count else 0
+
+        # A mode lost a packet and may have been overtaken, recompute lazily on next read
+        if key == self.mode1 or key == self.mode2:
+            self.modes_dirty = True
+
+    def _better(self, key: int, other: int) -> bool:
+        """Order keys by count, ties go to the larger delay."""
+        count, other_count = self.histogram[key], self.histogram[other]
+        return count > other_count or (count == other_count and key > other)
+
+    def resync(self) -> None:
+        """Recompute the running sums exactly to cancel accumulated floating point drift."""
+        window = self.window()
+        self.total = math.fsum(window)
+        self.total_sq = math.fsum(v * v for v in window)
+        self.pushes_since_resync = 0
+
+    def window(self) -> list:
+        """Delays in the window from oldest to newest."""
+        size, head = self.size, self.head
+        return [self.values[(head + i) % size] for i in range(self.count)]
+
+    def mean(self) -> float:
+        return self.total / self.count
+
+    def std(self) -> float:
+        """Population standard deviation, like np.std."""
+        mean = self.total / self.count
+        return math.sqrt(max(self.total_sq / self.count - mean * mean, 0.0))
+
+    def unique_count(self) -> int:
+        """Number of distinct rounded delays in the window."""
+        return len(self.histogram)
+
+    def count_ratio(self) -> float:
+        """Least frequent over most frequent rounded delay count."""
+        return self.min_count / self.max_count
+
+    def concentration(self) -> float:
+        """Share of the window taken by its most frequent rounded delay."""
+        return self.max_count / self.count
+
+    def top_two(self) -> Tuple[Optional[int], Optional[int]]:
+        """Keys of the two most frequent rounded delays, ties go to the larger delay."""
+        if self.modes_dirty:
+            mode1 = mode2 = None
+            count1 = count2 = 0
+            for key, count in self.histogram.items():
+                if count > count1 or (count == count1 and key > mode1):
+                    mode2, count2 = mode1, count1
+                    mode1, count1 = key, count
+                elif mode2 is None or count > count2 or (count == count2 and key > mode2):
+                    mode2, count2 = key, count
+            self.mode1, self.mode2 = mode1, mode2
+            self.modes_dirty = False
+        return self.mode1, self.mode2
+
+    def min_value(self) -> float:
+        return self.sorted_values[0]
+
+    def max_value(self) -> float:
+        return self.sorted_values[-1]
+
+    def band_count(self, low: float, high: float) -> int:
+        """Number of delays in the window within [low, high]."""
+        sorted_values = self.sorted_values
+        return bisect_right(sorted_values, high) - bisect_left(sorted_values, low)
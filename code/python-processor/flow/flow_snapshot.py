@@ -0,0 +1,159 @@
+"""
+Binary snapshot of a processor's flow table and baselines, handed to the process replacing it
+(see processor.handoff). Every flow is stored as its state and detector counters, its pacer if
+paced, and the ring of ipds of its exact window, packed like the baseline snapshot so that
+100k flows dump and index in a fraction of a second.
+
+Loading only indexes the flows by key: a flow is restored into the new process's detector when
+its next packet arrives, so rebuilding window statistics is spread over traffic instead of
+holding up the takeover, and flows that went idle meanwhile are never rebuilt. Windows of a
+different size are refilled with the latest ipds that fit. Multi-scale detectors get their
+shortest window back, longer scales fill again from the following blocks.
+
+Release deadlines and pacing grids are on the scheduler's monotonic clock, which processes on
+the same host share, so the new process keeps the flows' frames behind those the old one still
+has to release.
+"""
+import gc
+import math
+import os
+import struct
+from array import array
+from contextlib import contextmanager
+from typing import Dict
+
+from detector.baseline import BaselineStore
+from mitigator.pacing_mitigator import FlowPacer
+
+SNAPSHOT_MAGIC = b"CCFT"
+SNAPSHOT_VERSION = 1
+_header = struct.Struct("<4sHIdI")  # magic, version, flow count, latest last_seen, baseline snapshot length
+# key length, last_seen, mitigation_count, release_at, analyzed_at, total_packets, last_packet_time,
+# detection_count, suspect, paced, ipd count, index of the oldest ipd
+_flow = struct.Struct("<BdIdQQdIBBHH")
+_pacer = struct.Struct("<ddId")  # interval, next_slot, misses, paced_until
+_IPD_SIZE = array("d").itemsize
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pause the cyclic garbage collector: dumping or loading many flows allocates enough objects
+    to trigger full collections, each going over the objects of every flow.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def dumps(flow_table, baselines: BaselineStore) -> bytes:
+    """Serialize the flows of a FlowTable, least recently used first, and the baselines."""
+    baseline_data = baselines.dumps()
+    parts = [None, baseline_data]
+    pack = _flow.pack
+    pack_pacer = _pacer.pack
+    latest = 0.0
+    for key, state in flow_table.flows.items():
+        detector = state.detector
+        window = detector.ipd_window
+        count = window.count
+        # The ring is full from head on, or filled from 0 up to count
+        ipds = window.values if count == window.size else window.values[:count]
+        last_packet_time = detector.last_packet_time
+        pacer = state.pacer
+        parts.append(pack(len(key), state.last_seen, state.mitigation_count, state.release_at, state.analyzed_at,
+                          detector.total_packets, math.nan if last_packet_time is None else last_packet_time,
+                          detector.detection_count, detector.suspect, pacer is not None, count, window.head))
+        parts.append(key)
+        if pacer is not None:
+            parts.append(pack_pacer(pacer.interval, pacer.next_slot, pacer.misses, pacer.paced_until))
+        parts.append(ipds.tobytes())
+        if state.last_seen > latest:
+            latest = state.last_seen
+    parts[0] = _header.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(flow_table.flows), latest, len(baseline_data))
+    return b"".join(parts)
+
+
+def save(path: str, data: bytes) -> None:
+    """Atomically write a snapshot to path."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class FlowSnapshot:
+    def __init__(self, data: bytes, idle_timeout: float = 60.0, pacing: bool = True):
+        """
+        Initialize a snapshot written by dumps(), indexing its flows for restore().
+        Args:
+            data: Snapshot bytes
+            idle_timeout: Seconds without a packet after which a flow of the snapshot is not restored
+            pacing: Whether pacers are restored, False when the new process does not pace flows
+        """
+        magic, version, count, latest, baseline_len = _header.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"Not a flow table snapshot (magic {magic!r}, version {version})")
+        self.data = data
+        self.idle_timeout = idle_timeout
+        self.pacing = pacing
+        # Every flow has gone idle by then, the snapshot can be dropped
+        self.expires_at = latest + idle_timeout
+        offset = _header.size
+        self.baselines = data[offset:offset + baseline_len]
+        offset += baseline_len
+        self.index: Dict[bytes, int] = {}
+        index = self.index
+        unpack = _flow.unpack_from
+        flow_size, pacer_size = _flow.size, _pacer.size
+        for _ in range(count):
+            fields = unpack(data, offset)
+            key_start = offset + flow_size
+            key = data[key_start:key_start + fields[0]]
+            index[key] = offset
+            offset = key_start + fields[0] + fields[10] * _IPD_SIZE
+            if fields[9]:
+                offset += pacer_size
+
+    def __len__(self) -> int:
+        """Flows not restored yet."""
+        return len(self.index)
+
+    def restore(self, key: bytes, state, now: float) -> bool:
+        """
+        Restore a flow of the snapshot into the fresh FlowState of its first packet at time now.
+        Each flow is restored at most once. Returns whether the snapshot had the flow.
+        """
+        offset = self.index.pop(key, None)
+        if offset is None:
+            return False
+        (key_len, last_seen, mitigation_count, release_at, analyzed_at, total_packets, last_packet_time,
+         detection_count, suspect, paced, count, head) = _flow.unpack_from(self.data, offset)
+        if now - last_seen > self.idle_timeout:
+            # The flow would have been dropped by the old process too
+            return False
+        offset += _flow.size + key_len
+        state.mitigation_count = mitigation_count
+        state.release_at = release_at
+        state.analyzed_at = analyzed_at
+        if paced:
+            interval, next_slot, misses, paced_until = _pacer.unpack_from(self.data, offset)
+            offset += _pacer.size
+            if self.pacing:
+                pacer = state.pacer = FlowPacer(interval, next_slot)
+                pacer.misses = misses
+                pacer.paced_until = paced_until
+        detector = state.detector
+        detector.total_packets = total_packets
+        detector.last_packet_time = None if math.isnan(last_packet_time) else last_packet_time
+        detector.detection_count = detection_count
+        detector.suspect = bool(suspect)
+        ipds = array("d")
+        ipds.frombytes(self.data[offset:offset + count * _IPD_SIZE])
+        detector.ipd_window.load(ipds[head:] + ipds[:head] if head else ipds)
+        return True
+
@@ -0,0 +1,177 @@
+import struct
+from array import array
+from collections import OrderedDict
+from typing import Callable, Optional
+
+ETH_HEADER_LEN = 14
+ETH_P_IP = 0x0800
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+_ethertype = struct.Struct("!H")
+_fragment = struct.Struct("!H")  # IPv4 flags and fragment offset
+
+# 32-bit FNV-1a, the same hash the MITM switch uses to pick a shard
+FNV_OFFSET = 2166136261
+FNV_PRIME = 16777619
+
+# Hash buckets remembering the release deadlines of dropped flows, see FlowTable.get()
+RELEASE_BUCKETS = 4096
+
+
+def flow_key(data: bytes) -> bytes:
+    """
+    Build a compact flow key from a raw Ethernet frame.
+
+    IPv4 frames are keyed by their 5-tuple (src ip, dst ip, protocol, src port, dst port),
+    packed as 13 bytes. Ports are zero for protocols other than TCP and UDP, and for fragments
+    but the first, which carry payload where the first has the transport header.
+    Any other frame (ARP, IPv6, truncated...) is keyed by its Ethernet header so that
+    it still gets its own state instead of polluting an IP flow.
+    """
+    if len(data) < ETH_HEADER_LEN + 20 or _ethertype.unpack_from(data, 12)[0] != ETH_P_IP:
+        return bytes(data[:ETH_HEADER_LEN])
+    ihl = (data[ETH_HEADER_LEN] & 0x0F) * 4
+    proto = data[ETH_HEADER_LEN + 9]
+    addrs = bytes(data[ETH_HEADER_LEN + 12:ETH_HEADER_LEN + 20])
+    l4 = ETH_HEADER_LEN + ihl
+    if (proto in (IPPROTO_TCP, IPPROTO_UDP) and len(data) >= l4 + 4
+            and not _fragment.unpack_from(data, ETH_HEADER_LEN + 6)[0] & 0x1FFF):
+        ports = bytes(data[l4:l4 + 4])
+    else:
+        ports = b"\x00\x00\x00\x00"
+    return addrs + bytes((proto,)) + ports
+
+
+def subnet_key(key: bytes, prefix_len: int = 24) -> bytes:
+    """
+    Key of the source subnet of a flow, used to share state such as baselines between its flows.
+    Flows that are not IPv4 keep their own flow key.
+    """
+    if len(key) != 13:
+        return key
+    mask = (0xFFFFFFFF << (32 - prefix_len)) & 0xFFFFFFFF if prefix_len else 0
+    return (int.from_bytes(key[:4], "big") & mask).to_bytes(4, "big") + bytes((prefix_len,))
+
+
+def flow_hash(key: bytes) -> int:
+    """32-bit FNV-1a hash of a flow key, matches flow_hash() in the MITM switch."""
+    value = FNV_OFFSET
+    for byte in key:
+        value = ((value ^ byte) * FNV_PRIME) & 0xFFFFFFFF
+    return value
+
+
+def shard_of(key: bytes, shard_count: int) -> int:
+    """Index of the processor shard that owns the flow."""
+    return flow_hash(key) % shard_count if shard_count > 1 else 0
+
+
+class FlowState:
+    """Per-flow detector and mitigation state kept in the flow table."""
+    __slots__ = ("detector", "mitigation_count", "last_seen", "release_at", "pacer", "flow_id", "analyzed_at")
+
+    def __init__(self, detector, last_seen: float):
+        self.detector = detector
+        self.mitigation_count = 0  # Remaining packets to mitigate, 0 if not mitigating
+        self.last_seen = last_seen
+        self.release_at = 0.0  # Release deadline of the flow's latest frame
+        self.pacer = None  # Release grid while the flow is paced
+        self.flow_id = None  # flow_hash() of the key, computed when first needed
+        self.analyzed_at = 0  # Packet count of the detector when a window was last sent for analysis
+
+
+class FlowTable:
+    def __init__(self,
+                 detector_factory: Callable[[bytes], object],
+                 max_flows: int = 100000,
+                 idle_timeout: float = 60.0):
+        """
+        Initialize the flow table.
+        Flows are kept in least recently used order, so both idle timeout and capacity
+        eviction only ever look at the head of the table.
+        Args:
+            detector_factory: Callable returning a fresh detector for a new flow, given the flow key
+            max_flows: Maximum number of flows kept at the same time
+            idle_timeout: Seconds without a packet after which a flow is dropped
+        """
+        self.detector_factory = detector_factory
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.flows: "OrderedDict[bytes, FlowState]" = OrderedDict()
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        # Flows handed over by a previous process (see flow.flow_snapshot), restored on their next packet
+        self.snapshot = None
+        self.restored = 0
+        # Latest release deadline of the flows dropped so far, by hash bucket of their key
+        self.dropped_release_at = array('d', bytes(8 * RELEASE_BUCKETS))
+
+    def __len__(self) -> int:
+        return len(self.flows)
+
+    def get(self, key: bytes, now: float) -> FlowState:
+        """Return the state of the flow, creating it if needed, and mark it as most recently used."""
+        state = self.flows.get(key)
+        if state is not None:
+            self.flows.move_to_end(key)
+            state.last_seen = now
+        else:
+            state = FlowState(self.detector_factory(key), now)
+            if self.snapshot is not None and self.snapshot.restore(key, state, now):
+                self.restored += 1
+            # Frames of the flow's dropped state may still wait for release, its next ones go behind them.
+            # A flow sharing the bucket may wait for another's frames too, past deadlines have no effect
+            release_at = self.dropped_release_at[hash(key) % RELEASE_BUCKETS]
+            if release_at > state.release_at:
+                state.release_at = release_at
+            self.flows[key] = state
+            if len(self.flows) > self.max_flows:
+                self._drop(*self.flows.popitem(last=False))
+                self.evicted_lru += 1
+        self.expire(now)
+        return state
+
+    def lookup(self, key: bytes) -> Optional[FlowState]:
+        """Return the state of the flow without touching its recency."""
+        return self.flows.get(key)
+
+    def expire(self, now: float, budget: int = 8) -> int:
+        """
+        Drop idle flows from the head of the table.
+        At most budget flows are dropped per call so the cost per packet stays constant.
+        Returns:
+            Number of flows dropped
+        """
+        expired = 0
+        deadline = now - self.idle_timeout
+        flows = self.flows
+        while flows and expired < budget:
+            key, state = next(iter(flows.items()))
+            if state.last_seen > deadline:
+                break
+            del flows[key]
+            self._drop(key, state)
+            expired += 1
+        self.evicted_idle += expired
+        snapshot = self.snapshot
+        if snapshot is not None and (now >= snapshot.expires_at or not snapshot):
+            # Every flow left in the snapshot went idle, or none is left
+            self.snapshot = None
+        return expired
+
+    def _drop(self, key: bytes, state: FlowState) -> None:
+        bucket = hash(key) % RELEASE_BUCKETS
+        if state.release_at > self.dropped_release_at[bucket]:
+            self.dropped_release_at[bucket] = state.release_at
+
+    def get_stats(self) -> dict:
+        """Get flow table statistics."""
+        return {
+            'active_flows': len(self.flows),
+            'max_flows': self.max_flows,
+            'evicted_idle': self.evicted_idle,
+            'evicted_lru': self.evicted_lru,
+            'restored': self.restored,
+            'snapshot_pending': len(self.snapshot) if self.snapshot is not None else 0
+        }
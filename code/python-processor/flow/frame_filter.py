@@ -0,0 +1,194 @@
+"""
+Header parser for raw Ethernet frames and the filter deciding which frames the processor inspects.
+Frames are read in place with precompiled struct.Struct unpackers, so a memoryview slice of a batch
+message is parsed without copying it. Filter rules look like
+
+    udp                      every UDP frame
+    udp:8000-8100            UDP with either port in 8000-8100
+    tcp:22,443@10.1.0.0/16   TCP with either port 22 or 443 and either address in 10.1.0.0/16
+    ip@fd00::/8              any IP protocol with either address in fd00::/8
+    icmp                     ICMP (or 1, any protocol number)
+
+and a frame is inspected if any rule matches it.
+"""
+import ipaddress
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+ETH_HEADER_LEN = 14
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+# 802.1Q and 802.1ad (QinQ) tags
+VLAN_ETHERTYPES = (0x8100, 0x88A8)
+MAX_VLAN_TAGS = 2
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+# IPv6 extension headers skipped to reach the transport header: hop-by-hop, routing, destination options
+IPV6_EXTENSIONS = (0, 43, 60)
+IPV6_FRAGMENT = 44
+IPV6_AUTH = 51
+MAX_IPV6_EXTENSIONS = 8
+
+PROTOCOLS = {"tcp": IPPROTO_TCP, "udp": IPPROTO_UDP, "icmp": 1, "icmpv6": 58, "sctp": 132}
+ANY_PROTOCOL = -1  # "ip" or "any" rules
+
+_ethertype = struct.Struct("!H")
+_vlan = struct.Struct("!2xH")  # TCI, inner ethertype
+_ipv4 = struct.Struct("!B5xHxB2xII")  # version/ihl, flags/fragment offset, protocol, src, dst
+_ipv6 = struct.Struct("!6xB1xQQQQ")  # next header, src and dst as two 64-bit halves
+_ipv6_extension = struct.Struct("!BB")  # next header, length
+_ipv6_fragment = struct.Struct("!B1xH")  # next header, fragment offset/flags
+_ports = struct.Struct("!HH")
+
+# (ip version, protocol, src, dst, src port, dst port), ports are 0 without a TCP or UDP header
+Headers = Tuple[int, int, int, int, int, int]
+
+
+def parse_headers(data) -> Optional[Headers]:
+    """
+    Parse the Ethernet, VLAN, IPv4 or IPv6 and TCP or UDP headers of a frame, bytes or memoryview.
+    Addresses are ints. Returns None for frames that are not IP (ARP, LLDP...) or are truncated.
+    """
+    size = len(data)
+    if size < ETH_HEADER_LEN:
+        return None
+    ethertype = _ethertype.unpack_from(data, 12)[0]
+    offset = ETH_HEADER_LEN
+    tags = 0
+    while ethertype in VLAN_ETHERTYPES and tags < MAX_VLAN_TAGS:
+        if size < offset + 4:
+            return None
+        ethertype = _vlan.unpack_from(data, offset)[0]
+        offset += 4
+        tags += 1
+
+    if ethertype == ETH_P_IP:
+        if size < offset + 20:
+            return None
+        version_ihl, fragment, protocol, src, dst = _ipv4.unpack_from(data, offset)
+        version = 4
+        # Only the first fragment carries the transport header
+        has_ports = not fragment & 0x1FFF
+        offset += (version_ihl & 0x0F) * 4
+    elif ethertype == ETH_P_IPV6:
+        if size < offset + 40:
+            return None
+        protocol, src_high, src_low, dst_high, dst_low = _ipv6.unpack_from(data, offset)
+        version = 6
+        src = src_high << 64 | src_low
+        dst = dst_high << 64 | dst_low
+        has_ports = True
+        offset += 40
+        extensions = 0
+        while extensions < MAX_IPV6_EXTENSIONS and (protocol in IPV6_EXTENSIONS or protocol == IPV6_FRAGMENT
+                                                    or protocol == IPV6_AUTH):
+            if size < offset + 8:
+                return None
+            if protocol == IPV6_FRAGMENT:
+                protocol, fragment = _ipv6_fragment.unpack_from(data, offset)
+                has_ports = has_ports and not fragment & 0xFFF8
+                offset += 8
+            else:
+                next_header, length = _ipv6_extension.unpack_from(data, offset)
+                offset += (length + 2) * 4 if protocol == IPV6_AUTH else (length + 1) * 8
+                protocol = next_header
+            extensions += 1
+    else:
+        return None
+
+    if has_ports and (protocol == IPPROTO_UDP or protocol == IPPROTO_TCP) and size >= offset + 4:
+        src_port, dst_port = _ports.unpack_from(data, offset)
+        return version, protocol, src, dst, src_port, dst_port
+    return version, protocol, src, dst, 0, 0
+
+
+def _parse_ports(spec: str) -> bytearray:
+    """Lookup table of the 65536 ports, set for the ports of a spec like "53,8000-8100"."""
+    table = bytearray(65536)
+    for part in spec.split(","):
+        low, _, high = part.partition("-")
+        low, high = int(low), int(high or low)
+        if not 0 <= low <= high <= 65535:
+            raise ValueError(f"Invalid port range {part!r}")
+        table[low:high + 1] = b"\x01" * (high - low + 1)
+    return table
+
+
+def _match_rules(rules, headers: Headers) -> bool:
+    version, _, src, dst, src_port, dst_port = headers
+    for ports, networks in rules:
+        if ports is not None and not (ports[src_port] or ports[dst_port]):
+            continue
+        if networks is not None:
+            for network_version, mask, prefix in networks:
+                if network_version == version and (src & mask == prefix or dst & mask == prefix):
+                    break
+            else:
+                continue
+        return True
+    return False
+
+
+class FrameFilter:
+    def __init__(self, rules: Sequence[str]):
+        """
+        Compile filter rules (see the module docstring) into per-protocol lookups.
+        Port lists become 65536-entry tables and networks (version, mask, prefix) pairs, so matching
+        a frame is a dict lookup and a few integer operations per rule of its protocol.
+        Args:
+            rules: Rules like "udp:8000-8100@10.1.0.0/16", a frame matching any of them is inspected
+        """
+        self.rules = list(rules)
+        # Protocol (or ANY_PROTOCOL) -> [(port table or None, networks or None)]
+        self.compiled: Dict[int, List[Tuple[Optional[bytearray], Optional[List[Tuple[int, int, int]]]]]] = {}
+        for rule in self.rules:
+            rule = rule.strip().lower()
+            rule, _, cidrs = rule.partition("@")
+            name, _, ports = rule.partition(":")
+            if name in ("ip", "any"):
+                protocol = ANY_PROTOCOL
+            elif name in PROTOCOLS:
+                protocol = PROTOCOLS[name]
+            elif name.isdigit():
+                protocol = int(name)
+            else:
+                raise ValueError(f"Unknown protocol {name!r} in filter rule, expected ip, {', '.join(PROTOCOLS)} "
+                                 "or a protocol number")
+            networks = None
+            if cidrs:
+                networks = []
+                for cidr in cidrs.split(","):
+                    network = ipaddress.ip_network(cidr, strict=False)
+                    networks.append((network.version, int(network.netmask), int(network.network_address)))
+            self.compiled.setdefault(protocol, []).append((_parse_ports(ports) if ports else None, networks))
+        self.any_rules = self.compiled.get(ANY_PROTOCOL, [])
+        self.matched_count = 0
+        self.bypassed_count = 0
+
+    def match_headers(self, headers: Optional[Headers]) -> bool:
+        """Whether parsed headers match a rule, frames that are not IP never do."""
+        if headers is None:
+            return False
+        rules = self.compiled.get(headers[1])
+        if rules is not None and _match_rules(rules, headers):
+            return True
+        return bool(self.any_rules) and _match_rules(self.any_rules, headers)
+
+    def match(self, data) -> bool:
+        """Whether a frame should be inspected, counting matched and bypassed frames."""
+        if self.match_headers(parse_headers(data)):
+            self.matched_count += 1
+            return True
+        self.bypassed_count += 1
+        return False
+
+    def get_stats(self) -> dict:
+        """Get filter statistics."""
+        total = self.matched_count + self.bypassed_count
+        return {
+            'rules': self.rules,
+            'matched': self.matched_count,
+            'bypassed': self.bypassed_count,
+            'bypass_ratio': self.bypassed_count / max(total, 1)
+        }
@@ -0,0 +1,132 @@
+"""
+Capture of the switch's frames in a JetStream stream, to replay production traffic later (see
+bench.capture_replay). The stream listens on inpktsec and inpktinsec, their shard subjects and
+their batch subjects, so it stores every frame the switch publishes with its capture timestamp:
+the Capture-Ts-Ns header of single frames, the record timestamps of batches. Retention limits
+keep the stream within max_age and max_bytes, oldest messages are discarded first.
+Create or update the stream and show its state with
+
+    python -m journal.capture_stream --stream INPKT --max_age 86400 --max_bytes 4294967296
+
+or start the processor with --capture_stream INPKT.
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+from typing import AsyncIterator, NamedTuple, Optional
+
+import nats.errors
+import nats.js.errors
+from nats.js.api import AckPolicy, ConsumerConfig, DeliverPolicy, DiscardPolicy, RetentionPolicy, StorageType, StreamConfig
+
+from processor.batch_framing import BATCH_PREFIX, iter_batch
+from processor.packet_processor import CAPTURE_TS_HEADER, OUT_SUBJECTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STREAM = "INPKT"
+DEFAULT_MAX_AGE = 86400.0  # Seconds
+DEFAULT_MAX_BYTES = 4 << 30
+# Messages are looked up by the time the server stored them, which trails capture by at most this (seconds)
+STORE_SLACK = 5.0
+
+
+class CapturedFrame(NamedTuple):
+    timestamp: float  # Capture time (seconds since the epoch)
+    subject: str  # inpktsec or inpktinsec, without batch prefix or shard suffix
+    data: bytes
+
+
+def capture_subjects():
+    """Subjects the switch publishes frames on, with and without shards and batching."""
+    subjects = []
+    for subject in OUT_SUBJECTS:
+        subjects += [subject, f"{subject}.*", BATCH_PREFIX + subject, f"{BATCH_PREFIX}{subject}.*"]
+    return subjects
+
+
+async def ensure_capture_stream(js, name: str = DEFAULT_STREAM, max_age: float = DEFAULT_MAX_AGE,
+                                max_bytes: int = DEFAULT_MAX_BYTES, max_msgs: int = -1):
+    """Create the capture stream, or update the retention limits of an existing one. Returns its info."""
+    config = StreamConfig(name=name, subjects=capture_subjects(), retention=RetentionPolicy.LIMITS,
+                          storage=StorageType.FILE, discard=DiscardPolicy.OLD, max_age=max_age,
+                          max_bytes=max_bytes, max_msgs=max_msgs,
+                          description="Frames published by the switch, for replay through the processor")
+    try:
+        await js.stream_info(name)
+    except nats.js.errors.NotFoundError:
+        info = await js.add_stream(config)
+        logger.info(f"Created capture stream {name}: max_age {max_age:g}s, max_bytes {max_bytes}")
+        return info
+    return await js.update_stream(config)
+
+
+async def read_capture(js, stream: str = DEFAULT_STREAM, start: Optional[float] = None, end: Optional[float] = None,
+                       fetch_batch: int = 1024, fetch_timeout: float = 2.0) -> AsyncIterator[CapturedFrame]:
+    """
+    Yield the frames of the capture stream captured in [start, end) (seconds since the epoch), in stream order.
+    Reading starts at the first message stored around start and ends at the first one stored well after
+    end, or when the stream has no more messages; frames of a flow come in the order they were captured.
+    """
+    config = ConsumerConfig(ack_policy=AckPolicy.NONE, inactive_threshold=60.0, filter_subjects=capture_subjects())
+    if start is not None:
+        config.deliver_policy = DeliverPolicy.BY_START_TIME
+        config.opt_start_time = datetime.datetime.fromtimestamp(start - STORE_SLACK, tz=datetime.timezone.utc)
+    subscription = await js.pull_subscribe("", stream=stream, config=config)
+    try:
+        while True:
+            try:
+                messages = await subscription.fetch(fetch_batch, timeout=fetch_timeout)
+            except nats.errors.TimeoutError:
+                return
+            for msg in messages:
+                metadata = msg.metadata
+                stored = metadata.timestamp.timestamp()
+                if end is not None and stored > end + STORE_SLACK:
+                    return
+                subject = msg.subject
+                if subject.startswith(BATCH_PREFIX):
+                    subject = subject[len(BATCH_PREFIX):].split(".")[0]
+                    for timestamp, frame in iter_batch(msg.data):
+                        timestamp = timestamp / 1e9 if timestamp else stored
+                        if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                            yield CapturedFrame(timestamp, subject, bytes(frame))
+                else:
+                    value = msg.headers.get(CAPTURE_TS_HEADER) if msg.headers else None
+                    timestamp = int(value) / 1e9 if value is not None else stored
+                    if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                        yield CapturedFrame(timestamp, subject.split(".")[0], msg.data)
+                if metadata.num_pending == 0:
+                    return
+    finally:
+        await subscription.unsubscribe()
+
+
+async def _show(args) -> None:
+    nc = await nats.connect(args.nats)
+    try:
+        js = nc.jetstream()
+        info = await ensure_capture_stream(js, args.stream, args.max_age, args.max_bytes, args.max_msgs)
+        state = info.state
+        print(f"Stream {args.stream} on {', '.join(info.config.subjects)}: {state.messages} messages, "
+              f"{state.bytes} bytes, sequences {state.first_seq}-{state.last_seq}")
+    finally:
+        await nc.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or update the JetStream capture of the switch's frames")
+    parser.add_argument("--nats", type=str, default=os.getenv("NATS_SURVEYOR_SERVERS", "nats://nats:4222"),
+                        help="NATS server (NATS_SURVEYOR_SERVERS)")
+    parser.add_argument("--stream", type=str, default=DEFAULT_STREAM, help="Name of the capture stream")
+    parser.add_argument("--max_age", type=float, default=DEFAULT_MAX_AGE, help="Seconds a captured frame is kept")
+    parser.add_argument("--max_bytes", type=int, default=DEFAULT_MAX_BYTES, help="Size limit of the stream")
+    parser.add_argument("--max_msgs", type=int, default=-1, help="Message limit of the stream, -1 for none")
+    args = parser.parse_args()
+    asyncio.run(_show(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+"""
+Append-only journal of every inspected frame and the detector's decision on it, kept as fixed-width
+binary columns in numpy.memmap segment files. Readers map the segments read-only, so a journal can
+be inspected or rescored with detect_batch() without copying or parsing anything. There is a score
+column per detector of the processor's pipeline and per window scale, whose names every segment
+header records:
+
+    python -m journal.packet_journal /var/lib/processor/journal --flow 3735928559
+    python -m journal.packet_journal /var/lib/processor/journal --rescore --window_size 30
+"""
+import argparse
+import glob
+import logging
+import os
+import re
+import struct
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from detector.batch_detector import SCORE_NAMES, detect_batch
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MAGIC = b"CCJN"
+# Version 1 segments have the SCORE_NAMES columns and no score names in the header
+JOURNAL_VERSION = 2
+_header = struct.Struct("<4sHHQQ")  # magic, version, column count, capacity, record count
+_names_length = struct.Struct("<H")  # Length of the space separated score names following the header
+_COUNT_OFFSET = 16
+_ALIGN = 64
+
+# Column name -> dtype of the columns before and after the scores, in file order
+_FRAME_COLUMNS = (
+    ("ts", np.float64),  # Capture time (seconds)
+    ("flow_id", np.uint32),  # flow_hash() of the flow key
+    ("subject", np.uint8),  # Index in SUBJECTS, SUBJECT_OTHER if not there
+    ("length", np.uint16),  # Frame length
+)
+_DECISION_COLUMNS = (
+    ("total_score", np.float32),
+    ("decision", np.uint8),  # DECISION_* flags
+    ("delay", np.float32),  # Release delay added by the processor (seconds)
+)
+# array typecodes of the column dtypes, records are staged in arrays and copied in blocks
+_TYPECODES = {np.float64: 'd', np.uint32: 'I', np.uint8: 'B', np.uint16: 'H', np.float32: 'f'}
+
+SUBJECTS = ("inpktsec", "inpktinsec")
+SUBJECT_OTHER = 255
+
+DECISION_COVERT = 1  # The detector flagged the flow on this frame
+DECISION_MITIGATED = 2  # The frame was delayed or paced by the mitigation
+DECISION_SKIPPED = 4  # The full score was skipped by the tiered detection prefilter
+DECISION_SAMPLED = 8  # Detection was skipped by overload control
+
+
+def journal_columns(score_names: Sequence[str] = SCORE_NAMES) -> Tuple:
+    """Column name -> dtype of a journal recording these scores, in file order."""
+    return _FRAME_COLUMNS + tuple((name, np.float32) for name in score_names) + _DECISION_COLUMNS
+
+
+# Columns of a journal of the default pipeline
+COLUMNS = journal_columns()
+
+
+def _header_size(names: bytes) -> int:
+    """Bytes before the first column of a segment whose header records these score names."""
+    return -(-(_header.size + _names_length.size + len(names)) // _ALIGN) * _ALIGN
+
+
+def _layout(capacity: int, columns: Tuple, header_size: int) -> List:
+    """(name, dtype, offset) of every column of a segment holding capacity records."""
+    layout = []
+    offset = header_size
+    for name, dtype in columns:
+        layout.append((name, np.dtype(dtype), offset))
+        offset += -(-capacity * np.dtype(dtype).itemsize // _ALIGN) * _ALIGN
+    layout.append((None, None, offset))  # File size
+    return layout
+
+
+def segment_paths(directory: str, prefix: str = "journal") -> List[str]:
+    """Segment files of a journal, oldest first."""
+    # Shard 1's journal-1-00000000.seg matches journal-[0-9]*.seg too, only a whole sequence number is one of ours
+    sequence = re.compile(re.escape(prefix) + r"-(\d{8,})\.seg")
+    segments = []
+    for path in glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(prefix)}-[0-9]*.seg")):
+        match = sequence.fullmatch(os.path.basename(path))
+        if match is not None:
+            segments.append((int(match.group(1)), path))
+    return [path for _, path in sorted(segments)]
+
+
+class PacketJournal:
+    def __init__(self,
+                 directory: str,
+                 prefix: str = "journal",
+                 segment_records: int = 1 << 20,
+                 max_segments: int = 64,
+                 block_records: int = 256,
+                 score_names: Sequence[str] = SCORE_NAMES):
+        """
+        Initialize a journal writer.
+        Records are staged and copied into the mapped columns of the current segment block_records
+        at a time, and on flush(); the record count in the header is updated after the columns so
+        readers never see a partial record.
+        A full segment is flushed and a new one started; segments beyond max_segments are deleted,
+        oldest first. A restarted writer continues after the last existing segment.
+        Args:
+            directory: Directory of the segment files, created if needed
+            prefix: File name prefix of the segments, e.g. one per shard
+            segment_records: Records per segment
+            max_segments: Segments kept on disk, 0 to keep all
+            block_records: Records staged before they are copied into the segment
+            score_names: Scores recorded of every frame besides total_score, the names of the processor's
+                         detectors and scales (see processor.packet_processor.score_names)
+        """
+        self.score_names = tuple(score_names)
+        fixed = {name for name, _ in _FRAME_COLUMNS + _DECISION_COLUMNS}
+        if len(set(self.score_names)) != len(self.score_names) or fixed.intersection(self.score_names):
+            raise ValueError(f"Invalid journal score names {self.score_names}")
+        self.names = " ".join(self.score_names).encode()
+        self.column_types = journal_columns(self.score_names)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.block_records = min(block_records, segment_records)
+        self.layout = _layout(segment_records, self.column_types, _header_size(self.names))
+        existing = segment_paths(directory, prefix)
+        self.sequence = int(os.path.basename(existing[-1])[len(prefix) + 1:-len(".seg")]) + 1 if existing else 0
+        self.subject_codes: Dict[str, int] = {}
+        self.records_count = 0
+        self.segments_count = 0
+        self.map: Optional[np.memmap] = None
+        self.columns: List[np.ndarray] = []
+        self.staged = 0
+        # Every staged column but the scores is an attribute named like it, e.g. self.ts, for append()
+        self.staging = []
+        self.score_columns = []
+        for name, dtype in self.column_types:
+            column = array(_TYPECODES[dtype])
+            if name in self.score_names:
+                self.score_columns.append((name, column))
+            else:
+                setattr(self, name, column)
+            self.staging.append(column)
+        self._open_segment()
+
+    def _open_segment(self) -> None:
+        path = os.path.join(self.directory, f"{self.prefix}-{self.sequence:08d}.seg")
+        self.sequence += 1
+        size = self.layout[-1][2]
+        with open(path, "wb") as f:
+            f.truncate(size)
+        self.map = np.memmap(path, dtype=np.uint8, mode="r+", shape=(size,))
+        header = (_header.pack(JOURNAL_MAGIC, JOURNAL_VERSION, len(self.column_types), self.segment_records, 0)
+                  + _names_length.pack(len(self.names)) + self.names)
+        self.map[:len(header)] = np.frombuffer(header, dtype=np.uint8)
+        self.count_view = self.map[_COUNT_OFFSET:_COUNT_OFFSET + 8].view(np.uint64)
+        self.columns = [self.map[offset:offset + self.segment_records * dtype.itemsize].view(dtype)
+                        for name, dtype, offset in self.layout[:-1]]
+        self.count = 0
+        self.path = path
+        self.segments_count += 1
+        self._enforce_retention()
+
+    def _enforce_retention(self) -> None:
+        if self.max_segments <= 0:
+            return
+        for path in segment_paths(self.directory, self.prefix)[:-self.max_segments]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove journal segment {path}: {e}")
+
+    def append(self, ts: float, flow_id: int, subject: str, length: int, scores: Dict[str, float],
+               decision: int, delay: float) -> None:
+        """Add the record of one frame, scores as returned by CovertChannelDetector.detect(), 0 if missing."""
+        code = self.subject_codes.get(subject)
+        if code is None:
+            # Sharded subjects carry a suffix, e.g. inpktsec.3
+            base = subject.split(".")[0]
+            code = self.subject_codes[subject] = SUBJECTS.index(base) if base in SUBJECTS else SUBJECT_OTHER
+        self.ts.append(ts)
+        self.flow_id.append(flow_id)
+        self.subject.append(code)
+        self.length.append(length if length < 0xffff else 0xffff)
+        get = scores.get
+        for name, column in self.score_columns:
+            column.append(get(name, 0.0))
+        self.total_score.append(get('total_score', 0.0))
+        self.decision.append(decision)
+        self.delay.append(delay)
+        self.staged += 1
+        self.records_count += 1
+        if self.staged >= self.block_records:
+            self.write_staged()
+
+    def write_staged(self) -> None:
+        """Copy the staged records into the segment, rotating segments as they fill up."""
+        written = 0
+        staged = self.staged
+        while written < staged:
+            if self.count == self.segment_records:
+                self.rotate()
+            count = min(staged - written, self.segment_records - self.count)
+            for column, values in zip(self.columns, self.staging):
+                column[self.count:self.count + count] = np.frombuffer(values, dtype=column.dtype)[written:written + count]
+            self.count += count
+            self.count_view[0] = self.count
+            written += count
+        for values in self.staging:
+            del values[:]
+        self.staged = 0
+
+    def rotate(self) -> None:
+        """Write the current segment back to disk and start a new one."""
+        self.map.flush()
+        self.map = None
+        self._open_segment()
+
+    def flush(self) -> None:
+        """Copy the staged records into the segment and write its mapped pages back to disk."""
+        if self.staged:
+            self.write_staged()
+        if self.map is not None:
+            self.map.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.map = None
+        self.columns = []
+
+    def get_stats(self) -> dict:
+        """Get journal statistics."""
+        return {
+            'records': self.records_count,
+            'segments': self.segments_count,
+            'segment': self.path,
+            'segment_records': self.count,
+            'staged': self.staged
+        }
+
+
+class JournalSegment:
+    def __init__(self, path: str):
+        """
+        Map a journal segment read-only.
+        Columns are numpy views of the mapped file holding the records written so far, e.g.
+        segment["ts"] and segment["flow_id"] can be passed to detect_batch() as they are.
+        Args:
+            path: Segment file written by PacketJournal
+        """
+        self.path = path
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, column_count, capacity, count = _header.unpack_from(data, 0)
+        if magic != JOURNAL_MAGIC or version not in (1, JOURNAL_VERSION):
+            raise ValueError(f"Not a journal segment: {path} (magic {magic!r}, version {version})")
+        if version == 1:
+            self.score_names = SCORE_NAMES
+            header_size = _ALIGN
+        else:
+            length, = _names_length.unpack_from(data, _header.size)
+            start = _header.size + _names_length.size
+            names = bytes(data[start:start + length])
+            self.score_names = tuple(names.decode().split())
+            header_size = _header_size(names)
+        columns = journal_columns(self.score_names)
+        if column_count != len(columns):
+            raise ValueError(f"Not a journal segment: {path} ({column_count} columns, expected {len(columns)})")
+        self.capacity = capacity
+        self.count = count
+        self.columns: Dict[str, np.ndarray] = {
+            name: data[offset:offset + capacity * dtype.itemsize].view(dtype)[:count]
+            for name, dtype, offset in _layout(capacity, columns, header_size)[:-1]
+        }
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+
+def read_journal(directory: str, prefix: str = "journal") -> List[JournalSegment]:
+    """Map every segment of a journal, oldest first."""
+    return [JournalSegment(path) for path in segment_paths(directory, prefix)]
+
+
+def concatenate(segments: List[JournalSegment]) -> Dict[str, np.ndarray]:
+    """Columns of several segments joined, this copies unless there is a single segment."""
+    if len(segments) == 1:
+        return segments[0].columns
+    if any(segment.score_names != segments[0].score_names for segment in segments):
+        raise ValueError("Journal segments record different scores, e.g. after the detectors were changed")
+    return {name: np.concatenate([segment[name] for segment in segments]) for name in segments[0].columns}
+
+
+def rescore(columns: Dict[str, np.ndarray], window_size: int = 50, threshold: float = 0.7):
+    """Score journaled frames again with detect_batch(), e.g. with another window size or threshold."""
+    return detect_batch(columns["ts"], columns["flow_id"], window_size=window_size, threshold=threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a packet journal")
+    parser.add_argument("directory", type=str, help="Journal directory")
+    parser.add_argument("--prefix", type=str, default="journal", help="Segment file name prefix")
+    parser.add_argument("--flow", type=int, default=None, help="Print the records of this flow id")
+    parser.add_argument("--rescore", action="store_true", help="Score the journal again with detect_batch()")
+    parser.add_argument("--window_size", type=int, default=30, help="Window size for rescoring")
+    parser.add_argument("--detection_threshold", type=float, default=0.65, help="Detection threshold for rescoring")
+    args = parser.parse_args()
+
+    segments = read_journal(args.directory, args.prefix)
+    if not segments:
+        print(f"No journal segments in {args.directory}")
+        return
+    columns = concatenate(segments)
+    flagged = (columns["decision"] & DECISION_COVERT) != 0
+    print(f"{len(segments)} segments, {len(columns['ts'])} records, "
+          f"{flagged.sum()} detections on {len(np.unique(columns['flow_id'][flagged]))} flows")
+    flow_ids, counts = np.unique(columns["flow_id"][flagged], return_counts=True)
+    for flow_id, count in sorted(zip(flow_ids, counts), key=lambda item: -item[1])[:20]:
+        print(f"  flow {flow_id}: {count} detections")
+
+    if args.rescore:
+        if segments[0].score_names != SCORE_NAMES:
+            print(f"Journaled with the scores {' '.join(segments[0].score_names)}, "
+                  f"rescoring with the default detectors")
+        is_covert, _, _ = rescore(columns, args.window_size, args.detection_threshold)
+        print(f"Rescored: {is_covert.sum()} detections on {len(np.unique(columns['flow_id'][is_covert]))} flows, "
+              f"{(is_covert != flagged).sum()} records decided differently")
+
+    if args.flow is not None:
+        rows = np.flatnonzero(columns["flow_id"] == args.flow)
+        previous = None
+        score_names = segments[0].score_names + ("total_score",)
+        print(f"{'ts':>18}{'ipd':>10}" + "".join(f"{name[:10]:>11}" for name in score_names)
+              + f"{'decision':>9}{'delay':>10}")
+        for row in rows:
+            ts = columns["ts"][row]
+            ipd = ts - previous if previous is not None else 0.0
+            previous = ts
+            print(f"{ts:>18.6f}{ipd:>10.4f}" + "".join(f"{columns[name][row]:>11.2f}" for name in score_names)
+                  + f"{columns['decision'][row]:>9}{columns['delay'][row]:>10.4f}")
+
+
+if __name__ == '__main__':
+    main()
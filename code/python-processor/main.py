@@ -1,13 +1,18 @@
 import argparse
 import asyncio
 from nats.aio.client import Client as NATS
+import multiprocessing
 import os
-import random
-import time
 import logging
+import signal
 
-from detector.covert_channel_detector import CovertChannelDetector
-from mitigator.covert_channel_mitigator import CovertChannelMitigator
+from detector.pipeline import DETECTORS
+from journal.capture_stream import DEFAULT_MAX_AGE, DEFAULT_MAX_BYTES, ensure_capture_stream
+from journal.packet_journal import PacketJournal
+from metrics.metrics import MetricsAggregator
+from processor.batch_framing import BATCH_PREFIX
+from processor.handoff import DEFAULT_HANDOFF_TIMEOUT, HandoffServer, take_over
+from processor.packet_processor import PacketProcessor, input_subjects, score_names
 
 # Configure logging
 logging.basicConfig(
@@ -17,7 +22,20 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def run(mean_value, min_delay, max_delay, window_size: int = 50, detection_threshold: float = 0.6, history_length: int = 5):
+async def run(mean_value, min_delay, max_delay, window_size: int = 50, detection_threshold: float = 0.6,
+              max_flows: int = 100000, flow_idle_timeout: float = 60.0, max_pending_frames: int = 10000,
+              metrics_port: int = 9108, debug_sample: int = 0, shard_index: int = 0, shard_count: int = 1,
+              baseline_scope: str = "flow", baseline_decay: float = 0.0, baseline_snapshot: str = None,
+              baseline_snapshot_interval: float = 60.0, batch_size: int = 0, batch_flush_us: int = 1000,
+              mitigation_mode: str = "delay", pace_quantum: float = 0.05, pace_hold: float = 30.0,
+              full_score_interval: int = 0, journal_dir: str = None, journal_segment_records: int = 1 << 20,
+              journal_max_segments: int = 64, detectors: list = None, analysis_workers: int = 0,
+              analysis_max_in_flight: int = 64, analysis_threshold: float = 0.3, analysis_lag: int = 5,
+              monitor_rules: list = None, scales: list = None, scale_fusion: str = "max",
+              overload_depth: list = None, overload_lag: list = None, overload_hold: float = 2.0,
+              overload_sample: int = 8, capture_stream: str = None, capture_max_age: float = DEFAULT_MAX_AGE,
+              capture_max_bytes: int = DEFAULT_MAX_BYTES, handoff_dir: str = None,
+              handoff_timeout: float = DEFAULT_HANDOFF_TIMEOUT, drain_timeout: float = 30.0):
     """
     Run the processor with covert channel detection and mitigation.
 
@@ -25,82 +43,223 @@ async def run(mean_value, min_delay, max_delay, window_size: int = 50, detection
         mean_value: Mean value for adding random delay to packages
         window_size: Number of packets to analyze in detection window
         detection_threshold: Threshold for detection confidence (0-1)
-        history_length: Number of windows to keep for baseline comparison
+        max_flows: Maximum number of flows to keep detector state for
+        flow_idle_timeout: Seconds without a packet after which a flow's state is dropped
+        max_pending_frames: Maximum number of delayed frames waiting for release
+        metrics_port: Port of the Prometheus /metrics endpoint, 0 to disable
+        debug_sample: Print the details of one in debug_sample packets, 0 to disable
+        shard_index: Shard handled by this processor, in [0, shard_count)
+        shard_count: Number of shards the switch spreads flows over, 1 to handle all frames
+        baseline_scope: Learn ipd baselines per "flow" or per source "subnet"
+        baseline_decay: Weight of a new ipd in a warmed up baseline, 0 to freeze baselines
+        baseline_snapshot: File baselines are loaded from at startup and saved to, None to disable
+        baseline_snapshot_interval: Seconds between baseline snapshots
+        batch_size: Frames per outgoing batch message, 0 or 1 to publish every frame on its own
+        batch_flush_us: Longest time an outgoing frame waits for its batch to fill (microseconds)
+        mitigation_mode: "delay" for random delays on the next packets, or "grid", "jitter" or "predictive" pacing
+        pace_quantum: Granularity of the release grid of paced flows (seconds)
+        pace_hold: Seconds a flow stays paced after its last detection
+        full_score_interval: Fully score flows failing the detection prefilter only every this many packets, 0 for always;
+                             not supported with scales
+        journal_dir: Directory of the packet and decision journal, None to disable
+        journal_segment_records: Records per journal segment file
+        journal_max_segments: Journal segment files kept, oldest are deleted first
+        detectors: Detector specs of the scoring pipeline like "entropy:0.3", None for the default pipeline
+        analysis_workers: Processes running slow statistical tests on suspect windows, 0 to disable
+        analysis_max_in_flight: Suspect windows analyzed at the same time, more are dropped
+        analysis_threshold: Detector score from which a window is sent for analysis
+        analysis_lag: Autocorrelation lag checked by the analysis, the senders' bit_repeat_len
+        monitor_rules: Filter rules like "udp:8000-8100@10.1.0.0/16" of the frames to inspect, None for all
+        scales: Window lengths scored at once, e.g. [16, 64, 256, 1024], None for window_size alone
+        scale_fusion: How per-scale scores are fused, "max" or "mean"
+        overload_depth: Pending messages entering the sample, skip_delay and pass_through overload levels
+        overload_lag: Event loop lag (seconds) entering the same levels, overload control is off without either
+        overload_hold: Seconds the backlog stays under a level's watermarks before stepping down
+        overload_sample: Score a flow's window every this many packets while sampling
+        capture_stream: JetStream stream recording the switch's frames for bench.capture_replay, None to disable
+        capture_max_age: Seconds a captured frame is kept
+        capture_max_bytes: Size limit of the capture stream
+        handoff_dir: Directory the flow state is handed over through on a hot restart, None to disable
+        handoff_timeout: Seconds to wait for a running processor of the shard to hand over its flow state
+        drain_timeout: On exit, delayed frames due within this many seconds are released at their deadlines,
+                       later ones at once
     """
     nc = NATS()
 
-    # Initialize detector and mitigator
-    detector = CovertChannelDetector(
+    nats_url = os.getenv("NATS_SURVEYOR_SERVERS", "nats://nats:4222")
+    await nc.connect(nats_url)
+    if capture_stream and shard_index == 0:
+        # JetStream records the frames as the switch publishes them, the processor only sets the stream up
+        await ensure_capture_stream(nc.jetstream(), capture_stream, capture_max_age, capture_max_bytes)
+
+    journal = None
+    if journal_dir:
+        # Every shard writes its own segments
+        journal = PacketJournal(journal_dir, prefix=f"journal-{shard_index}" if shard_count > 1 else "journal",
+                                segment_records=journal_segment_records, max_segments=journal_max_segments,
+                                score_names=score_names(detectors, scales))
+
+    processor = PacketProcessor(
+        nc, mean_value, min_delay, max_delay,
         window_size=window_size,
-        threshold=detection_threshold,
-        history_length=history_length
+        detection_threshold=detection_threshold,
+        max_flows=max_flows,
+        flow_idle_timeout=flow_idle_timeout,
+        max_pending_frames=max_pending_frames,
+        debug_sample=debug_sample,
+        out_subjects=input_subjects(shard_index, shard_count),
+        baseline_scope=baseline_scope,
+        baseline_decay=baseline_decay,
+        batch_size=batch_size,
+        batch_flush_us=batch_flush_us,
+        mitigation_mode=mitigation_mode,
+        pace_quantum=pace_quantum,
+        pace_hold=pace_hold,
+        full_score_interval=full_score_interval,
+        journal=journal,
+        detectors=detectors,
+        analysis_workers=analysis_workers,
+        analysis_max_in_flight=analysis_max_in_flight,
+        analysis_threshold=analysis_threshold,
+        analysis_lag=analysis_lag,
+        monitor_rules=monitor_rules,
+        scales=scales,
+        scale_fusion=scale_fusion,
+        overload_depth=overload_depth,
+        overload_lag=overload_lag,
+        overload_hold=overload_hold,
+        overload_sample=overload_sample
     )
-    mitigator = CovertChannelMitigator(min_delay=min_delay, max_delay=max_delay)
+    if baseline_snapshot:
+        # Every shard learns the baselines of its own flows
+        if shard_count > 1:
+            baseline_snapshot = f"{baseline_snapshot}.{shard_index}"
+        processor.baselines.load(baseline_snapshot)
+    await processor.start()
+    if metrics_port:
+        # A process taking over the shard listens on the same port until this one exits
+        metrics_server = await processor.metrics.serve(metrics_port, reuse_port=bool(handoff_dir))
 
-    nats_url = os.getenv("NATS_SURVEYOR_SERVERS", "nats://nats:4222")
-    await nc.connect(nats_url)
+    # Subscribe to inpktsec and inpktinsec topics, or to this shard's part of them
+    subjects = list(processor.out_subjects)
+    handlers = {}
+    for subject in subjects:
+        handlers[subject] = processor.message_handler
+        # The switch sends batches instead when PROCESSOR_BATCH_SIZE is set
+        handlers[BATCH_PREFIX + subject] = processor.batch_handler
+    handoff = None
+    if handoff_dir:
+        # Take over the flow state of a processor already running this shard, if any, then stand by to hand it on
+        subscriptions = await take_over(nc, processor, handlers, shard_index, handoff_timeout)
+        handoff = HandoffServer(nc, processor, subscriptions, shard_index, handoff_dir)
+        await handoff.start()
+    else:
+        subscriptions = [await nc.subscribe(subject, cb=handler) for subject, handler in handlers.items()]
+    for subscription in subscriptions:
+        # Overload control watches the messages pending in every subscription
+        processor.watch(subscription)
 
-    processed_packets_count = 0
-    detected_covert_channel_count = 0
-    continue_to_mitigate = False
-    current_mitigation_count = 0
-
-    async def message_handler(msg):
-        nonlocal continue_to_mitigate, current_mitigation_count, detected_covert_channel_count, processed_packets_count
-        now = time.time()
-        # Add packet to detector
-        detector.add_packet(now)
-        # Check for covert channel
-        is_covert, confidence, detailed_scores = detector.detect()
-
-        if is_covert:
-            print(f"Covert channel detected! Confidence: {confidence:.2f}")
-            detected_covert_channel_count += 1
-
-            # Log detailed scores for analysis
-            if logger.isEnabledFor(logging.DEBUG):
-                score_str = ", ".join([f"{k}: {v:.3f}" for k, v in detailed_scores.items()
-                                       if k != 'total_score'])
-                logger.debug(f"Detection scores: {score_str}")
-            # Apply mitigation
-            continue_to_mitigate = True
-            current_mitigation_count = 0
+    print(f"Subscribed to {' and '.join(subjects)} topics")
+    print(f"IPD Covert Channel Detector active with window_size={' '.join(map(str, scales)) if scales else window_size}, "
+          f"threshold={detection_threshold}, "
+          f"max_flows={max_flows}, max_pending_frames={max_pending_frames}, "
+          f"detectors={processor.pipeline.describe()}, monitor={' '.join(monitor_rules) if monitor_rules else 'all'}, "
+          f"overload control {'on' if processor.overload is not None else 'off'}")
 
+    loop = asyncio.get_running_loop()
+    # docker stop sends SIGTERM, exit through the same path as on Ctrl-C
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    next_snapshot = loop.time() + baseline_snapshot_interval
+    try:
+        while not stopping.is_set() and (handoff is None or not handoff.done.is_set()):
+            await asyncio.sleep(1)
+            # Exit rather than run on with frames no longer released
+            processor.check_tasks()
+            logger.debug(f"Processor stats: {processor.get_stats()}")
+            if baseline_snapshot and loop.time() >= next_snapshot:
+                next_snapshot = loop.time() + baseline_snapshot_interval
+                # Serialize on the loop, where baselines are updated, and write the file off it
+                data = processor.baselines.dumps()
+                await loop.run_in_executor(None, processor.baselines.save, baseline_snapshot, data)
+    finally:
+        handed_over = handoff is not None and handoff.done.is_set()
+        if handed_over:
+            # The new process has the subscriptions and flow state, and serves the metrics of the shard
+            if metrics_port:
+                metrics_server.close()
         else:
-            # Process packet normally with random delay
-            delay = random.expovariate(1 / mean_value)
-            await asyncio.sleep(delay)
-        if continue_to_mitigate:
-            current_mitigation_count += 1
-            if current_mitigation_count >= 10:
-                continue_to_mitigate = False
-                current_mitigation_count = 0
-            else:
-                delay = mitigator.mitigate()
-                logger.debug(f"Mitigator applied random delay: {delay}")
-                await asyncio.sleep(delay)
-        processed_packets_count += 1
-        print(f"Processed packets count: {processed_packets_count}")
-        print(f"Detected covert channel count: {detected_covert_channel_count}")
-        subject = msg.subject
-        if subject == "inpktsec":
-            await nc.publish("outpktinsec", msg.data)
-        else:
-            await nc.publish("outpktsec", msg.data)
+            print("Disconnecting...")
+            try:
+                # Stop taking frames, those already received are still inspected
+                for subscription in subscriptions:
+                    await subscription.drain()
+            except Exception as e:
+                logger.warning(f"Could not drain the subscriptions: {e!r}")
+        try:
+            # Forward the delayed and batched frames before the connection is closed
+            await processor.drain(drain_timeout)
+            await nc.flush()
+        except Exception as e:
+            logger.warning(f"Could not forward every frame before exiting: {e!r}")
+        await nc.close()
+        if baseline_snapshot:
+            processor.baselines.save(baseline_snapshot)
+        if journal is not None:
+            journal.close()
+        processor.close()
 
-    # Subscribe to inpktsec and inpktinsec topics
-    await nc.subscribe("inpktsec", cb=message_handler)
-    await nc.subscribe("inpktinsec", cb=message_handler)
 
-    print("Subscribed to inpktsec and inpktinsec topics")
-    print(f"IPD Covert Channel Detector active with window_size={window_size}, threshold={detection_threshold}")
+def run_shard(*args, **kwargs):
+    """Process entry point of one shard worker."""
+    try:
+        asyncio.run(run(*args, **kwargs))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_shards(shard_count: int, *args, metrics_port: int = 9108, **kwargs):
+    """
+    Run one processor process per shard so detection uses shard_count cores.
+    Flows never move between shards, so each worker owns its flows' detector state and
+    forwards their frames in order without any state shared between processes.
+    Shard i serves its metrics on metrics_port + 1 + i, and this process serves those of
+    every shard on metrics_port with a shard label, so Prometheus scrapes a single target.
+    """
+    workers = []
+    for shard_index in range(shard_count):
+        worker = multiprocessing.Process(
+            target=run_shard, args=args, name=f"processor-shard-{shard_index}",
+            kwargs=dict(kwargs, metrics_port=metrics_port + 1 + shard_index if metrics_port else 0,
+                        shard_index=shard_index, shard_count=shard_count))
+        worker.start()
+        workers.append(worker)
 
+    def stop(signum, frame):
+        # docker stop signals this process only, the shards forward their frames before exiting on SIGTERM
+        for worker in workers:
+            worker.terminate()
+    signal.signal(signal.SIGTERM, stop)
     try:
-        while True:
-            await asyncio.sleep(1)
+        if metrics_port:
+            asyncio.run(serve_shard_metrics(workers, metrics_port, reuse_port=bool(kwargs.get('handoff_dir'))))
+        for worker in workers:
+            worker.join()
     except KeyboardInterrupt:
-        print("Disconnecting...")
-        await nc.close()
+        for worker in workers:
+            worker.join()
+
+
+async def serve_shard_metrics(workers, metrics_port: int, reuse_port: bool = False):
+    """Serve the metrics of every shard on metrics_port until the workers exit."""
+    aggregator = MetricsAggregator({str(shard_index): metrics_port + 1 + shard_index
+                                    for shard_index in range(len(workers))})
+    server = await aggregator.serve(metrics_port, reuse_port=reuse_port)
+    try:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, worker.join) for worker in workers))
+    finally:
+        server.close()
 
 
 if __name__ == '__main__':
@@ -112,7 +271,122 @@ if __name__ == '__main__':
                         help="Window size for detector (number of packets to analyze)")
     parser.add_argument("--detection_threshold", type=float, default=0.65,
                         help="Detection threshold (0-1)")
-    parser.add_argument("--history_length", type=int, default=5,
-                        help="Number of windows to keep for baseline comparison")
+    parser.add_argument("--max_flows", type=int, default=100000,
+                        help="Maximum number of flows to keep detector state for")
+    parser.add_argument("--flow_idle_timeout", type=float, default=60.0,
+                        help="Seconds without a packet after which a flow is dropped")
+    parser.add_argument("--max_pending_frames", type=int, default=10000,
+                        help="Maximum number of delayed frames waiting for release")
+    parser.add_argument("--metrics_port", type=int, default=9108,
+                        help="Port of the Prometheus /metrics endpoint, 0 to disable; with several shards it serves "
+                             "every shard's metrics and shard i also serves its own on metrics_port + 1 + i")
+    parser.add_argument("--debug_sample", type=int, default=0,
+                        help="Print the details of one in this many packets, 0 to disable")
+    parser.add_argument("--shard_count", type=int, default=int(os.getenv("PROCESSOR_SHARDS", "1")),
+                        help="Number of shards the switch spreads flows over (PROCESSOR_SHARDS)")
+    parser.add_argument("--shard_index", type=int, default=None,
+                        help="Only handle this shard, by default one worker process is started per shard")
+    parser.add_argument("--baseline_scope", choices=["flow", "subnet"], default="flow",
+                        help="Learn ipd baselines per flow or per source /24 subnet")
+    parser.add_argument("--baseline_decay", type=float, default=0.0,
+                        help="Weight of a new ipd in a warmed up baseline, e.g. 0.01; 0 freezes baselines")
+    parser.add_argument("--baseline_snapshot", type=str, default=os.getenv("BASELINE_SNAPSHOT"),
+                        help="File to load baselines from at startup and save them to (BASELINE_SNAPSHOT)")
+    parser.add_argument("--baseline_snapshot_interval", type=float, default=60.0,
+                        help="Seconds between baseline snapshots")
+    parser.add_argument("--batch_size", type=int, default=int(os.getenv("PROCESSOR_BATCH_SIZE", "0")),
+                        help="Frames per outgoing batch message, 0 to publish every frame on its own (PROCESSOR_BATCH_SIZE)")
+    parser.add_argument("--batch_flush_us", type=int, default=int(os.getenv("PROCESSOR_BATCH_FLUSH_US", "1000")),
+                        help="Longest time a frame waits for its batch to fill in microseconds (PROCESSOR_BATCH_FLUSH_US)")
+    parser.add_argument("--mitigation_mode", choices=["delay", "grid", "jitter", "predictive"], default="delay",
+                        help="Random delays on the packets after a detection, or pace the suspect flow on a release grid")
+    parser.add_argument("--pace_quantum", type=float, default=0.05,
+                        help="Granularity of the release grid of paced flows (seconds)")
+    parser.add_argument("--pace_hold", type=float, default=30.0,
+                        help="Seconds a flow stays paced after its last detection")
+    parser.add_argument("--full_score_interval", type=int, default=0,
+                        help="Tiered detection: flows failing the cheap prefilter get the full score only every "
+                             "this many packets, 0 to score every packet; not supported with --scales")
+    parser.add_argument("--journal_dir", type=str, default=os.getenv("JOURNAL_DIR"),
+                        help="Record every frame and its decision in a journal in this directory (JOURNAL_DIR)")
+    parser.add_argument("--journal_segment_records", type=int, default=1 << 20,
+                        help="Records per journal segment file")
+    parser.add_argument("--journal_max_segments", type=int, default=64,
+                        help="Journal segment files kept, 0 to keep all")
+    parser.add_argument("--detectors", type=str, nargs="+", default=os.getenv("DETECTORS", "").split() or None,
+                        help="Detectors of the scoring pipeline as name[:weight], e.g. bimodal:0.5 regularity:0.3 "
+                             f"entropy ks:0.2, from {', '.join(sorted(DETECTORS))} (DETECTORS)")
+    parser.add_argument("--analysis_workers", type=int, default=int(os.getenv("ANALYSIS_WORKERS", "0")),
+                        help="Processes running KS, sample entropy and autocorrelation tests on suspect windows, "
+                             "0 to disable (ANALYSIS_WORKERS)")
+    parser.add_argument("--analysis_max_in_flight", type=int, default=64,
+                        help="Suspect windows analyzed at the same time, more are dropped")
+    parser.add_argument("--analysis_threshold", type=float, default=0.3,
+                        help="Detector score from which a window is sent for analysis")
+    parser.add_argument("--analysis_lag", type=int, default=5,
+                        help="Autocorrelation lag checked by the analysis, the senders' bit_repeat_len")
+    parser.add_argument("--monitor", type=str, nargs="+", default=os.getenv("MONITOR_RULES", "").split() or None,
+                        help="Only inspect frames matching one of these rules, e.g. udp:8000-8100@10.1.0.0/16 icmp; "
+                             "others are forwarded at once (MONITOR_RULES)")
+    parser.add_argument("--scales", type=int, nargs="+", default=None,
+                        help="Score every flow over these window lengths at once, e.g. 16 64 256 1024, "
+                             "instead of --window_size alone")
+    parser.add_argument("--scale_fusion", choices=["max", "mean"], default="max",
+                        help="Fuse per-scale scores with the most confident scale or their mean")
+    parser.add_argument("--overload_control", action="store_true",
+                        help="Degrade detection under overload instead of letting NATS drop frames of a slow consumer; "
+                             "passed through frames can overtake delayed frames of their flow")
+    parser.add_argument("--overload_depth", type=int, nargs=3, default=[1000, 10000, 50000],
+                        help="With --overload_control, pending messages from which detection is sampled, benign "
+                             "delays are skipped and frames are passed through")
+    parser.add_argument("--overload_lag", type=float, nargs=3, default=[0.1, 0.5, 2.0],
+                        help="With --overload_control, event loop lag (seconds) from which the same overload levels "
+                             "are entered")
+    parser.add_argument("--overload_hold", type=float, default=2.0,
+                        help="Seconds the backlog stays under a level's watermarks before stepping down")
+    parser.add_argument("--overload_sample", type=int, default=8,
+                        help="Score a flow's window every this many packets while sampling")
+    parser.add_argument("--capture_stream", type=str, default=os.getenv("CAPTURE_STREAM"),
+                        help="Record inpktsec and inpktinsec with capture timestamps in this JetStream stream, "
+                             "for replay with bench.capture_replay (CAPTURE_STREAM)")
+    parser.add_argument("--capture_max_age", type=float, default=DEFAULT_MAX_AGE,
+                        help="Seconds a captured frame is kept in the capture stream")
+    parser.add_argument("--capture_max_bytes", type=int, default=DEFAULT_MAX_BYTES,
+                        help="Size limit of the capture stream, oldest frames are discarded first")
+    parser.add_argument("--handoff_dir", type=str, default=os.getenv("HANDOFF_DIR") or None,
+                        help="Enable hot restarts: directory, shared with the next process, the flow state is handed "
+                             "over through when a processor is started while one runs the shard, e.g. /dev/shm "
+                             "(HANDOFF_DIR); both processes need it, disabled when not given")
+    parser.add_argument("--handoff_timeout", type=float, default=DEFAULT_HANDOFF_TIMEOUT,
+                        help="Seconds to wait for the running processor to hand over its flow state")
+    parser.add_argument("--drain_timeout", type=float, default=30.0,
+                        help="On exit, release delayed frames due within this many seconds at their deadlines, "
+                             "later ones at once")
     args = parser.parse_args()
-    asyncio.run(run(args.mean_value, args.min_delay, args.max_delay, args.window_size, args.detection_threshold, args.history_length))
+    if args.scales and args.full_score_interval:
+        # The multi-scale detector has no prefilter, every packet would be scored anyway
+        parser.error("--full_score_interval is not supported with --scales")
+    config = (args.mean_value, args.min_delay, args.max_delay, args.window_size, args.detection_threshold,
+              args.max_flows, args.flow_idle_timeout, args.max_pending_frames)
+    options = dict(baseline_scope=args.baseline_scope, baseline_decay=args.baseline_decay,
+                   baseline_snapshot=args.baseline_snapshot, baseline_snapshot_interval=args.baseline_snapshot_interval,
+                   batch_size=args.batch_size, batch_flush_us=args.batch_flush_us,
+                   mitigation_mode=args.mitigation_mode, pace_quantum=args.pace_quantum, pace_hold=args.pace_hold,
+                   full_score_interval=args.full_score_interval, journal_dir=args.journal_dir,
+                   journal_segment_records=args.journal_segment_records,
+                   journal_max_segments=args.journal_max_segments, detectors=args.detectors,
+                   analysis_workers=args.analysis_workers, analysis_max_in_flight=args.analysis_max_in_flight,
+                   analysis_threshold=args.analysis_threshold, analysis_lag=args.analysis_lag,
+                   monitor_rules=args.monitor, scales=args.scales, scale_fusion=args.scale_fusion,
+                   overload_depth=args.overload_depth if args.overload_control else None,
+                   overload_lag=args.overload_lag if args.overload_control else None,
+                   overload_hold=args.overload_hold, overload_sample=args.overload_sample,
+                   capture_stream=args.capture_stream, capture_max_age=args.capture_max_age,
+                   capture_max_bytes=args.capture_max_bytes,
+                   handoff_dir=args.handoff_dir, handoff_timeout=args.handoff_timeout,
+                   drain_timeout=args.drain_timeout)
+    if args.shard_count > 1 and args.shard_index is None:
+        run_shards(args.shard_count, *config, metrics_port=args.metrics_port, debug_sample=args.debug_sample, **options)
+    else:
+        asyncio.run(run(*config, args.metrics_port, args.debug_sample,
+                        args.shard_index or 0, args.shard_count, **options))
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from functools import partial
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from 1 us to 2 s; covers detect() time as well as mitigation delays
+DEFAULT_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.0)
+
+
+class Counter:
+    """Monotonic counter, one value per label value."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label: str = None):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.values: Dict[str, float] = {}
+
+    def inc(self, label_value: str = "", amount: float = 1.0) -> None:
+        self.values[label_value] = self.values.get(label_value, 0.0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for label_value, value in self.values.items():
+            yield self.name, _labels(self.label, label_value), value
+
+
+class Gauge:
+    """
+    Value read from a callback when scraped, so updating it costs nothing on the hot path.
+    Callbacks reading an ever increasing count are exported with the counter type.
+    """
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.kind = kind
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        yield self.name, "", float(self.read())
+
+
+class Histogram:
+    """Fixed-bucket histogram, one set of buckets per label value."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label: str = None, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = buckets
+        self.counts: Dict[str, List[int]] = {}
+        self.sums: Dict[str, float] = {}
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        counts = self.counts.get(label_value)
+        if counts is None:
+            counts = self.counts[label_value] = [0] * (len(self.buckets) + 1)
+            self.sums[label_value] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[label_value] += value
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for label_value, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                yield self.name + "_bucket", _labels(self.label, label_value, le), cumulative
+            yield self.name + "_sum", _labels(self.label, label_value), self.sums[label_value]
+            yield self.name + "_count", _labels(self.label, label_value), cumulative
+
+
+def _escape(value: str) -> str:
+    """Label value escaped as the text exposition format requires."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _escape_help(documentation: str) -> str:
+    """HELP text escaped as the text exposition format requires; quotes are left as they are."""
+    return documentation.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _labels(label: str, value: str, le: str = None) -> str:
+    pairs = []
+    if label:
+        pairs.append(f'{label}="{_escape(value)}"')
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "processor"):
+        """
+        Initialize a registry of metrics rendered in the Prometheus text exposition format.
+        Metrics are plain Python counters updated from the event loop thread only, so
+        recording a sample is a dict lookup and an addition without any locking.
+        """
+        self.prefix = prefix
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, label: str = None) -> Counter:
+        return self._register(Counter(f"{self.prefix}_{name}", documentation, label))
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(f"{self.prefix}_{name}", documentation, read))
+
+    def counter_callback(self, name: str, documentation: str, read: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(f"{self.prefix}_{name}", documentation, read, kind="counter"))
+
+    def histogram(self, name: str, documentation: str, label: str = None,
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}", documentation, label, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value!r}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port: int, host: str = "0.0.0.0", reuse_port: bool = False) -> asyncio.AbstractServer:
+        """
+        Serve the registry on http://host:port/metrics from the running event loop.
+        With reuse_port a process taking over (see processor.handoff) can listen before the old one exits.
+        """
+        return await _serve(self._render, port, host, reuse_port)
+
+    async def _render(self) -> str:
+        return self.render()
+
+
+class MetricsAggregator:
+    def __init__(self, ports: Dict[str, int], label: str = "shard", host: str = "127.0.0.1", timeout: float = 2.0):
+        """
+        Initialize an endpoint serving the metrics of several processes as one, e.g. of every shard,
+        so that Prometheus scrapes a single target whatever the number of processes.
+        On every scrape each process's /metrics is fetched and its samples get label="<its key>";
+        processor_scrape_up tells which processes answered.
+        Args:
+            ports: Port of the /metrics endpoint of every process, by label value
+            label: Label telling the processes apart
+            host: Host the processes serve their metrics on
+            timeout: Seconds to wait for a process's metrics
+        """
+        self.ports = ports
+        self.label = label
+        self.host = host
+        self.timeout = timeout
+
+    async def render(self) -> str:
+        results = await asyncio.gather(*(fetch(port, self.host, self.timeout) for port in self.ports.values()),
+                                       return_exceptions=True)
+        texts = {}
+        up = [f"# HELP processor_scrape_up Whether the metrics of the {self.label} could be read",
+              "# TYPE processor_scrape_up gauge"]
+        for (value, port), result in zip(self.ports.items(), results):
+            if isinstance(result, BaseException):
+                logger.debug(f"Could not read the metrics of {self.label} {value} on port {port}: {result!r}")
+            else:
+                texts[value] = result
+            up.append(f'processor_scrape_up{{{self.label}="{_escape(value)}"}} '
+                      f'{0.0 if isinstance(result, BaseException) else 1.0}')
+        return merge(texts, self.label) + "\n".join(up) + "\n"
+
+    async def serve(self, port: int, host: str = "0.0.0.0", reuse_port: bool = False) -> asyncio.AbstractServer:
+        """Serve the merged metrics on http://host:port/metrics from the running event loop."""
+        return await _serve(self.render, port, host, reuse_port)
+
+
+async def fetch(port: int, host: str = "127.0.0.1", timeout: float = 2.0) -> str:
+    """Body of http://host:port/metrics, as served by MetricsRegistry.serve()."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f"GET /metrics HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = head.split(b"\r\n", 1)[0]
+    if not status.startswith(b"HTTP/1.1 200"):
+        raise ConnectionError(f"Unexpected response {status!r}")
+    return body.decode()
+
+
+def merge(texts: Dict[str, str], label: str) -> str:
+    """
+    Merge expositions rendered by MetricsRegistry into one, every sample of texts[value] labeled with
+    label="value". Samples of a metric stay together under a single HELP and TYPE as the format requires.
+    """
+    families: Dict[str, List[str]] = {}
+    for value, text in texts.items():
+        lines = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split(" ", 3)[2]
+                lines = families.get(name)
+                if lines is None:
+                    lines = families[name] = [line]
+            elif line.startswith("# TYPE "):
+                if len(lines) == 1:
+                    lines.append(line)
+            elif line and lines is not None:
+                series, _, sample = line.rpartition(" ")
+                if series.endswith("}"):
+                    brace = series.index("{")
+                    series = f'{series[:brace + 1]}{label}="{_escape(value)}",{series[brace + 1:]}'
+                else:
+                    series = f'{series}{{{label}="{_escape(value)}"}}'
+                lines.append(f"{series} {sample}")
+    return "".join(line + "\n" for lines in families.values() for line in lines)
+
+
+async def _serve(render: Callable[[], Awaitable[str]], port: int, host: str, reuse_port: bool) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(partial(_handle_http, render), host, port, reuse_port=reuse_port or None)
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+async def _handle_http(render: Callable[[], Awaitable[str]], reader: asyncio.StreamReader,
+                       writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await reader.readuntil(b"\r\n\r\n")
+        path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+        if path.split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", (await render()).encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
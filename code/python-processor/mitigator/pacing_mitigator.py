@@ -0,0 +1,72 @@
+import math
+import random
+
+# Release grids a suspect flow can be re-timed onto
+PACING_MODES = ("grid", "jitter", "predictive")
+# Predictive pacing halves its interval once a flow has this many slots of frames queued
+PREDICTIVE_BACKLOG = 4
+
+
+class FlowPacer:
+    """Release grid of one paced flow, frames are released one per slot in arrival order."""
+    __slots__ = ("interval", "next_slot", "misses", "paced_until")
+
+    def __init__(self, interval: float, start: float):
+        self.interval = interval
+        self.next_slot = start
+        self.misses = 0  # Frames that arrived after their slot
+        self.paced_until = start  # Pacing stops when no detection happened until then
+
+
+class PacingMitigator:
+    def __init__(self,
+                 mode: str = "grid",
+                 quantum: float = 0.05,
+                 hold: float = 30.0,
+                 max_interval: float = 2.0):
+        """
+        Initialize the pacing mitigator.
+        Instead of adding random delays to a few packets, a suspect flow is re-timed onto a
+        per-flow release grid whose interval is a multiple of quantum, so its inter-packet
+        delays no longer carry the sender's timing:
+            grid: constant rate at the flow's mean rate when it was detected
+            jitter: same grid, each frame released at a random point of its slot
+            predictive: the interval doubles whenever a frame misses its slot and halves when
+                        PREDICTIVE_BACKLOG slots of frames are queued, so the only timing left
+                        to an observer is when those few interval changes happened
+        Args:
+            mode: One of PACING_MODES
+            quantum: Granularity of release times and grid intervals (seconds)
+            hold: Seconds a flow stays paced after its last detection
+            max_interval: Largest grid interval (seconds)
+        """
+        if mode not in PACING_MODES:
+            raise ValueError(f"Unknown pacing mode {mode!r}, expected one of {PACING_MODES}")
+        self.mode = mode
+        self.quantum = quantum
+        self.hold = hold
+        self.max_interval = max_interval
+
+    def start(self, mean_ipd: float, now: float) -> FlowPacer:
+        """Start pacing a flow whose recent mean ipd is mean_ipd, the first slot is the next grid point."""
+        interval = min(max(math.ceil(mean_ipd / self.quantum), 1) * self.quantum, self.max_interval)
+        return FlowPacer(interval, math.ceil(now / self.quantum) * self.quantum)
+
+    def release_time(self, pacer: FlowPacer, arrival: float) -> float:
+        """Release time of the flow's next frame, which arrived at arrival."""
+        interval = pacer.interval
+        slot = pacer.next_slot
+        if arrival > slot:
+            # The frame missed its slot, it goes to the first slot after its arrival
+            pacer.misses += 1
+            slot += math.ceil((arrival - slot) / interval) * interval
+            if self.mode == "predictive" and interval < self.max_interval:
+                pacer.interval = interval = min(interval * 2, self.max_interval)
+        elif self.mode == "predictive" and slot - arrival > PREDICTIVE_BACKLOG * interval and interval > self.quantum:
+            # Too slow for the flow, latency would keep growing
+            pacer.interval = interval = max(math.ceil(interval / 2 / self.quantum) * self.quantum, self.quantum)
+        pacer.next_slot = slot + interval
+        if self.mode == "jitter":
+            # Stays inside the slot so frames of the flow keep their order
+            return slot + random.random() * interval
+        return slot
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from multiprocessing import get_context, shared_memory
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from detector.deep_analysis import analyze
+
+logger = logging.getLogger(__name__)
+
+# Window of a worker process onto the parent's slots, set by _attach()
+_slots: Optional[np.ndarray] = None
+_shared: Optional[shared_memory.SharedMemory] = None
+
+
+def _attach(name: str, slot_count: int, slot_len: int) -> None:
+    """Worker initializer, maps the shared slots once per process."""
+    global _slots, _shared
+    _shared = shared_memory.SharedMemory(name=name)
+    _slots = np.ndarray((slot_count, slot_len), dtype=np.float64, buffer=_shared.buf)
+
+
+def _analyze_slot(slot: int, count: int, baseline_mean: float, lag: int) -> Dict:
+    # Copy out so the parent can reuse the slot as soon as the result is back
+    return analyze(np.array(_slots[slot, :count]), baseline_mean, lag)
+
+
+class AnalysisOffload:
+    def __init__(self,
+                 on_verdict: Callable[[bytes, Dict], None],
+                 workers: int = 1,
+                 max_in_flight: int = 64,
+                 window_size: int = 50,
+                 lag: int = 5):
+        """
+        Initialize the asynchronous analysis tier.
+        Windows are copied into slots of a shared memory block and analyzed by detector.deep_analysis
+        in a process pool, so the event loop only pays for the copy and the submission. A window
+        submitted while every slot is in flight is dropped, never queued, and a flow has at most
+        one window in flight.
+        Args:
+            on_verdict: Called on the event loop with the flow key and the analysis result
+            workers: Worker processes
+            max_in_flight: Windows being analyzed at the same time, beyond this submissions are dropped
+            window_size: Largest window in ipds
+            lag: Autocorrelation is checked up to this lag, the bit repetition of the suspected senders
+        """
+        self.on_verdict = on_verdict
+        self.max_in_flight = max_in_flight
+        self.window_size = window_size
+        self.lag = lag
+        self.shared = shared_memory.SharedMemory(create=True, size=max_in_flight * window_size * 8)
+        self.slots = np.ndarray((max_in_flight, window_size), dtype=np.float64, buffer=self.shared.buf)
+        self.free_slots = list(range(max_in_flight))
+        self.pending: Dict[bytes, int] = {}  # Flow key -> slot of its window in flight
+        # Spawned workers do not inherit the event loop, the NATS connection or their threads
+        self.pool = ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=_attach,
+                                        initargs=(self.shared.name, max_in_flight, window_size))
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.submitted_count = 0
+        self.completed_count = 0
+        self.covert_count = 0
+        self.dropped_full_count = 0  # Every slot was in flight
+        self.dropped_pending_count = 0  # The flow already had a window in flight
+        self.failed_count = 0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def submit(self, key: bytes, window, baseline_mean: float) -> bool:
+        """
+        Queue the analysis of a flow's window (a SlidingWindowStats), returns False if it was dropped.
+        Must be called from the event loop.
+        """
+        if key in self.pending:
+            self.dropped_pending_count += 1
+            return False
+        if not self.free_slots:
+            self.dropped_full_count += 1
+            return False
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        slot = self.free_slots[-1]
+        ipds = window.window()[-self.window_size:]
+        self.slots[slot, :len(ipds)] = ipds
+        try:
+            future = self.loop.run_in_executor(self.pool, _analyze_slot, slot, len(ipds), baseline_mean, self.lag)
+        except BrokenProcessPool as e:
+            # A dead pool must never take down frame forwarding, windows are only counted as failed
+            self.failed_count += 1
+            if self.failed_count == 1:
+                logger.error(f"Window analysis disabled: {e}")
+            return False
+        self.free_slots.pop()
+        self.pending[key] = slot
+        future.add_done_callback(partial(self._done, key, slot))
+        self.submitted_count += 1
+        return True
+
+    def _done(self, key: bytes, slot: int, future: asyncio.Future) -> None:
+        del self.pending[key]
+        self.free_slots.append(slot)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.failed_count += 1
+            logger.warning(f"Window analysis failed: {error!r}")
+            return
+        result = future.result()
+        self.completed_count += 1
+        if result['covert']:
+            self.covert_count += 1
+        self.on_verdict(key, result)
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.slots = None
+        self.shared.close()
+        self.shared.unlink()
+
+    def get_stats(self) -> dict:
+        """Get analysis offload statistics."""
+        return {
+            'in_flight': len(self.pending),
+            'max_in_flight': self.max_in_flight,
+            'submitted': self.submitted_count,
+            'completed': self.completed_count,
+            'covert_verdicts': self.covert_count,
+            'dropped_full': self.dropped_full_count,
+            'dropped_pending': self.dropped_pending_count,
+            'failed': self.failed_count
+        }
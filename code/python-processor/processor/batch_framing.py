@@ -0,0 +1,100 @@
+import asyncio
+import struct
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Tuple
+
+# Batched frames travel on BATCH_PREFIX + subject, e.g. batch.inpktsec or batch.inpktsec.3 when sharded
+BATCH_PREFIX = "batch."
+
+# Every frame of a batch is preceded by its receive timestamp in nanoseconds and its length,
+# in network byte order like the MITM switch writes them
+RECORD_HEADER = struct.Struct("!QI")
+
+
+def iter_batch(payload) -> Iterator[Tuple[int, memoryview]]:
+    """
+    Yield the (timestamp ns, frame) records of a batch.
+    Frames are memoryview slices of payload, so nothing is copied; a truncated last record is dropped.
+    """
+    view = memoryview(payload)
+    end = len(view)
+    offset = 0
+    header_size = RECORD_HEADER.size
+    unpack = RECORD_HEADER.unpack_from
+    while offset + header_size <= end:
+        timestamp, length = unpack(view, offset)
+        offset += header_size
+        if offset + length > end:
+            return
+        yield timestamp, view[offset:offset + length]
+        offset += length
+
+
+def encode_batch(records) -> bytes:
+    """Build a batch from (timestamp ns, frame) records."""
+    pack = RECORD_HEADER.pack
+    parts = []
+    for timestamp, frame in records:
+        parts.append(pack(timestamp, len(frame)))
+        parts.append(frame)
+    return b"".join(parts)
+
+
+class BatchPublisher:
+    def __init__(self,
+                 publish: Callable[[str, bytes], Awaitable[None]],
+                 batch_size: int = 64,
+                 flush_us: int = 1000):
+        """
+        Initialize the batch publisher.
+        Frames published on a subject are collected and sent as one message on BATCH_PREFIX + subject,
+        when batch_size frames are waiting or when the oldest has waited flush_us microseconds.
+        Args:
+            publish: Coroutine function publishing data on a subject, e.g. nc.publish
+            batch_size: Frames per batch message
+            flush_us: Longest time a frame waits in a batch (microseconds)
+        """
+        self.publish_message = publish
+        self.batch_size = batch_size
+        self.flush_delay = flush_us / 1e6
+        self.pending: Dict[str, List] = {}
+        self.timers: Dict[str, asyncio.TimerHandle] = {}
+        self.batches_count = 0
+        self.frames_count = 0
+
+    async def publish(self, subject: str, data: bytes) -> None:
+        """Add a frame to the batch of subject, same signature as nc.publish."""
+        pending = self.pending.get(subject)
+        if pending is None:
+            pending = self.pending[subject] = []
+        pending.append(RECORD_HEADER.pack(time.time_ns(), len(data)))
+        pending.append(data)
+        if len(pending) >= 2 * self.batch_size:
+            await self.flush(subject)
+        elif len(pending) == 2:
+            loop = asyncio.get_running_loop()
+            self.timers[subject] = loop.call_later(self.flush_delay, self._flush_later, subject)
+
+    async def flush(self, subject: str = None) -> None:
+        """Publish the waiting frames of subject, or of every subject when None."""
+        for name in [subject] if subject is not None else list(self.pending):
+            pending = self.pending.pop(name, None)
+            timer = self.timers.pop(name, None)
+            if timer is not None:
+                timer.cancel()
+            if pending:
+                self.batches_count += 1
+                self.frames_count += len(pending) // 2
+                await self.publish_message(BATCH_PREFIX + name, b"".join(pending))
+
+    def _flush_later(self, subject: str) -> None:
+        self.timers.pop(subject, None)
+        asyncio.ensure_future(self.flush(subject))
+
+    def get_stats(self) -> dict:
+        """Get batching statistics."""
+        return {
+            'batches': self.batches_count,
+            'frames': self.frames_count,
+            'pending': sum(len(pending) // 2 for pending in self.pending.values())
+        }
@@ -0,0 +1,158 @@
+"""
+Hot restart: a new processor process takes over a shard from the running one with its flow state
+and without losing frames, e.g. to change --window_size or --detection_threshold or to upgrade.
+Hot restarts are enabled with --handoff_dir (or HANDOFF_DIR) on both processes. Start the new
+process next to the old one, on the same host and with the same shard settings:
+
+ 1. The new process subscribes to the shard's subjects in QUEUE_GROUP, which the running process
+    is also in, so NATS hands every frame to exactly one of them while both are subscribed. Frames
+    the new process gets are buffered.
+ 2. It requests the handoff on processor.handoff.<shard>. The old process drains its subscriptions:
+    the server stops sending it frames, and it inspects the ones it already received.
+ 3. The old process dumps its flow table and baselines (flow.flow_snapshot) to a file, in shared
+    memory by default, and replies with its path.
+ 4. The new process loads the snapshot, inspects the buffered frames in order, then handles frames
+    as they come and answers the next handoff request itself.
+ 5. The old process releases the frames it still delays and exits. The new process keeps frames of
+    a flow behind them with the flow's release deadline from the snapshot.
+
+Frames of a flow split between the two processes during the round trip of steps 1-2 can be
+forwarded out of order; no frame is dropped. Without a running process the request finds no
+responder and the new process starts with empty state.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List
+
+import nats.errors
+
+from flow.flow_snapshot import save
+
+logger = logging.getLogger(__name__)
+
+HANDOFF_SUBJECT = "processor.handoff"
+# Queue group of the frame subscriptions, shared by the old and the new process of a shard
+QUEUE_GROUP = "processor"
+DEFAULT_HANDOFF_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+# Seconds the new process waits for the old one to drain and dump its state
+DEFAULT_HANDOFF_TIMEOUT = 10.0
+
+
+def handoff_subject(shard_index: int = 0) -> str:
+    return f"{HANDOFF_SUBJECT}.{shard_index}"
+
+
+async def take_over(nc, processor, handlers: Dict[str, Callable[[object], Awaitable[None]]], shard_index: int = 0,
+                    timeout: float = DEFAULT_HANDOFF_TIMEOUT) -> List:
+    """
+    Subscribe handlers to their subjects, taking over the shard's flow state from a running process if any.
+    Returns the subscriptions once the frames received during the handoff are handled.
+    """
+    buffered = deque()
+    buffering = True
+
+    def buffer(handler):
+        async def callback(msg):
+            if buffering:
+                buffered.append((handler, msg))
+            else:
+                await handler(msg)
+        return callback
+
+    subscriptions = [await nc.subscribe(subject, queue=QUEUE_GROUP, cb=buffer(handler))
+                     for subject, handler in handlers.items()]
+    start = time.perf_counter()
+    try:
+        reply = await nc.request(handoff_subject(shard_index), timeout=timeout)
+    except nats.errors.NoRespondersError:
+        reply = None
+    except nats.errors.TimeoutError:
+        logger.warning(f"No handoff from the running processor of shard {shard_index} within {timeout:g}s, "
+                       f"starting with empty flow state")
+        reply = None
+    info = json.loads(reply.data) if reply is not None else None
+    if info is not None and 'error' in info:
+        logger.warning(f"The running processor of shard {shard_index} could not hand over its flow state: "
+                       f"{info['error']}")
+    elif info is not None:
+        load_start = time.perf_counter()
+        try:
+            with open(info['path'], "rb") as f:
+                data = f.read()
+            os.remove(info['path'])
+            flows = processor.load_state(data)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load the handoff snapshot {info['path']}: {e}")
+        else:
+            now = time.perf_counter()
+            logger.info(f"Took over {flows} flows from process {info['pid']} in {(now - start) * 1000:.0f}ms: "
+                        f"drain {info['drain_ms']:.0f}ms, dump {info['dump_ms']:.0f}ms, "
+                        f"load {(now - load_start) * 1000:.0f}ms, {len(data)} bytes")
+    replayed = 0
+    # Frames keep arriving while buffered ones are handled, they join the buffer until it is empty
+    while buffered:
+        handler, msg = buffered.popleft()
+        await handler(msg)
+        replayed += 1
+    buffering = False
+    if info is not None:
+        logger.info(f"Handled {replayed} frames received during the handoff")
+    return subscriptions
+
+
+class HandoffServer:
+    def __init__(self, nc, processor, subscriptions: List, shard_index: int = 0,
+                 directory: str = DEFAULT_HANDOFF_DIR):
+        """
+        Initialize the side of a running processor answering handoff requests.
+        Args:
+            nc: NATS connection
+            processor: PacketProcessor whose state is handed over
+            subscriptions: Frame subscriptions drained before the state is dumped
+            shard_index: Shard handled by the processor
+            directory: Directory the snapshot is written to, shared with the new process
+        """
+        self.nc = nc
+        self.processor = processor
+        self.subscriptions = subscriptions
+        self.shard_index = shard_index
+        self.directory = directory
+        self.subscription = None
+        self.done = asyncio.Event()  # Set once the state is handed over, the process should then exit
+
+    async def start(self) -> None:
+        self.subscription = await self.nc.subscribe(handoff_subject(self.shard_index), cb=self._handle)
+
+    async def _handle(self, msg) -> None:
+        if self.done.is_set():
+            return
+        start = time.perf_counter()
+        # Inspect every frame already received, none arrive after this
+        for subscription in self.subscriptions:
+            await subscription.drain()
+        drained = time.perf_counter()
+        data = self.processor.dump_state()
+        dumped = time.perf_counter()
+        path = os.path.join(self.directory, f"processor-handoff-{self.shard_index}-{os.getpid()}.bin")
+        reply = {
+            'path': path,
+            'pid': os.getpid(),
+            'flows': len(self.processor.flow_table),
+            'drain_ms': (drained - start) * 1000,
+            'dump_ms': (dumped - drained) * 1000
+        }
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, save, path, data)
+        except OSError as e:
+            # The subscriptions are drained already, the new process goes on without the flow state
+            logger.warning(f"Could not write the handoff snapshot {path}: {e}")
+            reply['error'] = str(e)
+        await msg.respond(json.dumps(reply).encode())
+        self.done.set()
+        await self.subscription.unsubscribe()
+        logger.info(f"Handed over {len(self.processor.flow_table)} flows in {(time.perf_counter() - start) * 1000:.0f}ms")
@@ -0,0 +1,173 @@
+"""
+Overload control: when frames arrive faster than the processor can inspect them, the pending
+buffers of its NATS subscriptions fill up until the server cuts it off as a slow consumer and
+frames are dropped without notice. Forwarding frames matters more than catching every covert
+channel, so the processor degrades step by step as the backlog grows and recovers once it drains:
+
+    normal        every frame is scored and delayed
+    sample        a flow's window is only scored every sample_interval packets
+    skip_delay    benign frames are also forwarded without their random delay
+    pass_through  frames are forwarded at once without flow state, detection or delay, so they
+                  can overtake delayed frames of their flow still waiting for release
+
+The backlog is measured by the messages pending in the watched subscriptions and by how late the
+event loop runs a periodic probe, which grows when the handler keeps the loop busy.
+"""
+import asyncio
+import logging
+from typing import Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+LEVEL_NORMAL = 0
+LEVEL_SAMPLE = 1
+LEVEL_SKIP_DELAY = 2
+LEVEL_PASS_THROUGH = 3
+LEVELS = ("normal", "sample", "skip_delay", "pass_through")
+
+# Pending messages and event loop lag (seconds) from which each level above normal is entered
+DEFAULT_DEPTH_WATERMARKS = (1000, 10000, 50000)
+DEFAULT_LAG_WATERMARKS = (0.1, 0.5, 2.0)
+
+
+class OverloadController:
+    def __init__(self,
+                 depth_watermarks: Optional[Sequence[int]] = DEFAULT_DEPTH_WATERMARKS,
+                 lag_watermarks: Optional[Sequence[float]] = DEFAULT_LAG_WATERMARKS,
+                 hold: float = 2.0,
+                 sample_interval: int = 8,
+                 probe_interval: float = 0.05,
+                 check_interval: int = 256,
+                 on_transition: Optional[Callable[[int, int], None]] = None):
+        """
+        Initialize the overload controller of a processor.
+        The level rises as soon as the pending depth or the lag reaches the watermark of a higher
+        level, and falls one level at a time once both stayed under the current level's watermarks
+        for hold seconds, so a backlog being worked off does not make the level flap.
+        Levels are updated by the lag probe and every check_interval frames by the handler, whose
+        frames keep the probe from running when the loop is saturated.
+        Args:
+            depth_watermarks: Pending messages entering the sample, skip_delay and pass_through levels,
+                              None to ignore the pending depth
+            lag_watermarks: Event loop lag (seconds) entering the same levels, None to ignore the lag
+            hold: Seconds both signals stay under the current level's watermarks before stepping down
+            sample_interval: In the sample level and above, score a flow's window every this many packets
+            probe_interval: Seconds between runs of the lag probe
+            check_interval: Frames between level updates by the handler
+            on_transition: Called with the old and new level on every level change
+        """
+        self.depth_watermarks = tuple(depth_watermarks) if depth_watermarks else (float('inf'),) * 3
+        self.lag_watermarks = tuple(lag_watermarks) if lag_watermarks else (float('inf'),) * 3
+        if len(self.depth_watermarks) != 3 or len(self.lag_watermarks) != 3:
+            raise ValueError("Overload watermarks need one value per level above normal: sample, skip_delay, pass_through")
+        if list(self.depth_watermarks) != sorted(self.depth_watermarks) or list(self.lag_watermarks) != sorted(self.lag_watermarks):
+            raise ValueError("Overload watermarks must not decrease from one level to the next")
+        self.hold = hold
+        self.sample_interval = max(1, sample_interval)
+        self.probe_interval = probe_interval
+        self.check_interval = check_interval
+        self.on_transition = on_transition
+        self.subscriptions: List = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.level = LEVEL_NORMAL
+        self.frames = 0
+        self.probe_due = None  # Time the lag probe should run next, late while the loop is busy
+        self.probe_lag = 0.0
+        self.calm_since = None  # Since when the signals are under the current level's watermarks
+        self.level_started = None
+        self.level_seconds = [0.0] * len(LEVELS)
+        self.transition_count = 0
+        self.peak_depth = 0
+        self.peak_lag = 0.0
+
+    def watch(self, subscription) -> None:
+        """Count the messages pending in subscription, anything with a pending_msgs like a nats-py Subscription."""
+        self.subscriptions.append(subscription)
+
+    def depth(self) -> int:
+        """Messages received but not handled yet, over every watched subscription."""
+        return sum(subscription.pending_msgs for subscription in self.subscriptions)
+
+    def lag(self) -> float:
+        """How late the lag probe runs, or would run if the loop let it."""
+        if self.probe_due is None:
+            return 0.0
+        return max(self.probe_lag, self.loop.time() - self.probe_due)
+
+    def tick(self) -> int:
+        """Count a frame and return the level it is handled at, updated every check_interval frames."""
+        self.frames += 1
+        if self.frames % self.check_interval == 0:
+            self.update()
+        return self.level
+
+    def update(self) -> int:
+        """Move to the level the current pending depth and lag call for."""
+        depth = self.depth()
+        lag = self.lag()
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+        if lag > self.peak_lag:
+            self.peak_lag = lag
+        target = LEVEL_NORMAL
+        for level, (depth_mark, lag_mark) in enumerate(zip(self.depth_watermarks, self.lag_watermarks), 1):
+            if depth >= depth_mark or lag >= lag_mark:
+                target = level
+        now = self.loop.time()
+        if target > self.level:
+            self._transition(target, now)
+        elif target < self.level:
+            if self.calm_since is None:
+                self.calm_since = now
+            elif now - self.calm_since >= self.hold:
+                # One level at a time, the next step down waits for another hold
+                self._transition(self.level - 1, now)
+        else:
+            self.calm_since = None
+        return self.level
+
+    def _transition(self, level: int, now: float) -> None:
+        old = self.level
+        self.level_seconds[old] += now - self.level_started
+        self.level_started = now
+        self.level = level
+        self.calm_since = None
+        self.transition_count += 1
+        log = logger.warning if level > old else logger.info
+        log(f"Overload level {LEVELS[old]} -> {LEVELS[level]}: {self.depth()} pending, lag {self.lag() * 1000:.0f} ms")
+        if self.on_transition is not None:
+            self.on_transition(old, level)
+
+    async def run(self) -> None:
+        """Lag probe, measures how late it wakes up and updates the level."""
+        loop = self.loop
+        while True:
+            self.probe_due = loop.time() + self.probe_interval
+            await asyncio.sleep(self.probe_interval)
+            self.probe_lag = max(loop.time() - self.probe_due, 0.0)
+            self.update()
+
+    async def start(self) -> asyncio.Task:
+        """Start the lag probe on the running loop."""
+        self.loop = asyncio.get_running_loop()
+        self.level_started = self.loop.time()
+        return asyncio.create_task(self.run())
+
+    def seconds_at(self, level: int) -> float:
+        """Seconds spent at level so far."""
+        seconds = self.level_seconds[level]
+        if level == self.level and self.level_started is not None:
+            seconds += self.loop.time() - self.level_started
+        return seconds
+
+    def get_stats(self) -> dict:
+        """Get overload control statistics."""
+        return {
+            'level': LEVELS[self.level],
+            'pending': self.depth(),
+            'lag': self.lag() if self.loop is not None else 0.0,
+            'peak_pending': self.peak_depth,
+            'peak_lag': self.peak_lag,
+            'transitions': self.transition_count,
+            'seconds': {name: self.seconds_at(level) for level, name in enumerate(LEVELS)} if self.loop is not None else None
+        }
@@ -0,0 +1,527 @@
+import logging
+import random
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from detector.baseline import DEFAULT_DECAY, BaselineStore
+from detector.covert_channel_detector import CovertChannelDetector
+from detector.multiscale import MultiScaleDetector, scale_names
+from detector.pipeline import DetectorPipeline
+from flow.flow_snapshot import FlowSnapshot, dumps as dump_flows, paused_gc
+from flow.flow_table import FlowState, FlowTable, flow_hash, flow_key, subnet_key
+from flow.frame_filter import FrameFilter
+from journal.packet_journal import (DECISION_COVERT, DECISION_MITIGATED, DECISION_SAMPLED, DECISION_SKIPPED,
+                                    PacketJournal)
+from metrics.metrics import MetricsRegistry
+from mitigator.covert_channel_mitigator import CovertChannelMitigator
+from mitigator.pacing_mitigator import PACING_MODES, PacingMitigator
+from processor.analysis_offload import AnalysisOffload
+from processor.batch_framing import BATCH_PREFIX, BatchPublisher, iter_batch
+from processor.overload import (LEVEL_PASS_THROUGH, LEVEL_SAMPLE, LEVEL_SKIP_DELAY, LEVELS,
+                                OverloadController)
+from scheduler.release_scheduler import ReleaseScheduler
+
+logger = logging.getLogger(__name__)
+
+# Subject a frame is forwarded to, by the subject it was received on
+OUT_SUBJECTS = {
+    "inpktsec": "outpktinsec",
+    "inpktinsec": "outpktsec",
+}
+
+# Baselines are learned per flow, or per source subnet so new flows of a subnet start with a warm baseline
+BASELINE_SCOPES = ("flow", "subnet")
+
+# Random delays on the packets after a detection, or pacing of the suspect flow (see PACING_MODES)
+MITIGATION_MODES = ("delay",) + PACING_MODES
+
+# Scores of a frame whose detection was skipped by overload control
+SAMPLED_SCORES = {'total_score': 0.0}
+
+# Header set by the MITM switch with the kernel receive timestamp in nanoseconds since the epoch
+CAPTURE_TS_HEADER = "Capture-Ts-Ns"
+
+
+def input_subjects(shard_index: int = 0, shard_count: int = 1) -> Dict[str, str]:
+    """
+    Subjects a processor shard subscribes to, mapped to the subject each frame is forwarded to.
+    With more than one shard the switch publishes every frame on <subject>.<shard>, the shard
+    being chosen by the hash of the frame's flow so that a flow is always handled by one worker.
+    """
+    if shard_count <= 1:
+        return dict(OUT_SUBJECTS)
+    return {f"{subject}.{shard_index}": out for subject, out in OUT_SUBJECTS.items()}
+
+
+def score_names(detectors: Optional[Sequence[str]] = None, scales: Optional[Sequence[int]] = None) -> Tuple[str, ...]:
+    """
+    Names of the scores the detectors of a processor give besides total_score, i.e. the score columns
+    its journal needs: one per detector of the pipeline, then one per window scale.
+    """
+    names = tuple(detector.name for detector in DetectorPipeline.from_specs(detectors).detectors)
+    return names + scale_names(scales) if scales else names
+
+
+def capture_time(msg) -> float:
+    """
+    Receive timestamp of a frame in seconds.
+    Uses the switch's kernel timestamp when present so that event loop and NATS scheduling
+    jitter do not show up in the ipds. Falls back to the processor's CLOCK_REALTIME, the clock the
+    switch stamps frames with. The two are only comparable when the switch and the processor run
+    on the same host, or on hosts whose clocks are NTP-synced; otherwise the offset between them
+    shows up in the ipds and idle times of flows with frames both with and without the header.
+    """
+    headers = msg.headers
+    if headers:
+        value = headers.get(CAPTURE_TS_HEADER)
+        if value is not None:
+            return int(value) / 1e9
+    return time.time()
+
+
+class PacketProcessor:
+    def __init__(self,
+                 nc,
+                 mean_value: float,
+                 min_delay: float,
+                 max_delay: float,
+                 window_size: int = 50,
+                 detection_threshold: float = 0.6,
+                 max_flows: int = 100000,
+                 flow_idle_timeout: float = 60.0,
+                 max_pending_frames: int = 10000,
+                 packet_time: Optional[Callable[[object], float]] = None,
+                 debug_sample: int = 0,
+                 out_subjects: Optional[Dict[str, str]] = None,
+                 baseline_scope: str = "flow",
+                 baseline_decay: float = DEFAULT_DECAY,
+                 baseline_prefix_len: int = 24,
+                 batch_size: int = 0,
+                 batch_flush_us: int = 1000,
+                 mitigation_mode: str = "delay",
+                 pace_quantum: float = 0.05,
+                 pace_hold: float = 30.0,
+                 full_score_interval: int = 0,
+                 journal: Optional[PacketJournal] = None,
+                 detectors: Optional[Sequence[str]] = None,
+                 analysis_workers: int = 0,
+                 analysis_max_in_flight: int = 64,
+                 analysis_threshold: float = 0.3,
+                 analysis_lag: int = 5,
+                 monitor_rules: Optional[Sequence[str]] = None,
+                 scales: Optional[Sequence[int]] = None,
+                 scale_fusion: str = "max",
+                 overload_depth: Optional[Sequence[int]] = None,
+                 overload_lag: Optional[Sequence[float]] = None,
+                 overload_hold: float = 2.0,
+                 overload_sample: int = 8):
+        """
+        Initialize the packet processor with per-flow covert channel detection and mitigation.
+        Args:
+            nc: Connected NATS client, or any object with an async publish(subject, payload)
+            mean_value: Mean value for adding random delay to packages
+            min_delay: Minimum mitigation delay (seconds)
+            max_delay: Maximum mitigation delay (seconds)
+            window_size: Number of packets to analyze in detection window
+            detection_threshold: Threshold for detection confidence (0-1)
+            max_flows: Maximum number of flows to keep detector state for
+            flow_idle_timeout: Seconds without a packet after which a flow's state is dropped
+            max_pending_frames: Maximum number of delayed frames waiting for release
+            packet_time: Returns the arrival timestamp of a message, capture_time() when None
+            debug_sample: Print the details of one in debug_sample packets, 0 to disable
+            out_subjects: Subject to forward frames to by input subject, OUT_SUBJECTS when None
+            baseline_scope: Learn a baseline per "flow" or per source "subnet"
+            baseline_decay: Weight of a new ipd in a warmed up baseline, 0 to freeze baselines
+            baseline_prefix_len: Prefix length of the subnets baselines are shared by
+            batch_size: Frames per outgoing batch message, 0 or 1 to publish every frame on its own
+            batch_flush_us: Longest time an outgoing frame waits for its batch to fill (microseconds)
+            mitigation_mode: "delay" for random delays on the next packets, or a pacing mode of PACING_MODES
+            pace_quantum: Granularity of the release grid of paced flows (seconds)
+            pace_hold: Seconds a flow stays paced after its last detection
+            full_score_interval: Tiered detection, flows failing the detector's prefilter are only fully
+                                 scored every full_score_interval packets; 0 scores every packet.
+                                 Not supported with scales
+            journal: Journal every frame and its decision is recorded in, None to disable; it must record
+                     the score_names() of detectors and scales
+            detectors: Detector specs of the scoring pipeline, e.g. ["bimodal:0.5", "entropy"], None for the default ones
+            analysis_workers: Processes running the slow statistical tests on suspect windows, 0 to disable
+            analysis_max_in_flight: Suspect windows analyzed at the same time, more are dropped
+            analysis_threshold: Score from which a window is suspect and sent for analysis
+            analysis_lag: Autocorrelation lag checked by the analysis, the bit repetition of suspected senders
+            monitor_rules: Filter rules of the traffic to inspect (see flow.frame_filter), other frames are
+                           forwarded at once without detection; None or empty to inspect every frame
+            scales: Score every flow over these window lengths at once (see detector.multiscale) instead
+                    of window_size alone; None or empty for a single window
+            scale_fusion: How per-scale scores are fused into one, "max" or "mean"
+            overload_depth: Pending messages of the watched subscriptions entering the sample, skip_delay
+                            and pass_through levels of overload control (see processor.overload)
+            overload_lag: Event loop lag (seconds) entering the same levels; overload control is disabled
+                          when neither overload_depth nor overload_lag is given
+            overload_hold: Seconds the backlog stays under the current level's watermarks before stepping down
+            overload_sample: Score a flow's window every this many packets while sampling
+        """
+        self.nc = nc
+        self.mean_value = mean_value
+        self.packet_time = capture_time if packet_time is None else packet_time
+        self.debug_sample = debug_sample
+        self.out_subjects = OUT_SUBJECTS if out_subjects is None else out_subjects
+        self.journal = journal
+        self.frame_filter = FrameFilter(monitor_rules) if monitor_rules else None
+
+        # Under overload, detection and delays are given up step by step before NATS drops frames
+        self.overload = None
+        if overload_depth or overload_lag:
+            self.overload = OverloadController(overload_depth, overload_lag, overload_hold, overload_sample,
+                                               on_transition=self._record_transition)
+        self.sampled_count = 0
+        self.undelayed_count = 0
+        self.passed_through_count = 0
+
+        if baseline_scope not in BASELINE_SCOPES:
+            raise ValueError(f"Unknown baseline scope {baseline_scope!r}, expected one of {BASELINE_SCOPES}")
+        if baseline_scope == "subnet":
+            baseline_key = lambda key: subnet_key(key, baseline_prefix_len)
+        else:
+            baseline_key = lambda key: key
+        # Baselines outlive flow state, so a flow coming back after its state was dropped is not relearned
+        self.baselines = BaselineStore(baseline_decay, max_entries=max_flows)
+
+        # Every flow's detector runs the same pipeline, which holds no per-flow state
+        self.pipeline = DetectorPipeline.from_specs(detectors)
+        if journal is not None and journal.score_names != score_names(detectors, scales):
+            raise ValueError(f"The journal records the scores {' '.join(journal.score_names)}, the detectors give "
+                             f"{' '.join(score_names(detectors, scales))}")
+        # Initialize per-flow detectors and mitigator
+        if scales and full_score_interval:
+            raise ValueError("full_score_interval is not supported with scales, the multi-scale detector "
+                             "scores every packet")
+        if scales:
+            detector_factory = lambda key: MultiScaleDetector(
+                scales=scales,
+                threshold=detection_threshold,
+                baseline=self.baselines.get(baseline_key(key)),
+                pipeline=self.pipeline,
+                fusion=scale_fusion
+            )
+        else:
+            detector_factory = lambda key: CovertChannelDetector(
+                window_size=window_size,
+                threshold=detection_threshold,
+                baseline=self.baselines.get(baseline_key(key)),
+                full_score_interval=full_score_interval,
+                pipeline=self.pipeline
+            )
+        self.flow_table = FlowTable(
+            detector_factory,
+            max_flows=max_flows,
+            idle_timeout=flow_idle_timeout
+        )
+        self.mitigator = CovertChannelMitigator(min_delay=min_delay, max_delay=max_delay)
+        if mitigation_mode not in MITIGATION_MODES:
+            raise ValueError(f"Unknown mitigation mode {mitigation_mode!r}, expected one of {MITIGATION_MODES}")
+        self.pacing = PacingMitigator(mitigation_mode, pace_quantum, pace_hold) if mitigation_mode != "delay" else None
+        self.paced_flows_count = 0
+
+        # Released frames are sent on their own or collected into batch messages
+        self.batcher = BatchPublisher(nc.publish, batch_size, batch_flush_us) if batch_size > 1 else None
+        publish = nc.publish if self.batcher is None else self.batcher.publish
+        self.publish = publish
+
+        # Delayed frames are released by the scheduler so the handler never sleeps
+        self.scheduler = ReleaseScheduler(publish, max_pending=max_pending_frames,
+                                          on_release=self._record_release)
+
+        # Suspect windows get slower tests in worker processes, covert verdicts start or extend mitigation
+        self.window_size = window_size
+        self.analysis_threshold = analysis_threshold
+        self.analysis = None
+        if analysis_workers > 0:
+            self.analysis = AnalysisOffload(self._on_verdict, analysis_workers, analysis_max_in_flight,
+                                            window_size, analysis_lag)
+        self.analysis_mitigations_count = 0
+
+        self.tasks = []  # Tasks started by start(), kept so they are not collected and their errors are seen
+        self.processed_packets_count = 0
+        self.detected_covert_channel_count = 0
+        self.skipped_scores_count = 0
+
+        self.metrics = MetricsRegistry()
+        self.packets_metric = self.metrics.counter("packets_total", "Frames received", "subject")
+        self.batches_metric = self.metrics.counter("batches_total", "Batch messages received", "subject")
+        self.detections_metric = self.metrics.counter("detections_total", "Covert channel detections", "subject")
+        self.mitigated_metric = self.metrics.counter("mitigated_packets_total", "Frames delayed by the mitigator", "subject")
+        self.bypassed_metric = self.metrics.counter("bypassed_packets_total", "Frames forwarded without detection",
+                                                    "subject")
+        self.paced_metric = self.metrics.counter("paced_packets_total", "Frames released on a pacing grid", "subject")
+        self.metrics.counter_callback("paced_flows_total", "Flows that were paced", lambda: self.paced_flows_count)
+        self.metrics.counter_callback("full_scores_skipped_total", "Frames the detector prefilter answered alone",
+                                      lambda: self.skipped_scores_count)
+        self.metrics.gauge("full_scores_skipped_ratio", "Share of frames that skipped the full detection score",
+                           lambda: self.skipped_scores_count / max(1, self.processed_packets_count))
+        self.detect_time_metric = self.metrics.histogram("detect_seconds", "Time spent in add_packet() and detect()")
+        self.publish_latency_metric = self.metrics.histogram(
+            "publish_latency_seconds", "Time from receiving a frame to publishing it", "subject")
+        self.metrics.gauge("release_queue_depth", "Frames waiting for release", lambda: len(self.scheduler))
+        self.metrics.gauge("release_queue_peak", "Highest number of frames waiting for release",
+                           lambda: self.scheduler.peak_pending)
+        self.metrics.counter_callback("release_queue_full_waits_total", "Times a frame waited for room in the release queue",
+                                      lambda: self.scheduler.full_wait_count)
+        self.metrics.counter_callback("release_publish_errors_total", "Delayed frames lost because publishing failed",
+                                      lambda: self.scheduler.publish_error_count)
+        self.metrics.gauge("flows_active", "Flows with detector state", lambda: len(self.flow_table))
+        self.metrics.counter_callback("flows_evicted_idle_total", "Flows dropped after idle timeout",
+                                      lambda: self.flow_table.evicted_idle)
+        self.metrics.counter_callback("flows_evicted_lru_total", "Flows dropped to stay under max_flows",
+                                      lambda: self.flow_table.evicted_lru)
+        self.metrics.counter_callback("flows_restored_total", "Flows restored from a previous process's snapshot",
+                                      lambda: self.flow_table.restored)
+        self.metrics.gauge("baselines", "Learned ipd baselines", lambda: len(self.baselines))
+        if self.frame_filter is not None:
+            frame_filter = self.frame_filter
+            self.metrics.gauge("bypass_ratio", "Share of frames outside the monitor rules",
+                               lambda: frame_filter.bypassed_count / max(1, frame_filter.bypassed_count + frame_filter.matched_count))
+        if self.analysis is not None:
+            analysis = self.analysis
+            self.metrics.gauge("analysis_in_flight", "Suspect windows being analyzed", lambda: len(analysis))
+            self.metrics.counter_callback("analysis_submitted_total", "Suspect windows sent for analysis",
+                                          lambda: analysis.submitted_count)
+            self.metrics.counter_callback("analysis_completed_total", "Suspect windows analyzed",
+                                          lambda: analysis.completed_count)
+            self.metrics.counter_callback("analysis_covert_total", "Analyses with a covert verdict",
+                                          lambda: analysis.covert_count)
+            self.metrics.counter_callback("analysis_dropped_full_total", "Suspect windows dropped, no analysis slot free",
+                                          lambda: analysis.dropped_full_count)
+            self.metrics.counter_callback("analysis_dropped_pending_total",
+                                          "Suspect windows dropped, the flow had one in flight",
+                                          lambda: analysis.dropped_pending_count)
+            self.metrics.counter_callback("analysis_mitigations_total", "Flows mitigated on an analysis verdict",
+                                          lambda: self.analysis_mitigations_count)
+        if self.overload is not None:
+            overload = self.overload
+            self.transitions_metric = self.metrics.counter("overload_transitions_total", "Overload level changes",
+                                                           "transition")
+            self.metrics.gauge("overload_level", "Overload level, 0 normal, 1 sample, 2 skip_delay, 3 pass_through",
+                               lambda: overload.level)
+            self.metrics.gauge("overload_pending", "Messages pending in the watched subscriptions", overload.depth)
+            self.metrics.gauge("overload_lag_seconds", "How late the event loop runs the lag probe", overload.lag)
+            for level, name in enumerate(LEVELS):
+                self.metrics.counter_callback(f"overload_{name}_seconds_total", f"Seconds spent at the {name} level",
+                                              lambda level=level: overload.seconds_at(level))
+            self.metrics.counter_callback("overload_sampled_total", "Frames whose detection was skipped while sampling",
+                                          lambda: self.sampled_count)
+            self.metrics.counter_callback("overload_undelayed_total", "Benign frames forwarded without random delay",
+                                          lambda: self.undelayed_count)
+            self.metrics.counter_callback("overload_passed_through_total", "Frames forwarded without inspection",
+                                          lambda: self.passed_through_count)
+        if journal is not None:
+            self.metrics.counter_callback("journal_records_total", "Frames recorded in the journal",
+                                          lambda: self.journal.records_count)
+
+    async def start(self) -> None:
+        """Start releasing scheduled frames, and the overload lag probe."""
+        self.tasks.append(await self.scheduler.start())
+        if self.overload is not None:
+            self.tasks.append(await self.overload.start())
+
+    def check_tasks(self) -> None:
+        """Raise the error a task started by start() stopped with, e.g. the dispatcher releasing delayed frames."""
+        for task in self.tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    def watch(self, subscription) -> None:
+        """Let overload control count the messages pending in a subscription of this processor."""
+        if self.overload is not None:
+            self.overload.watch(subscription)
+
+    async def message_handler(self, msg) -> None:
+        await self.handle_frame(msg.subject, msg.data, self.packet_time(msg))
+
+    async def batch_handler(self, msg) -> None:
+        """Handle a batch message, every frame is handled as if it arrived on its own."""
+        subject = msg.subject[len(BATCH_PREFIX):]
+        self.batches_metric.inc(subject)
+        handle_frame = self.handle_frame
+        for timestamp, frame in iter_batch(msg.data):
+            await handle_frame(subject, frame, timestamp / 1e9 if timestamp else time.time())
+
+    async def handle_frame(self, subject: str, data, now: float) -> None:
+        """Inspect a frame received on subject at time now and schedule its release."""
+        level = self.overload.tick() if self.overload is not None else 0
+        if level >= LEVEL_PASS_THROUGH:
+            # Fail open: forwarded at once, frames still waiting for release in their flow may be overtaken
+            self.passed_through_count += 1
+            await self.publish(self.out_subjects.get(subject, "outpktsec"), data)
+            return
+        if self.frame_filter is not None and not self.frame_filter.match(data):
+            # Traffic outside the monitor rules is forwarded at once and never gets flow or detector state
+            self.bypassed_metric.inc(subject)
+            await self.publish(self.out_subjects.get(subject, "outpktsec"), data)
+            return
+        scheduler = self.scheduler
+        received = scheduler.now()
+        release_at = self.inspect(subject, data, now, received, level)
+        await scheduler.schedule(release_at, self.out_subjects.get(subject, "outpktsec"), data, received)
+
+    def inspect(self, subject: str, data, now: float, received: float, level: int = 0) -> float:
+        """
+        Run detection and mitigation for a frame and return its release deadline.
+        now is the frame's capture time used for the ipds, received its arrival on the scheduler's clock,
+        level the overload level (see processor.overload) the frame is handled at.
+        """
+        self.packets_metric.inc(subject)
+        # Find the flow of the frame and add packet to its detector
+        key = flow_key(data)
+        flow = self.flow_table.get(key, now)
+        detector = flow.detector
+        detect_start = time.perf_counter()
+        detector.add_packet(now)
+        decision = 0
+        if level >= LEVEL_SAMPLE and detector.total_packets % self.overload.sample_interval:
+            # Ipds are still recorded, so the window is complete when it is scored next
+            is_covert, confidence, detailed_scores = False, 0.0, SAMPLED_SCORES
+            self.sampled_count += 1
+            decision = DECISION_SAMPLED
+        else:
+            # Check for covert channel
+            is_covert, confidence, detailed_scores = detector.detect()
+        self.detect_time_metric.observe(time.perf_counter() - detect_start)
+        delay = 0.0
+        if "skipped" in detailed_scores:
+            self.skipped_scores_count += 1
+            decision = DECISION_SKIPPED
+
+        if is_covert:
+            decision = DECISION_COVERT
+            self.detected_covert_channel_count += 1
+            self.detections_metric.inc(subject)
+            # Log once when a flow starts being mitigated rather than on every detection
+            if flow.mitigation_count == 0 and flow.pacer is None:
+                logger.info(f"Covert channel detected on {subject}! Confidence: {confidence:.2f}")
+
+            # Log detailed scores for analysis
+            if logger.isEnabledFor(logging.DEBUG):
+                score_str = ", ".join([f"{k}: {v:.3f}" for k, v in detailed_scores.items()
+                                       if k != 'total_score'])
+                logger.debug(f"Detection scores: {score_str}")
+            # Apply mitigation to the next packets of this flow
+            self.start_mitigation(flow, received)
+
+        elif level >= LEVEL_SKIP_DELAY:
+            self.undelayed_count += 1
+        else:
+            # Process packet normally with random delay
+            delay = random.expovariate(1 / self.mean_value)
+        if (self.analysis is not None and confidence >= self.analysis_threshold
+                and detector.total_packets - flow.analyzed_at >= self.window_size):
+            # One analysis per window of a suspect flow, a dropped window is not retried before the next one;
+            # the verdict comes back in _on_verdict()
+            baseline = detector.baseline
+            self.analysis.submit(key, detector.ipd_window, baseline.mean if baseline.established else 0.0)
+            flow.analyzed_at = detector.total_packets
+        if flow.mitigation_count > 0:
+            flow.mitigation_count -= 1
+            if flow.mitigation_count > 0:
+                delay += self.mitigator.mitigate()
+                decision |= DECISION_MITIGATED
+                self.mitigated_metric.inc(subject)
+        release_at = received + delay
+        pacer = flow.pacer
+        if pacer is not None:
+            if received > pacer.paced_until:
+                flow.pacer = None
+            else:
+                # Paced flows are released on their grid instead, whatever their own timing
+                release_at = self.pacing.release_time(pacer, received)
+                decision |= DECISION_MITIGATED
+                self.paced_metric.inc(subject)
+        self.processed_packets_count += 1
+        if self.debug_sample and self.processed_packets_count % self.debug_sample == 0:
+            print(f"Packet {self.processed_packets_count} on {subject}: flow {key.hex()}, "
+                  f"scores {detailed_scores}, delay {release_at - received:.6f}s, queue {len(self.scheduler)}")
+        # Never release a frame before the previous frame of its flow to keep per-flow order
+        release_at = max(release_at, flow.release_at)
+        flow.release_at = release_at
+        if self.journal is not None:
+            if flow.flow_id is None:
+                flow.flow_id = flow_hash(key)
+            self.journal.append(now, flow.flow_id, subject, len(data), detailed_scores, decision, release_at - received)
+        return release_at
+
+    def start_mitigation(self, flow: FlowState, now: float) -> None:
+        """Start or extend the mitigation of a flow at time now on the scheduler's clock."""
+        if self.pacing is None:
+            flow.mitigation_count = 10
+        else:
+            if flow.pacer is None:
+                flow.pacer = self.pacing.start(flow.detector.ipd_window.mean(), now)
+                self.paced_flows_count += 1
+            flow.pacer.paced_until = now + self.pacing.hold
+
+    def _on_verdict(self, key: bytes, result: Dict) -> None:
+        if not result['covert']:
+            return
+        # The flow may have been dropped while its window was analyzed
+        flow = self.flow_table.lookup(key)
+        if flow is None:
+            return
+        if flow.mitigation_count == 0 and flow.pacer is None:
+            logger.info(f"Covert channel confirmed by analysis: KS {result['ks']:.2f}, "
+                        f"sample entropy {result['sample_entropy']:.2f}, autocorrelation {result['autocorrelation']:.2f}")
+        self.analysis_mitigations_count += 1
+        self.start_mitigation(flow, self.scheduler.now())
+
+    def dump_state(self) -> bytes:
+        """Serialize flow and baseline state for the process taking over (see processor.handoff)."""
+        with paused_gc():
+            return dump_flows(self.flow_table, self.baselines)
+
+    def load_state(self, data: bytes) -> int:
+        """
+        Take over the state dumped by a previous process. Baselines are loaded at once, flows are
+        restored on their next packet. Returns the number of flows in the snapshot.
+        """
+        with paused_gc():
+            snapshot = FlowSnapshot(data, self.flow_table.idle_timeout, pacing=self.pacing is not None)
+            self.baselines.loads(snapshot.baselines)
+        self.flow_table.snapshot = snapshot
+        return len(snapshot)
+
+    async def drain(self, timeout: Optional[float] = 30.0) -> None:
+        """
+        Forward every frame still held back, e.g. before disconnecting: delayed frames at their deadlines
+        or at once if due more than timeout seconds from now, then the batch being filled.
+        """
+        early = await self.scheduler.drain(timeout)
+        if early:
+            logger.warning(f"{early} delayed frames released before their deadline")
+        if self.batcher is not None:
+            await self.batcher.flush()
+
+    def close(self) -> None:
+        """Stop the analysis workers."""
+        if self.analysis is not None:
+            self.analysis.close()
+
+    def _record_transition(self, old: int, new: int) -> None:
+        self.transitions_metric.inc(f"{LEVELS[old]}_to_{LEVELS[new]}")
+
+    def _record_release(self, subject: str, latency: float) -> None:
+        self.publish_latency_metric.observe(latency, subject)
+
+    def get_stats(self) -> dict:
+        """Get processor statistics."""
+        return {
+            'processed_packets': self.processed_packets_count,
+            'detected_covert_channels': self.detected_covert_channel_count,
+            'skipped_full_scores': self.skipped_scores_count,
+            'flows': self.flow_table.get_stats(),
+            'baselines': self.baselines.get_stats(),
+            'release_queue': self.scheduler.get_stats(),
+            'batches': self.batcher.get_stats() if self.batcher is not None else None,
+            'journal': self.journal.get_stats() if self.journal is not None else None,
+            'filter': self.frame_filter.get_stats() if self.frame_filter is not None else None,
+            'analysis': self.analysis.get_stats() if self.analysis is not None else None,
+            'overload': dict(self.overload.get_stats(), sampled=self.sampled_count, undelayed=self.undelayed_count,
+                             passed_through=self.passed_through_count) if self.overload is not None else None
+        }
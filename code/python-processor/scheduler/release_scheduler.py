@@ -0,0 +1,167 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ReleaseScheduler:
+    def __init__(self,
+                 publish: Callable[[str, bytes], Awaitable[None]],
+                 max_pending: int = 10000,
+                 on_release: Optional[Callable[[str, float], None]] = None):
+        """
+        Initialize the release scheduler.
+        Frames are kept in a heap ordered by release deadline (event loop time) and published
+        by a single dispatcher task when their deadline arrives, so delaying a frame never
+        blocks the subscription callbacks that receive and inspect the following frames.
+        A frame whose publish raises is counted in publish_error_count and dropped, the
+        following frames are still released.
+        Args:
+            publish: Coroutine function publishing data on a subject, e.g. nc.publish
+            max_pending: Maximum number of frames waiting for release
+            on_release: Called with the subject and seconds since the frame was received, after publishing
+        """
+        self.publish = publish
+        self.max_pending = max_pending
+        self.on_release = on_release
+        self.heap = []
+        self.sequence = itertools.count()  # Keeps frames with equal deadlines in arrival order
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task: Optional[asyncio.Task] = None  # Dispatcher task
+        self.waiter: Optional[asyncio.Future] = None  # Wakes the dispatcher on an earlier deadline
+        self.space: Optional[asyncio.Event] = None  # Set while the heap has room
+        self.releasing = False  # Only one coroutine publishes at a time to keep release order
+        self.released_count = 0
+        self.publish_error_count = 0
+        self.full_wait_count = 0
+        self.peak_pending = 0
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def now(self) -> float:
+        """Current time on the scheduler's monotonic clock."""
+        return self.loop.time()
+
+    async def schedule(self, deadline: float, subject: str, data: bytes, received: float = None) -> None:
+        """
+        Queue a frame to be published on subject at deadline (see now()).
+        received is the time the frame arrived (see now()), the deadline when not given.
+        Callers that need per-flow ordering must pass non-decreasing deadlines for a flow;
+        frames with equal deadlines are released in the order they were scheduled.
+        Waits for room if max_pending frames are already queued.
+        """
+        while len(self.heap) >= self.max_pending:
+            self.full_wait_count += 1
+            self.space.clear()
+            await self.space.wait()
+
+        heap = self.heap
+        heapq.heappush(heap, (deadline, next(self.sequence), subject, data,
+                              deadline if received is None else received))
+        if len(heap) > self.peak_pending:
+            self.peak_pending = len(heap)
+        if heap[0][0] <= self.loop.time():
+            # Callbacks of a busy subscription do not yield to the dispatcher, release due frames here
+            await self.release_due()
+        elif heap[0][0] == deadline and self.waiter is not None and not self.waiter.done():
+            # Wake the dispatcher since this frame is now the first to be released
+            self.waiter.set_result(None)
+
+    async def release_due(self, until: Optional[float] = None) -> None:
+        """Publish every frame whose deadline has passed, or is not after until, in deadline order."""
+        if self.releasing:
+            return
+        self.releasing = True
+        heap = self.heap
+        time = self.loop.time
+        on_release = self.on_release
+        try:
+            while heap and heap[0][0] <= (time() if until is None else until):
+                _, _, subject, data, received = heapq.heappop(heap)
+                try:
+                    await self.publish(subject, data)
+                except Exception as e:
+                    # Raising here would stop the dispatcher, or fail the unrelated caller of schedule()
+                    self.publish_error_count += 1
+                    if self.publish_error_count & (self.publish_error_count - 1) == 0:
+                        # Logged on the 1st, 2nd, 4th, 8th... failure, a lost connection fails every frame
+                        logger.warning(f"Could not release a frame on {subject}: {e!r} "
+                                       f"({self.publish_error_count} frames lost so far)")
+                    continue
+                self.released_count += 1
+                if on_release is not None:
+                    on_release(subject, time() - received)
+        finally:
+            self.releasing = False
+        if len(heap) < self.max_pending:
+            self.space.set()
+
+    async def drain(self, timeout: Optional[float] = None) -> int:
+        """
+        Release every queued frame, e.g. before exiting: frames due within timeout seconds at their
+        deadlines, then the later ones at once. Works whether the dispatcher runs or not.
+        Returns the number of frames released before their deadline.
+        """
+        loop = self.loop
+        heap = self.heap
+        end = None if timeout is None else loop.time() + timeout
+        while heap and (end is None or heap[0][0] <= end):
+            # Always yields, the dispatcher may be publishing the due frames
+            await asyncio.sleep(max(heap[0][0] - loop.time(), 0.0))
+            await self.release_due()
+        early = len(heap)
+        while heap:
+            await self.release_due(until=float('inf'))
+            await asyncio.sleep(0)
+        return early
+
+    async def run(self) -> None:
+        """Dispatcher loop, publishes frames whose deadline has passed."""
+        self.loop = asyncio.get_running_loop()
+        self.space = asyncio.Event()
+        self.space.set()
+        heap = self.heap
+        while True:
+            await self.release_due()
+
+            self.waiter = self.loop.create_future()
+            timer = None
+            if heap:
+                timer = self.loop.call_at(heap[0][0], self._wake)
+            try:
+                await self.waiter
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    async def start(self) -> asyncio.Task:
+        """Start the dispatcher on the running loop, it is kept in self.task."""
+        self.task = asyncio.create_task(self.run())
+        self.task.add_done_callback(self._dispatcher_done)
+        while self.loop is None and not self.task.done():
+            await asyncio.sleep(0)
+        return self.task
+
+    def _dispatcher_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Release dispatcher stopped, {len(self.heap)} delayed frames are no longer released",
+                         exc_info=task.exception())
+
+    def _wake(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def get_stats(self) -> Dict:
+        """Get release queue statistics."""
+        return {
+            'pending': len(self.heap),
+            'max_pending': self.max_pending,
+            'peak_pending': self.peak_pending,
+            'released': self.released_count,
+            'publish_errors': self.publish_error_count,
+            'full_waits': self.full_wait_count
+        }
@@ -0,0 +1,371 @@
+"""
+Discrete-event simulation of the covert channel experiment: code/sec/phase2_experiment_sender.py
+sends a message repeatedly through the processor to code/insec/covert_channel_receiver.py, which
+answers with the decoded bits. Sleeps, network hops and mitigation delays advance a virtual
+clock instead of the wall clock, so a trial taking minutes in the lab is simulated in
+milliseconds. Frames go through PacketProcessor.inspect(), the processor's own detection and
+delay models. Run from code/python-processor:
+
+    python -m simulator.covert_channel --message Hello --trials 20 --mitigation_mode delay
+"""
+import argparse
+import heapq
+import itertools
+import json
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from bench.traces import create_bitstream_from_message, udp_frame, INSECURE_HOST_IP, SECURE_HOST_IP
+from processor.packet_processor import MITIGATION_MODES, PacketProcessor
+
+# "none" runs detection without delaying anything, to measure the channel and the detector alone
+SIMULATED_MITIGATION_MODES = ("none",) + MITIGATION_MODES
+
+COVERT_PORT = 8002
+SENDER_FIRST_PORT = 40000  # Every trial opens a new socket, hence a new flow
+BENIGN_FIRST_PORT = 50000
+
+
+class DiscardNATS:
+    async def publish(self, subject: str, payload: bytes = b'', headers: Dict = None) -> None:
+        pass
+
+
+class EventQueue:
+    """Virtual clock with callbacks run in time order, callbacks due at the same time run in scheduling order."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.heap = []
+        self.sequence = itertools.count()
+
+    def at(self, when: float, callback: Callable, *args) -> None:
+        heapq.heappush(self.heap, (when, next(self.sequence), callback, args))
+
+    def run(self) -> None:
+        heap = self.heap
+        pop = heapq.heappop
+        while heap:
+            self.now, _, callback, args = pop(heap)
+            callback(*args)
+
+
+class CovertReceiver:
+    def __init__(self,
+                 sender_bit_delay: float,
+                 given_delay_threshold: float,
+                 bit_repeat_len: int,
+                 bitstream_len: int,
+                 respond: Callable[[str, int], None]):
+        """
+        Initialize the decoding state of covert_channel_receiver.py.
+        Its state is kept across messages like the receiver's, so the gap between two trials
+        is averaged into the first bit of the next message.
+        Args:
+            sender_bit_delay: Senders bit delay for 0
+            given_delay_threshold: Added to sender_bit_delay to tolerate other delays
+            bit_repeat_len: How many packets the sender sends for 1 bit
+            bitstream_len: Bits decoded before answering
+            respond: Called with the decoded bits and the port of the packet that completed them
+        """
+        self.ipd_threshold = sender_bit_delay + given_delay_threshold
+        self.bit_repeat_len = bit_repeat_len
+        self.bitstream_len = bitstream_len
+        self.respond = respond
+        self.last_timestamp: Optional[float] = None
+        self.recv_times: List[float] = []
+        self.is_first_data_received = False
+        self.resulting_stream = ""
+
+    def receive(self, now: float, port: int) -> None:
+        recv_times = self.recv_times
+        if self.last_timestamp is not None:
+            recv_times.append(now - self.last_timestamp)
+        self.last_timestamp = now
+        bit_repeat_len = self.bit_repeat_len
+        if len(recv_times) >= bit_repeat_len or (len(recv_times) >= bit_repeat_len - 1 and not self.is_first_data_received):
+            self.is_first_data_received = True
+            self.resulting_stream += "0" if sum(recv_times) / len(recv_times) < self.ipd_threshold else "1"
+            recv_times.clear()
+            if len(self.resulting_stream) >= self.bitstream_len:
+                self.respond(self.resulting_stream, port)
+                self.resulting_stream = ""
+
+
+class ExperimentSender:
+    def __init__(self,
+                 events: EventQueue,
+                 bitstream: str,
+                 bit_delay: Dict[str, float],
+                 bit_repeat_len: int,
+                 trials: int,
+                 send: Callable[[int], None],
+                 sleep_overshoot: Callable[[], float],
+                 response_timeout: float):
+        """
+        Initialize the trial loop of phase2_experiment_sender.py.
+        Each trial sends bit_repeat_len packets per bit from a new socket, sleeping the bit's
+        delay after every packet, then blocks until the receiver's answer arrives.
+        Args:
+            events: Event queue of the simulation
+            bitstream: Bits sent in every trial
+            bit_delay: Gap after a packet by bit value (seconds)
+            bit_repeat_len: How many packets are sent for 1 bit
+            trials: Number of times the message is sent
+            send: Sends a packet from the given source port at the current virtual time
+            sleep_overshoot: Returns how much longer than asked a time.sleep() takes
+            response_timeout: Seconds to wait for an answer before the trial counts as timed out
+        """
+        self.events = events
+        self.bitstream = bitstream
+        self.bit_delay = bit_delay
+        self.bit_repeat_len = bit_repeat_len
+        self.trials = trials
+        self.send = send
+        self.sleep_overshoot = sleep_overshoot
+        self.response_timeout = response_timeout
+        self.trial = -1
+        self.trial_start = 0.0
+        self.waiting = False
+        self.response: Optional[str] = None
+        self.bers: List[float] = []
+        self.capacities: List[float] = []
+        self.transmission_times: List[float] = []
+        self.timeouts = 0
+        self.done = False
+
+    @property
+    def port(self) -> int:
+        return SENDER_FIRST_PORT + self.trial
+
+    def start_trial(self) -> None:
+        events = self.events
+        self.trial += 1
+        self.trial_start = when = events.now
+        self.waiting = False
+        self.response = None
+        for bit in self.bitstream:
+            delay = self.bit_delay[bit]
+            for _ in range(self.bit_repeat_len):
+                events.at(when, self.send, self.port)
+                when += delay + self.sleep_overshoot()
+        events.at(when, self.wait_response, self.trial)
+        events.at(when + self.response_timeout, self.time_out, self.trial)
+
+    def deliver(self, bits: str, port: int) -> None:
+        """An answer reached the sender's host, answers to sockets of earlier trials are lost."""
+        if self.done or port != self.port:
+            return
+        if self.waiting:
+            self.finish(bits)
+        elif self.response is None:
+            self.response = bits
+
+    def wait_response(self, trial: int) -> None:
+        if self.response is not None:
+            self.finish(self.response)
+        else:
+            self.waiting = True
+
+    def time_out(self, trial: int) -> None:
+        if trial == self.trial and self.waiting:
+            self.timeouts += 1
+            self.finish("")
+
+    def finish(self, received_bits: str) -> None:
+        # Metrics as computed by the sender's experiment
+        total_time = self.events.now - self.trial_start
+        errors = sum(a != b for a, b in zip(self.bitstream, received_bits))
+        self.bers.append(errors / len(self.bitstream))
+        self.capacities.append((len(received_bits) - errors) / total_time)
+        self.transmission_times.append(total_time)
+        self.waiting = False
+        if self.trial + 1 < self.trials:
+            self.start_trial()
+        else:
+            self.done = True
+
+
+def simulate(message: str = "Hello",
+             zero_bit_delay: float = 0.3,
+             one_bit_delay: float = 0.9,
+             bit_repeat_len: int = 5,
+             given_delay_threshold: float = 0.3,
+             trials: int = 10,
+             mitigation_mode: str = "delay",
+             detection_threshold: float = 0.65,
+             window_size: int = 30,
+             mean_value: float = 5e-6,
+             min_delay: float = 0.6,
+             max_delay: float = 1.6,
+             benign_flows: int = 10,
+             benign_mean_ipd: float = 0.1,
+             latency: float = 0.0005,
+             jitter: float = 0.0002,
+             sleep_overshoot: float = 0.0001,
+             response_timeout: float = 60.0,
+             seed: int = 0) -> Dict:
+    """
+    Simulate trials of the experiment with benign flows from other ports of the secure host
+    sharing the processor, and return the sender's BER and capacity with detection and false
+    positive rates.
+    Args:
+        message: Message sent in every trial, a bitstream or text
+        zero_bit_delay: Zero's bit delay time
+        one_bit_delay: One's bit delay time
+        bit_repeat_len: How many packets are sent for 1 bit
+        given_delay_threshold: Receiver's delay threshold
+        trials: Times the message is sent
+        mitigation_mode: "none" to only detect, or one of the processor's MITIGATION_MODES
+        detection_threshold: Detection threshold (0-1)
+        window_size: Window size for detector
+        mean_value: Mean of the processor's random delay on every frame
+        min_delay: Minimum mitigation delay
+        max_delay: Maximum mitigation delay
+        benign_flows: Number of benign flows running during the trials
+        benign_mean_ipd: Mean of their exponential ipds
+        latency: One-way latency of every network hop (seconds)
+        jitter: Standard deviation of the latency between the hosts and the switch (seconds)
+        sleep_overshoot: Mean time a time.sleep() of the sender takes longer than asked (seconds)
+        response_timeout: Seconds the sender waits for an answer
+        seed: Seed of every random draw, processor included
+    """
+    if mitigation_mode not in SIMULATED_MITIGATION_MODES:
+        raise ValueError(f"Unknown mitigation mode {mitigation_mode!r}, expected one of {SIMULATED_MITIGATION_MODES}")
+    rng = random.Random(seed)
+    # The processor draws its delays from the random module
+    random.seed(seed)
+    wall_start = time.perf_counter()
+
+    events = EventQueue()
+    detect_only = mitigation_mode == "none"
+    processor = PacketProcessor(DiscardNATS(), mean_value, 0.0 if detect_only else min_delay,
+                                0.0 if detect_only else max_delay, window_size=window_size,
+                                detection_threshold=detection_threshold,
+                                mitigation_mode="delay" if detect_only else mitigation_mode)
+    bitstream = create_bitstream_from_message(message)
+    flagged_ports = set()
+    covert_packets = [0, 0]  # Frames, frames flagged
+    benign_packets = [0, 0]
+
+    def network_delay() -> float:
+        return latency + abs(rng.gauss(0, jitter))
+
+    def inspect(subject: str, frame: bytes, port: int, counts: List[int]) -> float:
+        """Frame arrives at the switch now, returns when the switch sends it on."""
+        now = events.now
+        detections = processor.detected_covert_channel_count
+        release_at = processor.inspect(subject, frame, now, now)
+        counts[0] += 1
+        if processor.detected_covert_channel_count != detections:
+            counts[1] += 1
+            flagged_ports.add(port)
+        # Switch to processor and back
+        return release_at + 2 * latency
+
+    frames = {}
+
+    def covert_frame(port: int) -> bytes:
+        frame = frames.get(port)
+        if frame is None:
+            frame = frames[port] = udp_frame(SECURE_HOST_IP, INSECURE_HOST_IP, port, COVERT_PORT, b"bit")
+        return frame
+
+    def covert_at_switch(port: int) -> None:
+        events.at(inspect("inpktsec", covert_frame(port), port, covert_packets) + network_delay(),
+                  covert_at_receiver, port)
+
+    def covert_at_receiver(port: int) -> None:
+        receiver.receive(events.now, port)
+
+    def send_covert(port: int) -> None:
+        events.at(events.now + network_delay(), covert_at_switch, port)
+
+    def answer_at_switch(bits: str, port: int) -> None:
+        frame = udp_frame(INSECURE_HOST_IP, SECURE_HOST_IP, COVERT_PORT, port, bits.encode())
+        events.at(inspect("inpktinsec", frame, port, [0, 0]) + network_delay(), sender.deliver, bits, port)
+
+    def respond(bits: str, port: int) -> None:
+        events.at(events.now + network_delay(), answer_at_switch, bits, port)
+
+    def send_benign(port: int) -> None:
+        if sender.done:
+            return
+        events.at(events.now + network_delay(), benign_at_switch, port)
+        events.at(events.now + rng.expovariate(1 / benign_mean_ipd), send_benign, port)
+
+    def benign_at_switch(port: int) -> None:
+        frame = frames.get(port)
+        if frame is None:
+            frame = frames[port] = udp_frame(SECURE_HOST_IP, INSECURE_HOST_IP, port, 8000, b"data")
+        inspect("inpktsec", frame, port, benign_packets)
+
+    receiver = CovertReceiver(zero_bit_delay, given_delay_threshold, bit_repeat_len, len(bitstream), respond)
+    sender = ExperimentSender(events, bitstream, {"0": zero_bit_delay, "1": one_bit_delay}, bit_repeat_len, trials,
+                              send_covert, lambda: rng.expovariate(1 / sleep_overshoot) if sleep_overshoot else 0.0,
+                              response_timeout)
+
+    for flow in range(benign_flows):
+        events.at(rng.uniform(0, benign_mean_ipd), send_benign, BENIGN_FIRST_PORT + flow)
+    events.at(0.0, sender.start_trial)
+    events.run()
+
+    covert_ports = {SENDER_FIRST_PORT + trial for trial in range(sender.trial + 1)}
+    bers = np.array(sender.bers)
+    capacities = np.array(sender.capacities)
+    return {
+        'trials': len(bers),
+        'ber': float(bers.mean()),
+        'ber_std': float(bers.std()),
+        'capacity_bps': float(capacities.mean()),
+        'capacity_bps_std': float(capacities.std()),
+        'transmission_seconds': float(np.mean(sender.transmission_times)),
+        'timeouts': sender.timeouts,
+        'detection_rate': len(flagged_ports & covert_ports) / max(len(covert_ports), 1),
+        'covert_packets_flagged': covert_packets[1] / max(covert_packets[0], 1),
+        'false_positive_rate': len(flagged_ports - covert_ports) / benign_flows if benign_flows else 0.0,
+        'benign_packets_flagged': benign_packets[1] / max(benign_packets[0], 1),
+        'packets': covert_packets[0] + benign_packets[0],
+        'virtual_seconds': events.now,
+        'wall_seconds': time.perf_counter() - wall_start
+    }
+
+
+def add_simulation_arguments(parser: argparse.ArgumentParser, nargs: Optional[str] = None) -> None:
+    """Add the parameters of simulate(), with nargs="+" every parameter takes a list of values to sweep."""
+    parser.add_argument("--message", type=str, nargs=nargs, default="Hello", help="Message sent in every trial")
+    parser.add_argument("--zero_bit_delay", type=float, nargs=nargs, default=0.3, help="Zero's bit delay time")
+    parser.add_argument("--one_bit_delay", type=float, nargs=nargs, default=0.9, help="One's bit delay time")
+    parser.add_argument("--bit_repeat_len", type=int, nargs=nargs, default=5, help="How many packets sends the same bit")
+    parser.add_argument("--given_delay_threshold", type=float, nargs=nargs, default=0.3, help="Receiver's delay threshold")
+    parser.add_argument("--trials", type=int, nargs=nargs, default=10, help="Times the message is sent")
+    parser.add_argument("--mitigation_mode", choices=SIMULATED_MITIGATION_MODES, nargs=nargs, default="delay",
+                        help="Processor mitigation, none to only detect")
+    parser.add_argument("--detection_threshold", type=float, nargs=nargs, default=0.65, help="Detection threshold (0-1)")
+    parser.add_argument("--window_size", type=int, nargs=nargs, default=30, help="Window size for detector")
+    parser.add_argument("--mean_value", type=float, nargs=nargs, default=5e-6, help="Mean value for random delay")
+    parser.add_argument("--min_delay", type=float, nargs=nargs, default=0.6, help="Minimum mitigation delay")
+    parser.add_argument("--max_delay", type=float, nargs=nargs, default=1.6, help="Maximum mitigation delay")
+    parser.add_argument("--benign_flows", type=int, nargs=nargs, default=10, help="Benign flows sharing the processor")
+    parser.add_argument("--benign_mean_ipd", type=float, nargs=nargs, default=0.1, help="Mean ipd of benign flows")
+    parser.add_argument("--latency", type=float, nargs=nargs, default=0.0005, help="One-way latency of a network hop")
+    parser.add_argument("--jitter", type=float, nargs=nargs, default=0.0002, help="Jitter of the host to switch latency")
+    parser.add_argument("--sleep_overshoot", type=float, nargs=nargs, default=0.0001,
+                        help="Mean time the sender's sleeps overshoot")
+    parser.add_argument("--response_timeout", type=float, nargs=nargs, default=60.0,
+                        help="Seconds the sender waits for the receiver's answer")
+    parser.add_argument("--seed", type=int, nargs=nargs, default=0, help="Random seed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Covert channel experiment simulator")
+    add_simulation_arguments(parser)
+    args = parser.parse_args()
+    print(json.dumps(simulate(**vars(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
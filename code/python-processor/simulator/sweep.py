@@ -0,0 +1,82 @@
+"""
+Run the covert channel simulator over a grid of parameters in a process pool and write BER,
+capacity, detection rate and false positive tables. Every parameter of the simulator takes a
+list of values, the grid is their cartesian product. Run from code/python-processor:
+
+    python -m simulator.sweep --zero_bit_delay 0.1 0.2 0.3 --one_bit_delay 0.6 0.9 \
+        --bit_repeat_len 3 5 --detection_threshold 0.55 0.65 0.75 --output_dir sweep_results
+"""
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from simulator.covert_channel import add_simulation_arguments, simulate
+
+# Table file name -> result columns written to it
+TABLES = {
+    "ber.csv": ("ber", "ber_std", "timeouts"),
+    "capacity.csv": ("capacity_bps", "capacity_bps_std", "transmission_seconds"),
+    "detection.csv": ("detection_rate", "covert_packets_flagged"),
+    "false_positives.csv": ("false_positive_rate", "benign_packets_flagged"),
+}
+
+
+def grid(args) -> List[Dict]:
+    """Parameter sets of the cartesian product of every parameter's values."""
+    names = list(vars(args))
+    return [dict(zip(names, values)) for values in itertools.product(*(vars(args)[name] for name in names))]
+
+
+def write_table(path: str, parameters: List[str], rows: List[Dict], columns) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(parameters + list(columns))
+        for row in rows:
+            writer.writerow([row[name] for name in parameters] + [row[column] for column in columns])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Covert channel parameter sweep")
+    add_simulation_arguments(parser, nargs="+")
+    sweep = parser.add_argument_group("sweep")
+    sweep.add_argument("--workers", type=int, default=os.cpu_count(), help="Simulations run in parallel")
+    sweep.add_argument("--output_dir", type=str, default="sweep_results", help="Directory the tables are written to")
+    args = parser.parse_args()
+    workers, output_dir = args.workers, args.output_dir
+    del args.workers, args.output_dir
+    # Single defaults come back as scalars
+    for name, value in vars(args).items():
+        if not isinstance(value, list):
+            setattr(args, name, [value])
+
+    points = grid(args)
+    # Only parameters that vary identify a row
+    parameters = [name for name, values in vars(args).items() if len(values) > 1] or ["seed"]
+    print(f"Simulating {len(points)} parameter sets on {workers} workers")
+    start = time.perf_counter()
+    rows = []
+    with ProcessPoolExecutor(workers) as pool:
+        for point, result in zip(points, pool.map(_simulate, points)):
+            rows.append(dict(point, **result))
+            print(", ".join(f"{name}={point[name]}" for name in parameters) +
+                  f": BER {result['ber']:.3f}, {result['capacity_bps']:.3f} bits/s, "
+                  f"detection {result['detection_rate']:.2f}, FP {result['false_positive_rate']:.2f}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    write_table(os.path.join(output_dir, "sweep.csv"), list(vars(args)), rows,
+                [column for column in rows[0] if column not in vars(args)])
+    for name, columns in TABLES.items():
+        write_table(os.path.join(output_dir, name), parameters, rows, columns)
+    print(f"{len(rows)} simulations in {time.perf_counter() - start:.1f}s, tables written to {output_dir}")
+
+
+def _simulate(point: Dict) -> Dict:
+    return simulate(**point)
+
+
+if __name__ == '__main__':
+    main()
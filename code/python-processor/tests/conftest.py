@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules are imported from code/python-processor, as when the processor runs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
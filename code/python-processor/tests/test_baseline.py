@@ -0,0 +1,59 @@
+import pytest
+
+from detector.baseline import BASELINE_MIN_SAMPLES, BaselineEstimator, BaselineStore
+
+
+def test_first_samples_give_plain_mean_and_std():
+    values = [0.01 * (index % 7) + 0.02 for index in range(BASELINE_MIN_SAMPLES)]
+    estimator = BaselineEstimator(decay=0.01)
+    for value in values:
+        estimator.update(value)
+    mean = sum(values) / len(values)
+    assert estimator.established
+    assert estimator.mean == pytest.approx(mean)
+    assert estimator.std() == pytest.approx((sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5)
+
+
+def test_zero_decay_freezes_baseline():
+    estimator = BaselineEstimator(decay=0)
+    for _ in range(BASELINE_MIN_SAMPLES):
+        estimator.update(0.05)
+    estimator.update(10.0)
+    assert estimator.mean == pytest.approx(0.05)
+    assert estimator.count == BASELINE_MIN_SAMPLES
+
+
+def test_save_load_round_trip(tmp_path):
+    store = BaselineStore(decay=0.02, max_entries=10)
+    for index in range(5):
+        estimator = store.get(bytes([index]) * (index + 1))
+        for sample in range(index * 30):
+            estimator.update(0.001 * (sample % 11))
+    store.get(b"\x00")  # Most recently used
+    path = str(tmp_path / "baselines.bin")
+    store.save(path)
+
+    loaded = BaselineStore(decay=0.02, max_entries=10)
+    assert loaded.load(path) == 5
+    assert list(loaded.entries) == list(store.entries)
+    for key, estimator in store.entries.items():
+        other = loaded.entries[key]
+        assert (other.mean, other.variance, other.count, other.decay) == (
+            estimator.mean, estimator.variance, estimator.count, estimator.decay)
+
+
+def test_load_keeps_most_recent_entries():
+    store = BaselineStore(max_entries=10)
+    for index in range(6):
+        store.get(bytes([index]))
+    loaded = BaselineStore(max_entries=4)
+    loaded.loads(store.dumps())
+    assert list(loaded.entries) == [bytes([index]) for index in range(2, 6)]
+    assert loaded.evicted == 2
+
+
+def test_load_missing_and_invalid(tmp_path):
+    store = BaselineStore()
+    assert store.load(str(tmp_path / "missing.bin")) == 0
+    with pytest.raises(ValueError):
+        store.loads(b"XXXX\x01\x00\x00\x00\x00\x00")
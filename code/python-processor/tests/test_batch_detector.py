@@ -0,0 +1,75 @@
+import random
+
+import numpy as np
+import pytest
+
+from detector.batch_detector import SCORE_NAMES, detect_batch
+from detector.covert_channel_detector import CovertChannelDetector
+from detector.pipeline import DetectorPipeline
+
+
+def interleaved_capture(seed: int, flows: int = 12, packets: int = 260):
+    """Timestamps and flow ids of benign, covert and tie-heavy flows interleaved in arrival order."""
+    rng = random.Random(seed)
+    timestamps, flow_ids = [], []
+    for flow in range(flows):
+        timestamp = rng.uniform(0, 5)
+        for index in range(packets):
+            kind = flow % 3
+            if kind == 0:
+                ipd = rng.expovariate(20)
+            elif kind == 1:
+                # Benign start for the baseline, then a covert channel
+                ipd = rng.expovariate(20) if index < 130 else rng.choice((0.3, 0.9)) + rng.gauss(0, 0.002)
+            else:
+                ipd = rng.choice((0.05, 0.15, 0.3, 0.6, 0.9))
+            timestamp += ipd
+            timestamps.append(timestamp)
+            flow_ids.append(1000 + flow)
+    order = np.argsort(timestamps, kind="stable")
+    return np.array(timestamps)[order], np.array(flow_ids)[order]
+
+
+@pytest.mark.parametrize("window_size", [16, 30, 50])
+def test_matches_streaming_detector(window_size):
+    timestamps, flow_ids = interleaved_capture(window_size)
+    is_covert, total, scores = detect_batch(timestamps, flow_ids, window_size=window_size, threshold=0.65)
+    detectors = {}
+    for index, (timestamp, flow_id) in enumerate(zip(timestamps, flow_ids)):
+        detector = detectors.get(flow_id)
+        if detector is None:
+            detector = detectors[flow_id] = CovertChannelDetector(window_size=window_size, threshold=0.65,
+                                                                  baseline_decay=0)
+        detector.add_packet(timestamp)
+        expected_covert, expected_total, expected_scores = detector.detect()
+        assert is_covert[index] == expected_covert
+        assert total[index] == pytest.approx(expected_total)
+        for name in SCORE_NAMES:
+            assert scores[name][index] == pytest.approx(expected_scores.get(name, 0.0)), name
+    assert is_covert.any()
+
+
+def test_detector_method_uses_its_settings():
+    timestamps, flow_ids = interleaved_capture(1, flows=3)
+    detector = CovertChannelDetector(window_size=30, threshold=0.5, pipeline=DetectorPipeline.from_specs(None))
+    is_covert, total, _ = detector.detect_batch(timestamps, flow_ids)
+    expected_covert, expected_total, _ = detect_batch(timestamps, flow_ids, window_size=30, threshold=0.5)
+    assert np.array_equal(is_covert, expected_covert)
+    assert np.array_equal(total, expected_total)
+    assert detector.total_packets == 0
+
+
+def test_detector_method_rejects_what_it_cannot_vectorize():
+    timestamps = np.arange(100) * 0.1
+    with pytest.raises(ValueError):
+        CovertChannelDetector(baseline_decay=0.01).detect_batch(timestamps)
+    with pytest.raises(ValueError):
+        CovertChannelDetector(baseline_decay=0, pipeline=DetectorPipeline.from_specs(["entropy"])).detect_batch(
+            timestamps)
+
+
+def test_short_and_empty_captures():
+    is_covert, total, scores = detect_batch(np.array([]), window_size=30)
+    assert len(is_covert) == len(total) == 0
+    is_covert, total, scores = detect_batch(np.arange(10) * 0.1, window_size=30)
+    assert not is_covert.any() and not total.any()
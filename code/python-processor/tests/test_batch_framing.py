@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from bench.traces import udp_frame
+from processor.batch_framing import BATCH_PREFIX, RECORD_HEADER, BatchPublisher, encode_batch, iter_batch
+from processor.packet_processor import PacketProcessor
+
+
+def test_round_trip():
+    records = [(1_700_000_000_123_456_789, b"frame one"), (0, b""), (2 ** 64 - 1, bytes(range(256)) * 6)]
+    decoded = [(timestamp, bytes(frame)) for timestamp, frame in iter_batch(encode_batch(records))]
+    assert decoded == records
+
+
+def test_frames_are_views():
+    payload = encode_batch([(1, b"abc")])
+    (_, frame), = iter_batch(payload)
+    assert isinstance(frame, memoryview)
+    assert frame.obj is payload
+
+
+def test_truncated_last_record_dropped():
+    payload = encode_batch([(1, b"first"), (2, b"second")])
+    assert [bytes(frame) for _, frame in iter_batch(payload[:-1])] == [b"first"]
+    assert [bytes(frame) for _, frame in iter_batch(payload[:RECORD_HEADER.size - 1])] == []
+    assert list(iter_batch(b"")) == []
+
+
+def test_publisher_batches_frames():
+    async def run():
+        messages = []
+
+        async def publish(subject, data):
+            messages.append((subject, data))
+
+        publisher = BatchPublisher(publish, batch_size=3, flush_us=1000)
+        for index in range(4):
+            await publisher.publish("outpktsec", bytes([index]))
+        # A full batch is sent at once, the last frame waits for flush_us
+        assert len(messages) == 1
+        await asyncio.sleep(0.02)
+        assert len(messages) == 2
+        assert all(subject == BATCH_PREFIX + "outpktsec" for subject, _ in messages)
+        frames = [bytes(frame) for _, data in messages for _, frame in iter_batch(data)]
+        assert frames == [b"\x00", b"\x01", b"\x02", b"\x03"]
+        assert publisher.get_stats() == {'batches': 2, 'frames': 4, 'pending': 0}
+
+    asyncio.run(run())
+
+
+def test_processor_drain_forwards_delayed_and_batched_frames():
+    async def run():
+        messages = []
+
+        class Connection:
+            async def publish(self, subject, data):
+                messages.append((subject, data))
+
+        processor = PacketProcessor(Connection(), 0.05, 0.6, 1.6, batch_size=64, batch_flush_us=10_000_000)
+        await processor.start()
+        frames = [udp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, bytes([index])) for index in range(5)]
+        for frame in frames:
+            await processor.handle_frame("inpktsec", frame, time.time())
+        # Still delayed or waiting for their batch to fill
+        assert messages == []
+        await processor.drain(timeout=5.0)
+        assert len(processor.scheduler) == 0
+        assert [bytes(frame) for _, data in messages for _, frame in iter_batch(data)] == frames
+
+    asyncio.run(run())
@@ -0,0 +1,149 @@
+import random
+from collections import deque
+
+import numpy as np
+import pytest
+
+from detector.covert_channel_detector import CovertChannelDetector
+
+
+class ReferenceDetector:
+    """
+    Frozen copy of the original numpy detector, without its debug prints. Tied modes are ordered
+    with a stable sort: the original's default np.argsort ordered them arbitrarily, the incremental
+    detector deliberately sends ties to the larger delay, which is what a stable sort gives.
+    """
+
+    def __init__(self, window_size: int, threshold: float):
+        self.window_size = window_size
+        self.threshold = threshold
+        self.packet_times = deque(maxlen=window_size * 2)
+        self.ipd_history = deque(maxlen=3 * window_size)
+        self.baseline_delays = deque(maxlen=100)
+        self.baseline_established = False
+
+    def add_packet(self, timestamp: float) -> None:
+        self.packet_times.append(timestamp)
+        if len(self.packet_times) >= 2:
+            ipd = self.packet_times[-1] - self.packet_times[-2]
+            self.ipd_history.append(ipd)
+            if not self.baseline_established and len(self.baseline_delays) < 100 and ipd < 0.2:
+                self.baseline_delays.append(ipd)
+                if len(self.baseline_delays) == 100:
+                    self.baseline_established = True
+
+    def detect(self):
+        if len(self.packet_times) < self.window_size:
+            return False, 0.0, {"total_score": 0.0}
+        delays = list(self.ipd_history)[-self.window_size:]
+        if len(delays) < self.window_size - 1:
+            return False, 0.0, {"total_score": 0.0}
+        delays = np.array(delays)
+        score = 0.0
+        detailed_scores = {}
+
+        unique_delays, counts = np.unique(np.round(delays, 3), return_counts=True)
+        bimodal_score = 0.0
+        if len(unique_delays) >= 2:
+            count_ratio = min(counts) / max(counts)
+            if count_ratio > 0.5:
+                sorted_indices = np.argsort(counts, kind="stable")[::-1]
+                top_2_delays = unique_delays[sorted_indices[:2]]
+                value_ratio = max(top_2_delays) / max(min(top_2_delays), 0.001)
+                if value_ratio > 2.0 and max(unique_delays) - min(unique_delays) > 0.2:
+                    bimodal_score = 0.5
+        detailed_scores['bimodal'] = bimodal_score
+        score += bimodal_score
+
+        cv = np.std(delays) / max(np.mean(delays), 0.001)
+        regularity_score = 0.3 if cv < 0.7 else 0.0
+        detailed_scores['regularity'] = regularity_score
+        score += regularity_score
+
+        baseline_score = 0.0
+        if self.baseline_established and len(self.baseline_delays) > 0:
+            baseline_mean = np.mean(self.baseline_delays)
+            baseline_std = np.std(self.baseline_delays)
+            if baseline_std > 0 and abs(np.mean(delays) - baseline_mean) / baseline_std > 2.0:
+                baseline_score = 0.2
+        detailed_scores['baseline_deviation'] = baseline_score
+        score += baseline_score
+
+        pattern_score = 0.0
+        if len(unique_delays) >= 2:
+            sorted_indices = np.argsort(counts, kind="stable")[::-1]
+            top_two_delays = unique_delays[sorted_indices[:2]]
+            min_delay = min(top_two_delays)
+            max_delay = max(top_two_delays)
+            if max_delay > 0.5 and min_delay > 0.1:
+                for band in (0.2, 0.1):
+                    if max_delay - min_delay > band:
+                        short_delays = np.sum((delays >= min_delay - band) & (delays <= min_delay + band))
+                        long_delays = np.sum((delays >= max_delay - band) & (delays <= max_delay + band))
+                        if (short_delays + long_delays) / len(delays) > 0.6:
+                            pattern_score = 0.4
+        detailed_scores['pattern_match'] = pattern_score
+        score += pattern_score
+
+        score = min(1.0, score)
+        detailed_scores['total_score'] = score
+        return score > self.threshold, score, detailed_scores
+
+
+def benign_ipds(rng: random.Random, count: int):
+    return [rng.expovariate(10) for _ in range(count)]
+
+
+def covert_ipds(rng: random.Random, count: int):
+    return [rng.choice((0.3, 0.9)) + rng.gauss(0, 0.003) for _ in range(count)]
+
+
+def tied_ipds(rng: random.Random, count: int):
+    # Few distinct delays so that several of them share the top counts
+    values = rng.sample((0.05, 0.15, 0.2, 0.3, 0.45, 0.6, 0.9, 1.2), rng.randint(2, 5))
+    return [rng.choice(values) for _ in range(count)]
+
+
+def mixed_ipds(rng: random.Random, count: int):
+    # A benign start establishes the baseline, the covert part then deviates from it
+    return benign_ipds(rng, count // 2) + covert_ipds(rng, count - count // 2)
+
+
+@pytest.mark.parametrize("generate", [benign_ipds, covert_ipds, tied_ipds, mixed_ipds])
+@pytest.mark.parametrize("window_size", [16, 30, 50])
+def test_decisions_match_reference(generate, window_size):
+    rng = random.Random(f"{generate.__name__}-{window_size}")
+    threshold = 0.65
+    compared = 0
+    for _ in range(20):
+        # A frozen baseline learns from the first 100 short delays like the original detector
+        detector = CovertChannelDetector(window_size=window_size, threshold=threshold, baseline_decay=0)
+        reference = ReferenceDetector(window_size, threshold)
+        timestamp = rng.uniform(0, 100)
+        for ipd in [0.0] + generate(rng, 4 * window_size):
+            timestamp += ipd
+            detector.add_packet(timestamp)
+            reference.add_packet(timestamp)
+            is_covert, score, scores = detector.detect()
+            expected_covert, expected_score, expected_scores = reference.detect()
+            assert is_covert == expected_covert
+            assert score == pytest.approx(expected_score)
+            for name, expected in expected_scores.items():
+                assert scores[name] == pytest.approx(expected), name
+            compared += 1
+    assert compared == 20 * (4 * window_size + 1)
+
+
+def test_tied_modes_go_to_larger_delay():
+    # 0.2 and 0.3 tie behind 0.9: with 0.3 as the second mode the band around 0.3 and 0.9 matches
+    ipds = [0.9] * 8 + [0.3] * 4 + [0.2] * 4 + [0.05] * 4
+    detector = CovertChannelDetector(window_size=len(ipds) + 1, threshold=0.65, baseline_decay=0)
+    reference = ReferenceDetector(len(ipds) + 1, 0.65)
+    timestamp = 0.0
+    for ipd in [0.0] + ipds:
+        timestamp += ipd
+        detector.add_packet(timestamp)
+        reference.add_packet(timestamp)
+    assert detector.ipd_window.top_two() == (900, 300)
+    _, _, scores = detector.detect()
+    assert scores['pattern_match'] == reference.detect()[2]['pattern_match']
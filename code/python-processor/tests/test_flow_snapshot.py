@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+from bench.capture_replay import DiscardNATS
+from bench.traces import synthetic_trace, udp_frame
+from flow.flow_table import flow_key
+from processor.packet_processor import PacketProcessor
+
+
+def new_processor(**kwargs) -> PacketProcessor:
+    return PacketProcessor(DiscardNATS(), 5e-6, 0.6, 1.6, window_size=30, detection_threshold=0.65, **kwargs)
+
+
+def replay(processor: PacketProcessor, frames, seed: int):
+    random.seed(seed)
+    return [processor.inspect(frame.subject, frame.data, frame.timestamp, frame.timestamp) for frame in frames]
+
+
+@pytest.mark.parametrize("kwargs", [{}, {'mitigation_mode': "grid"}, {'scales': (30, 120)}])
+def test_round_trip(kwargs):
+    trace = synthetic_trace(40, 2, 150, seed=3)
+    middle = trace[len(trace) // 2].timestamp
+    old = new_processor(**kwargs)
+    replay(old, [frame for frame in trace if frame.timestamp < middle], 0)
+    new = new_processor(**kwargs)
+    assert new.load_state(old.dump_state()) == len(old.flow_table)
+    assert len(new.baselines) == len(old.baselines)
+
+    now = max(flow.last_seen for flow in old.flow_table.flows.values())
+    for key, original in old.flow_table.flows.items():
+        restored = new.flow_table.get(key, now)
+        a, b = original.detector, restored.detector
+        assert b.ipd_window.window() == a.ipd_window.window()
+        assert (b.total_packets, b.last_packet_time, b.detection_count, b.suspect) == (
+            a.total_packets, a.last_packet_time, a.detection_count, a.suspect)
+        assert (restored.release_at, restored.mitigation_count, restored.analyzed_at) == (
+            original.release_at, original.mitigation_count, original.analyzed_at)
+        assert (restored.pacer is None) == (original.pacer is None)
+        if original.pacer is not None:
+            assert (restored.pacer.interval, restored.pacer.next_slot, restored.pacer.paced_until) == (
+                original.pacer.interval, original.pacer.next_slot, original.pacer.paced_until)
+        assert b.baseline.mean == a.baseline.mean
+    assert new.flow_table.restored == len(old.flow_table)
+
+
+def test_handed_over_processor_continues_like_the_old_one():
+    trace = synthetic_trace(40, 2, 150, seed=4)
+    middle = trace[len(trace) // 2].timestamp
+    first = [frame for frame in trace if frame.timestamp < middle]
+    second = [frame for frame in trace if frame.timestamp >= middle]
+    old = new_processor()
+    replay(old, first, 0)
+    new = new_processor()
+    new.load_state(old.dump_state())
+    before = old.detected_covert_channel_count
+    assert replay(new, second, 1) == replay(old, second, 1)
+    assert new.detected_covert_channel_count == old.detected_covert_channel_count - before > 0
+
+
+def test_idle_flows_not_restored():
+    old = new_processor(flow_idle_timeout=10.0)
+    frame = udp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, b"x")
+    for index in range(5):
+        old.inspect("inpktsec", frame, float(index), float(index))
+    new = new_processor(flow_idle_timeout=10.0)
+    new.load_state(old.dump_state())
+    state = new.flow_table.get(flow_key(frame), 20.0)
+    assert state.detector.total_packets == 0
+    assert new.flow_table.restored == 0
+
+
+def test_invalid_snapshot():
+    with pytest.raises(ValueError):
+        new_processor().load_state(b"XXXX" + bytes(64))
@@ -0,0 +1,130 @@
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from bench.traces import arp_frame, icmp_frame, tcp_frame, udp_frame
+from flow.flow_table import FlowTable, flow_hash, flow_key, shard_of
+
+SWITCH_SOURCE = os.path.join(os.path.dirname(__file__), "..", "..", "mitm", "switch", "switch.c")
+
+
+class CountingDetector:
+    def __init__(self, key):
+        self.key = key
+
+
+def fragment(frame: bytes, offset: int) -> bytes:
+    """frame as an IPv4 fragment at offset (8-byte units), more fragments following."""
+    return frame[:20] + (0x2000 | offset).to_bytes(2, "big") + frame[22:]
+
+
+def frames():
+    return [
+        udp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, b"payload"),
+        fragment(udp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, b"x" * 64), 0),
+        fragment(udp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, b"x" * 64), 185),
+        udp_frame("10.1.0.22", "10.0.0.21", 40000, 8002, b""),
+        tcp_frame("10.0.0.21", "10.1.0.21", 443, 51234, b"x" * 100),
+        icmp_frame("10.1.0.21", "10.0.0.21", 7),
+        arp_frame("10.1.0.21", "10.0.0.21"),
+        b"\x01\x02\x03",
+    ]
+
+
+def test_flow_key_udp():
+    key = flow_key(udp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, b""))
+    assert key == bytes([10, 1, 0, 21, 10, 0, 0, 21, 17]) + (40000).to_bytes(2, "big") + (8002).to_bytes(2, "big")
+
+
+def test_flow_key_fragments():
+    first, later = frames()[1:3]
+    assert flow_key(first) == flow_key(frames()[0])
+    # Later fragments have payload where the ports would be
+    assert flow_key(later) == bytes([10, 1, 0, 21, 10, 0, 0, 21, 17]) + bytes(4)
+
+
+def test_flow_hash_fnv1a_vectors():
+    assert flow_hash(b"") == 0x811C9DC5
+    assert flow_hash(b"a") == 0xE40C292C
+    assert flow_hash(b"foobar") == 0xBF9CF968
+
+
+def test_shard_of():
+    key = flow_key(frames()[0])
+    assert shard_of(key, 1) == 0
+    assert shard_of(key, 4) == flow_hash(key) % 4
+
+
+@pytest.mark.skipif(shutil.which("cc") is None, reason="no C compiler")
+def test_flow_hash_matches_switch(tmp_path):
+    with open(SWITCH_SOURCE) as f:
+        source = f.read()
+    function = re.search(r"^uint32_t flow_hash\(unsigned char \*buffer, int size\) \{.*?^\}", source,
+                         re.MULTILINE | re.DOTALL).group(0)
+    harness = tmp_path / "flow_hash.c"
+    harness.write_text(
+        "#include <stdint.h>\n#include <stdio.h>\n#include <string.h>\n#include <arpa/inet.h>\n"
+        "#include <linux/if_ether.h>\n#include <netinet/in.h>\n#include <netinet/ip.h>\n"
+        + function + "\n"
+        "int main(void) {\n"
+        "    unsigned char buffer[2048];\n"
+        "    unsigned int size;\n"
+        "    while (fread(&size, 4, 1, stdin) == 1 && fread(buffer, 1, size, stdin) == size) {\n"
+        "        printf(\"%u\\n\", flow_hash(buffer, (int)size));\n"
+        "    }\n"
+        "    return 0;\n"
+        "}\n")
+    binary = tmp_path / "flow_hash"
+    subprocess.run(["cc", "-o", str(binary), str(harness)], check=True)
+    data = b"".join(len(frame).to_bytes(4, "little") + frame for frame in frames())
+    output = subprocess.run([str(binary)], input=data, capture_output=True, check=True).stdout.split()
+    assert [int(value) for value in output] == [flow_hash(flow_key(frame)) for frame in frames()]
+
+
+def test_lru_eviction():
+    table = FlowTable(CountingDetector, max_flows=2, idle_timeout=60.0)
+    a = table.get(b"a", 0.0)
+    table.get(b"b", 1.0)
+    # Touching a makes b the least recently used flow
+    assert table.get(b"a", 2.0) is a
+    table.get(b"c", 3.0)
+    assert list(table.flows) == [b"a", b"c"]
+    assert table.lookup(b"b") is None
+    assert table.evicted_lru == 1
+
+
+def test_lookup_keeps_recency():
+    table = FlowTable(CountingDetector, max_flows=2, idle_timeout=60.0)
+    table.get(b"a", 0.0)
+    table.get(b"b", 1.0)
+    assert table.lookup(b"a").detector.key == b"a"
+    table.get(b"c", 2.0)
+    assert table.lookup(b"a") is None
+
+
+def test_idle_expiry():
+    table = FlowTable(CountingDetector, max_flows=100, idle_timeout=100.0)
+    for index in range(20):
+        table.get(bytes([index]), float(index))
+    assert table.expire(115.0, budget=4) == 4
+    assert table.expire(115.0, budget=100) == 12
+    assert list(table.flows) == [bytes([index]) for index in range(16, 20)]
+    assert table.evicted_idle == 16
+    # get() expires idle flows at the head of the table too
+    table.get(b"new", 140.0)
+    assert list(table.flows) == [b"new"]
+
+
+def test_dropped_flow_keeps_release_deadline():
+    table = FlowTable(CountingDetector, max_flows=1, idle_timeout=10.0)
+    table.get(b"a", 0.0).release_at = 5.0
+    table.get(b"b", 1.0)
+    assert table.lookup(b"a") is None
+    assert table.get(b"a", 2.0).release_at == 5.0
+    # Idle flows keep theirs too
+    table.get(b"a", 2.0).release_at = 8.0
+    table.expire(20.0)
+    assert table.get(b"a", 20.0).release_at == 8.0
@@ -0,0 +1,49 @@
+import pytest
+
+from bench.traces import arp_frame, icmp_frame, ipv6_udp_frame, tcp_frame, udp_frame, vlan_tagged
+from flow.frame_filter import FrameFilter, parse_headers
+
+
+def test_parse_headers():
+    headers = parse_headers(udp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, b"x"))
+    assert headers == (4, 17, 0x0A010015, 0x0A000015, 40000, 8002)
+    assert parse_headers(memoryview(vlan_tagged(udp_frame("10.1.0.21", "10.0.0.21", 1, 2, b""), 5))) == (
+        4, 17, 0x0A010015, 0x0A000015, 1, 2)
+    assert parse_headers(ipv6_udp_frame("fd00::1", "fd00::2", 3, 4, b""))[:2] == (6, 17)
+    assert parse_headers(icmp_frame("10.1.0.21", "10.0.0.21", 1))[4:] == (0, 0)
+    assert parse_headers(arp_frame("10.1.0.21", "10.0.0.21")) is None
+    assert parse_headers(udp_frame("10.1.0.21", "10.0.0.21", 1, 2, b"")[:30]) is None
+
+
+@pytest.mark.parametrize("rules, frame, expected", [
+    (["udp"], udp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, b""), True),
+    (["udp"], tcp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, b""), False),
+    (["udp:8000-8100"], udp_frame("10.1.0.21", "10.0.0.21", 40000, 8002, b""), True),
+    (["udp:8000-8100"], udp_frame("10.1.0.21", "10.0.0.21", 8100, 40000, b""), True),
+    (["udp:8000-8100"], udp_frame("10.1.0.21", "10.0.0.21", 40000, 8101, b""), False),
+    (["tcp:22,443@10.1.0.0/16"], tcp_frame("10.0.0.21", "10.1.3.4", 443, 51234, b""), True),
+    (["tcp:22,443@10.1.0.0/16"], tcp_frame("10.0.0.21", "10.2.3.4", 443, 51234, b""), False),
+    (["ip@fd00::/8"], ipv6_udp_frame("fd00::1", "2001:db8::1", 1, 2, b""), True),
+    (["ip@10.0.0.0/8"], ipv6_udp_frame("fd00::1", "2001:db8::1", 1, 2, b""), False),
+    (["icmp"], icmp_frame("10.1.0.21", "10.0.0.21", 1), True),
+    (["1"], icmp_frame("10.1.0.21", "10.0.0.21", 1), True),
+    (["any"], arp_frame("10.1.0.21", "10.0.0.21"), False),
+    (["tcp", "udp:53"], vlan_tagged(udp_frame("10.1.0.21", "10.0.0.21", 53, 40000, b""), 7), True),
+])
+def test_match(rules, frame, expected):
+    assert FrameFilter(rules).match(frame) is expected
+
+
+def test_counts():
+    frame_filter = FrameFilter(["udp"])
+    frame_filter.match(udp_frame("10.1.0.21", "10.0.0.21", 1, 2, b""))
+    frame_filter.match(tcp_frame("10.1.0.21", "10.0.0.21", 1, 2, b""))
+    frame_filter.match(arp_frame("10.1.0.21", "10.0.0.21"))
+    stats = frame_filter.get_stats()
+    assert (stats['matched'], stats['bypassed']) == (1, 2)
+
+
+@pytest.mark.parametrize("rule", ["gre", "udp:70000", "udp:10-5", "udp@10.0.0.0/33"])
+def test_invalid_rules(rule):
+    with pytest.raises(ValueError):
+        FrameFilter([rule])
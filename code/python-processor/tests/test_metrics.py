@@ -0,0 +1,56 @@
+import asyncio
+
+from metrics.metrics import MetricsAggregator, MetricsRegistry, fetch, merge
+
+
+def registry(packets: int, latency: float) -> MetricsRegistry:
+    metrics = MetricsRegistry()
+    counter = metrics.counter("packets_total", "Frames received", "subject")
+    counter.inc("inpktsec", packets)
+    metrics.gauge("flows_active", "Flows with detector state", lambda: packets // 2)
+    histogram = metrics.histogram("publish_latency_seconds", "Time to publish", buckets=(0.1, 1.0))
+    histogram.observe(latency)
+    return metrics
+
+
+def test_merge_groups_samples_by_metric():
+    text = merge({"0": registry(4, 0.05).render(), "1": registry(6, 0.5).render()}, "shard")
+    lines = text.splitlines()
+    assert lines[:4] == ["# HELP processor_packets_total Frames received",
+                         "# TYPE processor_packets_total counter",
+                         'processor_packets_total{shard="0",subject="inpktsec"} 4.0',
+                         'processor_packets_total{shard="1",subject="inpktsec"} 6.0']
+    assert 'processor_flows_active{shard="1"} 3.0' in lines
+    assert 'processor_publish_latency_seconds_bucket{shard="1",le="0.1"} 0' in lines
+    assert 'processor_publish_latency_seconds_count{shard="0"} 1' in lines
+    assert sum(line.startswith("# TYPE ") for line in lines) == 3
+
+
+def test_aggregator_serves_every_process():
+    async def run():
+        first, second = registry(4, 0.05), registry(6, 0.5)
+        servers = [await first.serve(0, host="127.0.0.1"), await second.serve(0, host="127.0.0.1")]
+        ports = [server.sockets[0].getsockname()[1] for server in servers]
+        # The third process is not running
+        aggregator = MetricsAggregator({"0": ports[0], "1": ports[1], "2": 1}, timeout=1.0)
+        server = await aggregator.serve(0, host="127.0.0.1")
+        text = await fetch(server.sockets[0].getsockname()[1])
+        for running in servers + [server]:
+            running.close()
+        return text
+
+    lines = asyncio.run(run()).splitlines()
+    assert 'processor_packets_total{shard="1",subject="inpktsec"} 6.0' in lines
+    assert 'processor_scrape_up{shard="0"} 1.0' in lines
+    assert 'processor_scrape_up{shard="2"} 0.0' in lines
+
+
+def test_label_values_and_help_escaped():
+    metrics = MetricsRegistry()
+    metrics.counter("packets_total", "Frames\nreceived \\ \"raw\"", "subject").inc('in"pkt\\sec\n')
+    lines = metrics.render().splitlines()
+    assert lines == ['# HELP processor_packets_total Frames\\nreceived \\\\ "raw"',
+                     "# TYPE processor_packets_total counter",
+                     'processor_packets_total{subject="in\\"pkt\\\\sec\\n"} 1.0']
+    assert 'processor_packets_total{shard="a\\"b",subject="in\\"pkt\\\\sec\\n"} 1.0' in merge(
+        {'a"b': metrics.render()}, "shard").splitlines()
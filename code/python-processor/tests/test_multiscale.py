@@ -0,0 +1,96 @@
+import random
+from collections import deque
+
+import pytest
+
+from bench.capture_replay import DiscardNATS
+from detector.baseline import BaselineEstimator
+from detector.multiscale import BlockSummary, MergedWindow, MultiScaleDetector
+from detector.pipeline import DetectorPipeline, default_pipeline
+from detector.sliding_window import SlidingWindowStats
+from processor.packet_processor import PacketProcessor
+
+
+def ms_ipds(rng: random.Random, count: int):
+    """Ipds on the 1 ms grid of the merged histograms, mixing benign and covert timing."""
+    ipds = []
+    while len(ipds) < count:
+        if rng.random() < 0.5:
+            ipds.extend(rng.choice((300, 900)) for _ in range(rng.randint(10, 80)))
+        else:
+            ipds.extend(max(1, round(rng.expovariate(1 / 80))) for _ in range(rng.randint(10, 80)))
+    return [value / 1000 for value in ipds[:count]]
+
+
+@pytest.mark.parametrize("block_size, block_count", [(16, 4), (8, 8), (30, 2)])
+def test_merged_window_matches_exact_window(block_size, block_count):
+    rng = random.Random(block_size * block_count)
+    length = block_size * block_count
+    pipeline = DetectorPipeline.from_specs(None)
+    baseline = BaselineEstimator(decay=0, mean=0.08, variance=0.0004, count=100)
+    merged = MergedWindow(block_count)
+    exact = SlidingWindowStats(length)
+    blocks = deque(maxlen=block_count + 1)
+    block = BlockSummary()
+    compared = 0
+    for value in ms_ipds(rng, 40 * length):
+        exact.push(value)
+        block.add(value)
+        if block.count < block_size:
+            continue
+        blocks.append(block)
+        merged.refresh(block, blocks[0] if len(blocks) > block_count else None)
+        block = BlockSummary()
+        if len(blocks) < block_count:
+            continue
+        merged.summarize(blocks)
+        assert len(merged) == len(exact) == length
+        assert merged.mean() == pytest.approx(exact.mean())
+        assert merged.std() == pytest.approx(exact.std())
+        assert merged.unique_count() == exact.unique_count()
+        assert merged.count_ratio() == exact.count_ratio()
+        assert merged.concentration() == exact.concentration()
+        assert merged.top_two() == exact.top_two()
+        assert (merged.min_value(), merged.max_value()) == (exact.min_value(), exact.max_value())
+        for low, high in ((0.1, 0.5), (0.7, 1.1), (0.2, 0.4), (0.0, 0.08)):
+            assert merged.band_count(low, high) == exact.band_count(low, high)
+        assert merged.sorted_values == list(exact.sorted_values)
+        merged_score, merged_details = pipeline.score(merged, baseline)
+        exact_score, exact_details = pipeline.score(exact, baseline)
+        assert merged_score == pytest.approx(exact_score)
+        assert merged_details == pytest.approx(exact_details)
+        compared += 1
+    assert compared > 30
+
+
+def test_detector_scores_long_scale_like_exact_window():
+    rng = random.Random(1)
+    detector = MultiScaleDetector(scales=(16, 64), threshold=0.65, baseline_decay=0)
+    # Exact window of the longest scale over the same ipds, on the 1 ms grid of the merged histogram
+    exact = SlidingWindowStats(64)
+    timestamp = 0.0
+    checked = 0
+    for ipd in [0.0] + ms_ipds(rng, 64 * 20):
+        last = timestamp
+        timestamp += ipd
+        detector.add_packet(timestamp)
+        if ipd:
+            exact.push(round((timestamp - last) * 1000) / 1000)
+        detector.detect()
+        # The 64 ipd scale is rescored every time a block of 16 completes
+        if detector.completed_blocks >= 4 and detector.block.count == 0 and ipd:
+            score, details = default_pipeline.score(exact, detector.baseline)
+            assert detector.scale_scores[1] == pytest.approx(score)
+            assert detector.scale_details[1] == pytest.approx(details)
+            checked += 1
+    assert checked == 20 * 4 - 3
+
+
+def test_scales_must_be_multiples():
+    with pytest.raises(ValueError):
+        MultiScaleDetector(scales=(16, 40))
+
+
+def test_full_score_interval_rejected_with_scales():
+    with pytest.raises(ValueError):
+        PacketProcessor(DiscardNATS(), 5e-6, 0.6, 1.6, scales=(16, 64), full_score_interval=8)
@@ -0,0 +1,91 @@
+import pytest
+
+from processor.overload import (LEVEL_NORMAL, LEVEL_PASS_THROUGH, LEVEL_SAMPLE, LEVEL_SKIP_DELAY,
+                                OverloadController)
+
+
+class FakeLoop:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+
+class FakeSubscription:
+    def __init__(self):
+        self.pending_msgs = 0
+
+
+def controller(**kwargs):
+    transitions = []
+    overload = OverloadController(depth_watermarks=(10, 100, 1000), lag_watermarks=(0.1, 0.5, 2.0), hold=2.0,
+                                  on_transition=lambda old, new: transitions.append((old, new)), **kwargs)
+    loop = FakeLoop()
+    overload.loop = loop
+    overload.level_started = loop.now
+    subscription = FakeSubscription()
+    overload.watch(subscription)
+    return overload, loop, subscription, transitions
+
+
+def test_rises_at_once_and_falls_one_level_per_hold():
+    overload, loop, subscription, transitions = controller()
+    subscription.pending_msgs = 5
+    assert overload.update() == LEVEL_NORMAL
+    subscription.pending_msgs = 1000
+    assert overload.update() == LEVEL_PASS_THROUGH
+
+    subscription.pending_msgs = 0
+    assert overload.update() == LEVEL_PASS_THROUGH
+    loop.now = 1.9
+    assert overload.update() == LEVEL_PASS_THROUGH
+    loop.now = 2.0
+    assert overload.update() == LEVEL_SKIP_DELAY
+    loop.now = 3.0
+    assert overload.update() == LEVEL_SKIP_DELAY
+    loop.now = 5.0
+    assert overload.update() == LEVEL_SAMPLE
+    assert transitions == [(LEVEL_NORMAL, LEVEL_PASS_THROUGH), (LEVEL_PASS_THROUGH, LEVEL_SKIP_DELAY),
+                           (LEVEL_SKIP_DELAY, LEVEL_SAMPLE)]
+    assert overload.seconds_at(LEVEL_PASS_THROUGH) == pytest.approx(2.0)
+    assert overload.seconds_at(LEVEL_SKIP_DELAY) == pytest.approx(3.0)
+
+
+def test_backlog_back_at_level_restarts_hold():
+    overload, loop, subscription, transitions = controller()
+    subscription.pending_msgs = 150
+    assert overload.update() == LEVEL_SKIP_DELAY
+    subscription.pending_msgs = 0
+    overload.update()
+    loop.now = 1.5
+    subscription.pending_msgs = 200
+    assert overload.update() == LEVEL_SKIP_DELAY
+    subscription.pending_msgs = 0
+    loop.now = 3.0
+    assert overload.update() == LEVEL_SKIP_DELAY
+    loop.now = 5.0
+    assert overload.update() == LEVEL_SAMPLE
+    assert overload.transition_count == 2
+
+
+def test_lag_raises_level():
+    overload, loop, subscription, transitions = controller()
+    overload.probe_due = 0.0
+    loop.now = 0.6
+    assert overload.lag() == pytest.approx(0.6)
+    assert overload.update() == LEVEL_SKIP_DELAY
+    assert overload.get_stats()['peak_lag'] == pytest.approx(0.6)
+
+
+def test_tick_updates_every_check_interval():
+    overload, loop, subscription, transitions = controller(check_interval=4)
+    subscription.pending_msgs = 20
+    assert [overload.tick() for _ in range(4)] == [LEVEL_NORMAL] * 3 + [LEVEL_SAMPLE]
+
+
+def test_invalid_watermarks():
+    with pytest.raises(ValueError):
+        OverloadController(depth_watermarks=(10, 100))
+    with pytest.raises(ValueError):
+        OverloadController(lag_watermarks=(1.0, 0.5, 2.0))
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from bench.capture_replay import DiscardNATS
+from bench.traces import synthetic_trace
+from journal.packet_journal import (DECISION_COVERT, DECISION_MITIGATED, SUBJECT_OTHER, PacketJournal,
+                                    concatenate, read_journal, segment_paths)
+from processor.packet_processor import PacketProcessor, score_names
+
+
+def write_records(journal: PacketJournal, count: int):
+    for index in range(count):
+        scores = {'bimodal': 0.5, 'regularity': 0.3, 'pattern_match': 0.4 * (index % 2), 'total_score': 0.8}
+        journal.append(1000.0 + index * 0.01, index % 3, ("inpktsec", "inpktinsec.2", "other")[index % 3],
+                       60 + index, scores, DECISION_COVERT | DECISION_MITIGATED if index % 2 else 0, 0.001 * index)
+
+
+def test_write_read(tmp_path):
+    journal = PacketJournal(str(tmp_path), segment_records=100, block_records=8)
+    write_records(journal, 20)
+    # Staged records are not visible before they are written to the segment
+    assert len(read_journal(str(tmp_path))[0]) == 16
+    journal.flush()
+    segment, = read_journal(str(tmp_path))
+    assert len(segment) == 20
+    np.testing.assert_allclose(segment["ts"], 1000.0 + np.arange(20) * 0.01)
+    assert list(segment["flow_id"]) == [index % 3 for index in range(20)]
+    assert list(segment["subject"][:3]) == [0, 1, SUBJECT_OTHER]
+    assert list(segment["length"]) == list(range(60, 80))
+    np.testing.assert_allclose(segment["pattern_match"], [0.4 * (index % 2) for index in range(20)], rtol=1e-6)
+    assert list(segment["baseline_deviation"]) == [0.0] * 20
+    assert list(segment["decision"][:2]) == [0, DECISION_COVERT | DECISION_MITIGATED]
+    np.testing.assert_allclose(segment["delay"], np.arange(20) * 0.001, rtol=1e-6)
+    journal.close()
+
+
+def test_segments_rotate_and_retain(tmp_path):
+    journal = PacketJournal(str(tmp_path), segment_records=10, max_segments=3, block_records=4)
+    write_records(journal, 45)
+    journal.close()
+    paths = segment_paths(str(tmp_path))
+    assert len(paths) == 3
+    segments = read_journal(str(tmp_path))
+    assert [len(segment) for segment in segments] == [10, 10, 5]
+    columns = concatenate(segments)
+    np.testing.assert_allclose(columns["ts"], 1000.0 + np.arange(20, 45) * 0.01)
+
+    # A restarted writer continues after the last segment
+    journal = PacketJournal(str(tmp_path), segment_records=10, max_segments=3)
+    assert journal.path > paths[-1]
+    journal.close()
+
+
+def test_invalid_segment(tmp_path):
+    path = tmp_path / "journal-00000000.seg"
+    path.write_bytes(b"\x00" * 128)
+    with pytest.raises(ValueError):
+        read_journal(str(tmp_path))
+
+
+def test_shards_keep_their_segments(tmp_path):
+    journals = [PacketJournal(str(tmp_path), prefix=prefix, segment_records=10, max_segments=2, block_records=4)
+                for prefix in ("journal", "journal-1")]
+    for journal in journals:
+        write_records(journal, 35)
+        journal.close()
+    # Retention of one journal leaves the other's segments alone
+    assert [len(segment) for segment in read_journal(str(tmp_path))] == [10, 5]
+    assert [len(segment) for segment in read_journal(str(tmp_path), "journal-1")] == [10, 5]
+    assert [path[-len("00000000.seg"):] for path in segment_paths(str(tmp_path))] == ["00000002.seg", "00000003.seg"]
+
+
+def journal_replay(directory: str, **kwargs):
+    journal = PacketJournal(directory, segment_records=1000, score_names=score_names(**kwargs))
+    processor = PacketProcessor(DiscardNATS(), 5e-6, 0.6, 1.6, window_size=16, journal=journal, **kwargs)
+    for frame in synthetic_trace(4, 1, 120, seed=1):
+        processor.inspect(frame.subject, frame.data, frame.timestamp, frame.timestamp)
+    journal.close()
+    segment, = read_journal(directory)
+    return segment
+
+
+def test_columns_follow_the_detectors(tmp_path):
+    segment = journal_replay(str(tmp_path), detectors=["bimodal", "entropy:0.3"])
+    assert segment.score_names == ("bimodal", "entropy")
+    assert segment["entropy"].any()
+    np.testing.assert_allclose(np.minimum(segment["bimodal"] + segment["entropy"], 1.0), segment["total_score"],
+                               rtol=1e-6)
+
+
+def test_columns_follow_the_scales(tmp_path):
+    segment = journal_replay(str(tmp_path), scales=(16, 64))
+    assert segment.score_names == ("bimodal", "regularity", "baseline_deviation", "pattern_match",
+                                   "scale_16", "scale_64")
+    assert segment["scale_64"].any()
+    np.testing.assert_allclose(np.maximum(segment["scale_16"], segment["scale_64"]), segment["total_score"],
+                               rtol=1e-6)
+
+
+def test_journal_must_match_the_pipeline(tmp_path):
+    with pytest.raises(ValueError):
+        PacketProcessor(DiscardNATS(), 5e-6, 0.6, 1.6, journal=PacketJournal(str(tmp_path)), scales=(16, 64))
@@ -0,0 +1,29 @@
+import random
+import time
+from types import SimpleNamespace
+
+from bench.capture_replay import DiscardNATS
+from bench.traces import udp_frame
+from processor.packet_processor import CAPTURE_TS_HEADER, PacketProcessor, capture_time
+
+
+def test_flow_order_kept_across_eviction():
+    processor = PacketProcessor(DiscardNATS(), 0.5, 0.6, 1.6, window_size=30, max_flows=1)
+    frames = [udp_frame("10.1.0.21", "10.0.0.21", 40000 + index % 2, 8002, b"") for index in range(2)]
+    random.seed(0)
+    deadlines = {0: [], 1: []}
+    for index in range(200):
+        flow = index % 2
+        deadlines[flow].append(processor.inspect("inpktsec", frames[flow], index * 0.01, index * 0.01))
+    assert processor.flow_table.evicted_lru == 199
+    for flow_deadlines in deadlines.values():
+        assert flow_deadlines == sorted(flow_deadlines)
+
+
+def test_capture_time_falls_back_to_the_switch_clock():
+    before = time.time()
+    stamped = capture_time(SimpleNamespace(headers={CAPTURE_TS_HEADER: str(time.time_ns())}))
+    unstamped = capture_time(SimpleNamespace(headers=None))
+    assert capture_time(SimpleNamespace(headers={CAPTURE_TS_HEADER: "1500000000"})) == 1.5
+    # Frames with and without the switch timestamp are on the same time base
+    assert before <= stamped <= unstamped <= time.time()
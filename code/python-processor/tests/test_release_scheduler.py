@@ -0,0 +1,126 @@
+import asyncio
+
+from scheduler.release_scheduler import ReleaseScheduler
+
+
+class Recorder:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, subject: str, data: bytes) -> None:
+        self.published.append((subject, data))
+
+
+async def drain(scheduler: ReleaseScheduler, timeout: float = 2.0) -> None:
+    deadline = scheduler.now() + timeout
+    while len(scheduler) and scheduler.now() < deadline:
+        await asyncio.sleep(0.005)
+
+
+def test_releases_in_deadline_order():
+    async def run():
+        recorder = Recorder()
+        released = []
+        scheduler = ReleaseScheduler(recorder.publish, on_release=lambda subject, latency: released.append(latency))
+        task = await scheduler.start()
+        now = scheduler.now()
+        await scheduler.schedule(now + 0.06, "out", b"3")
+        await scheduler.schedule(now + 0.02, "out", b"1")
+        await scheduler.schedule(now + 0.04, "out", b"2a")
+        # Equal deadlines keep the order they were scheduled in
+        await scheduler.schedule(now + 0.04, "out", b"2b")
+        await scheduler.schedule(now + 0.04, "out", b"2c", received=now)
+        await drain(scheduler)
+        task.cancel()
+        assert [data for _, data in recorder.published] == [b"1", b"2a", b"2b", b"2c", b"3"]
+        assert scheduler.released_count == 5
+        # The frame received at now waited for its deadline, the others count from their deadline
+        assert released[3] >= 0.04
+        assert all(latency < 0.04 for index, latency in enumerate(released) if index != 3)
+
+    asyncio.run(run())
+
+
+def test_due_frames_released_by_schedule():
+    async def run():
+        recorder = Recorder()
+        scheduler = ReleaseScheduler(recorder.publish)
+        task = await scheduler.start()
+        # A busy caller that never yields still gets its due frames published
+        for index in range(3):
+            await scheduler.schedule(scheduler.now() - 1.0, "out", bytes([index]))
+        assert [data for _, data in recorder.published] == [b"\x00", b"\x01", b"\x02"]
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def test_backpressure_waits_for_room():
+    async def run():
+        recorder = Recorder()
+        scheduler = ReleaseScheduler(recorder.publish, max_pending=2)
+        task = await scheduler.start()
+        now = scheduler.now()
+        await scheduler.schedule(now + 0.05, "out", b"1")
+        await scheduler.schedule(now + 0.05, "out", b"2")
+        third = asyncio.ensure_future(scheduler.schedule(now + 0.05, "out", b"3"))
+        await asyncio.sleep(0.01)
+        assert not third.done()
+        assert len(scheduler) == 2
+        await asyncio.wait_for(third, 1.0)
+        await drain(scheduler)
+        task.cancel()
+        assert [data for _, data in recorder.published] == [b"1", b"2", b"3"]
+        assert scheduler.full_wait_count == 1
+        assert scheduler.get_stats()['peak_pending'] == 2
+
+    asyncio.run(run())
+
+
+def test_failed_publish_does_not_stop_releases():
+    async def run():
+        published = []
+
+        async def publish(subject: str, data: bytes) -> None:
+            if data == b"bad":
+                raise ConnectionError("connection closed")
+            published.append(data)
+
+        scheduler = ReleaseScheduler(publish)
+        task = await scheduler.start()
+        now = scheduler.now()
+        # Released inline by schedule(), which must not see the error
+        await scheduler.schedule(now - 1.0, "out", b"bad")
+        await scheduler.schedule(now + 0.01, "out", b"1")
+        await scheduler.schedule(now + 0.02, "out", b"bad")
+        await scheduler.schedule(now + 0.03, "out", b"2")
+        await drain(scheduler)
+        assert not task.done()
+        task.cancel()
+        assert published == [b"1", b"2"]
+        assert (scheduler.publish_error_count, scheduler.released_count) == (2, 2)
+        assert scheduler.task is task
+
+    asyncio.run(run())
+
+
+def test_drain_releases_every_frame():
+    async def run():
+        recorder = Recorder()
+        scheduler = ReleaseScheduler(recorder.publish)
+        task = await scheduler.start()
+        # Drained without the dispatcher too, e.g. after it failed
+        task.cancel()
+        now = scheduler.now()
+        await scheduler.schedule(now + 60.0, "out", b"4")
+        await scheduler.schedule(now + 0.02, "out", b"2")
+        await scheduler.schedule(now + 0.01, "out", b"1")
+        await scheduler.schedule(now + 30.0, "out", b"3")
+        assert await scheduler.drain(timeout=0.5) == 2
+        # Frames due within the timeout waited for their deadline
+        assert scheduler.now() >= now + 0.02
+        assert scheduler.now() < now + 0.5
+        assert [data for _, data in recorder.published] == [b"1", b"2", b"3", b"4"]
+        assert len(scheduler) == 0
+
+    asyncio.run(run())
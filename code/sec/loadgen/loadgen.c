@@ -0,0 +1,530 @@
+/**
+ * @file loadgen.c
+ * @brief A UDP load generator mixing many benign flows with covert timing channel flows, paced on absolute deadlines.
+ *
+ * The senders in code/sec send one datagram per sendto and pace with time.sleep, which is neither fast nor
+ * precise enough to load the switch and the processors. This generator keeps every flow's next send deadline
+ * in a min-heap on CLOCK_MONOTONIC, waits for the earliest one with an absolute timer and sends every packet
+ * that is due in one sendmmsg call. Flows differ by source port only, so all of them go through one raw UDP
+ * socket (like rawsocket/sender.c) and a single sendmmsg can carry packets of many flows.
+ *
+ * @dependencies
+ * - raw sockets (run as root or with CAP_NET_RAW)
+ * - libm
+ *
+ * @details
+ * - Benign flows send with inter-packet delays drawn from a constant, exponential, uniform or pareto distribution
+ *   whose mean is flows / rate, so -r sets the total benign packet rate.
+ * - Covert flows send a message like covert_channel_sender.py: bit_repeat_len packets per bit, each followed by
+ *   the bit's BIT_DELAY gap, repeating the message until the end of the run.
+ * - Deadlines are absolute, so a late wake-up never shifts the following packets of a flow.
+ * - The timer is clock_nanosleep(TIMER_ABSTIME) or a timerfd armed with TFD_TIMER_ABSTIME; the last spin_us
+ *   before a deadline are spent polling the clock to avoid timer wake-up latency.
+ * - At the end, the send time of every packet is compared with its deadline and the timing error percentiles
+ *   are printed as JSON, separately for benign and covert packets.
+ *
+ * Usage:
+ *   ./loadgen [-d dest_ip] [-t seconds] [-b benign_flows] [-r benign_pps] [-D const|exp|uniform|pareto]
+ *             [-c covert_flows] [-m message] [-z zero_bit_delay] [-o one_bit_delay] [-n bit_repeat_len]
+ *             [-B batch] [-s payload_size] [-T nanosleep|timerfd] [-w spin_us] [-e early_us] [-S seed]
+ *
+ *   ./loadgen -b 1000 -r 200000 -c 4 -t 30
+ */
+#define _GNU_SOURCE
+#include <errno.h>
+#include <math.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <arpa/inet.h>
+#include <netinet/udp.h>
+#include <sys/prctl.h>
+#include <sys/socket.h>
+#include <sys/timerfd.h>
+
+#define BENIGN_DEST_PORT 8000
+#define COVERT_DEST_PORT 8002
+#define BENIGN_FIRST_PORT 20000
+#define COVERT_FIRST_PORT 40000
+#define MAX_BATCH 1024
+#define MAX_PAYLOAD 1400
+#define ERROR_BUCKETS 100000  // Timing error histogram in microseconds, the last bucket collects larger errors
+
+#define NSEC_PER_SEC 1000000000LL
+
+enum distribution { DIST_CONST, DIST_EXP, DIST_UNIFORM, DIST_PARETO };
+enum timer_mode { TIMER_NANOSLEEP, TIMER_TIMERFD };
+
+struct flow {
+    int64_t deadline;   // Next send time, CLOCK_MONOTONIC nanoseconds
+    uint16_t src_port;
+    uint16_t dst_port;
+    bool covert;
+    int bit_index;      // Covert flows: bit of the message being sent
+    int repeat;         // Covert flows: packets of the current bit already sent
+};
+
+struct error_histogram {
+    uint64_t buckets[ERROR_BUCKETS];
+    uint64_t count;
+    uint64_t early;     // Packets sent before their deadline (-e)
+    int64_t max_ns;
+    double sum_ns;
+};
+
+struct config {
+    const char *dest_ip;
+    double seconds;
+    int benign_flows;
+    double benign_rate;
+    enum distribution distribution;
+    int covert_flows;
+    char bitstream[8 * 256 + 1];
+    double bit_delay[2];
+    int bit_repeat_len;
+    int batch;
+    int payload_size;
+    enum timer_mode timer;
+    int64_t spin_ns;
+    int64_t early_ns;
+    uint64_t seed;
+};
+
+static struct config config = {
+    .seconds = 10.0,
+    .benign_flows = 100,
+    .benign_rate = 10000.0,
+    .distribution = DIST_EXP,
+    .covert_flows = 1,
+    .bit_delay = {0.3, 0.9},
+    .bit_repeat_len = 5,
+    .batch = 256,
+    .payload_size = 64,
+    .timer = TIMER_NANOSLEEP,
+    .spin_ns = 20000,
+    .early_ns = 0,
+    .seed = 1,
+};
+
+static struct flow *flows;
+static int *heap;       // Flow indices ordered by deadline
+static int heap_size;
+static uint64_t rng_state;
+static struct error_histogram benign_errors, covert_errors;
+
+int64_t now_ns();
+void wait_until(int64_t deadline, int timer_fd);
+double next_random();
+int64_t next_gap(struct flow *flow);
+void heap_push(int index);
+void heap_pop_push(int index);
+void record_error(struct error_histogram *histogram, int64_t error);
+void print_errors(const char *name, struct error_histogram *histogram);
+void create_bitstream_from_message(const char *message, char *bitstream, size_t size);
+bool parse_args(int argc, char **argv);
+
+int main(int argc, char **argv) {
+    if (!parse_args(argc, argv)) {
+        return 1;
+    }
+    if (config.dest_ip == NULL) {
+        fprintf(stderr, "Environment variable INSECURENET_HOST_IP not set and no -d given\n");
+        return 1;
+    }
+    int flow_count = config.benign_flows + config.covert_flows;
+    if (flow_count == 0) {
+        fprintf(stderr, "No flows to send\n");
+        return 1;
+    }
+
+    // Raw UDP socket, the kernel adds the IP header and we choose the source port of every packet
+    int sock = socket(AF_INET, SOCK_RAW, IPPROTO_UDP);
+    if (sock < 0) {
+        perror("socket");
+        return 1;
+    }
+    int sndbuf = 16 * 1024 * 1024;
+    if (setsockopt(sock, SOL_SOCKET, SO_SNDBUF, &sndbuf, sizeof(sndbuf)) < 0) {
+        perror("setsockopt SO_SNDBUF failed");
+    }
+    int timer_fd = -1;
+    if (config.timer == TIMER_TIMERFD) {
+        timer_fd = timerfd_create(CLOCK_MONOTONIC, 0);
+        if (timer_fd < 0) {
+            perror("timerfd_create");
+            return 1;
+        }
+    }
+    // The default 50us timer slack would be larger than the gaps we pace
+    prctl(PR_SET_TIMERSLACK, 1UL);
+
+    struct sockaddr_in dest_addr;
+    memset(&dest_addr, 0, sizeof(dest_addr));
+    dest_addr.sin_family = AF_INET;
+    dest_addr.sin_addr.s_addr = inet_addr(config.dest_ip);
+
+    rng_state = config.seed ? config.seed : 1;
+    flows = calloc(flow_count, sizeof(struct flow));
+    heap = calloc(flow_count, sizeof(int));
+    if (flows == NULL || heap == NULL) {
+        fprintf(stderr, "Out of memory\n");
+        return 1;
+    }
+    int64_t start = now_ns() + 10000000;  // Give the first deadlines some headroom
+    double mean_gap = config.benign_flows / config.benign_rate;
+    for (int i = 0; i < flow_count; i++) {
+        struct flow *flow = &flows[i];
+        flow->covert = i >= config.benign_flows;
+        if (flow->covert) {
+            flow->src_port = COVERT_FIRST_PORT + (i - config.benign_flows);
+            flow->dst_port = COVERT_DEST_PORT;
+            flow->deadline = start;
+        } else {
+            flow->src_port = BENIGN_FIRST_PORT + i;
+            flow->dst_port = BENIGN_DEST_PORT;
+            // Spread the first packets over one mean gap so flows do not start in lockstep
+            flow->deadline = start + (int64_t)(next_random() * mean_gap * NSEC_PER_SEC);
+        }
+        heap_push(i);
+    }
+
+    static unsigned char packets[MAX_BATCH][sizeof(struct udphdr) + MAX_PAYLOAD];
+    static struct mmsghdr msgs[MAX_BATCH];
+    static struct iovec iovecs[MAX_BATCH];
+    static int64_t deadlines[MAX_BATCH];
+    static bool covert[MAX_BATCH];
+    int packet_size = sizeof(struct udphdr) + config.payload_size;
+    for (int i = 0; i < config.batch; i++) {
+        iovecs[i].iov_base = packets[i];
+        iovecs[i].iov_len = packet_size;
+        msgs[i].msg_hdr.msg_name = &dest_addr;
+        msgs[i].msg_hdr.msg_namelen = sizeof(dest_addr);
+        msgs[i].msg_hdr.msg_iov = &iovecs[i];
+        msgs[i].msg_hdr.msg_iovlen = 1;
+        memset(packets[i], 'x', packet_size);
+    }
+
+    int64_t end = start + (int64_t)(config.seconds * NSEC_PER_SEC);
+    uint64_t sent = 0, send_errors = 0, batches = 0, partial_sends = 0;
+    while (true) {
+        int64_t deadline = flows[heap[0]].deadline;
+        if (deadline >= end) {
+            break;
+        }
+        int64_t now = now_ns();
+        if (deadline - config.early_ns > now) {
+            wait_until(deadline - config.early_ns, timer_fd);
+            now = now_ns();
+        }
+
+        // Every packet due by now goes into the batch, flows stay in the heap with their next deadline
+        int count = 0;
+        while (count < config.batch) {
+            int index = heap[0];
+            struct flow *flow = &flows[index];
+            if (flow->deadline - config.early_ns > now || flow->deadline >= end) {
+                break;
+            }
+            struct udphdr *udph = (struct udphdr *)packets[count];
+            udph->source = htons(flow->src_port);
+            udph->dest = htons(flow->dst_port);
+            udph->len = htons(packet_size);
+            udph->check = 0;
+            char *payload = (char *)(udph + 1);
+            if (flow->covert && config.payload_size >= 5) {
+                memcpy(payload, "bit:", 4);
+                payload[4] = config.bitstream[flow->bit_index];
+            }
+            deadlines[count] = flow->deadline;
+            covert[count] = flow->covert;
+            count++;
+            flow->deadline += next_gap(flow);
+            heap_pop_push(index);
+        }
+
+        int64_t send_time = now_ns();
+        int done = 0;
+        while (done < count) {
+            int result = sendmmsg(sock, msgs + done, count - done, 0);
+            if (result < 0) {
+                if (errno == EINTR) {
+                    continue;
+                }
+                // ENOBUFS and friends: the packets of this batch are lost, keep the schedule
+                send_errors += count - done;
+                break;
+            }
+            if (done + result < count) {
+                partial_sends++;
+            }
+            done += result;
+        }
+        batches++;
+        sent += done;
+        for (int i = 0; i < done; i++) {
+            record_error(covert[i] ? &covert_errors : &benign_errors, send_time - deadlines[i]);
+        }
+    }
+    double elapsed = (now_ns() - start) / 1e9;
+
+    printf("{\n");
+    printf("  \"seconds\": %.3f,\n", elapsed);
+    printf("  \"benign_flows\": %d,\n", config.benign_flows);
+    printf("  \"covert_flows\": %d,\n", config.covert_flows);
+    printf("  \"packets\": %llu,\n", (unsigned long long)sent);
+    printf("  \"packets_per_second\": %.1f,\n", sent / elapsed);
+    printf("  \"send_errors\": %llu,\n", (unsigned long long)send_errors);
+    printf("  \"batches\": %llu,\n", (unsigned long long)batches);
+    printf("  \"partial_sends\": %llu,\n", (unsigned long long)partial_sends);
+    printf("  \"packets_per_batch\": %.2f,\n", batches ? (double)sent / batches : 0.0);
+    print_errors("benign_timing_error_us", &benign_errors);
+    printf(",\n");
+    print_errors("covert_timing_error_us", &covert_errors);
+    printf("\n}\n");
+
+    if (timer_fd >= 0) {
+        close(timer_fd);
+    }
+    close(sock);
+    free(flows);
+    free(heap);
+    return 0;
+}
+
+int64_t now_ns() {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (int64_t)ts.tv_sec * NSEC_PER_SEC + ts.tv_nsec;
+}
+
+void wait_until(int64_t deadline, int timer_fd) {
+    int64_t sleep_until = deadline - config.spin_ns;
+    if (sleep_until > now_ns()) {
+        struct timespec ts = {.tv_sec = sleep_until / NSEC_PER_SEC, .tv_nsec = sleep_until % NSEC_PER_SEC};
+        if (config.timer == TIMER_TIMERFD) {
+            struct itimerspec spec = {.it_interval = {0, 0}, .it_value = ts};
+            uint64_t expirations;
+            if (timerfd_settime(timer_fd, TFD_TIMER_ABSTIME, &spec, NULL) == 0) {
+                while (read(timer_fd, &expirations, sizeof(expirations)) < 0 && errno == EINTR);
+            }
+        } else {
+            while (clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &ts, NULL) == EINTR);
+        }
+    }
+    // Timer wake-ups are late by some microseconds, the rest is spent polling the clock
+    while (now_ns() < deadline);
+}
+
+double next_random() {
+    // xorshift64*, uniform in [0, 1)
+    rng_state ^= rng_state >> 12;
+    rng_state ^= rng_state << 25;
+    rng_state ^= rng_state >> 27;
+    return ((rng_state * 2685821657736338717ULL) >> 11) * (1.0 / 9007199254740992.0);
+}
+
+int64_t next_gap(struct flow *flow) {
+    if (flow->covert) {
+        // BIT_DELAY encoding of covert_channel_sender.py, the message repeats
+        double gap = config.bit_delay[config.bitstream[flow->bit_index] - '0'];
+        if (++flow->repeat >= config.bit_repeat_len) {
+            flow->repeat = 0;
+            if (config.bitstream[++flow->bit_index] == '\0') {
+                flow->bit_index = 0;
+            }
+        }
+        return (int64_t)(gap * NSEC_PER_SEC);
+    }
+    double mean = config.benign_flows / config.benign_rate;
+    double gap;
+    switch (config.distribution) {
+    case DIST_CONST:
+        gap = mean;
+        break;
+    case DIST_UNIFORM:
+        gap = mean * 2.0 * next_random();
+        break;
+    case DIST_PARETO:
+        // Shape 1.5, scale chosen for the same mean: heavy tailed bursts and pauses
+        gap = mean / 3.0 / pow(1.0 - next_random(), 1.0 / 1.5);
+        break;
+    case DIST_EXP:
+    default:
+        gap = -mean * log(1.0 - next_random());
+        break;
+    }
+    int64_t gap_ns = (int64_t)(gap * NSEC_PER_SEC);
+    return gap_ns > 0 ? gap_ns : 1;
+}
+
+void heap_push(int index) {
+    int child = heap_size++;
+    int64_t deadline = flows[index].deadline;
+    while (child > 0) {
+        int parent = (child - 1) / 2;
+        if (flows[heap[parent]].deadline <= deadline) {
+            break;
+        }
+        heap[child] = heap[parent];
+        child = parent;
+    }
+    heap[child] = index;
+}
+
+void heap_pop_push(int index) {
+    // Replace the root with index, whose deadline moved later, and sift it down
+    int64_t deadline = flows[index].deadline;
+    int parent = 0;
+    while (true) {
+        int child = 2 * parent + 1;
+        if (child >= heap_size) {
+            break;
+        }
+        if (child + 1 < heap_size && flows[heap[child + 1]].deadline < flows[heap[child]].deadline) {
+            child++;
+        }
+        if (deadline <= flows[heap[child]].deadline) {
+            break;
+        }
+        heap[parent] = heap[child];
+        parent = child;
+    }
+    heap[parent] = index;
+}
+
+void record_error(struct error_histogram *histogram, int64_t error) {
+    if (error < 0) {
+        histogram->early++;
+        error = 0;
+    }
+    int64_t bucket = error / 1000;
+    histogram->buckets[bucket < ERROR_BUCKETS ? bucket : ERROR_BUCKETS - 1]++;
+    histogram->count++;
+    histogram->sum_ns += error;
+    if (error > histogram->max_ns) {
+        histogram->max_ns = error;
+    }
+}
+
+void print_errors(const char *name, struct error_histogram *histogram) {
+    const double quantiles[] = {0.5, 0.9, 0.99, 0.999};
+    const char *labels[] = {"p50", "p90", "p99", "p999"};
+    printf("  \"%s\": {\"packets\": %llu, \"early\": %llu, \"mean\": %.1f, \"max\": %.1f",
+           name, (unsigned long long)histogram->count, (unsigned long long)histogram->early,
+           histogram->count ? histogram->sum_ns / histogram->count / 1000.0 : 0.0, histogram->max_ns / 1000.0);
+    for (int q = 0; q < 4; q++) {
+        uint64_t rank = (uint64_t)ceil(quantiles[q] * histogram->count);
+        uint64_t seen = 0;
+        int bucket = 0;
+        while (bucket < ERROR_BUCKETS - 1 && seen + histogram->buckets[bucket] < rank) {
+            seen += histogram->buckets[bucket++];
+        }
+        // Upper edge of the bucket holding the quantile
+        printf(", \"%s\": %d", labels[q], histogram->count ? bucket + 1 : 0);
+    }
+    printf("}");
+}
+
+void create_bitstream_from_message(const char *message, char *bitstream, size_t size) {
+    // Same encoding as covert_channel_sender.py: a message of 0s and 1s is sent as is, text as 8 bits per character
+    bool is_bits = message[0] != '\0';
+    for (const char *c = message; *c; c++) {
+        if (*c != '0' && *c != '1') {
+            is_bits = false;
+            break;
+        }
+    }
+    size_t length = 0;
+    if (is_bits) {
+        for (const char *c = message; *c && length + 1 < size; c++) {
+            bitstream[length++] = *c;
+        }
+    } else {
+        for (const char *c = message; *c && length + 8 < size; c++) {
+            for (int bit = 7; bit >= 0; bit--) {
+                bitstream[length++] = ((unsigned char)*c >> bit) & 1 ? '1' : '0';
+            }
+        }
+    }
+    bitstream[length] = '\0';
+}
+
+bool parse_args(int argc, char **argv) {
+    const char *message = "Hello";
+    config.dest_ip = getenv("INSECURENET_HOST_IP");
+    int option;
+    while ((option = getopt(argc, argv, "d:t:b:r:D:c:m:z:o:n:B:s:T:w:e:S:h")) != -1) {
+        switch (option) {
+        case 'd': config.dest_ip = optarg; break;
+        case 't': config.seconds = atof(optarg); break;
+        case 'b': config.benign_flows = atoi(optarg); break;
+        case 'r': config.benign_rate = atof(optarg); break;
+        case 'D':
+            if (strcmp(optarg, "const") == 0) {
+                config.distribution = DIST_CONST;
+            } else if (strcmp(optarg, "exp") == 0) {
+                config.distribution = DIST_EXP;
+            } else if (strcmp(optarg, "uniform") == 0) {
+                config.distribution = DIST_UNIFORM;
+            } else if (strcmp(optarg, "pareto") == 0) {
+                config.distribution = DIST_PARETO;
+            } else {
+                fprintf(stderr, "Unknown distribution %s, expected const, exp, uniform or pareto\n", optarg);
+                return false;
+            }
+            break;
+        case 'c': config.covert_flows = atoi(optarg); break;
+        case 'm': message = optarg; break;
+        case 'z': config.bit_delay[0] = atof(optarg); break;
+        case 'o': config.bit_delay[1] = atof(optarg); break;
+        case 'n': config.bit_repeat_len = atoi(optarg); break;
+        case 'B': config.batch = atoi(optarg); break;
+        case 's': config.payload_size = atoi(optarg); break;
+        case 'T':
+            if (strcmp(optarg, "nanosleep") == 0) {
+                config.timer = TIMER_NANOSLEEP;
+            } else if (strcmp(optarg, "timerfd") == 0) {
+                config.timer = TIMER_TIMERFD;
+            } else {
+                fprintf(stderr, "Unknown timer %s, expected nanosleep or timerfd\n", optarg);
+                return false;
+            }
+            break;
+        case 'w': config.spin_ns = (int64_t)(atof(optarg) * 1000); break;
+        case 'e': config.early_ns = (int64_t)(atof(optarg) * 1000); break;
+        case 'S': config.seed = strtoull(optarg, NULL, 10); break;
+        default:
+            fprintf(stderr, "Usage: %s [-d dest_ip] [-t seconds] [-b benign_flows] [-r benign_pps] "
+                            "[-D const|exp|uniform|pareto] [-c covert_flows] [-m message] [-z zero_bit_delay] "
+                            "[-o one_bit_delay] [-n bit_repeat_len] [-B batch] [-s payload_size] "
+                            "[-T nanosleep|timerfd] [-w spin_us] [-e early_us] [-S seed]\n", argv[0]);
+            return false;
+        }
+    }
+    create_bitstream_from_message(message, config.bitstream, sizeof(config.bitstream));
+    if (config.covert_flows > 0 && config.bitstream[0] == '\0') {
+        fprintf(stderr, "Covert flows need a message\n");
+        return false;
+    }
+    if (config.benign_flows > 0 && config.benign_rate <= 0) {
+        fprintf(stderr, "Benign flows need a rate above 0\n");
+        return false;
+    }
+    if (config.batch < 1 || config.batch > MAX_BATCH) {
+        fprintf(stderr, "Batch size must be between 1 and %d\n", MAX_BATCH);
+        return false;
+    }
+    if (config.payload_size < 0 || config.payload_size > MAX_PAYLOAD) {
+        fprintf(stderr, "Payload size must be between 0 and %d\n", MAX_PAYLOAD);
+        return false;
+    }
+    if (config.covert_flows + config.benign_flows > 20000) {
+        fprintf(stderr, "At most 20000 flows\n");
+        return false;
+    }
+    return true;
+}